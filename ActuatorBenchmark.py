@@ -0,0 +1,560 @@
+#!/usr/bin/python
+# ActuatorBenchmark.py - Benchmarks for the OF-Actuator wrapper
+# Works with Python 2.7 and 3
+
+"""
+Benchmarks for the wrapper. Run with:
+
+	python ActuatorBenchmark.py suite [--rtt-ms 0.5] [--output run.json]
+		[--baseline baseline.json] [--threshold 0.2]
+	python ActuatorBenchmark.py reader [--size-mb 8] [--repeat 3]
+	python ActuatorBenchmark.py encode [--count 100000]
+	python ActuatorBenchmark.py ingest [--count 100000] [--batch 256]
+
+suite: directive throughput and latency percentiles against a
+	SimulatedActuator with the given network round-trip time, for
+	sequential calls, pipelined batches, threads sharing one wrapper,
+	threads using an ActuatorPool, threads using a ShardedActuator over
+	--shards actuators, and large INFO and HOSTINFO reads.
+	Results are written as JSON; with --baseline every scenario is compared
+	to a stored run and the command exits with status 1 if throughput fell
+	or p99 latency rose by more than the threshold fraction.
+
+reader: throughput of ResponseReader on a multi-megabyte INFO response,
+	both reading it whole (read_response) and line by line (iter_lines),
+	compared with a plain string-concatenating line reader.
+encode: cost of validating and encoding one directive with the compiled
+	DirectiveSchema, compared with the directive builders as they were
+	before (per-call parameter list, linear membership checks and string
+	concatenation).
+ingest: alerts per second through the ActuatorIngest pipeline (parsing,
+	rule mapping and micro-batching) on one core, printing the directives
+	to a null stream (dry run) and sending them to a SimulatedActuator.
+"""
+
+import argparse
+import json
+import math
+import platform
+import socket
+import sys
+import threading
+import time
+
+from ActuatorIngest import RuleSet, ingest
+from ActuatorPool import ActuatorPool
+from ActuatorProtocol import ResponseReader
+from ActuatorWrapper import ActuatorWrapper
+from DirectiveSchema import DIRECTIVES
+from ShardedActuator import ShardedActuator
+from SimulatedActuator import SimulatedActuator
+
+#Typical keyword arguments per directive for the encode benchmark
+ENCODE_SAMPLES = [
+	("block", {"blockIP": "10.0.0.1", "dstPort": 22, "linkdrop": True,
+			   "timeout": 600}),
+	("deny", {"IP1": "10.0.0.0/24", "IP2": "10.1.0.1", "IP2port": 443,
+			  "proto": "tcp", "priority": 100}),
+	("redirect", {"IP1": "10.0.0.1", "remapIP": "10.0.0.2", "remapPort": 8080,
+				  "timeout": 60}),
+	("quarantine", {"quarantinedIP": "10.0.0.1", "notifier": "10.0.0.9",
+					"dnsPass": True}),
+	("cancel", {"id": 12345}),
+	("adjust", {"id": 12345, "timeout": 0}),
+]
+
+def make_info_response(size_mb):
+	"""
+	Build an INFO response of roughly size_mb megabytes
+	"""
+	lines = []
+	size = 0
+	d_id = 0
+	while size < size_mb * 1024 * 1024:
+		d_id += 1
+		line = (" %d: BLOCK -blockIP 10.%d.%d.%d -timeout 3600; "
+				"expires in 3600 seconds\n" % (d_id, (d_id >> 16) & 255,
+											   (d_id >> 8) & 255, d_id & 255))
+		lines.append(line)
+		size += len(line)
+	lines.append("DONE\n")
+	return "".join(lines).encode("ascii")
+
+def _concat_reader(sock):
+	"""
+	Baseline reader: receive into a str and split lines by concatenation
+	"""
+	data = b""
+	while 1:
+		chunk = sock.recv(65536)
+		if not chunk:
+			raise socket.error("Connection closed")
+		data += chunk
+		if data.endswith(b"\nDONE\n"):
+			return data.split(b"\n")
+
+def bench_reader(size_mb=8, repeat=3):
+	"""
+	Measure response reading throughput on an INFO response of size_mb
+
+	RETURNS:
+		@rtype: List
+		@return: One dict per reader with its name, MB/s and lines/s
+	"""
+	payload = make_info_response(size_mb)
+	line_count = payload.count(b"\n")
+	readers = [
+		("read_response", lambda r, s: r.read_response()),
+		("iter_lines", lambda r, s: sum(1 for _ in r.iter_lines())),
+		("concat_baseline", lambda r, s: _concat_reader(s)),
+	]
+	results = []
+	for name, read in readers:
+		elapsed = 0.0
+		for _ in range(repeat):
+			left, right = socket.socketpair()
+			writer = threading.Thread(target=left.sendall, args=(payload,))
+			writer.daemon = True
+			reader = ResponseReader(right)
+			start = time.time()
+			writer.start()
+			read(reader, right)
+			elapsed += time.time() - start
+			writer.join()
+			left.close()
+			right.close()
+		results.append({
+			"name": name,
+			"mb_per_s": len(payload) * repeat / elapsed / (1024 * 1024),
+			"lines_per_s": line_count * repeat / elapsed,
+		})
+	return results
+
+class _LegacyBuilder(object):
+	"""
+	Baseline encoder: the directive builders as they were before
+	DirectiveSchema, rebuilding the parameter list on every call, checking
+	membership linearly and growing the line by concatenation
+	"""
+
+	def _generate_args(self, poss_params, **kwargs):
+		args_gen = " "
+		for param, value in kwargs.items():
+			param = str(param)
+			if param not in poss_params:
+				raise ValueError(("Parameter \"" + param + "\" not in possible "
+							"parameter set for this Directive. Possible "
+							"parameters are - " + " ".join(poss_params)))
+			if type(value) == bool and value == True:
+				args_gen += "-" + str(param) + " "
+			else:
+				args_gen += "-" + str(param) + " " + str(value) + " "
+		return args_gen.rstrip()
+
+	def block(self, **kwargs):
+		poss_params = ["blockIP", "dstPort", "proto", "linkdrop", "style",
+						"resetAfter", "priority", "switch", "timeout"]
+		if kwargs.get("blockIP") == None:
+			raise ValueError("blockIP must be specified")
+		return "BLOCK" + self._generate_args(poss_params, **kwargs)
+
+	def deny(self, **kwargs):
+		poss_params = ["IP1", "IP2", "IP1port", "IP2port", "proto", "linkdrop1",
+					   "linkdrop2", "style", "resetAfter", "priority", "switch",
+					   "timeout"]
+		if all([kwargs.get("IP1") == None, kwargs.get("IP2") == None,
+				kwargs.get("IP1port") == None,
+				kwargs.get("IP2port") == None]):
+			raise ValueError(("You must specify at least one of the parameters:"
+							  " IP1, IP2, IP1port, IP2port"))
+		return "DENY" + self._generate_args(poss_params, **kwargs)
+
+	def redirect(self, **kwargs):
+		poss_params = ["IP1", "IP2", "IP1port", "IP2port", "proto", "remapIP",
+					   "remapPort", "block", "resetAfter", "redirectIdle",
+					   "priority", "switch", "timeout"]
+		if (kwargs.get("remapIP") == None or
+			all([	kwargs.get("IP1") == None, kwargs.get("IP2") == None,
+					kwargs.get("IP1port") == None,
+					kwargs.get("IP2port") == None])):
+			raise ValueError("You must specify remapIP and one of IP1, IP2, "
+							 "IP1port, IP2port")
+		return "REDIRECT" + self._generate_args(poss_params, **kwargs)
+
+	def quarantine(self, **kwargs):
+		poss_params = ["quarantinedIP", "notifier", "notifierPort", "dnsIP",
+						"dnsPass", "linkdrop", "style", "resetAfter",
+						"redirectIdle", "priority", "switch", "timeout"]
+		if any([kwargs.get("quarantinedIP") == None,
+				kwargs.get("notifier") == None]):
+			raise ValueError(("You must specify quarantinedIP and notifier"))
+		return "QUARANTINE" + self._generate_args(poss_params, **kwargs)
+
+	def cancel(self, **kwargs):
+		poss_params = ["all", "id"]
+		if sum([kwargs.get("all") == None, kwargs.get("id") == None]) != 1:
+			raise ValueError("You must specify either all or id")
+		return "CANCEL" + self._generate_args(poss_params, **kwargs)
+
+	def adjust(self, **kwargs):
+		poss_params = ["id", "timeout"]
+		if kwargs.get("id") == None or kwargs.get("timeout") == None:
+			raise ValueError("You must specify id and timeout")
+		return "ADJUST" + self._generate_args(poss_params, **kwargs)
+
+def bench_encode(count=100000):
+	"""
+	Measure the cost of encoding each sample directive count times
+
+	RETURNS:
+		@rtype: List
+		@return: One dict per directive with its name and the legacy and
+			compiled cost in microseconds per directive
+	"""
+	legacy_builder = _LegacyBuilder()
+	results = []
+	for name, kwargs in ENCODE_SAMPLES:
+		legacy_build = getattr(legacy_builder, name)
+		build = DIRECTIVES[name].build
+		start = time.time()
+		for _ in range(count):
+			legacy_build(**kwargs)
+		legacy = time.time() - start
+		start = time.time()
+		for _ in range(count):
+			build(kwargs)
+		compiled = time.time() - start
+		results.append({
+			"name": name,
+			"legacy_us": legacy / count * 1e6,
+			"compiled_us": compiled / count * 1e6,
+		})
+	return results
+
+INGEST_RULES = [
+	{"match": {"type": "worm"}, "directive": "QUARANTINE",
+	 "params": {"quarantinedIP": "{src}", "notifier": "10.255.0.1"}},
+	{"match": {"type": "portscan", "severity": {"min": 3}},
+	 "directive": "BLOCK", "params": {"blockIP": "{src}", "timeout": 600}},
+	{"match": {"type": "exfiltration"}, "directive": "DENY",
+	 "params": {"IP1": "{src}", "IP2": "{dst}", "timeout": 600}},
+]
+
+def _alert_lines(count):
+	""" count JSON alert lines, generated lazily """
+	types = ["portscan", "portscan", "exfiltration", "worm", "login"]
+	addresses = _addresses(4096)
+	for n in range(count):
+		yield json.dumps({"type": types[n % len(types)], "severity": n % 5,
+						  "src": addresses[n % 4096],
+						  "dst": addresses[(n * 7) % 4096]}) + "\n"
+
+class _NullOutput(object):
+	def write(self, data):
+		pass
+
+def bench_ingest(count=100000, batch=256):
+	"""
+	Measure ingestion throughput of count alerts
+
+	RETURNS:
+		@rtype: List
+		@return: One dict per target with its name, alerts/s and
+			directives/s
+	"""
+	rules = RuleSet(INGEST_RULES)
+	results = []
+	with SimulatedActuator() as actuator:
+		wrapper = ActuatorWrapper(*actuator.address)
+		for name, client, output in [("dry_run", None, _NullOutput()),
+									 ("simulated", wrapper, None)]:
+			start = time.time()
+			stats = ingest(_alert_lines(count), rules, client, output, batch)
+			elapsed = time.time() - start
+			results.append({
+				"name": name,
+				"alerts_per_s": stats["alerts"] / elapsed,
+				"directives_per_s": stats["directives"] / elapsed,
+			})
+		wrapper.quit()
+	return results
+
+def percentile(samples, fraction):
+	""" Nearest-rank percentile of a sorted list """
+	if not samples:
+		return 0.0
+	#Rounded first so 0.99 * 100 is rank 99, not 100
+	rank = int(math.ceil(round(fraction * len(samples), 9)))
+	return samples[min(max(rank - 1, 0), len(samples) - 1)]
+
+def summarize(latencies, elapsed, operations):
+	"""
+	RETURNS:
+		@rtype: Dictionary
+		@return: ops_per_s over the whole run and latency percentiles in
+			milliseconds of the individual timed calls
+	"""
+	latencies = sorted(latencies)
+	return {
+		"operations": operations,
+		"ops_per_s": operations / elapsed if elapsed else 0.0,
+		"p50_ms": percentile(latencies, 0.50) * 1000,
+		"p90_ms": percentile(latencies, 0.90) * 1000,
+		"p99_ms": percentile(latencies, 0.99) * 1000,
+		"max_ms": latencies[-1] * 1000 if latencies else 0.0,
+	}
+
+def _timed_blocks(wrapper, addresses, latencies):
+	""" BLOCK each address, appending every call's duration """
+	for address in addresses:
+		start = time.time()
+		wrapper.block(blockIP=address)
+		latencies.append(time.time() - start)
+
+def _addresses(count, offset=0):
+	return ["10.%d.%d.%d" % (((n + offset) >> 16) & 255,
+							 ((n + offset) >> 8) & 255, (n + offset) & 255)
+			for n in range(count)]
+
+def bench_sequential(address, count):
+	""" One BLOCK at a time; latency per directive """
+	wrapper = ActuatorWrapper(*address)
+	latencies = []
+	start = time.time()
+	_timed_blocks(wrapper, _addresses(count), latencies)
+	elapsed = time.time() - start
+	wrapper.cancel(all=True)
+	wrapper.quit()
+	return summarize(latencies, elapsed, count)
+
+def bench_pipelined(address, count, batch):
+	""" BLOCKs in pipelined batches; latency per batch """
+	wrapper = ActuatorWrapper(*address)
+	addresses = _addresses(count)
+	latencies = []
+	start = time.time()
+	for first in range(0, count, batch):
+		batch_start = time.time()
+		with wrapper.pipeline() as pipe:
+			for ip in addresses[first:first + batch]:
+				pipe.block(blockIP=ip)
+		latencies.append(time.time() - batch_start)
+	elapsed = time.time() - start
+	wrapper.cancel(all=True)
+	wrapper.quit()
+	return summarize(latencies, elapsed, count)
+
+def _run_threads(threads, target):
+	""" Run target(n, latencies) on n threads; return latencies and time """
+	latencies = []
+	workers = [threading.Thread(target=target, args=(n, latencies))
+			   for n in range(threads)]
+	start = time.time()
+	for worker in workers:
+		worker.start()
+	for worker in workers:
+		worker.join()
+	return latencies, time.time() - start
+
+def bench_threaded(address, count, threads):
+	""" Threads sharing one wrapper; latency per directive """
+	wrapper = ActuatorWrapper(*address)
+	per_thread = count // threads
+	def work(n, latencies):
+		_timed_blocks(wrapper, _addresses(per_thread, n * per_thread),
+					  latencies)
+	latencies, elapsed = _run_threads(threads, work)
+	wrapper.cancel(all=True)
+	wrapper.quit()
+	return summarize(latencies, elapsed, per_thread * threads)
+
+def bench_pool(address, count, threads):
+	""" Threads using an ActuatorPool; latency per directive """
+	pool = ActuatorPool(address[0], address[1], max_size=threads)
+	per_thread = count // threads
+	def work(n, latencies):
+		with pool.connection() as wrapper:
+			_timed_blocks(wrapper, _addresses(per_thread, n * per_thread),
+						  latencies)
+	latencies, elapsed = _run_threads(threads, work)
+	pool.cancel(all=True)
+	pool.close()
+	return summarize(latencies, elapsed, per_thread * threads)
+
+def bench_sharded(rtt, jitter, count, threads, shards):
+	"""
+	Threads using a ShardedActuator over several actuators, each thread
+	routing to one shard by switch; latency per directive
+	"""
+	actuators = [SimulatedActuator(rtt=rtt, jitter=jitter,
+								   switch_id=n + 1).start()
+				 for n in range(shards)]
+	sharded = ShardedActuator([actuator.address for actuator in actuators],
+							  lambda ip, port: ActuatorPool(ip, port,
+															max_size=threads))
+	per_thread = count // threads
+	def work(n, latencies):
+		switch = n % shards + 1
+		for address in _addresses(per_thread, n * per_thread):
+			start = time.time()
+			sharded.block(blockIP=address, switch=switch)
+			latencies.append(time.time() - start)
+	sharded.refresh_topology()
+	latencies, elapsed = _run_threads(threads, work)
+	sharded.cancel(all=True)
+	sharded.close()
+	for actuator in actuators:
+		actuator.stop()
+	return summarize(latencies, elapsed, per_thread * threads)
+
+def _timed_reads(read, repeat):
+	latencies = []
+	start = time.time()
+	for _ in range(repeat):
+		read_start = time.time()
+		read()
+		latencies.append(time.time() - read_start)
+	return latencies, time.time() - start
+
+def bench_info(address, size, repeat):
+	""" Whole and streamed reads of an INFO listing size directives """
+	wrapper = ActuatorWrapper(*address)
+	with wrapper.pipeline() as pipe:
+		for ip in _addresses(size):
+			pipe.block(blockIP=ip)
+	results = {}
+	for name, read in [("info", wrapper.info),
+					   ("info_records", lambda: list(wrapper.info_records()))]:
+		latencies, elapsed = _timed_reads(read, repeat)
+		results[name] = summarize(latencies, elapsed, repeat)
+		results[name]["records_per_s"] = size * repeat / elapsed
+	wrapper.cancel(all=True)
+	wrapper.quit()
+	return results
+
+def bench_hostinfo(rtt, size, repeat):
+	""" Reads of a HOSTINFO listing size hosts """
+	with SimulatedActuator(rtt=rtt, hosts=size) as actuator:
+		wrapper = ActuatorWrapper(*actuator.address)
+		latencies, elapsed = _timed_reads(wrapper.hostinfo, repeat)
+		wrapper.quit()
+	result = summarize(latencies, elapsed, repeat)
+	result["records_per_s"] = size * repeat / elapsed
+	return result
+
+def run_suite(rtt=0.0005, jitter=0.0, count=2000, threads=8, batch=256,
+			  info_size=20000, repeat=5, shards=2):
+	"""
+	Run every scenario against a fresh SimulatedActuator
+
+	RETURNS:
+		@rtype: Dictionary
+		@return: {"meta": run parameters and environment,
+			"results": scenario name -> summarize() dictionary}
+	"""
+	results = {}
+	with SimulatedActuator(rtt=rtt, jitter=jitter) as actuator:
+		address = actuator.address
+		results["sequential"] = bench_sequential(address, count)
+		results["pipelined"] = bench_pipelined(address, count, batch)
+		results["threaded"] = bench_threaded(address, count, threads)
+		results["pool"] = bench_pool(address, count, threads)
+		results.update(bench_info(address, info_size, repeat))
+	results["sharded"] = bench_sharded(rtt, jitter, count, threads, shards)
+	results["hostinfo"] = bench_hostinfo(rtt, info_size, repeat)
+	meta = {
+		"rtt_ms": rtt * 1000, "jitter_ms": jitter * 1000, "count": count,
+		"threads": threads, "batch": batch, "info_size": info_size,
+		"repeat": repeat, "shards": shards, "python": platform.python_version(),
+		"platform": platform.platform(), "timestamp": time.time(),
+	}
+	return {"meta": meta, "results": results}
+
+def compare(results, baseline, threshold=0.2):
+	"""
+	Compare a run to a baseline run (both as returned by run_suite)
+
+	RETURNS:
+		@rtype: List
+		@return: One message per regression: a scenario whose ops_per_s fell,
+			or whose p99_ms rose, by more than threshold (a fraction)
+	"""
+	regressions = []
+	for name, base in sorted(baseline["results"].items()):
+		current = results["results"].get(name)
+		if current is None:
+			continue
+		if current["ops_per_s"] < base["ops_per_s"] * (1 - threshold):
+			regressions.append("%s: %.0f ops/s, baseline %.0f" % (name,
+							   current["ops_per_s"], base["ops_per_s"]))
+		if current["p99_ms"] > base["p99_ms"] * (1 + threshold):
+			regressions.append("%s: p99 %.2f ms, baseline %.2f ms" % (name,
+							   current["p99_ms"], base["p99_ms"]))
+	return regressions
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description=__doc__,
+		formatter_class=argparse.RawDescriptionHelpFormatter)
+	commands = parser.add_subparsers(dest="command")
+	reader = commands.add_parser("reader",
+								 help="Response reader throughput on INFO")
+	reader.add_argument("--size-mb", type=float, default=8)
+	reader.add_argument("--repeat", type=int, default=3)
+	encode = commands.add_parser("encode",
+								 help="Directive validation and encoding cost")
+	encode.add_argument("--count", type=int, default=100000)
+	ingest_parser = commands.add_parser("ingest",
+										help="Alert ingestion throughput")
+	ingest_parser.add_argument("--count", type=int, default=100000)
+	ingest_parser.add_argument("--batch", type=int, default=256)
+	suite = commands.add_parser("suite",
+								help="Throughput and latency scenarios")
+	suite.add_argument("--rtt-ms", type=float, default=0.5)
+	suite.add_argument("--jitter-ms", type=float, default=0.0)
+	suite.add_argument("--count", type=int, default=2000)
+	suite.add_argument("--threads", type=int, default=8)
+	suite.add_argument("--batch", type=int, default=256)
+	suite.add_argument("--info-size", type=int, default=20000)
+	suite.add_argument("--repeat", type=int, default=5)
+	suite.add_argument("--shards", type=int, default=2)
+	suite.add_argument("--output", help="Write the results to this JSON file")
+	suite.add_argument("--baseline", help="JSON results to compare against")
+	suite.add_argument("--threshold", type=float, default=0.2)
+	args = parser.parse_args(argv)
+
+	if args.command == "suite":
+		results = run_suite(args.rtt_ms / 1000.0, args.jitter_ms / 1000.0,
+							args.count, args.threads, args.batch,
+							args.info_size, args.repeat, args.shards)
+		for name, result in sorted(results["results"].items()):
+			print("%-13s %10.0f ops/s  p50 %8.2f ms  p99 %8.2f ms" % (name,
+				  result["ops_per_s"], result["p50_ms"], result["p99_ms"]))
+		if args.output:
+			with open(args.output, "w") as output:
+				json.dump(results, output, indent=2, sort_keys=True)
+		if args.baseline:
+			with open(args.baseline) as baseline:
+				regressions = compare(results, json.load(baseline),
+									  args.threshold)
+			for regression in regressions:
+				print("REGRESSION " + regression)
+			if regressions:
+				sys.exit(1)
+	elif args.command == "reader":
+		for result in bench_reader(args.size_mb, args.repeat):
+			print("%-16s %8.1f MB/s %12.0f lines/s" % (result["name"],
+				  result["mb_per_s"], result["lines_per_s"]))
+	elif args.command == "encode":
+		for result in bench_encode(args.count):
+			print("%-12s legacy %6.2f us  compiled %6.2f us" % (
+				  result["name"], result["legacy_us"], result["compiled_us"]))
+	elif args.command == "ingest":
+		for result in bench_ingest(args.count, args.batch):
+			print("%-10s %10.0f alerts/s %10.0f directives/s" % (
+				  result["name"], result["alerts_per_s"],
+				  result["directives_per_s"]))
+	else:
+		parser.print_help()
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,54 @@
+#!/usr/bin/python
+# ActuatorBenchmarkTest.py - Test for the OF-Actuator wrapper benchmarks
+# Works with Python 2.7 and 3
+
+"""
+Tests the benchmark statistics and baseline comparison, and runs a tiny
+suite against the simulated actuator. No actuator needed.
+"""
+
+import json
+import unittest
+
+from ActuatorBenchmark import compare, percentile, run_suite
+
+def run(ops_per_s, p99_ms):
+	return {"results": {"sequential": {"ops_per_s": ops_per_s,
+									   "p99_ms": p99_ms}}}
+
+class ActuatorBenchmarkTest(unittest.TestCase):
+
+	def test_percentile(self):
+		""" Test nearest-rank percentiles. """
+		samples = list(range(1, 101))
+		self.assertEqual(percentile(samples, 0.5), 50)
+		self.assertEqual(percentile(samples, 0.99), 99)
+		self.assertEqual(percentile(samples, 1.0), 100)
+		self.assertEqual(percentile([7], 0.99), 7)
+		self.assertEqual(percentile([], 0.5), 0.0)
+
+	def test_compare(self):
+		""" Test flagging throughput and p99 regressions. """
+		baseline = run(1000.0, 2.0)
+		self.assertEqual(compare(run(900.0, 2.2), baseline, 0.2), [])
+		self.assertEqual(len(compare(run(700.0, 2.0), baseline, 0.2)), 1)
+		self.assertEqual(len(compare(run(700.0, 3.0), baseline, 0.2)), 2)
+		#Scenarios missing from the new run are not regressions
+		self.assertEqual(compare({"results": {}}, baseline), [])
+
+	def test_suite(self):
+		""" Test a small run of every scenario. """
+		results = run_suite(rtt=0.0, count=16, threads=2, batch=4,
+							info_size=50, repeat=1)
+		self.assertEqual(sorted(results["results"]),
+						 ["hostinfo", "info", "info_records", "pipelined",
+						  "pool", "sequential", "sharded", "threaded"])
+		for result in results["results"].values():
+			self.assertTrue(result["ops_per_s"] > 0)
+		#Results must survive a JSON round trip for baselines
+		self.assertEqual(compare(json.loads(json.dumps(results)), results,
+								 threshold=0.0), [])
+
+
+if __name__ == '__main__':
+	unittest.main()
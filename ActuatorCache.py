@@ -0,0 +1,648 @@
+#!/usr/bin/python
+# ActuatorCache.py - Client-side caches for the OF-Actuator wrapper
+# Works with Python 2.7 and 3
+
+"""
+Client-side state kept by ActuatorWrapper so common questions can be answered
+without a round-trip to the actuator.
+
+DirectiveCache: Local mirror of the directives active on the actuator. Enable
+	with ActuatorWrapper(..., track_state=True). It also indexes directives by
+	canonical_key() so ActuatorWrapper(..., dedupe=True) can find an identical
+	active directive instead of creating a duplicate, and by the addresses
+	they block (see AddressIndex.py).
+HostInfoCache: TTL/LRU cache of HOSTINFO lookups. Enable with
+	ActuatorWrapper(..., hostinfo_cache=HostInfoCache(...)).
+QueryCoalescer: Shares one outstanding INFO, SWITCHES, HOSTINFO or HELP
+	query among the threads asking it at the same time. Enable with
+	ActuatorWrapper(..., query_coalescer=QueryCoalescer(...)).
+"""
+
+import collections
+import heapq
+import re
+import threading
+import time
+
+from ActuatorProtocol import DirectiveRecord
+from AddressIndex import AddressIndex, address_int, parse_cidr
+
+#BLOCK is an alias for DENY; its parameters under their DENY names
+_BLOCK_AS_DENY = {"blockIP": "IP1", "dstPort": "IP2port",
+				  "linkdrop": "linkdrop1"}
+_ADDRESS_PARAMS = frozenset(["IP1", "IP2", "blockIP", "quarantinedIP",
+							 "notifier", "dnsIP", "remapIP", "IP"])
+_CIDR = re.compile(r"^(\d{1,3}(?:\.\d{1,3}){3})(?:/(\d{1,2}))?$")
+#Parameters that do not change what a directive matches
+_KEY_IGNORED = frozenset(["timeout"])
+#Parameters naming the addresses each directive type blocks
+_BLOCKED_PARAMS = {"BLOCK": ("blockIP",), "DENY": ("IP1", "IP2"),
+				   "QUARANTINE": ("quarantinedIP",), "UNPLUG": ("IP",)}
+
+def _canonical_value(param, value):
+	""" Normalize one parameter value for canonical_key() """
+	if value is True or value is False:
+		return value
+	value = str(value).strip()
+	if param in _ADDRESS_PARAMS:
+		match = _CIDR.match(value)
+		if match:
+			prefixlen = int(match.group(2) or 32)
+			octets = [int(octet) for octet in match.group(1).split(".")]
+			network = ((octets[0] << 24) | (octets[1] << 16) |
+					   (octets[2] << 8) | octets[3])
+			network &= (0xffffffff << (32 - prefixlen)) & 0xffffffff
+			return "%d.%d.%d.%d/%d" % (network >> 24, (network >> 16) & 255,
+									   (network >> 8) & 255, network & 255,
+									   prefixlen)
+		return value
+	if value.isdigit():
+		return str(int(value))
+	return value.lower()
+
+def canonical_key(directive, params):
+	"""
+	Hashable key identifying what a directive does, independent of parameter
+	order and spelling: BLOCK is keyed as the DENY it translates to, addresses
+	as network/prefixlen, numbers without leading zeros. The timeout is left
+	out so a re-issued directive with a new timeout has the same key, and so
+	are None values and False flags, which the directive line leaves out
+	"""
+	directive = directive.upper()
+	items = []
+	for param, value in params.items():
+		param = str(param)
+		if param in _KEY_IGNORED or value is None or value is False:
+			continue
+		if directive == "BLOCK":
+			param = _BLOCK_AS_DENY.get(param, param)
+		items.append((param, _canonical_value(param, value)))
+	if directive == "BLOCK":
+		directive = "DENY"
+	items.sort()
+	return (directive, tuple(items))
+
+def same_directive(known, record):
+	"""
+	Whether an INFO record shows the directive known (a record of a directive
+	as it was issued). INFO may list BLOCK as the DENY it translates to and
+	add parameters filled in from the defaults
+	"""
+	params = record.params
+	rename = (_BLOCK_AS_DENY if known.directive == "BLOCK" and
+			  record.directive == "DENY" else {})
+	if rename or known.directive == record.directive:
+		#Parameters as issued are usually listed verbatim
+		for param, value in known.params.items():
+			found = params.get(rename.get(param, param))
+			if found != value and found != str(value):
+				break
+		else:
+			return True
+	directive, params = canonical_key(known.directive, known.params)
+	found, found_params = canonical_key(record.directive, record.params)
+	return directive == found and set(params) <= set(found_params)
+
+def _blocked_prefixes(record):
+	"""
+	(first, last) address integers of every prefix a directive blocks
+	"""
+	prefixes = []
+	for param in _BLOCKED_PARAMS.get(record.directive, ()):
+		value = record.params.get(param)
+		if value is None or value is True:
+			continue
+		try:
+			prefixes.append(parse_cidr(value))
+		except ValueError:
+			#Not an address, e.g. a host name
+			pass
+	return prefixes
+
+class DirectiveCache(object):
+	"""
+	Mirror of active directives, keyed by directive ID. Filled from the
+	directives the wrapper issues and corrected by reconciling against INFO
+	whenever it is older than the staleness bound. Entries are dropped when
+	their timeout runs out, cancelled or missing from INFO.
+	"""
+
+	def __init__(self, staleness=30.0):
+		"""
+		ARGUMENTS:
+			o  staleness: Seconds after which the mirror must be reconciled
+				against INFO before it is trusted again. None never
+				reconciles automatically
+		"""
+		self.staleness = staleness
+		self.default_timeout = None
+		self.last_sync = None
+		self._lock = threading.Lock()
+		self._records = {}
+		#(expires, id) of records that expire, may hold outdated entries
+		self._expiry = []
+		#IDs added since the INFO of a running reconcile was requested
+		self._added_during_sync = None
+		#canonical_key -> ID of an active directive with that key. Built on
+		#the first find() after a replace(), which then stays cheap for
+		#large INFO listings nobody deduplicates against
+		self._by_key = {}
+		#AddressIndex over the prefixes blocked by the records, built on
+		#first use. Records added since are checked one by one, and removed
+		#ones filtered out, until enough changes pile up to rebuild it
+		self._by_address = None
+		self._unindexed = []
+		self._index_changes = 0
+
+	def _expires(self, timeout, now):
+		"""
+		Expiry time for a directive given its timeout parameter. 0 means
+		active indefinitely, None means the actuator's default timeout
+		"""
+		if timeout is None:
+			timeout = self.default_timeout
+		if timeout is None:
+			return None
+		timeout = float(timeout)
+		if timeout <= 0:
+			return None
+		return now + timeout
+
+	def _set(self, record):
+		""" Store a record and schedule its expiry. Lock must be held """
+		self._records[record.id] = record
+		if self._by_key is not None:
+			self._by_key[canonical_key(record.directive,
+									   record.params)] = record.id
+		if self._by_address is not None:
+			self._unindexed.append(record)
+			self._index_changes += 1
+		if record.expires is not None:
+			heapq.heappush(self._expiry, (record.expires, record.id))
+
+	def _remove(self, d_id):
+		""" Forget a record. Lock must be held """
+		record = self._records.pop(d_id, None)
+		if record is not None and self._by_key is not None:
+			key = canonical_key(record.directive, record.params)
+			if self._by_key.get(key) == d_id:
+				del self._by_key[key]
+		if record is not None:
+			self._index_changes += 1
+
+	def _expire(self, now):
+		""" Drop records whose expiry has passed. Lock must be held """
+		while self._expiry and self._expiry[0][0] <= now:
+			expires, d_id = heapq.heappop(self._expiry)
+			record = self._records.get(d_id)
+			#Skip heap entries outdated by an ADJUST or a re-sync
+			if record is not None and record.expires == expires:
+				self._remove(d_id)
+
+	def add(self, d_id, directive, params, now=None):
+		"""
+		Record a directive issued by the wrapper
+		"""
+		now = time.time() if now is None else now
+		params = dict((str(k), v) for k, v in params.items())
+		record = DirectiveRecord(d_id, directive, params,
+								 self._expires(params.get("timeout"), now))
+		with self._lock:
+			self._set(record)
+			if self._added_during_sync is not None:
+				self._added_during_sync.add(d_id)
+		return record
+
+	def cancel(self, d_id):
+		""" Apply a CANCEL -id locally """
+		with self._lock:
+			self._remove(d_id)
+
+	def cancel_all(self):
+		""" Apply a CANCEL -all locally """
+		with self._lock:
+			self._records.clear()
+			self._by_key = {}
+			self._by_address = None
+			self._expiry = []
+
+	def adjust(self, d_id, timeout, now=None):
+		""" Apply an ADJUST locally """
+		now = time.time() if now is None else now
+		with self._lock:
+			record = self._records.get(d_id)
+			if record is None:
+				return
+			record.params["timeout"] = str(timeout)
+			#Timeout 0 is explicit here, never the actuator default
+			record.expires = (None if float(timeout) <= 0 else
+							  now + float(timeout))
+			if record.expires is not None:
+				heapq.heappush(self._expiry, (record.expires, d_id))
+
+	def begin_sync(self):
+		"""
+		Mark the start of a reconcile, before INFO is requested. Directives
+		added from here on survive replace() even if INFO missed them
+		"""
+		with self._lock:
+			self._added_during_sync = set()
+
+	def replace(self, records, now=None):
+		"""
+		Reconcile with the records of an INFO response. Directives missing
+		from INFO are dropped; for known directives the parameters as issued
+		are kept and the expiry reported by the actuator wins
+		"""
+		now = time.time() if now is None else now
+		fresh = {}
+		for record in records:
+			fresh[record.id] = record
+		with self._lock:
+			for d_id, record in fresh.items():
+				known = self._records.get(d_id)
+				if known is not None:
+					if record.expires is not None:
+						known.expires = record.expires
+					fresh[d_id] = known
+			for d_id in self._added_during_sync or ():
+				if d_id in self._records:
+					fresh.setdefault(d_id, self._records[d_id])
+			self._added_during_sync = None
+			self._records = {}
+			self._by_key = None
+			self._by_address = None
+			self._expiry = []
+			for record in fresh.values():
+				self._set(record)
+			self.last_sync = now
+
+	def is_stale(self, now=None):
+		"""
+		Check whether the mirror is past its staleness bound
+		"""
+		if self.staleness is None:
+			return False
+		if self.last_sync is None:
+			return True
+		now = time.time() if now is None else now
+		return now - self.last_sync > self.staleness
+
+	def get(self, d_id, now=None):
+		"""
+		Return the active DirectiveRecord for d_id, None if not active
+		"""
+		now = time.time() if now is None else now
+		with self._lock:
+			self._expire(now)
+			return self._records.get(d_id)
+
+	def find(self, key, now=None):
+		"""
+		Return the active DirectiveRecord with the given canonical_key(),
+		None if there is none
+		"""
+		now = time.time() if now is None else now
+		with self._lock:
+			self._expire(now)
+			if self._by_key is None:
+				self._by_key = dict((canonical_key(record.directive,
+												   record.params), d_id)
+									for d_id, record in self._records.items())
+			d_id = self._by_key.get(key)
+			return None if d_id is None else self._records.get(d_id)
+
+	def _address_index(self, exact=False):
+		"""
+		Return the AddressIndex, rebuilt if it is missing, if many records
+		changed since it was built or, with exact, if any did. Lock must be
+		held
+		"""
+		index = self._by_address
+		changes = self._index_changes
+		if (index is None or changes > max(64, len(index) // 8) or
+				(exact and changes)):
+			index = AddressIndex((prefix, record)
+								 for record in self._records.values()
+								 for prefix in _blocked_prefixes(record))
+			self._by_address = index
+			self._unindexed = []
+			self._index_changes = 0
+		return index
+
+	def _matching(self, indexed, match):
+		"""
+		Live records among the indexed ones and those added since the index
+		was built for which match(first, last) holds for a blocked prefix,
+		ordered by ID. Lock must be held
+		"""
+		records = dict((record.id, record) for record in indexed)
+		for record in self._unindexed:
+			for first, last in _blocked_prefixes(record):
+				if match(first, last):
+					records[record.id] = record
+		live = self._records
+		return sorted((record for d_id, record in records.items()
+					   if live.get(d_id) is record), key=lambda r: r.id)
+
+	def covering(self, address, now=None):
+		"""
+		Return the active BLOCK, DENY, QUARANTINE and UNPLUG records whose
+		addresses cover address (dotted or integer), ordered by ID. A DENY
+		or BLOCK limited to some ports or peers is included as well
+		"""
+		now = time.time() if now is None else now
+		value = address_int(address)
+		with self._lock:
+			self._expire(now)
+			indexed = self._address_index().covering(value)
+			return self._matching(indexed, lambda first, last:
+								  first <= value <= last)
+
+	def overlapping(self, cidr, now=None):
+		"""
+		Return the active records whose addresses cover or lie inside cidr,
+		ordered by ID
+		"""
+		now = time.time() if now is None else now
+		lo, hi = parse_cidr(cidr)
+		with self._lock:
+			self._expire(now)
+			indexed = self._address_index().overlapping(cidr)
+			return self._matching(indexed, lambda first, last:
+								  first <= hi and lo <= last)
+
+	def contains_many(self, addresses, now=None):
+		"""
+		Check many addresses against the active directives at once, see
+		AddressIndex.contains_many()
+		"""
+		now = time.time() if now is None else now
+		with self._lock:
+			self._expire(now)
+			index = self._address_index(exact=True)
+		return index.contains_many(addresses)
+
+	def active(self, directive=None, now=None):
+		"""
+		List the active DirectiveRecords, optionally only those of one
+		directive type
+		"""
+		now = time.time() if now is None else now
+		with self._lock:
+			self._expire(now)
+			records = list(self._records.values())
+		if directive is not None:
+			records = [r for r in records if r.directive == directive]
+		return sorted(records, key=lambda r: r.id)
+
+	def __len__(self):
+		with self._lock:
+			self._expire(time.time())
+			return len(self._records)
+
+	def __contains__(self, d_id):
+		return self.get(d_id) is not None
+
+#First IPv4 address on a HOSTINFO line names the host the line describes
+_HOST_IP = re.compile(r"(?<![\d.])(\d{1,3}(?:\.\d{1,3}){3})(?![\d.])")
+
+class HostInfoCache(object):
+	"""
+	Bounded cache of HOSTINFO responses keyed by IP. Entries expire after ttl
+	seconds and the least recently used entry is evicted when the cache is
+	full. Hosts the actuator does not know are cached too (negative caching)
+	for negative_ttl seconds, so repeated lookups of unknown hosts do not
+	reach the actuator either.
+	"""
+
+	def __init__(self, ttl=60.0, max_size=4096, negative_ttl=5.0):
+		"""
+		ARGUMENTS:
+			o  ttl: Seconds a known host's information is reused
+			o  max_size: Maximum number of cached hosts
+			o  negative_ttl: Seconds an unknown host is remembered as unknown
+		"""
+		if max_size < 1:
+			raise ValueError("max_size must be at least 1")
+		self.ttl = ttl
+		self.max_size = max_size
+		self.negative_ttl = negative_ttl
+		self._lock = threading.Lock()
+		#IP -> (expires, response or Exception), least recently used first
+		self._entries = collections.OrderedDict()
+		self._stats = {"hits": 0, "misses": 0, "negative_hits": 0,
+					   "evictions": 0, "expirations": 0}
+
+	def _store(self, ip, value, ttl, now):
+		""" Insert or refresh an entry, evicting the LRU one if full """
+		if ttl is None or ttl <= 0:
+			return
+		with self._lock:
+			self._entries.pop(ip, None)
+			self._entries[ip] = (now + ttl, value)
+			while len(self._entries) > self.max_size:
+				self._entries.popitem(last=False)
+				self._stats["evictions"] += 1
+
+	def lookup(self, ip, now=None):
+		"""
+		RETURNS:
+			@rtype: Tuple
+			@return: (found, value). value is the cached HOSTINFO response, or
+				the Exception raised for an unknown host
+		"""
+		now = time.time() if now is None else now
+		with self._lock:
+			entry = self._entries.get(ip)
+			if entry is not None and entry[0] <= now:
+				del self._entries[ip]
+				self._stats["expirations"] += 1
+				entry = None
+			if entry is None:
+				self._stats["misses"] += 1
+				return False, None
+			#Mark as most recently used
+			del self._entries[ip]
+			self._entries[ip] = entry
+			if isinstance(entry[1], Exception):
+				self._stats["negative_hits"] += 1
+			else:
+				self._stats["hits"] += 1
+			return True, entry[1]
+
+	def store(self, ip, data, now=None):
+		""" Cache the HOSTINFO response for a known host """
+		self._store(ip, data, self.ttl, time.time() if now is None else now)
+
+	def store_unknown(self, ip, error, now=None):
+		""" Cache the error the actuator returned for an unknown host """
+		self._store(ip, error, self.negative_ttl,
+					time.time() if now is None else now)
+
+	def load_all(self, data, now=None):
+		"""
+		Warm the cache from a no-argument HOSTINFO response listing all
+		hosts. Each host is cached with its lines from the listing followed by
+		the response's terminating line. Returns the number of hosts cached
+		"""
+		now = time.time() if now is None else now
+		lines = data.splitlines(True)
+		if not lines:
+			return 0
+		end = lines[-1]
+		hosts = collections.OrderedDict()
+		current = None
+		for line in lines[:-1]:
+			match = _HOST_IP.search(line)
+			#Lines without an address continue the previous host
+			if match:
+				current = match.group(1)
+				hosts.setdefault(current, [])
+			if current is not None:
+				hosts[current].append(line)
+		for ip, host_lines in hosts.items():
+			self.store(ip, "".join(host_lines) + end, now)
+		return len(hosts)
+
+	def invalidate(self, ip=None):
+		""" Forget one host, or every host if ip is None """
+		with self._lock:
+			if ip is None:
+				self._entries.clear()
+			else:
+				self._entries.pop(ip, None)
+
+	def stats(self):
+		"""
+		RETURNS:
+			@rtype: Dictionary
+			@return: Hit/miss/eviction counters and the current size
+		"""
+		with self._lock:
+			stats = dict(self._stats)
+			stats["size"] = len(self._entries)
+		return stats
+
+	def __len__(self):
+		with self._lock:
+			return len(self._entries)
+
+class _Flight(object):
+	""" One outstanding query shared by the callers that asked for it """
+	__slots__ = ("done", "result", "error")
+
+	def __init__(self):
+		self.done = threading.Event()
+		self.result = None
+		self.error = None
+
+class QueryCoalescer(object):
+	"""
+	Single-flight coalescing of read-only queries (INFO, SWITCHES, HOSTINFO,
+	HELP). While a query is outstanding, callers asking the same query wait
+	for it and all get its response (or its exception) instead of sending it
+	again. With a window, a response also answers identical queries for
+	window seconds after it arrived, so a burst of refreshes costs one
+	round-trip. Responses are keyed by actuator address and directive line.
+	"""
+
+	def __init__(self, window=0.0, max_size=256):
+		"""
+		ARGUMENTS:
+			o  window: Seconds a response keeps answering identical queries.
+				0 only shares queries that are in flight at the same time
+			o  max_size: Maximum number of responses kept for the window
+		"""
+		if window < 0:
+			raise ValueError("window must not be negative")
+		self.window = window
+		self.max_size = max_size
+		self._lock = threading.Lock()
+		#key -> _Flight of the query outstanding for it
+		self._flights = {}
+		#key -> (expires, response), oldest first
+		self._results = collections.OrderedDict()
+		self._stats = {"queries": 0, "joined": 0, "window_hits": 0}
+
+	def query(self, key, fetch, *args):
+		"""
+		ARGUMENTS:
+			o  key: Hashable identifying the query, e.g. (address, line)
+			o  fetch, args: fetch(*args) sends the query and returns its
+				response
+		RETURNS:
+			@rtype: String
+			@return: The response of this query or of an identical one in
+				flight or within the window
+		"""
+		with self._lock:
+			if self.window:
+				entry = self._results.get(key)
+				if entry is not None:
+					if entry[0] > time.time():
+						self._stats["window_hits"] += 1
+						return entry[1]
+					del self._results[key]
+			flight = self._flights.get(key)
+			leader = flight is None
+			if leader:
+				flight = self._flights[key] = _Flight()
+				self._stats["queries"] += 1
+			else:
+				self._stats["joined"] += 1
+		if not leader:
+			flight.done.wait()
+			if flight.error is not None:
+				raise flight.error
+			return flight.result
+		try:
+			flight.result = fetch(*args)
+		except Exception as e:
+			flight.error = e
+			raise
+		finally:
+			with self._lock:
+				#invalidate() may have detached it already
+				if self._flights.get(key) is flight:
+					del self._flights[key]
+					if self.window and flight.error is None:
+						self._store(key, flight.result)
+			flight.done.set()
+		return flight.result
+
+	def _store(self, key, response):
+		""" Keep a response for the window. Lock held """
+		self._results.pop(key, None)
+		self._results[key] = (time.time() + self.window, response)
+		while len(self._results) > self.max_size:
+			self._results.popitem(last=False)
+
+	def invalidate(self, directive=None):
+		"""
+		Forget kept responses, and stop new callers joining queries in
+		flight, of one directive type (e.g. "INFO" after a directive
+		changed what INFO lists) or of every type if directive is None
+		"""
+		with self._lock:
+			for table in (self._results, self._flights):
+				for key in list(table):
+					if directive is None or _query_type(key) == directive:
+						del table[key]
+
+	def stats(self):
+		"""
+		RETURNS:
+			@rtype: Dictionary
+			@return: queries (sent), joined (answered by a query in flight),
+				window_hits (answered by a kept response) and in_flight
+		"""
+		with self._lock:
+			stats = dict(self._stats)
+			stats["in_flight"] = len(self._flights)
+		return stats
+
+def _query_type(key):
+	""" Directive type of a coalescing key ending in a directive line """
+	line = key[-1] if isinstance(key, tuple) else key
+	return line.split(" ", 1)[0]
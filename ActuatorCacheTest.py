@@ -0,0 +1,262 @@
+#!/usr/bin/python
+# ActuatorCacheTest.py - Test for OF-Actuator wrapper client-side caches
+# Works with Python 2.7 and 3
+
+"""
+Tests the caches on their own. No actuator needed.
+"""
+
+import threading
+import time
+import unittest
+
+from ActuatorCache import (DirectiveCache, HostInfoCache, QueryCoalescer,
+						  canonical_key, same_directive)
+from ActuatorProtocol import DirectiveRecord
+
+class DirectiveCacheTest(unittest.TestCase):
+
+	def setUp(self):
+		self.cache = DirectiveCache(staleness=10)
+
+	def test_expiry(self):
+		""" Test that directives drop out when their timeout runs out. """
+		self.cache.add(1, "BLOCK", {"blockIP": "10.0.0.1", "timeout": 5},
+					   now=100.0)
+		self.cache.add(2, "BLOCK", {"blockIP": "10.0.0.2", "timeout": 0},
+					   now=100.0)
+		self.cache.add(3, "BLOCK", {"blockIP": "10.0.0.3"}, now=100.0)
+		self.assertEqual([r.id for r in self.cache.active(now=104.0)],
+						 [1, 2, 3])
+		self.assertEqual([r.id for r in self.cache.active(now=106.0)], [2, 3])
+
+	def test_default_timeout(self):
+		""" Test that a known DEFAULTS timeout applies when none is given. """
+		self.cache.default_timeout = 5
+		self.cache.add(1, "DENY", {"IP1": "10.0.0.1"}, now=100.0)
+		self.assertEqual(self.cache.get(1, now=106.0), None)
+
+	def test_adjust(self):
+		""" Test that ADJUST moves the expiry. """
+		self.cache.add(1, "BLOCK", {"blockIP": "10.0.0.1", "timeout": 5},
+					   now=100.0)
+		self.cache.adjust(1, 60, now=101.0)
+		self.assertNotEqual(self.cache.get(1, now=110.0), None)
+		self.assertEqual(self.cache.get(1, now=162.0), None)
+
+	def test_replace(self):
+		""" Test reconciling against INFO records. """
+		self.cache.add(1, "BLOCK", {"blockIP": "10.0.0.1"}, now=100.0)
+		self.cache.add(2, "BLOCK", {"blockIP": "10.0.0.2"}, now=100.0)
+		self.cache.begin_sync()
+		self.cache.add(4, "BLOCK", {"blockIP": "10.0.0.4"}, now=100.0)
+		self.cache.replace([DirectiveRecord(2, "DENY", {"IP1": "10.0.0.2"},
+											expires=150.0),
+							DirectiveRecord(3, "DENY", {"IP1": "10.0.0.3"})],
+						   now=101.0)
+		active = self.cache.active(now=102.0)
+		self.assertEqual([r.id for r in active], [2, 3, 4])
+		#Parameters as issued are kept, expiry from INFO wins
+		self.assertEqual(active[0].directive, "BLOCK")
+		self.assertEqual(active[0].expires, 150.0)
+		self.assertFalse(self.cache.is_stale(now=105.0))
+		self.assertTrue(self.cache.is_stale(now=112.0))
+
+	def test_canonical_key(self):
+		""" Test that equivalent directives share a canonical key. """
+		key = canonical_key("DENY", {"IP1": "10.0.0.0/24", "IP2port": "080"})
+		self.assertEqual(key, canonical_key("BLOCK", {"dstPort": 80,
+			"blockIP": "10.0.0.7/24", "timeout": 60}))
+		self.assertNotEqual(key, canonical_key("DENY", {"IP1": "10.0.0.0/24"}))
+		self.assertNotEqual(canonical_key("BLOCK", {"blockIP": "10.0.0.1"}),
+							canonical_key("BLOCK", {"blockIP": "10.0.0.2"}))
+		#Left out of the directive line, so left out of the key
+		self.assertEqual(canonical_key("BLOCK", {"blockIP": "10.0.0.1"}),
+						 canonical_key("BLOCK", {"blockIP": "10.0.0.1",
+												 "style": None,
+												 "linkdrop": False}))
+
+	def test_same_directive(self):
+		""" Test matching issued directives to INFO records. """
+		known = DirectiveRecord(1, "BLOCK", {"blockIP": "10.0.0.1",
+											 "timeout": 60})
+		self.assertTrue(same_directive(known, DirectiveRecord(1, "DENY",
+			{"IP1": "10.0.0.1", "timeout": "60", "priority": "100"})))
+		self.assertTrue(same_directive(known, DirectiveRecord(1, "DENY",
+			{"IP1": "10.0.0.1/32"})))
+		self.assertFalse(same_directive(known, DirectiveRecord(1, "DENY",
+			{"IP1": "10.0.0.2", "timeout": "60"})))
+		self.assertFalse(same_directive(known, DirectiveRecord(1, "QUARANTINE",
+			{"quarantinedIP": "10.0.0.1"})))
+
+	def test_find(self):
+		""" Test looking directives up by canonical key. """
+		key = canonical_key("BLOCK", {"blockIP": "10.0.0.1"})
+		self.cache.add(1, "BLOCK", {"blockIP": "10.0.0.1", "timeout": 5},
+					   now=100.0)
+		self.assertEqual(self.cache.find(key, now=101.0).id, 1)
+		self.assertEqual(self.cache.find(key, now=106.0), None)
+		self.cache.add(2, "DENY", {"IP1": "10.0.0.1/32"}, now=110.0)
+		self.assertEqual(self.cache.find(key, now=111.0).id, 2)
+		self.cache.cancel(2)
+		self.assertEqual(self.cache.find(key, now=112.0), None)
+
+	def test_covering(self):
+		""" Test address lookups as directives come and go. """
+		self.cache.add(1, "BLOCK", {"blockIP": "10.0.0.0/8"}, now=100.0)
+		self.cache.add(2, "DENY", {"IP1": "10.1.0.0/16", "IP2": "10.1.2.3"},
+					   now=100.0)
+		self.cache.add(3, "QUARANTINE", {"quarantinedIP": "192.168.0.1",
+										 "notifier": "10.0.0.9"}, now=100.0)
+		self.cache.add(4, "REDIRECT", {"IP1": "10.1.2.3",
+									   "remapIP": "10.0.0.9"}, now=100.0)
+		covering = lambda address: [r.id for r in
+									self.cache.covering(address, now=101.0)]
+		self.assertEqual(covering("10.1.2.3"), [1, 2])
+		self.assertEqual(covering("10.0.0.9"), [1])
+		self.assertEqual(covering("192.168.0.2"), [])
+		#Added after the index was built
+		self.cache.add(5, "UNPLUG", {"IP": "192.168.0.2", "timeout": 5},
+					   now=100.0)
+		self.assertEqual(covering("192.168.0.2"), [5])
+		self.cache.cancel(1)
+		self.assertEqual(covering("10.1.2.3"), [2])
+		self.assertEqual([r.id for r in self.cache.overlapping("192.168.0.0/24",
+															   now=101.0)],
+						 [3, 5])
+		self.assertEqual(list(self.cache.contains_many(["10.0.0.9", "10.1.0.1",
+														"192.168.0.2"],
+													   now=101.0)),
+						 [False, True, True])
+		#Expired
+		self.assertEqual(covering("192.168.0.2"), [5])
+		self.assertEqual([r.id for r in self.cache.covering("192.168.0.2",
+															now=106.0)], [])
+		self.cache.replace([DirectiveRecord(6, "DENY", {"IP1": "10.1.0.0/16"})],
+						   now=107.0)
+		self.assertEqual(covering("10.1.2.3"), [6])
+
+class HostInfoCacheTest(unittest.TestCase):
+
+	def setUp(self):
+		self.cache = HostInfoCache(ttl=60, max_size=2, negative_ttl=5)
+
+	def test_ttl(self):
+		""" Test that entries expire after their TTL. """
+		self.cache.store("10.0.0.1", "info\nDONE\n", now=100.0)
+		self.assertEqual(self.cache.lookup("10.0.0.1", now=150.0),
+						 (True, "info\nDONE\n"))
+		self.assertEqual(self.cache.lookup("10.0.0.1", now=161.0),
+						 (False, None))
+		self.assertEqual(self.cache.stats()["expirations"], 1)
+
+	def test_lru_eviction(self):
+		""" Test that the least recently used entry is evicted. """
+		self.cache.store("10.0.0.1", "a", now=100.0)
+		self.cache.store("10.0.0.2", "b", now=100.0)
+		self.cache.lookup("10.0.0.1", now=101.0)
+		self.cache.store("10.0.0.3", "c", now=102.0)
+		self.assertTrue(self.cache.lookup("10.0.0.1", now=103.0)[0])
+		self.assertFalse(self.cache.lookup("10.0.0.2", now=103.0)[0])
+		self.assertEqual(self.cache.stats()["evictions"], 1)
+
+	def test_negative(self):
+		""" Test negative caching of unknown hosts. """
+		error = Exception("ERROR unknown host")
+		self.cache.store_unknown("10.0.0.9", error, now=100.0)
+		self.assertEqual(self.cache.lookup("10.0.0.9", now=104.0),
+						 (True, error))
+		self.assertFalse(self.cache.lookup("10.0.0.9", now=106.0)[0])
+		self.assertEqual(self.cache.stats()["negative_hits"], 1)
+
+	def test_load_all(self):
+		""" Test warming the cache from a full HOSTINFO listing. """
+		cache = HostInfoCache()
+		count = cache.load_all((" 10.0.0.1 mac 00:00:00:00:00:01 port 1\n"
+								"    path 00:00:00:00:00:00:00:01\n"
+								" 10.0.0.2 mac 00:00:00:00:00:02 port 2\n"
+								"DONE\n"), now=100.0)
+		self.assertEqual(count, 2)
+		found, data = cache.lookup("10.0.0.1", now=101.0)
+		self.assertEqual(data.count("\n"), 3)
+		self.assertTrue(data.endswith("DONE\n"))
+
+
+class QueryCoalescerTest(unittest.TestCase):
+
+	def concurrent(self, coalescer, count, fetch):
+		""" Run count threads querying the same key; return their results """
+		results = []
+		def query():
+			try:
+				results.append(coalescer.query("INFO", fetch))
+			except Exception as e:
+				results.append(e)
+		threads = [threading.Thread(target=query) for i in range(count)]
+		for thread in threads:
+			thread.start()
+		return threads, results
+
+	def test_single_flight(self):
+		""" Test that concurrent identical queries share one fetch. """
+		coalescer = QueryCoalescer()
+		release = threading.Event()
+		calls = []
+		def fetch():
+			calls.append(1)
+			release.wait(5)
+			return "DONE\n"
+		threads, results = self.concurrent(coalescer, 8, fetch)
+		while coalescer.stats()["joined"] < 7:
+			time.sleep(0.001)
+		release.set()
+		for thread in threads:
+			thread.join()
+		self.assertEqual(results, ["DONE\n"] * 8)
+		self.assertEqual(len(calls), 1)
+		#Nothing is kept without a window
+		self.assertEqual(coalescer.query("INFO", lambda: "new"), "new")
+		self.assertEqual(coalescer.stats()["queries"], 2)
+
+	def test_shared_error(self):
+		""" Test that every caller of a failed query gets its error. """
+		coalescer = QueryCoalescer(window=60)
+		release = threading.Event()
+		error = Exception("ERROR busy")
+		def fetch():
+			release.wait(5)
+			raise error
+		threads, results = self.concurrent(coalescer, 3, fetch)
+		while coalescer.stats()["joined"] < 2:
+			time.sleep(0.001)
+		release.set()
+		for thread in threads:
+			thread.join()
+		self.assertEqual(results, [error] * 3)
+		#Errors are not kept for the window
+		self.assertEqual(coalescer.query("INFO", lambda: "ok"), "ok")
+
+	def test_window(self):
+		""" Test that a response answers queries within the window. """
+		coalescer = QueryCoalescer(window=0.05)
+		self.assertEqual(coalescer.query(("a", "INFO"), lambda: "first"),
+						 "first")
+		self.assertEqual(coalescer.query(("a", "INFO"), lambda: "second"),
+						 "first")
+		self.assertEqual(coalescer.query(("b", "INFO"), lambda: "other"),
+						 "other")
+		coalescer.query(("a", "SWITCHES"), lambda: "switches")
+		coalescer.invalidate("INFO")
+		self.assertEqual(coalescer.query(("a", "INFO"), lambda: "third"),
+						 "third")
+		self.assertEqual(coalescer.query(("a", "SWITCHES"), lambda: "new"),
+						 "switches")
+		time.sleep(0.06)
+		self.assertEqual(coalescer.query(("a", "INFO"), lambda: "fourth"),
+						 "fourth")
+		self.assertEqual(coalescer.stats()["window_hits"], 2)
+		self.assertRaises(ValueError, QueryCoalescer, -1)
+
+
+if __name__ == '__main__':
+	unittest.main()
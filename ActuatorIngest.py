@@ -0,0 +1,521 @@
+#!/usr/bin/python
+# ActuatorIngest.py - Turn a stream of alerts into OF-Actuator directives
+# Works with Python 2.7 and 3
+
+"""
+Reads alerts as JSON lines and turns them into directives through declarative
+rules, without writing any Python:
+
+	python ActuatorIngest.py rules.json [alerts.jsonl | -] [--follow]
+		[--actuator HOST:PORT] [--dedupe] [--dry-run] [--batch 256]
+		[--max-wait 0.2] [--interval 1]
+
+Alerts are read from stdin (or a file; with --follow the file is tailed like
+"tail -F"). Every second a throughput line is written to stderr. With
+--dry-run the directive lines are printed instead of sent.
+
+The rules file holds a list of rules (or {"rules": [...]}). The first rule
+whose match fits an alert decides its directive:
+
+	[
+		{"match": {"type": ["worm", "botnet"]},
+		 "directive": "QUARANTINE",
+		 "params": {"quarantinedIP": "{src.ip}", "notifier": "10.0.0.9"}},
+		{"match": {"type": "portscan", "severity": {"min": 3}},
+		 "directive": "BLOCK",
+		 "params": {"blockIP": "{src.ip}", "timeout": 600}}
+	]
+
+match maps alert fields (dotted for nested objects) to a value the field must
+equal, a list of values it must be one of, or {"min": x, "max": y} bounds.
+An empty match fits every alert. Parameter values may contain {field}
+references to alert fields; a value that is a single reference keeps the
+field's type. An alert missing a referenced field does not fit the rule.
+
+The stages are chained generators (lines, alerts, directives, batches), so
+memory stays bounded by one batch however long the input is. Directives are
+micro-batched into one pipelined write (DirectivePipeline), a batch being
+sent when it is full, when its oldest directive waited max_wait seconds or
+when the input goes idle. Identical directives within a batch are sent once.
+"""
+
+import argparse
+import json
+import os
+import re
+import select
+import socket
+import sys
+import time
+
+from ActuatorCache import canonical_key
+from DirectiveSchema import DIRECTIVES, ID
+
+_REFERENCE = re.compile(r"\{([^{}]+)\}")
+#json gives unicode strings on Python 2
+_TEXT_TYPES = (str, type(u""))
+
+def _getter(path):
+	"""
+	Return a function fetching a dotted field of an alert, raising KeyError
+	when it is missing
+	"""
+	names = path.split(".")
+	if len(names) == 1:
+		name = names[0]
+		return lambda alert: alert[name]
+	def get(alert):
+		for name in names:
+			alert = alert[name]
+		return alert
+	return get
+
+def _compile_test(path, expected):
+	""" Return a predicate on an alert for one match entry """
+	get = _getter(path)
+	if isinstance(expected, dict):
+		unknown = set(expected) - set(["min", "max"])
+		if unknown:
+			raise ValueError(("Unknown bound " + ", ".join(sorted(unknown)) +
+							  " for field \"" + path + "\""))
+		low = expected.get("min")
+		high = expected.get("max")
+		def test(alert):
+			value = get(alert)
+			if isinstance(value, bool) or not isinstance(value, (int, float)):
+				return False
+			return ((low is None or value >= low) and
+					(high is None or value <= high))
+	elif isinstance(expected, list):
+		#Unhashable alert values (lists, objects) simply never match
+		choices = frozenset(value for value in expected
+							if not isinstance(value, (list, dict)))
+		def test(alert):
+			value = get(alert)
+			return not isinstance(value, (list, dict)) and value in choices
+	else:
+		def test(alert):
+			return get(alert) == expected
+	return test
+
+def _compile_value(value):
+	"""
+	Return a function building one parameter value from an alert. Raises
+	KeyError when a referenced field is missing
+	"""
+	if not isinstance(value, _TEXT_TYPES):
+		return lambda alert: value
+	references = _REFERENCE.findall(value)
+	if not references:
+		return lambda alert: value
+	if _REFERENCE.sub("", value) == "" and len(references) == 1:
+		#A whole-value reference keeps the field's type
+		return _getter(references[0])
+	parts = _REFERENCE.split(value)
+	#Odd positions of the split are field references
+	pieces = [_getter(part) if i % 2 else part
+			  for i, part in enumerate(parts)]
+	def build(alert):
+		return "".join(piece if i % 2 == 0 else str(piece(alert))
+					   for i, piece in enumerate(pieces))
+	return build
+
+class Rule(object):
+	""" One compiled rule: a match on alert fields and a directive template """
+
+	__slots__ = ("directive", "spec", "_tests", "_params")
+
+	def __init__(self, entry):
+		"""
+		ARGUMENTS:
+			o  entry: Dictionary with directive, params and optionally match,
+				see the module documentation
+		"""
+		if not isinstance(entry, dict) or "directive" not in entry:
+			raise ValueError("A rule needs a directive: " + repr(entry))
+		self.directive = str(entry["directive"]).upper()
+		self.spec = DIRECTIVES.get(self.directive.lower())
+		if self.spec is None or self.spec.reply != ID:
+			raise ValueError(("Rules can only create directives, not " +
+							  self.directive))
+		params = entry.get("params", {})
+		for param in params:
+			if param not in self.spec.params:
+				raise ValueError(("Parameter \"" + param + "\" not in "
+								  "possible parameter set for " +
+								  self.directive))
+		self._tests = tuple(_compile_test(path, expected) for path, expected
+							in entry.get("match", {}).items())
+		self._params = tuple((str(param), _compile_value(value))
+							 for param, value in params.items())
+
+	def apply(self, alert):
+		"""
+		RETURNS:
+			@rtype: Dictionary
+			@return: The directive's parameters for alert, None if the rule
+				does not match it
+		"""
+		try:
+			for test in self._tests:
+				if not test(alert):
+					return None
+			return dict((param, build(alert)) for param, build
+						in self._params)
+		except (KeyError, TypeError):
+			#Missing field, or a field that is not an object
+			return None
+
+class RuleSet(object):
+	""" Ordered rules; the first one matching an alert applies """
+
+	def __init__(self, rules):
+		"""
+		ARGUMENTS:
+			o  rules: List of rule dictionaries, or {"rules": [...]}
+		"""
+		if isinstance(rules, dict):
+			rules = rules.get("rules")
+		if not isinstance(rules, list):
+			raise ValueError("Rules must be a list of rules")
+		self.rules = [Rule(entry) for entry in rules]
+
+	@classmethod
+	def load(cls, path):
+		""" Read a RuleSet from a JSON file """
+		with open(path) as rules:
+			return cls(json.load(rules))
+
+	def map(self, alert):
+		"""
+		RETURNS:
+			@rtype: Tuple
+			@return: (directive, parameters, directive line) of the first
+				matching rule, None if no rule matches. Raises ValueError if
+				the alert's values are not valid parameters
+		"""
+		for rule in self.rules:
+			kwargs = rule.apply(alert)
+			if kwargs is not None:
+				return rule.directive, kwargs, rule.spec.build(kwargs)
+		return None
+
+def new_stats():
+	""" Counters shared by the pipeline stages """
+	return {"lines": 0, "alerts": 0, "invalid": 0, "unmatched": 0,
+			"rejected": 0, "directives": 0, "coalesced": 0, "sent": 0,
+			"failed": 0, "batches": 0}
+
+def read_lines(stream, idle=None):
+	"""
+	Lines of a stream, read lazily. With idle, the stream's file descriptor
+	is read directly and None is yielded whenever no data arrived for idle
+	seconds, so later stages can flush while a pipe is quiet
+	"""
+	if idle is None:
+		for line in iter(stream.readline, ""):
+			yield line
+		return
+	fd = stream.fileno()
+	pending = b""
+	while 1:
+		if not select.select([fd], [], [], idle)[0]:
+			yield None
+			continue
+		chunk = os.read(fd, 65536)
+		if not chunk:
+			break
+		lines = (pending + chunk).split(b"\n")
+		pending = lines.pop()
+		for line in lines:
+			yield line.decode("utf-8", "replace")
+	if pending:
+		yield pending.decode("utf-8", "replace")
+
+def follow(path, interval=0.2, from_start=False, stop=None):
+	"""
+	Tail a file, following it when it is rotated or truncated. Yields each
+	line, and None whenever no new line arrived for interval seconds so
+	later stages can flush.
+
+	ARGUMENTS:
+		o  path: File to tail; it may not exist yet
+		o  interval: Seconds between polls at the end of the file
+		o  from_start: Read the lines already in the file too
+		o  stop: threading.Event ending the generator when set
+	"""
+	stream = None
+	identity = None
+	partial = ""
+	while stop is None or not stop.is_set():
+		if stream is None:
+			try:
+				stream = open(path)
+			except IOError:
+				yield None
+				time.sleep(interval)
+				continue
+			status = os.fstat(stream.fileno())
+			identity = (status.st_dev, status.st_ino)
+			if not from_start:
+				stream.seek(0, os.SEEK_END)
+			#Files appearing later are read from their start
+			from_start = True
+		line = stream.readline()
+		if line:
+			if not line.endswith("\n"):
+				#Half-written line; wait for the rest
+				partial += line
+				continue
+			yield partial + line
+			partial = ""
+			continue
+		yield None
+		time.sleep(interval)
+		try:
+			status = os.stat(path)
+		except OSError:
+			continue
+		if ((status.st_dev, status.st_ino) != identity or
+				status.st_size < stream.tell()):
+			#Rotated or truncated: start over on the current file
+			stream.close()
+			stream = None
+			partial = ""
+	if stream is not None:
+		stream.close()
+
+def parse_alerts(lines, stats):
+	""" JSON objects of the lines. Blank and malformed lines are skipped """
+	loads = json.loads
+	for line in lines:
+		if line is None:
+			yield None
+			continue
+		stats["lines"] += 1
+		line = line.strip()
+		if not line:
+			continue
+		try:
+			alert = loads(line)
+		except ValueError:
+			stats["invalid"] += 1
+			continue
+		if not isinstance(alert, dict):
+			stats["invalid"] += 1
+			continue
+		stats["alerts"] += 1
+		yield alert
+
+def map_alerts(alerts, rules, stats):
+	"""
+	(directive, parameters, directive line) of each alert some rule matches.
+	Alerts whose values are not valid parameters are counted as rejected
+	"""
+	rule_map = rules.map
+	for alert in alerts:
+		if alert is None:
+			yield None
+			continue
+		try:
+			mapped = rule_map(alert)
+		except ValueError:
+			stats["rejected"] += 1
+			continue
+		if mapped is None:
+			stats["unmatched"] += 1
+			continue
+		stats["directives"] += 1
+		yield mapped
+
+def micro_batches(directives, stats, size=256, max_wait=0.2):
+	"""
+	Lists of at most size directives. A batch is yielded when full, when its
+	first directive waited max_wait seconds, when the input goes idle (None)
+	and at the end of the input. Identical directives within a batch are
+	kept once
+	"""
+	batch = []
+	keys = set()
+	started = None
+	clock = time.time
+	for item in directives:
+		if item is not None:
+			directive, kwargs, line = item
+			key = canonical_key(directive, kwargs)
+			if key in keys:
+				stats["coalesced"] += 1
+				#A repeated alert never flushes the batch early
+				if clock() - started < max_wait:
+					continue
+			else:
+				if not batch:
+					started = clock()
+				keys.add(key)
+				batch.append(item)
+				if len(batch) < size and clock() - started < max_wait:
+					continue
+		if batch:
+			yield batch
+			batch = []
+			keys = set()
+	if batch:
+		yield batch
+
+def send_batch(client, batch, stats):
+	"""
+	Send one batch through a pipeline and count the outcome. If the
+	connection fails (ConnectionLost, ActuatorTimeout, ActuatorUnavailable)
+	the whole batch counts as failed, some of it possibly applied, and the
+	next batch reconnects
+	"""
+	try:
+		with client.pipeline() as pipe:
+			for directive, kwargs, line in batch:
+				getattr(pipe, directive.lower())(**kwargs)
+		failed = sum(1 for result in pipe.results
+					 if isinstance(result, Exception))
+	except socket.error:
+		failed = len(batch)
+	stats["batches"] += 1
+	stats["sent"] += len(batch) - failed
+	stats["failed"] += failed
+
+def write_batch(output, batch, stats):
+	""" Dry run: print the batch's directive lines """
+	output.write("".join(line + "\n" for directive, kwargs, line in batch))
+	stats["batches"] += 1
+	stats["sent"] += len(batch)
+
+class RateReporter(object):
+	"""
+	Calls report(stats, rates) at most every interval seconds, rates being
+	the per-second change of each counter since the previous report
+	"""
+
+	def __init__(self, stats, report, interval=1.0):
+		self._stats = stats
+		self._report = report
+		self._interval = interval
+		self._last = time.time()
+		self._previous = dict(stats)
+
+	def __call__(self, force=False):
+		now = time.time()
+		elapsed = now - self._last
+		if not force and elapsed < self._interval:
+			return
+		current = dict(self._stats)
+		rates = dict((name, (value - self._previous[name]) / elapsed
+					  if elapsed > 0 else 0.0)
+					 for name, value in current.items())
+		self._last = now
+		self._previous = current
+		self._report(current, rates)
+
+def format_rates(stats, rates):
+	""" One throughput line for the ingestion report """
+	return ("%8.0f alerts/s %8.0f directives/s %8.0f sent/s  total %d "
+			"alerts, %d sent, %d failed, %d coalesced, %d unmatched, "
+			"%d rejected, %d invalid" % (rates["alerts"], rates["directives"],
+			rates["sent"], stats["alerts"], stats["sent"], stats["failed"],
+			stats["coalesced"], stats["unmatched"], stats["rejected"],
+			stats["invalid"]))
+
+def ingest(lines, rules, client=None, output=None, batch=256, max_wait=0.2,
+		   report=None, interval=1.0, stats=None):
+	"""
+	ARGUMENTS:
+		o  lines: Iterable of JSON lines; None items mark idle input
+		o  rules: RuleSet
+		o  client: ActuatorWrapper or ShardedActuator the directives are
+			sent through (anything with pipeline())
+		o  output: Without client, stream the directive lines are written
+			to (dry run)
+		o  batch, max_wait: Largest batch and longest wait of a directive
+			for its batch to fill
+		o  report: Called as report(stats, rates) every interval seconds and
+			once at the end
+		o  stats: Counter dictionary to update, see new_stats()
+	DESCRIPTION:
+		Run the ingestion pipeline until lines is exhausted.
+	RETURNS:
+		@rtype: Dictionary
+		@return: The counters
+	"""
+	if client is None and output is None:
+		raise ValueError("Either client or output must be given")
+	stats = new_stats() if stats is None else stats
+	reporter = RateReporter(stats, report, interval) if report else None
+	batches = micro_batches(map_alerts(parse_alerts(lines, stats), rules,
+									   stats), stats, batch, max_wait)
+	for directives in batches:
+		if client is None:
+			write_batch(output, directives, stats)
+		else:
+			send_batch(client, directives, stats)
+		if reporter is not None:
+			reporter()
+	if reporter is not None:
+		reporter(force=True)
+	return stats
+
+def _address(text):
+	host, sep, port = text.rpartition(":")
+	if not sep:
+		raise argparse.ArgumentTypeError("Expected HOST:PORT")
+	return host, int(port)
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description=__doc__,
+		formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("rules", help="JSON rules file")
+	parser.add_argument("input", nargs="?", default="-",
+						help="JSON lines of alerts, - for stdin")
+	parser.add_argument("--follow", action="store_true",
+						help="Tail the input file instead of stopping at its end")
+	parser.add_argument("--from-start", action="store_true",
+						help="With --follow, read the lines already in the file")
+	parser.add_argument("--actuator", type=_address,
+						default=("127.0.0.1", 26795))
+	parser.add_argument("--dedupe", action="store_true",
+						help="Do not create directives that are already active")
+	parser.add_argument("--dry-run", action="store_true",
+						help="Print the directives instead of sending them")
+	parser.add_argument("--batch", type=int, default=256)
+	parser.add_argument("--max-wait", type=float, default=0.2)
+	parser.add_argument("--interval", type=float, default=1.0,
+						help="Seconds between throughput reports")
+	args = parser.parse_args(argv)
+
+	rules = RuleSet.load(args.rules)
+	if args.follow:
+		if args.input == "-":
+			parser.error("--follow needs an input file")
+		_run(follow(args.input, min(args.max_wait, 0.2), args.from_start),
+			 rules, args)
+	elif args.input == "-":
+		_run(read_lines(sys.stdin, args.max_wait), rules, args)
+	else:
+		with open(args.input) as alerts:
+			_run(read_lines(alerts), rules, args)
+
+def _run(lines, rules, args):
+	""" Ingest lines as the command line arguments ask """
+	client = None
+	if not args.dry_run:
+		from ActuatorWrapper import ActuatorWrapper
+		client = ActuatorWrapper(*args.actuator, dedupe=args.dedupe)
+	def report(stats, rates):
+		sys.stderr.write(format_rates(stats, rates) + "\n")
+	try:
+		ingest(lines, rules, client, sys.stdout, args.batch, args.max_wait,
+			   report, args.interval)
+	except KeyboardInterrupt:
+		pass
+	finally:
+		if client is not None:
+			client.quit()
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,205 @@
+#!/usr/bin/python
+# ActuatorIngestTest.py - Test for the alert ingestion pipeline
+# Works with Python 2.7 and 3
+
+"""
+Tests rule compilation and matching, micro-batching, tailing a file and a
+whole ingestion run against the simulated actuator. No actuator needed.
+"""
+
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from ActuatorIngest import (RuleSet, follow, ingest, micro_batches,
+							new_stats)
+from ActuatorWrapper import ActuatorWrapper
+from SimulatedActuator import SimulatedActuator
+
+RULES = [
+	{"match": {"type": ["worm", "botnet"]}, "directive": "quarantine",
+	 "params": {"quarantinedIP": "{src.ip}", "notifier": "10.0.0.9"}},
+	{"match": {"type": "portscan", "severity": {"min": 3}},
+	 "directive": "BLOCK",
+	 "params": {"blockIP": "{src.ip}", "dstPort": "{port}", "timeout": 600}},
+	{"match": {"type": "exfiltration"}, "directive": "DENY",
+	 "params": {"IP1": "{src.ip}", "IP2": "{dst}/32"}},
+]
+
+def alert(kind, ip, **fields):
+	fields.update({"type": kind, "src": {"ip": ip}})
+	return fields
+
+class RuleSetTest(unittest.TestCase):
+
+	def setUp(self):
+		self.rules = RuleSet({"rules": RULES})
+
+	def test_first_match(self):
+		""" Test that the first matching rule builds the directive. """
+		self.assertEqual(self.rules.map(alert("botnet", "10.0.0.1")),
+						 ("QUARANTINE", {"quarantinedIP": "10.0.0.1",
+										 "notifier": "10.0.0.9"},
+						  "QUARANTINE -quarantinedIP 10.0.0.1 -notifier "
+						  "10.0.0.9"))
+		directive, kwargs, line = self.rules.map(alert("portscan", "10.0.0.2",
+													   severity=4, port=22))
+		self.assertEqual(kwargs, {"blockIP": "10.0.0.2", "dstPort": 22,
+								  "timeout": 600})
+		directive, kwargs, line = self.rules.map(alert("exfiltration",
+													   "10.0.0.3",
+													   dst="192.0.2.1"))
+		self.assertEqual(kwargs["IP2"], "192.0.2.1/32")
+
+	def test_no_match(self):
+		""" Test alerts that fit no rule. """
+		self.assertIsNone(self.rules.map(alert("portscan", "10.0.0.2",
+											   severity=2, port=22)))
+		self.assertIsNone(self.rules.map(alert("portscan", "10.0.0.2",
+											   severity="high", port=22)))
+		#The referenced port is missing
+		self.assertIsNone(self.rules.map(alert("portscan", "10.0.0.2",
+											   severity=5)))
+		self.assertIsNone(self.rules.map({"type": "worm", "src": "10.0.0.1"}))
+		self.assertIsNone(self.rules.map({"type": ["worm"]}))
+
+	def test_invalid(self):
+		""" Test that bad rules and bad alert values raise ValueError. """
+		self.assertRaises(ValueError, self.rules.map,
+						  alert("worm", "10.0.0.1 -all"))
+		self.assertRaises(ValueError, RuleSet, [{"directive": "CANCEL"}])
+		self.assertRaises(ValueError, RuleSet, [{"params": {}}])
+		self.assertRaises(ValueError, RuleSet,
+						  [{"directive": "BLOCK", "params": {"IP1": "x"}}])
+		self.assertRaises(ValueError, RuleSet,
+						  [{"directive": "BLOCK", "match": {"a": {"over": 1}},
+							"params": {"blockIP": "{a}"}}])
+		self.assertRaises(ValueError, RuleSet, {"block": []})
+
+class IngestTest(unittest.TestCase):
+
+	def test_micro_batches(self):
+		""" Test batching by size, idle input and coalescing. """
+		stats = new_stats()
+		items = [("BLOCK", {"blockIP": "10.0.0.%d" % n}, None)
+				 for n in range(5)]
+		#The same directive as items[3]
+		items[4] = ("DENY", {"IP1": "10.0.0.3"}, None)
+		batches = list(micro_batches(items[:3] + [None] + items[3:], stats,
+									 size=2))
+		self.assertEqual([len(batch) for batch in batches], [2, 1, 1])
+		self.assertEqual(stats["coalesced"], 1)
+
+	def test_repeated_alerts(self):
+		""" Test that repeated alerts do not flush a batch early. """
+		stats = new_stats()
+		items = [("BLOCK", {"blockIP": "10.0.0.%d" % (n % 2)}, None)
+				 for n in range(8)]
+		batches = list(micro_batches(items, stats, size=4, max_wait=60))
+		self.assertEqual([len(batch) for batch in batches], [2])
+		self.assertEqual(stats["coalesced"], 6)
+		lines = [json.dumps(alert("worm", "10.0.0.%d" % (n % 2)))
+				 for n in range(8)]
+		output = []
+		class Output(object):
+			def write(self, data):
+				output.append(data)
+		stats = ingest(lines, RuleSet(RULES), output=Output(), max_wait=60)
+		self.assertEqual(len("".join(output).splitlines()), 2)
+		self.assertEqual((stats["batches"], stats["coalesced"]), (1, 6))
+
+	def test_dry_run(self):
+		""" Test printing the directives of a stream of alerts. """
+		lines = [json.dumps(alert("worm", "10.0.0.1")), "", "not json",
+				 "[1, 2]", json.dumps(alert("login", "10.0.0.2")),
+				 json.dumps(alert("worm", "10.0.0.1 x"))]
+		output = []
+		class Output(object):
+			def write(self, data):
+				output.append(data)
+		reports = []
+		stats = ingest(lines, RuleSet(RULES), output=Output(),
+					   report=lambda stats, rates: reports.append(rates))
+		self.assertEqual("".join(output), ("QUARANTINE -quarantinedIP "
+										   "10.0.0.1 -notifier 10.0.0.9\n"))
+		self.assertEqual((stats["lines"], stats["alerts"], stats["invalid"],
+						  stats["unmatched"], stats["rejected"]),
+						 (6, 3, 2, 1, 1))
+		self.assertEqual(len(reports), 1)
+		self.assertRaises(ValueError, ingest, lines, RuleSet(RULES))
+
+	def test_actuator(self):
+		""" Test sending the directives to the simulated actuator. """
+		lines = [json.dumps(alert("portscan", "10.0.1.%d" % (n % 50),
+								  severity=3, port=22)) for n in range(200)]
+		with SimulatedActuator() as actuator:
+			wrapper = ActuatorWrapper(*actuator.address)
+			stats = ingest(lines, RuleSet(RULES), wrapper, batch=64)
+			self.assertEqual(len(actuator.active_ids()), stats["sent"])
+			wrapper.quit()
+		self.assertEqual(stats["directives"], 200)
+		self.assertEqual((stats["coalesced"], stats["sent"]), (150, 50))
+		self.assertEqual(stats["batches"], 1)
+		self.assertEqual(stats["failed"], 0)
+
+	def test_actuator_restart(self):
+		""" Test that ingestion goes on while the actuator is down. """
+		actuator = SimulatedActuator().start()
+		port = actuator.port
+		def lines():
+			for phase in range(3):
+				for n in range(10):
+					yield json.dumps(alert("portscan", "10.0.%d.%d" %
+										   (phase, n), severity=3, port=22))
+				#Idle input flushes the batch
+				yield None
+				if phase == 0:
+					actuator.stop()
+				elif phase == 1:
+					restarted.append(SimulatedActuator(port=port).start())
+		restarted = []
+		wrapper = ActuatorWrapper(*actuator.address, reconnect_timeout=0.1)
+		try:
+			stats = ingest(lines(), RuleSet(RULES), wrapper, max_wait=60)
+			self.assertEqual(len(restarted[0].active_ids()), 10)
+		finally:
+			wrapper.quit()
+			for other in restarted:
+				other.stop()
+		self.assertEqual((stats["batches"], stats["sent"], stats["failed"]),
+						 (3, 20, 10))
+
+	def test_follow(self):
+		""" Test tailing a file through a rotation. """
+		directory = tempfile.mkdtemp()
+		path = os.path.join(directory, "alerts.jsonl")
+		try:
+			with open(path, "w") as alerts:
+				alerts.write("old\n")
+			stop = threading.Event()
+			lines = follow(path, interval=0.01, stop=stop)
+			self.assertIsNone(next(lines))
+			with open(path, "a") as alerts:
+				alerts.write("first\nsec")
+			self.assertEqual(next(lines), "first\n")
+			self.assertIsNone(next(lines))
+			with open(path, "a") as alerts:
+				alerts.write("ond\n")
+			self.assertEqual(next(lines), "second\n")
+			os.rename(path, path + ".1")
+			with open(path, "w") as alerts:
+				alerts.write("third\n")
+			received = [line for line in (next(lines) for i in range(3))
+						if line is not None]
+			self.assertEqual(received, ["third\n"])
+			stop.set()
+			self.assertEqual(list(lines), [])
+		finally:
+			shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+	unittest.main()
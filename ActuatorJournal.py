@@ -0,0 +1,446 @@
+#!/usr/bin/python
+# ActuatorJournal.py - Append-only journal of the directives a wrapper issued
+# Works with Python 2.7 and 3
+
+"""
+A DirectiveJournal records every directive an ActuatorWrapper creates (its ID,
+the directive line and when it expires) and every CANCEL and ADJUST of it,
+so a responder that dies can come back knowing which directives are its own:
+
+	journal = DirectiveJournal("/var/lib/responder/directives.journal")
+	wrapper = ActuatorWrapper(ip, port, journal=journal)
+	d_id = wrapper.block(blockIP="10.0.0.1", timeout=3600)
+	journal.note(d_id, "portscan alert 4711")
+
+On startup the wrapper loads the journal into its directive mirror and
+reconciles it against INFO; journaled directives the actuator no longer has
+(or gave to another directive) are dropped.
+
+File format: an 8 byte header (b"OFAJ" and the version) followed by records
+of a fixed 25 byte header - CRC32 of the rest of the record, operation, ID,
+a time and the payload length - and the payload (directive line, new
+timeout, note). The time is when the directive expires for CREATE and ADJUST
+(0 for never).
+Records are only ever appended; a record torn by a crash fails its CRC and is
+cut off on the next load.
+
+Once the file holds compact_ratio times more records than live directives
+it is compacted: the live directives are written to a new file, as one
+SNAPSHOT record, which atomically replaces the old one. A SNAPSHOT holds the
+IDs and expiry times as packed arrays followed by the directive lines, so
+loading it is a handful of bulk operations on the memory-mapped file rather
+than one record at a time. Directive lines are only parsed when records() is
+called.
+"""
+
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+
+from ActuatorProtocol import DirectiveRecord, parse_params
+from DirectiveSchema import DIRECTIVES
+
+MAGIC = b"OFAJ"
+VERSION = 1
+_FILE_HEADER = struct.Struct("<4sI")
+#crc, operation, directive ID, time, payload length
+_RECORD = struct.Struct("<IBQdI")
+
+#Operations
+CREATE = 1
+CANCEL = 2
+CANCEL_ALL = 3
+ADJUST = 4
+NOTE = 5
+SNAPSHOT = 6
+
+def _sync_directory(path):
+	""" fsync the directory holding path, so a rename in it is durable """
+	try:
+		fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+	except OSError:
+		#Directories cannot be opened on Windows
+		return
+	try:
+		os.fsync(fd)
+	finally:
+		os.close(fd)
+
+class JournalError(Exception):
+	""" The file is not a directive journal, or of an unknown version """
+
+class JournalEntry(object):
+	"""
+	One live journaled directive.
+
+	id: Directive ID
+	line: Directive line as sent, e.g. "BLOCK -blockIP 10.0.0.1"
+	expires: Expiry as epoch seconds, None if it never expires
+	note: Text given to DirectiveJournal.note(), None if none was
+	"""
+	__slots__ = ("id", "line", "expires", "note")
+
+	def __init__(self, id, line, expires=None, note=None):
+		self.id = id
+		self.line = line
+		self.expires = expires
+		self.note = note
+
+	@property
+	def directive(self):
+		return self.line.split(" ", 1)[0]
+
+	def record(self):
+		""" The entry as a DirectiveRecord """
+		directive, sep, params = self.line.partition(" ")
+		return DirectiveRecord(self.id, directive, parse_params(params),
+							   self.expires)
+
+	def __repr__(self):
+		return "JournalEntry(%d, %r, expires=%r, note=%r)" % (self.id,
+			self.line, self.expires, self.note)
+
+def _encode_expires(expires):
+	return 0.0 if expires is None else float(expires)
+
+def _with_timeout(line, timeout):
+	""" A directive line with its timeout parameter changed """
+	directive, sep, text = line.partition(" ")
+	params = parse_params(text)
+	params["timeout"] = timeout
+	return DIRECTIVES[directive.lower()].build(params)
+
+def _pack(operation, d_id, when, payload=b""):
+	body = _RECORD.pack(0, operation, d_id, when, len(payload))[4:] + payload
+	return struct.pack("<I", zlib.crc32(body) & 0xffffffff) + body
+
+def _pack_snapshot(entries, now):
+	""" One SNAPSHOT record of entries """
+	count = len(entries)
+	payload = b"".join([
+		struct.pack("<%dQ" % count, *[entry.id for entry in entries]),
+		struct.pack("<%dd" % count, *[_encode_expires(entry.expires)
+									  for entry in entries]),
+		"\n".join(entry.line for entry in entries).encode("ascii")])
+	return _pack(SNAPSHOT, count, now, payload)
+
+def _unpack_snapshot(count, payload):
+	""" The JournalEntries of a SNAPSHOT record's payload """
+	if not count:
+		return []
+	ids = struct.unpack_from("<%dQ" % count, payload)
+	expires = [when or None for when in
+			   struct.unpack_from("<%dd" % count, payload, 8 * count)]
+	lines = payload[16 * count:].decode("ascii").split("\n")
+	return list(map(JournalEntry, ids, lines, expires))
+
+class DirectiveJournal(object):
+	""" Append-only journal of created, cancelled and adjusted directives """
+
+	def __init__(self, path, sync=False, compact_ratio=4.0, compact_min=4096):
+		"""
+		ARGUMENTS:
+			o  path: Journal file, created if missing
+			o  sync: fsync after every record. Without it records survive the
+				process dying but not the machine losing power
+			o  compact_ratio: Compact once the file holds this many times
+				more records than there are live directives
+			o  compact_min: Never compact files of fewer records
+		"""
+		if compact_ratio <= 1:
+			raise ValueError("compact_ratio must be greater than 1")
+		self.path = path
+		self.sync = sync
+		self.compact_ratio = compact_ratio
+		self.compact_min = compact_min
+		self._lock = threading.Lock()
+		#ID -> JournalEntry of the directives not cancelled
+		self._entries = {}
+		#Records in the file
+		self._count = 0
+		self._stats = {"appended": 0, "compactions": 0, "truncated": 0}
+		self._fd = None
+		self._load()
+
+	def _load(self):
+		""" Replay the file into the entries, cutting off a torn tail """
+		flags = os.O_RDWR | os.O_CREAT | getattr(os, "O_BINARY", 0)
+		fd = os.open(self.path, flags, 0o644)
+		try:
+			size = os.fstat(fd).st_size
+			if size == 0:
+				os.write(fd, _FILE_HEADER.pack(MAGIC, VERSION))
+				self._fsync(fd)
+				end = _FILE_HEADER.size
+			elif size < _FILE_HEADER.size:
+				raise JournalError(self.path + " is not a directive journal")
+			else:
+				data = mmap.mmap(fd, size, access=mmap.ACCESS_READ)
+				try:
+					end = self._replay(data, size)
+				finally:
+					data.close()
+				if end < size:
+					#Torn by a crash while appending
+					os.ftruncate(fd, end)
+					self._stats["truncated"] += size - end
+			os.lseek(fd, end, os.SEEK_SET)
+		except Exception:
+			os.close(fd)
+			raise
+		self._fd = fd
+
+	def _replay(self, data, size):
+		"""
+		Apply the records of a mapped journal.
+
+		RETURNS:
+			@rtype: Integer
+			@return: Offset after the last intact record
+		"""
+		magic, version = _FILE_HEADER.unpack_from(data, 0)
+		if magic != MAGIC:
+			raise JournalError(self.path + " is not a directive journal")
+		if version != VERSION:
+			raise JournalError(("Unsupported journal version %d in %s" %
+								(version, self.path)))
+		entries = self._entries
+		unpack = _RECORD.unpack_from
+		header = _RECORD.size
+		crc32 = zlib.crc32
+		offset = _FILE_HEADER.size
+		count = 0
+		while offset + header <= size:
+			crc, operation, d_id, when, length = unpack(data, offset)
+			end = offset + header + length
+			if end > size:
+				break
+			if crc32(data[offset + 4:end]) & 0xffffffff != crc:
+				break
+			if operation == CREATE:
+				entries[d_id] = JournalEntry(d_id, data[offset + header:end]
+											 .decode("ascii"), when or None)
+			elif operation == CANCEL:
+				entries.pop(d_id, None)
+			elif operation == CANCEL_ALL:
+				entries.clear()
+			elif operation == ADJUST:
+				entry = entries.get(d_id)
+				if entry is not None:
+					entry.expires = when or None
+					entry.line = _with_timeout(entry.line,
+											   data[offset + header:end]
+											   .decode("ascii"))
+			elif operation == NOTE:
+				entry = entries.get(d_id)
+				if entry is not None:
+					entry.note = data[offset + header:end].decode("utf-8")
+			elif operation == SNAPSHOT:
+				#The ID field holds the number of entries
+				entries.clear()
+				entries.update((entry.id, entry) for entry in
+							   _unpack_snapshot(d_id,
+												data[offset + header:end]))
+			else:
+				break
+			offset = end
+			count += 1
+		self._count = count
+		return offset
+
+	def _fsync(self, fd):
+		if self.sync:
+			os.fsync(fd)
+
+	def _append(self, record):
+		""" Write one packed record. Lock held """
+		if self._fd is None:
+			raise ValueError("Journal is closed")
+		os.write(self._fd, record)
+		self._fsync(self._fd)
+		self._count += 1
+		self._stats["appended"] += 1
+		if (self._count >= self.compact_min and
+				self._count > self.compact_ratio * len(self._entries)):
+			self._compact()
+
+	def created(self, d_id, directive, kwargs, expires=None):
+		"""
+		Record a directive the actuator created.
+
+		ARGUMENTS:
+			o  d_id: Its ID
+			o  directive, kwargs: Directive type and parameters as sent
+			o  expires: When it expires (epoch seconds), None for never
+		"""
+		line = DIRECTIVES[directive.lower()].build(kwargs)
+		entry = JournalEntry(d_id, line, expires)
+		record = _pack(CREATE, d_id, _encode_expires(expires),
+					   line.encode("ascii"))
+		with self._lock:
+			self._entries[d_id] = entry
+			self._append(record)
+
+	def cancelled(self, d_id):
+		""" Record a CANCEL -id """
+		with self._lock:
+			if self._entries.pop(d_id, None) is not None:
+				self._append(_pack(CANCEL, d_id, time.time()))
+
+	def cancelled_all(self):
+		""" Record a CANCEL -all """
+		with self._lock:
+			self._entries.clear()
+			self._append(_pack(CANCEL_ALL, 0, time.time()))
+
+	def adjusted(self, d_id, timeout, now=None):
+		""" Record an ADJUST; timeout 0 never expires """
+		now = time.time() if now is None else now
+		expires = None if float(timeout) <= 0 else now + float(timeout)
+		with self._lock:
+			entry = self._entries.get(d_id)
+			if entry is not None:
+				entry.expires = expires
+				entry.line = _with_timeout(entry.line, timeout)
+				self._append(_pack(ADJUST, d_id, _encode_expires(expires),
+								   str(timeout).encode("ascii")))
+
+	def note(self, d_id, text):
+		"""
+		Attach a note (why the directive was created) to a journaled
+		directive. Returns False if d_id is not journaled
+		"""
+		with self._lock:
+			entry = self._entries.get(d_id)
+			if entry is None:
+				return False
+			entry.note = text
+			self._append(_pack(NOTE, d_id, time.time(),
+							   text.encode("utf-8")))
+		return True
+
+	def discard(self, d_ids):
+		""" Forget directives found gone from the actuator """
+		for d_id in d_ids:
+			self.cancelled(d_id)
+
+	def get(self, d_id):
+		""" The live JournalEntry of d_id, None if it is not journaled """
+		with self._lock:
+			return self._entries.get(d_id)
+
+	def entries(self, now=None):
+		"""
+		RETURNS:
+			@rtype: List
+			@return: JournalEntries of the directives not cancelled and not
+				expired, ordered by ID
+		"""
+		now = time.time() if now is None else now
+		with self._lock:
+			entries = [entry for entry in self._entries.values()
+					   if entry.expires is None or entry.expires > now]
+		return sorted(entries, key=lambda entry: entry.id)
+
+	def records(self, now=None):
+		"""
+		RETURNS:
+			@rtype: List
+			@return: DirectiveRecords of the journaled directives still
+				active, to seed a DirectiveCache
+		"""
+		return [entry.record() for entry in self.entries(now)]
+
+	def _compact(self, now=None):
+		""" Rewrite the file with the live entries only. Lock held """
+		now = time.time() if now is None else now
+		live = [entry for entry in self._entries.values()
+				if entry.expires is None or entry.expires > now]
+		live.sort(key=lambda entry: entry.id)
+		chunks = [_FILE_HEADER.pack(MAGIC, VERSION),
+				  _pack_snapshot(live, now)]
+		for entry in live:
+			if entry.note is not None:
+				chunks.append(_pack(NOTE, entry.id, now,
+									entry.note.encode("utf-8")))
+		temporary = self.path + ".compact"
+		flags = (os.O_WRONLY | os.O_CREAT | os.O_TRUNC |
+				 getattr(os, "O_BINARY", 0))
+		fd = os.open(temporary, flags, 0o644)
+		try:
+			try:
+				os.write(fd, b"".join(chunks))
+				#Always synced: the rename must not land before the data
+				os.fsync(fd)
+			finally:
+				os.close(fd)
+			#Renamed over the open journal, which stays usable if this fails
+			os.rename(temporary, self.path)
+		except Exception:
+			os.remove(temporary)
+			raise
+		_sync_directory(self.path)
+		fd = os.open(self.path, os.O_RDWR | getattr(os, "O_BINARY", 0))
+		os.lseek(fd, 0, os.SEEK_END)
+		os.close(self._fd)
+		self._fd = fd
+		self._entries = dict((entry.id, entry) for entry in live)
+		self._count = len(chunks) - 1
+		self._stats["compactions"] += 1
+
+	def compact(self, now=None):
+		""" Rewrite the file now, keeping only live directives """
+		with self._lock:
+			if self._fd is None:
+				raise ValueError("Journal is closed")
+			self._compact(now)
+
+	def retain(self, d_ids):
+		"""
+		Keep only the journaled directives whose ID is in d_ids (those
+		confirmed active by a reconcile) and compact
+		"""
+		d_ids = set(d_ids)
+		with self._lock:
+			for d_id in list(self._entries):
+				if d_id not in d_ids:
+					del self._entries[d_id]
+			self._compact()
+
+	def stats(self):
+		"""
+		RETURNS:
+			@rtype: Dictionary
+			@return: live (journaled directives), records (in the file),
+				bytes (file size), appended, compactions and truncated
+				(bytes of a torn tail cut off on load)
+		"""
+		with self._lock:
+			stats = dict(self._stats)
+			stats["live"] = len(self._entries)
+			stats["records"] = self._count
+			stats["bytes"] = (os.fstat(self._fd).st_size
+							  if self._fd is not None else 0)
+		return stats
+
+	def __len__(self):
+		with self._lock:
+			return len(self._entries)
+
+	def __contains__(self, d_id):
+		return self.get(d_id) is not None
+
+	def close(self):
+		with self._lock:
+			if self._fd is not None:
+				os.close(self._fd)
+				self._fd = None
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close()
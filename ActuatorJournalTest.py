@@ -0,0 +1,173 @@
+#!/usr/bin/python
+# ActuatorJournalTest.py - Test for the directive journal
+# Works with Python 2.7 and 3
+
+"""
+Tests the journal file on its own, and crash recovery of a wrapper against
+the simulated actuator. No actuator needed.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from ActuatorJournal import DirectiveJournal, JournalError
+from ActuatorWrapper import ActuatorWrapper
+from SimulatedActuator import SimulatedActuator
+
+class DirectiveJournalTest(unittest.TestCase):
+
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self.path = os.path.join(self.directory, "directives.journal")
+
+	def tearDown(self):
+		shutil.rmtree(self.directory)
+
+	def fill(self, journal):
+		journal.created(1, "BLOCK", {"blockIP": "10.0.0.1", "timeout": 60},
+						expires=1000.0)
+		journal.created(2, "DENY", {"IP1": "10.0.0.2", "linkdrop1": True})
+		journal.created(3, "QUARANTINE", {"quarantinedIP": "10.0.0.3",
+										  "notifier": "10.0.0.9"})
+		journal.note(2, "portscan alert")
+		journal.cancelled(3)
+		journal.adjusted(1, 600, now=2000.0)
+
+	def test_reload(self):
+		""" Test that a reopened journal has the same directives. """
+		with DirectiveJournal(self.path) as journal:
+			self.fill(journal)
+			self.assertFalse(journal.note(3, "cancelled"))
+		with DirectiveJournal(self.path) as journal:
+			entries = journal.entries(now=0)
+			self.assertEqual([entry.id for entry in entries], [1, 2])
+			self.assertEqual(entries[0].record().params,
+							 {"blockIP": "10.0.0.1", "timeout": "600"})
+			self.assertEqual(entries[0].expires, 2600.0)
+			self.assertEqual(entries[1].note, "portscan alert")
+			self.assertEqual(entries[1].expires, None)
+			record = journal.records(now=0)[1]
+			self.assertEqual((record.directive, record.params),
+							 ("DENY", {"IP1": "10.0.0.2", "linkdrop1": True}))
+			#Expired directives are left out
+			self.assertEqual([entry.id for entry in journal.entries(now=3000)],
+							 [2])
+			journal.cancelled_all()
+		with DirectiveJournal(self.path) as journal:
+			self.assertEqual(len(journal), 0)
+
+	def test_torn_tail(self):
+		""" Test that a record torn by a crash is cut off. """
+		with DirectiveJournal(self.path) as journal:
+			self.fill(journal)
+			size = journal.stats()["bytes"]
+		with open(self.path, "ab") as data:
+			data.write(b"\x12\x34\x56\x78\x01\x09")
+		with DirectiveJournal(self.path) as journal:
+			self.assertEqual(journal.stats()["truncated"], 6)
+			self.assertEqual(journal.stats()["bytes"], size)
+			self.assertEqual(len(journal), 2)
+			journal.created(4, "BLOCK", {"blockIP": "10.0.0.4"})
+		#A corrupted record ends the journal too
+		with open(self.path, "r+b") as data:
+			data.seek(size + 10)
+			data.write(b"\xff")
+		with DirectiveJournal(self.path) as journal:
+			self.assertNotIn(4, journal)
+			self.assertIn(2, journal)
+
+	def test_compaction(self):
+		""" Test that the file is compacted once mostly dead records. """
+		with DirectiveJournal(self.path, compact_ratio=2,
+							  compact_min=10) as journal:
+			self.fill(journal)
+			#Expired directives are dropped when compacting
+			journal.adjusted(1, 0)
+			for d_id in range(10, 20):
+				journal.created(d_id, "BLOCK", {"blockIP": "10.0.1.1"})
+				journal.cancelled(d_id)
+			stats = journal.stats()
+			self.assertTrue(stats["compactions"] >= 1)
+			self.assertTrue(stats["records"] < 10)
+			self.assertEqual(sorted(entry.id for entry in journal.entries(0)),
+							 [1, 2])
+		with DirectiveJournal(self.path) as journal:
+			entries = journal.entries(now=0)
+			self.assertEqual([entry.id for entry in entries], [1, 2])
+			self.assertEqual(entries[0].expires, None)
+			self.assertEqual(entries[1].note, "portscan alert")
+			journal.retain([2])
+			self.assertEqual(journal.stats()["records"], 2)
+		with DirectiveJournal(self.path) as journal:
+			self.assertEqual([entry.id for entry in journal.entries(0)], [2])
+
+	@unittest.skipUnless(os.path.isdir("/proc/self/fd"), "needs /proc")
+	def test_compact_descriptors(self):
+		""" Test that compacting does not leak file descriptors. """
+		with DirectiveJournal(self.path) as journal:
+			self.fill(journal)
+			open_fds = len(os.listdir("/proc/self/fd"))
+			for i in range(50):
+				journal.compact(now=0)
+			self.assertEqual(len(os.listdir("/proc/self/fd")), open_fds)
+			self.assertFalse(os.path.exists(self.path + ".compact"))
+
+	def test_failed_compaction(self):
+		""" Test that the journal stays usable if its rewrite fails. """
+		with DirectiveJournal(self.path) as journal:
+			self.fill(journal)
+			#Renaming onto a non-empty directory fails
+			os.remove(self.path)
+			os.mkdir(self.path)
+			open(os.path.join(self.path, "other"), "w").close()
+			self.assertRaises(OSError, journal.compact, now=0)
+			self.assertFalse(os.path.exists(self.path + ".compact"))
+			journal.created(4, "BLOCK", {"blockIP": "10.0.0.4"})
+			self.assertEqual([entry.id for entry in journal.entries(0)],
+							 [1, 2, 4])
+
+	def test_not_a_journal(self):
+		""" Test that other files are refused. """
+		with open(self.path, "wb") as data:
+			data.write(b"INFO -all\n")
+		self.assertRaises(JournalError, DirectiveJournal, self.path)
+		self.assertRaises(ValueError, DirectiveJournal, self.path,
+						  compact_ratio=1)
+
+	def test_recovery(self):
+		""" Test that a restarted wrapper reconciles its journal. """
+		with SimulatedActuator() as actuator:
+			journal = DirectiveJournal(self.path)
+			wrapper = ActuatorWrapper(*actuator.address, journal=journal)
+			kept = wrapper.block(blockIP="10.0.0.1", timeout=600)
+			gone = wrapper.deny(IP1="10.0.0.2")
+			cancelled = wrapper.quarantine(quarantinedIP="10.0.0.3",
+										   notifier="10.0.0.9")
+			wrapper.cancel(id=cancelled)
+			wrapper.adjust(id=kept, timeout=1200)
+			journal.note(kept, "portscan alert")
+			#The responder dies; meanwhile the directive expires and someone
+			#else creates one
+			wrapper._close_conn()
+			journal.close()
+			other = ActuatorWrapper(*actuator.address)
+			other.cancel(id=gone)
+			foreign = other.block(blockIP="10.0.0.4")
+			journal = DirectiveJournal(self.path)
+			wrapper = ActuatorWrapper(*actuator.address, journal=journal)
+			self.assertEqual([record.id for record in
+							  wrapper.active_directives()], [kept, foreign])
+			self.assertEqual(wrapper.active_directives()[0].params,
+							 {"blockIP": "10.0.0.1", "timeout": "1200"})
+			self.assertEqual([entry.id for entry in journal.entries()], [kept])
+			self.assertEqual(journal.get(kept).note, "portscan alert")
+			self.assertEqual(wrapper.stale_ids(), set([gone]))
+			wrapper.quit()
+			other.quit()
+			journal.close()
+
+
+if __name__ == '__main__':
+	unittest.main()
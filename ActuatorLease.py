@@ -0,0 +1,301 @@
+#!/usr/bin/python
+# ActuatorLease.py - Keep OF-Actuator directives alive by renewing leases
+# Works with Python 2.7 and 3
+
+"""
+Instead of creating long-lived directives with no timeout (which outlive the
+responder that created them if it dies), give them a short timeout and let a
+LeaseManager renew it for as long as they are wanted:
+
+	leases = LeaseManager(wrapper, timeout=120).start()
+	d_id = wrapper.block(blockIP="10.0.0.1", timeout=120)
+	leases.add(d_id)
+	...
+	leases.remove(d_id)     #expires within 120 seconds
+
+Renewals are scheduled on a hierarchical timer wheel (TimerWheel). Every
+tick only the slot of the current tick is looked at, and all leases due in it
+are renewed with one pipelined batch of ADJUSTs (adjust_many), so the cost
+per tick does not depend on the number of leases. A lease is renewed margin
+seconds before its directive would expire. If an ADJUST fails (the directive
+was cancelled or expired meanwhile) the lease is dropped and reported to
+on_lost.
+"""
+
+import threading
+import time
+
+class TimerWheel(object):
+	"""
+	Hierarchical timing wheel. Level 0 has one slot per tick; each higher
+	level has slots covering a whole turn of the level below and is cascaded
+	down one slot at a time when that level wraps around. Scheduling,
+	cancelling and advancing one tick are O(1); an entry is moved down at
+	most once per level.
+	"""
+
+	def __init__(self, bits=8, levels=4, now=0):
+		"""
+		ARGUMENTS:
+			o  bits: Each level has 2**bits slots
+			o  levels: Number of levels. Ticks further out than
+				2**(bits * levels) are kept in the outermost level and
+				cascaded again until due
+			o  now: Tick the wheel starts at
+		"""
+		self._bits = bits
+		self._mask = (1 << bits) - 1
+		self._levels = [[[] for i in range(1 << bits)] for j in range(levels)]
+		self._horizon = 1 << (bits * levels)
+		self.now = now
+		#key -> due tick; bucket entries no longer matching are outdated
+		self._due = {}
+
+	def __len__(self):
+		return len(self._due)
+
+	def __contains__(self, key):
+		return key in self._due
+
+	def _place(self, key, due):
+		""" Put an entry into the slot covering its due tick """
+		delta = due - self.now
+		if delta >= self._horizon:
+			delta = self._horizon - 1
+		level = 0
+		while level < len(self._levels) - 1 and delta >> (self._bits *
+														  (level + 1)):
+			level += 1
+		slot = (min(due, self.now + delta) >> (self._bits * level)) & self._mask
+		self._levels[level][slot].append((due, key))
+
+	def schedule(self, key, due):
+		"""
+		Schedule key for tick due, replacing an earlier schedule of it. Due
+		ticks already passed fire on the next advance
+		"""
+		due = max(due, self.now + 1)
+		self._due[key] = due
+		self._place(key, due)
+
+	def cancel(self, key):
+		""" Unschedule key. Its slot entry is dropped when reached """
+		self._due.pop(key, None)
+
+	def due(self, key):
+		""" Tick key is scheduled for, None if it is not scheduled """
+		return self._due.get(key)
+
+	def advance(self, to):
+		"""
+		Move the wheel to tick to.
+
+		RETURNS:
+			@rtype: List
+			@return: Keys that became due, in due order
+		"""
+		fired = []
+		while self.now < to:
+			if not self._due:
+				#Nothing scheduled: jump instead of stepping
+				self.now = to
+				break
+			self.now += 1
+			now = self.now
+			#Cascade every level whose slot index just wrapped around
+			level = 1
+			while (level < len(self._levels) and
+				   not (now & ((1 << (self._bits * level)) - 1))):
+				slot = (now >> (self._bits * level)) & self._mask
+				entries = self._levels[level][slot]
+				self._levels[level][slot] = []
+				for due, key in entries:
+					if self._due.get(key) == due:
+						self._place(key, due)
+				level += 1
+			slot = self._levels[0][now & self._mask]
+			self._levels[0][now & self._mask] = []
+			for due, key in slot:
+				if due > now:
+					#Clamped beyond the horizon, not due yet
+					if self._due.get(key) == due:
+						self._place(key, due)
+				elif self._due.get(key) == due:
+					del self._due[key]
+					fired.append(key)
+		return fired
+
+class LeaseManager(object):
+	""" Renews the timeouts of directives until they are released """
+
+	def __init__(self, client, timeout=300, margin=None, resolution=1.0,
+				 on_lost=None):
+		"""
+		ARGUMENTS:
+			o  client: ActuatorWrapper, ActuatorPool or ShardedActuator
+				sending the ADJUSTs (through adjust_many)
+			o  timeout: Seconds each renewal extends a directive by. Leased
+				directives should be created with this timeout
+			o  margin: Seconds before expiry a lease is renewed. Defaults to
+				a quarter of timeout
+			o  resolution: Seconds per wheel tick, i.e. how often the
+				background thread wakes up
+			o  on_lost: Called as on_lost(d_id, exception) for a lease
+				dropped because its ADJUST failed
+		"""
+		margin = timeout / 4.0 if margin is None else margin
+		if not 0 <= margin < timeout:
+			raise ValueError("margin must be in [0, timeout)")
+		if resolution <= 0:
+			raise ValueError("resolution must be positive")
+		self._client = client
+		self.timeout = timeout
+		self.margin = margin
+		self.resolution = resolution
+		self._on_lost = on_lost
+		self._lock = threading.Lock()
+		self._wheel = TimerWheel(now=self._tick_of(time.time()))
+		#d_id -> epoch seconds after which the lease is not renewed, or None
+		self._until = {}
+		self._stats = {"renewed": 0, "lost": 0, "released": 0, "batches": 0}
+		self._stop = threading.Event()
+		self._thread = None
+
+	def _tick_of(self, when):
+		return int(when / self.resolution)
+
+	def _schedule(self, d_id, expires):
+		""" Schedule a renewal margin seconds before expires. Lock held """
+		self._wheel.schedule(d_id, self._tick_of(expires - self.margin))
+
+	def __len__(self):
+		with self._lock:
+			return len(self._wheel)
+
+	def add(self, d_id, until=None, expires=None):
+		"""
+		ARGUMENTS:
+			o  d_id: Directive ID to keep alive
+			o  until: Epoch seconds after which it is no longer renewed,
+				None to renew it until remove()
+			o  expires: When the directive currently expires. Defaults to
+				timeout seconds from now (a directive just created or
+				adjusted with the lease timeout)
+		"""
+		if expires is None:
+			expires = time.time() + self.timeout
+		with self._lock:
+			self._until[d_id] = until
+			self._schedule(d_id, expires)
+
+	def remove(self, d_id):
+		"""
+		Stop renewing a directive; it expires when its current timeout runs
+		out. Returns False if it was not leased
+		"""
+		with self._lock:
+			if d_id not in self._until:
+				return False
+			self._wheel.cancel(d_id)
+			del self._until[d_id]
+		return True
+
+	def leased(self):
+		""" IDs of the directives currently being renewed """
+		with self._lock:
+			return sorted(self._until)
+
+	def tick(self, now=None):
+		"""
+		Renew every lease that is due, with one adjust_many batch.
+
+		RETURNS:
+			@rtype: Integer
+			@return: Number of leases renewed
+		"""
+		now = time.time() if now is None else now
+		with self._lock:
+			due = self._wheel.advance(self._tick_of(now))
+			renew = []
+			for d_id in due:
+				until = self._until.get(d_id)
+				if until is not None and now >= until:
+					#Let it run out on its own
+					del self._until[d_id]
+					self._stats["released"] += 1
+				else:
+					renew.append(d_id)
+		if not renew:
+			return 0
+		try:
+			results = self._client.adjust_many(renew, self.timeout)
+		except Exception as e:
+			#Nothing is known to be renewed; retry them on the next tick
+			results = None
+			error = e
+		renewed = 0
+		lost = []
+		with self._lock:
+			self._stats["batches"] += 1
+			for i, d_id in enumerate(renew):
+				if d_id not in self._until or d_id in self._wheel:
+					#Removed or re-added meanwhile
+					continue
+				if results is None:
+					self._wheel.schedule(d_id, self._wheel.now + 1)
+				elif isinstance(results[i], Exception):
+					del self._until[d_id]
+					self._stats["lost"] += 1
+					lost.append((d_id, results[i]))
+				else:
+					self._schedule(d_id, now + self.timeout)
+					renewed += 1
+			self._stats["renewed"] += renewed
+		if results is None:
+			raise error
+		if self._on_lost is not None:
+			for d_id, exception in lost:
+				self._on_lost(d_id, exception)
+		return renewed
+
+	def stats(self):
+		"""
+		RETURNS:
+			@rtype: Dictionary
+			@return: leases (currently renewed), renewed, lost, released
+				(reached until) and batches (adjust_many calls)
+		"""
+		with self._lock:
+			stats = dict(self._stats)
+			stats["leases"] = len(self._until)
+		return stats
+
+	def _run(self):
+		while not self._stop.wait(self.resolution):
+			try:
+				self.tick()
+			except Exception:
+				#Already rescheduled; the next tick retries
+				pass
+
+	def start(self):
+		""" Renew leases from a background thread. Returns self """
+		if self._thread is None:
+			self._stop.clear()
+			self._thread = threading.Thread(target=self._run)
+			self._thread.daemon = True
+			self._thread.start()
+		return self
+
+	def stop(self):
+		""" Stop the background thread. Leases are kept """
+		if self._thread is not None:
+			self._stop.set()
+			self._thread.join()
+			self._thread = None
+
+	def __enter__(self):
+		return self.start()
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.stop()
@@ -0,0 +1,98 @@
+#!/usr/bin/python
+# ActuatorLeaseTest.py - Test for the timer wheel and lease manager
+# Works with Python 2.7 and 3
+
+"""
+Tests TimerWheel on its own and LeaseManager against the simulated actuator.
+No actuator needed.
+"""
+
+import random
+import time
+import unittest
+
+from ActuatorLease import LeaseManager, TimerWheel
+from ActuatorWrapper import ActuatorWrapper
+from SimulatedActuator import SimulatedActuator
+
+class TimerWheelTest(unittest.TestCase):
+
+	def test_fires_on_due_tick(self):
+		""" Test that every entry fires exactly on its tick, at any range. """
+		rand = random.Random(1)
+		#16 slots in all, so most entries cascade or exceed the horizon
+		wheel = TimerWheel(bits=2, levels=2, now=5)
+		expected = {}
+		for key in range(300):
+			due = 5 + rand.randint(1, 100)
+			wheel.schedule(key, due)
+			expected.setdefault(due, set()).add(key)
+		self.assertEqual(len(wheel), 300)
+		for tick in range(6, 106):
+			self.assertEqual(set(wheel.advance(tick)),
+							 expected.get(tick, set()))
+		self.assertEqual(len(wheel), 0)
+
+	def test_cancel_and_reschedule(self):
+		""" Test that cancelled and moved entries do not fire early. """
+		wheel = TimerWheel(bits=3, levels=2)
+		wheel.schedule("a", 10)
+		wheel.schedule("b", 10)
+		wheel.schedule("c", 70)
+		wheel.cancel("a")
+		wheel.schedule("b", 20)
+		self.assertEqual(wheel.due("b"), 20)
+		self.assertEqual(wheel.advance(19), [])
+		self.assertEqual(wheel.advance(1000), ["b", "c"])
+		#Past ticks fire on the next advance
+		wheel.schedule("d", 3)
+		self.assertEqual(wheel.advance(1001), ["d"])
+
+class LeaseManagerTest(unittest.TestCase):
+
+	def setUp(self):
+		self.actuator = SimulatedActuator().start()
+		self.wrapper = ActuatorWrapper(*self.actuator.address)
+
+	def tearDown(self):
+		self.wrapper.quit()
+		self.actuator.stop()
+
+	def test_renewal(self):
+		""" Test batched renewals, lost leases and releases. """
+		lost = []
+		leases = LeaseManager(self.wrapper, timeout=4, margin=1,
+							  resolution=0.1,
+							  on_lost=lambda d_id, e: lost.append(d_id))
+		start = time.time()
+		d_ids = [self.wrapper.block(blockIP="10.0.3.%d" % n, timeout=4)
+				 for n in range(4)]
+		for d_id in d_ids[:3]:
+			leases.add(d_id, expires=start + 4)
+		leases.add(d_ids[3], until=start + 2, expires=start + 4)
+		self.assertEqual(leases.tick(start + 1), 0)
+		self.assertEqual(leases.tick(start + 3.05), 3)
+		self.assertEqual(self.actuator.stats()["ADJUST"], 3)
+		self.wrapper.cancel(id=d_ids[0])
+		self.assertTrue(leases.remove(d_ids[1]))
+		self.assertFalse(leases.remove(d_ids[1]))
+		self.assertEqual(leases.tick(start + 6.1), 1)
+		self.assertEqual(lost, [d_ids[0]])
+		self.assertEqual(leases.leased(), [d_ids[2]])
+		self.assertEqual(leases.stats(), {"leases": 1, "renewed": 4,
+										  "lost": 1, "released": 1,
+										  "batches": 2})
+
+	def test_background_thread(self):
+		""" Test that the background thread keeps a directive alive. """
+		with LeaseManager(self.wrapper, timeout=1, margin=0.5,
+						  resolution=0.05) as leases:
+			d_id = self.wrapper.block(blockIP="10.0.3.9", timeout=1)
+			leases.add(d_id)
+			time.sleep(1.5)
+			self.assertIn(d_id, self.actuator.active_ids())
+			self.assertTrue(leases.stats()["renewed"] >= 1)
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,210 @@
+#!/usr/bin/python
+# ActuatorMetrics.py - Client-side instrumentation for the OF-Actuator wrapper
+# Works with Python 2.7 and 3
+
+"""
+Per-directive latency histograms, byte counts, error counts and reconnect
+events, recorded by ActuatorWrapper when it is given a metrics object:
+
+	metrics = ActuatorMetrics()
+	wrapper = ActuatorWrapper(<ACTUATOR_IP>, <ACTUATOR_PORT>, metrics=metrics)
+	...
+	print(metrics.to_prometheus())
+
+Without one the wrapper skips all of this (a single attribute check per
+directive). One ActuatorMetrics may be shared by several wrappers, e.g. all
+connections of an ActuatorPool.
+
+Hooks see every exchange: pre_send(directive, line) before the line is
+written and post_receive(directive, line, response, seconds) after the
+response arrived, where response is the response text or the exception
+raised. directive is the directive keyword, e.g. "BLOCK".
+"""
+
+import bisect
+import threading
+import time
+
+#Upper bounds of the latency histogram buckets in seconds
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+				   0.5, 1.0, 2.5, 5.0, 10.0)
+
+class _Histogram(object):
+	""" Latency histogram of one directive type """
+	__slots__ = ("counts", "sum", "count")
+
+	def __init__(self, size):
+		#One count per bucket plus the +Inf bucket, not cumulative
+		self.counts = [0] * (size + 1)
+		self.sum = 0.0
+		self.count = 0
+
+def _label(value):
+	""" Escape a Prometheus label value """
+	return (str(value).replace("\\", "\\\\").replace("\"", "\\\"")
+			.replace("\n", "\\n"))
+
+class ActuatorMetrics(object):
+	""" Thread-safe collector of wrapper instrumentation """
+
+	def __init__(self, buckets=DEFAULT_BUCKETS):
+		"""
+		ARGUMENTS:
+			o  buckets: Increasing upper bounds in seconds of the latency
+				histogram buckets
+		"""
+		self.buckets = tuple(sorted(buckets))
+		self._lock = threading.Lock()
+		self._pre_send = []
+		self._post_receive = []
+		self.reset()
+
+	def reset(self):
+		""" Forget everything recorded so far. Hooks are kept """
+		with self._lock:
+			self._histograms = {}
+			self._sent = {}
+			self._received = {}
+			#(directive, error type) -> count
+			self._errors = {}
+			self._reconnects = 0
+
+	def add_hook(self, pre_send=None, post_receive=None):
+		""" Register callables run around every exchange """
+		with self._lock:
+			if pre_send is not None:
+				self._pre_send.append(pre_send)
+			if post_receive is not None:
+				self._post_receive.append(post_receive)
+
+	def pre_send(self, directive, line):
+		""" Run the pre-send hooks for a directive about to be written """
+		for hook in self._pre_send:
+			hook(directive, line)
+
+	def post_receive(self, directive, line, response, seconds, received=None):
+		"""
+		Record one exchange and run the post-receive hooks. response is the
+		response text, or the exception that ended the exchange. received
+		overrides the byte count for responses that were streamed, where
+		response is only the terminating line
+		"""
+		if isinstance(response, Exception):
+			error = type(response).__name__
+			received = received or 0
+		else:
+			error = "ERROR" if response.startswith("ERROR") else None
+			if received is None:
+				received = len(response)
+		sent = len(line) + 1
+		with self._lock:
+			histogram = self._histograms.get(directive)
+			if histogram is None:
+				histogram = self._histograms[directive] = _Histogram(
+					len(self.buckets))
+			histogram.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+			histogram.sum += seconds
+			histogram.count += 1
+			self._sent[directive] = self._sent.get(directive, 0) + sent
+			self._received[directive] = (self._received.get(directive, 0) +
+										 received)
+			if error is not None:
+				key = (directive, error)
+				self._errors[key] = self._errors.get(key, 0) + 1
+		for hook in self._post_receive:
+			hook(directive, line, response, seconds)
+
+	def measure(self, line, exchange, *args):
+		"""
+		Run exchange(line, *args), which sends a directive line and returns
+		its response, recording it
+		"""
+		directive = line.split(" ", 1)[0]
+		self.pre_send(directive, line)
+		start = time.time()
+		try:
+			data = exchange(line, *args)
+		except Exception as e:
+			self.post_receive(directive, line, e, time.time() - start)
+			raise
+		self.post_receive(directive, line, data, time.time() - start)
+		return data
+
+	def record_reconnect(self):
+		""" Count a reconnect of a wrapper to the actuator """
+		with self._lock:
+			self._reconnects += 1
+
+	def snapshot(self):
+		"""
+		RETURNS:
+			@rtype: Dictionary
+			@return: {"directives": directive -> {"count", "sum_seconds",
+				"buckets" (upper bound -> cumulative count), "bytes_sent",
+				"bytes_received"}, "errors": {(directive, error): count},
+				"reconnects": count}
+		"""
+		with self._lock:
+			directives = {}
+			for directive, histogram in self._histograms.items():
+				cumulative = 0
+				buckets = []
+				for bound, count in zip(self.buckets + (float("inf"),),
+										histogram.counts):
+					cumulative += count
+					buckets.append((bound, cumulative))
+				directives[directive] = {
+					"count": histogram.count,
+					"sum_seconds": histogram.sum,
+					"buckets": buckets,
+					"bytes_sent": self._sent.get(directive, 0),
+					"bytes_received": self._received.get(directive, 0),
+				}
+			return {"directives": directives, "errors": dict(self._errors),
+					"reconnects": self._reconnects}
+
+	def to_prometheus(self, prefix="ofactuator"):
+		"""
+		RETURNS:
+			@rtype: String
+			@return: Everything recorded, in the Prometheus text exposition
+				format
+		"""
+		snapshot = self.snapshot()
+		directives = sorted(snapshot["directives"].items())
+		lines = []
+		name = prefix + "_directive_duration_seconds"
+		lines.append("# HELP %s Time from sending a directive to its "
+					 "complete response" % name)
+		lines.append("# TYPE %s histogram" % name)
+		for directive, stats in directives:
+			label = _label(directive)
+			for bound, count in stats["buckets"]:
+				le = "+Inf" if bound == float("inf") else repr(bound)
+				lines.append("%s_bucket{directive=\"%s\",le=\"%s\"} %d" %
+							 (name, label, le, count))
+			lines.append("%s_sum{directive=\"%s\"} %r" %
+						 (name, label, stats["sum_seconds"]))
+			lines.append("%s_count{directive=\"%s\"} %d" %
+						 (name, label, stats["count"]))
+		for key, help_text in [("bytes_sent", "Bytes of directives sent"),
+							   ("bytes_received", "Bytes of responses "
+								"received")]:
+			name = "%s_%s_total" % (prefix, key)
+			lines.append("# HELP %s %s" % (name, help_text))
+			lines.append("# TYPE %s counter" % name)
+			for directive, stats in directives:
+				lines.append("%s{directive=\"%s\"} %d" %
+							 (name, _label(directive), stats[key]))
+		name = prefix + "_directive_errors_total"
+		lines.append("# HELP %s Directives answered with ERROR or failed "
+					 "with an exception, by error type" % name)
+		lines.append("# TYPE %s counter" % name)
+		for (directive, error), count in sorted(snapshot["errors"].items()):
+			lines.append("%s{directive=\"%s\",error=\"%s\"} %d" %
+						 (name, _label(directive), _label(error), count))
+		name = prefix + "_reconnects_total"
+		lines.append("# HELP %s Reconnects to the actuator" % name)
+		lines.append("# TYPE %s counter" % name)
+		lines.append("%s %d" % (name, snapshot["reconnects"]))
+		return "\n".join(lines) + "\n"
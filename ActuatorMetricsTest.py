@@ -0,0 +1,85 @@
+#!/usr/bin/python
+# ActuatorMetricsTest.py - Test for OF-Actuator wrapper instrumentation
+# Works with Python 2.7 and 3
+
+"""
+Tests the metrics collector on its own and through a wrapper talking to the
+simulated actuator.
+"""
+
+import unittest
+
+from ActuatorMetrics import ActuatorMetrics
+from ActuatorWrapper import ActuatorWrapper
+from SimulatedActuator import SimulatedActuator
+
+class ConnectionLost(Exception):
+	pass
+
+class ActuatorMetricsTest(unittest.TestCase):
+
+	def test_histogram(self):
+		""" Test bucketing, byte counts and errors. """
+		metrics = ActuatorMetrics(buckets=(0.01, 0.1))
+		metrics.post_receive("BLOCK", "BLOCK -blockIP 10.0.0.1", "OK 1\n",
+							 0.005)
+		metrics.post_receive("BLOCK", "BLOCK -blockIP 10.0.0.2", "OK 2\n",
+							 0.01)
+		metrics.post_receive("BLOCK", "BLOCK -blockIP 10.0.0.3",
+							 "ERROR no switch\n", 0.5)
+		metrics.post_receive("INFO", "INFO", ConnectionLost("reset"), 0.2)
+		stats = metrics.snapshot()
+		block = stats["directives"]["BLOCK"]
+		self.assertEqual(block["count"], 3)
+		self.assertEqual(block["buckets"],
+						 [(0.01, 2), (0.1, 2), (float("inf"), 3)])
+		self.assertEqual(block["bytes_sent"], 3 * 24)
+		self.assertEqual(block["bytes_received"], 5 + 5 + 16)
+		self.assertEqual(stats["errors"], {("BLOCK", "ERROR"): 1,
+										   ("INFO", "ConnectionLost"): 1})
+
+	def test_prometheus(self):
+		""" Test the Prometheus text format. """
+		metrics = ActuatorMetrics(buckets=(0.01,))
+		metrics.post_receive("CANCEL", "CANCEL -id 1", "OK\n", 0.002)
+		metrics.record_reconnect()
+		text = metrics.to_prometheus()
+		self.assertIn("# TYPE ofactuator_directive_duration_seconds "
+					  "histogram\n", text)
+		self.assertIn("ofactuator_directive_duration_seconds_bucket"
+					  "{directive=\"CANCEL\",le=\"+Inf\"} 1\n", text)
+		self.assertIn("ofactuator_bytes_sent_total{directive=\"CANCEL\"} 13\n",
+					  text)
+		self.assertIn("ofactuator_reconnects_total 1\n", text)
+
+	def test_wrapper(self):
+		""" Test instrumentation and hooks of a wrapper. """
+		seen = []
+		metrics = ActuatorMetrics()
+		metrics.add_hook(pre_send=lambda directive, line: seen.append(line),
+						 post_receive=lambda directive, line, response,
+						 seconds: seen.append(directive))
+		with SimulatedActuator() as actuator:
+			wrapper = ActuatorWrapper(*actuator.address, metrics=metrics)
+			d_id = wrapper.block(blockIP="10.0.0.1")
+			with wrapper.pipeline() as pipe:
+				pipe.block(blockIP="10.0.0.2")
+				pipe.cancel(id=999)
+			records = list(wrapper.info_records())
+			self.assertRaises(Exception, wrapper.cancel, id=998)
+			wrapper.quit()
+		stats = metrics.snapshot()
+		self.assertEqual(seen[:2], ["BLOCK -blockIP 10.0.0.1", "BLOCK"])
+		self.assertEqual(stats["directives"]["BLOCK"]["count"], 2)
+		self.assertEqual(stats["directives"]["CANCEL"]["count"], 2)
+		self.assertEqual(stats["errors"], {("CANCEL", "ERROR"): 2})
+		self.assertEqual(len(records), 2)
+		#Streamed INFO still counts every byte of the response
+		info = stats["directives"]["INFO"]["bytes_received"]
+		self.assertEqual(info, sum(len(" %d: DENY -IP1 %s; never expires\n" %
+									   (r.id, r.params["IP1"]))
+								   for r in records) + len("DONE\n"))
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,242 @@
+#!/usr/bin/python
+# ActuatorPool.py - Connection pool for openflowsec.org's OF-Actuator wrapper
+# Works with Python 2.7 and 3
+
+"""
+Thread-safe pool of ActuatorWrapper connections. Worker threads check a
+connection out, issue directives on it and give it back, so connections are
+reused instead of opened per thread and no two threads ever share a socket at
+the same time:
+
+	pool = ActuatorPool(<ACTUATOR_IP>, <ACTUATOR_PORT>, max_size=8)
+	with pool.connection() as wrapper:
+		d_id = wrapper.block(blockIP="10.0.0.1")
+
+	#Or let the pool check a connection out for a single directive
+	pool.cancel(id=d_id)
+
+At most max_size connections are open at a time; checkout waits up to
+max_wait seconds for one to be returned and raises PoolTimeout otherwise.
+Connections idle for longer than idle_timeout are closed, and an idle
+connection is health checked before it is handed out again.
+"""
+
+import contextlib
+import socket
+import threading
+import time
+
+from ActuatorWrapper import ActuatorWrapper
+
+class PoolTimeout(Exception):
+	""" No connection became available within the pool's max_wait """
+
+class ActuatorPool(object):
+	""" Bounded pool of ActuatorWrapper connections """
+
+	def __init__(self, server_ip="127.0.0.1", server_port=26795, max_size=8,
+				 max_wait=10.0, idle_timeout=300.0, health_check=None,
+				 wrapper_factory=ActuatorWrapper):
+		"""
+		ARGUMENTS:
+			o  server_ip, server_port: Actuator address
+			o  max_size: Maximum number of open connections
+			o  max_wait: Seconds checkout waits for a free connection
+			o  idle_timeout: Seconds after which an idle connection is closed
+			o  health_check: Optional callable(wrapper) returning False if an
+				idle connection must not be reused. Called in addition to
+				ActuatorWrapper.is_connected()
+			o  wrapper_factory: Callable(server_ip, server_port) returning a
+				new connected wrapper
+		"""
+		if max_size < 1:
+			raise ValueError("max_size must be at least 1")
+		self._server_ip = server_ip
+		self._server_port = server_port
+		self._max_size = max_size
+		self._max_wait = max_wait
+		self._idle_timeout = idle_timeout
+		self._health_check = health_check
+		self._wrapper_factory = wrapper_factory
+		self._cond = threading.Condition(threading.Lock())
+		#Idle connections as (wrapper, returned_at), most recent last
+		self._idle = []
+		self._size = 0
+		self._closed = False
+		self._stats = {"created": 0, "reused": 0, "evicted": 0,
+					   "discarded": 0, "waits": 0, "timeouts": 0}
+
+	def _healthy(self, wrapper):
+		""" Check an idle connection before handing it out again """
+		if not wrapper.is_connected():
+			return False
+		if self._health_check is not None:
+			try:
+				return bool(self._health_check(wrapper))
+			except Exception:
+				return False
+		return True
+
+	def _close_wrapper(self, wrapper):
+		""" Close a connection, ignoring errors from already dead sockets """
+		try:
+			wrapper.quit()
+		except Exception:
+			pass
+
+	def _evict_idle(self, now):
+		"""
+		Remove connections idle longer than idle_timeout. Must be called with
+		the lock held; returns the wrappers to close outside the lock
+		"""
+		expired = [wrapper for wrapper, returned in self._idle
+				   if now - returned > self._idle_timeout]
+		if expired:
+			self._idle = [(wrapper, returned) for wrapper, returned in self._idle
+						  if now - returned <= self._idle_timeout]
+			self._size -= len(expired)
+			self._stats["evicted"] += len(expired)
+		return expired
+
+	def checkout(self, max_wait=None):
+		"""
+		Take a connection out of the pool, opening a new one if none is idle
+		and the pool is not full.
+
+		RETURNS:
+			@rtype: ActuatorWrapper
+			@return: Connection reserved for the caller until checkin()
+		"""
+		max_wait = self._max_wait if max_wait is None else max_wait
+		deadline = time.time() + max_wait
+		while 1:
+			to_close = []
+			wrapper = None
+			create = False
+			with self._cond:
+				if self._closed:
+					raise ValueError("Pool is closed")
+				to_close = self._evict_idle(time.time())
+				while not self._idle and self._size >= self._max_size:
+					remaining = deadline - time.time()
+					if remaining <= 0:
+						self._stats["timeouts"] += 1
+						raise PoolTimeout(("No actuator connection available "
+										   "after %.3f seconds" % max_wait))
+					self._stats["waits"] += 1
+					self._cond.wait(remaining)
+				if self._idle:
+					#Reuse the most recently returned connection so rarely
+					#needed ones age out through idle eviction
+					wrapper = self._idle.pop()[0]
+				else:
+					self._size += 1
+					create = True
+			for stale in to_close:
+				self._close_wrapper(stale)
+
+			if create:
+				try:
+					wrapper = self._wrapper_factory(self._server_ip,
+													self._server_port)
+				except Exception:
+					with self._cond:
+						self._size -= 1
+						self._cond.notify()
+					raise
+				with self._cond:
+					self._stats["created"] += 1
+				return wrapper
+
+			if self._healthy(wrapper):
+				with self._cond:
+					self._stats["reused"] += 1
+				return wrapper
+			#Dead idle connection: drop it and try again
+			self._discard(wrapper)
+
+	def _discard(self, wrapper):
+		""" Close a checked out connection and free its slot """
+		with self._cond:
+			self._size -= 1
+			self._stats["discarded"] += 1
+			self._cond.notify()
+		self._close_wrapper(wrapper)
+
+	def checkin(self, wrapper, discard=False):
+		"""
+		Return a connection to the pool. Use discard=True for a connection
+		left in an unknown state (e.g. after a socket error)
+		"""
+		if discard or self._closed or not wrapper.is_connected():
+			self._discard(wrapper)
+			return
+		with self._cond:
+			self._idle.append((wrapper, time.time()))
+			self._cond.notify()
+
+	@contextlib.contextmanager
+	def connection(self, max_wait=None):
+		"""
+		Context manager checking a connection out for the "with" block.
+		Connections that raised a socket error are not put back
+		"""
+		wrapper = self.checkout(max_wait)
+		try:
+			yield wrapper
+		except socket.error:
+			self.checkin(wrapper, discard=True)
+			raise
+		except BaseException:
+			self.checkin(wrapper)
+			raise
+		else:
+			self.checkin(wrapper)
+
+	def stats(self):
+		"""
+		RETURNS:
+			@rtype: Dictionary
+			@return: Open/idle/in-use connection counts and lifetime counters
+		"""
+		with self._cond:
+			stats = dict(self._stats)
+			stats["size"] = self._size
+			stats["idle"] = len(self._idle)
+			stats["in_use"] = self._size - len(self._idle)
+		return stats
+
+	def close(self):
+		"""
+		Close all idle connections. Connections still checked out are closed
+		when they are returned
+		"""
+		with self._cond:
+			self._closed = True
+			idle = [wrapper for wrapper, returned in self._idle]
+			self._idle = []
+			self._size -= len(idle)
+			self._cond.notify_all()
+		for wrapper in idle:
+			self._close_wrapper(wrapper)
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close()
+
+def _pooled_directive(name):
+	""" Build a pool method issuing one directive on a pooled connection """
+	def directive(self, *args, **kwargs):
+		with self.connection() as wrapper:
+			return getattr(wrapper, name)(*args, **kwargs)
+	directive.__name__ = name
+	directive.__doc__ = (" %s directive on a pooled connection. See "
+						 "ActuatorWrapper.%s " % (name.upper(), name))
+	return directive
+
+for _name in ["block", "deny", "redirect", "quarantine", "unplug", "info",
+			  "cancel", "adjust", "switches", "defaults", "help", "hostinfo",
+			  "cancel_many", "adjust_many"]:
+	setattr(ActuatorPool, _name, _pooled_directive(_name))
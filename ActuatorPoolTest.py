@@ -0,0 +1,81 @@
+#!/usr/bin/python
+# ActuatorPoolTest.py - Test for OF-Actuator connection pool
+# Works with Python 2.7 and 3
+
+"""
+Same requirements as ActuatorWrapperTest.py, SERVER_IP and SERVER_PORT are
+shared with it.
+"""
+
+import threading
+import unittest
+
+import ActuatorWrapperTest
+from ActuatorPool import ActuatorPool, PoolTimeout
+
+class ActuatorPoolTest(unittest.TestCase):
+
+	def setUp(self):
+		self.pool = ActuatorPool(ActuatorWrapperTest.SERVER_IP,
+								 ActuatorWrapperTest.SERVER_PORT, max_size=4,
+								 max_wait=5)
+
+	def tearDown(self):
+		self.pool.close()
+
+	def test_concurrent_directives(self):
+		""" Test many threads issuing directives through a small pool. """
+		d_ids = []
+		errors = []
+		def worker(n):
+			try:
+				for i in range(10):
+					d_id = self.pool.block(blockIP="10.%d.%d.1" % (n, i),
+										   resetAfter="1")
+					d_ids.append(d_id)
+					self.pool.cancel(id=d_id)
+			except Exception as e:
+				errors.append(e)
+		threads = [threading.Thread(target=worker, args=(n,))
+				   for n in range(16)]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+		self.assertEqual(errors, [])
+		self.assertEqual(len(set(d_ids)), 160)
+		stats = self.pool.stats()
+		self.assertTrue(stats["created"] <= 4)
+		self.assertEqual(stats["in_use"], 0)
+
+	def test_checkout_timeout(self):
+		""" Test that checkout gives up after max_wait. """
+		pool = ActuatorPool(ActuatorWrapperTest.SERVER_IP,
+							ActuatorWrapperTest.SERVER_PORT, max_size=1)
+		with pool.connection():
+			self.assertRaises(PoolTimeout, pool.checkout, 0.05)
+		with pool.connection() as wrapper:
+			self.assertIn("DONE", wrapper.switches())
+		pool.close()
+
+	def test_idle_eviction(self):
+		""" Test that connections idle past idle_timeout are closed. """
+		pool = ActuatorPool(ActuatorWrapperTest.SERVER_IP,
+							ActuatorWrapperTest.SERVER_PORT, idle_timeout=0)
+		wrapper = pool.checkout()
+		pool.checkin(wrapper)
+		pool.checkout()
+		self.assertEqual(pool.stats()["evicted"], 1)
+		pool.close()
+
+	def test_dead_connection_not_reused(self):
+		""" Test that a connection closed while idle is replaced. """
+		wrapper = self.pool.checkout()
+		self.pool.checkin(wrapper)
+		wrapper._conn.close()
+		self.assertIn("DONE", self.pool.switches())
+		self.assertEqual(self.pool.stats()["created"], 2)
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,317 @@
+#!/usr/bin/python
+# ActuatorProtocol.py - Response framing and parsing for openflowsec.org's
+# OF-Actuator
+# Works with Python 2.7 and 3
+
+"""
+The actuator answers every directive with zero or more text lines followed by
+a single terminating line that starts with one of the keywords OK, DONE,
+ERROR or echo, e.g.:
+
+	OK 12
+	ERROR Unknown directive "BLCK"
+	 12: BLOCK -blockIP 10.0.0.1; expires in 25 seconds
+	 13: DENY -IP1 10.0.0.2; expires in 40 seconds
+	DONE
+
+Only a whole keyword at the start of a line ends a response; the keyword
+appearing anywhere else (for example inside a host name) does not.
+
+INFO lines (" <id>: <directive>; <expires>", optionally followed by the
+directive's rule lines) are parsed into DirectiveRecords by parse_info_lines.
+
+Sockets handed to ResponseReader and send_all may be non-blocking; both then
+wait for the socket with poll (select where poll is missing) and give up
+with ActuatorTimeout once an absolute deadline (time.time() seconds) passes.
+"""
+
+import datetime
+import errno
+import re
+import select
+import socket
+import time
+
+#Terminating line of a response, searched for directly in the receive buffer.
+#Anchoring on the preceding newline rather than "^" lets the regex engine skip
+#ahead between newlines instead of trying every position
+_RESPONSE_END_AT = re.compile(br"(?:OK|DONE|ERROR|echo)(?:[ \t][^\n]*)?\r?\n")
+_RESPONSE_END = re.compile(br"\n(?:OK|DONE|ERROR|echo)(?:[ \t][^\n]*)?\r?\n")
+_RESPONSE_END_LINE = re.compile(r"(?:OK|DONE|ERROR|echo)(?:[ \t]|\r?\n?$)")
+
+if str is bytes:
+	def _native(data):
+		""" Convert received bytes to the native str type """
+		return str(data)
+else:
+	def _native(data):
+		""" Convert received bytes to the native str type """
+		return data.decode("ascii", "replace")
+
+#errno values of a non-blocking socket that is not ready yet
+_WOULD_BLOCK = frozenset([errno.EAGAIN, errno.EWOULDBLOCK])
+
+class ActuatorTimeout(socket.timeout):
+	"""
+	A directive's deadline passed before it was sent or its response was
+	read. The connection it was sent on is out of step and must not be used
+	for another directive
+	"""
+
+def wait_ready(sock, expires, write=False):
+	"""
+	Wait until sock can be read (or written), raising ActuatorTimeout if the
+	absolute time expires passes first. expires None waits indefinitely
+	"""
+	if expires is None:
+		timeout = None
+	else:
+		timeout = expires - time.time()
+		if timeout <= 0:
+			raise ActuatorTimeout("Actuator did not answer before the deadline")
+	if hasattr(select, "poll"):
+		poller = select.poll()
+		poller.register(sock, select.POLLOUT if write else select.POLLIN)
+		#poll counts milliseconds; round up so it never returns early
+		ready = poller.poll(None if timeout is None
+							else int(timeout * 1000) + 1)
+	elif write:
+		ready = select.select([], [sock], [], timeout)[1]
+	else:
+		ready = select.select([sock], [], [], timeout)[0]
+	if not ready:
+		raise ActuatorTimeout("Actuator did not answer before the deadline")
+
+def send_all(sock, data, expires=None):
+	"""
+	Send all of data, waiting for room in the socket buffer as needed. On a
+	non-blocking sock expires bounds the wait like wait_ready
+	"""
+	view = memoryview(data)
+	while view:
+		try:
+			view = view[sock.send(view):]
+		except socket.error as e:
+			if e.errno not in _WOULD_BLOCK:
+				raise
+			wait_ready(sock, expires, write=True)
+
+def is_response_end(line):
+	"""
+	Check whether a (native str) response line is the last line of a response
+	"""
+	return _RESPONSE_END_LINE.match(line) is not None
+
+class ResponseReader(object):
+	"""
+	Incremental reader splitting the byte stream from the actuator into
+	responses. Data is received straight into a reusable chunk buffer and
+	appended to a persistent bytearray; bytes received past the end of one
+	response are kept for the next. Searching for the terminating line is done
+	by the regex engine over the buffer, so large INFO/HOSTINFO responses are
+	never split into per-line Python strings unless asked for with iter_lines()
+	"""
+
+	def __init__(self, sock, chunk_size=65536):
+		self._sock = sock
+		self._buffer = bytearray()
+		#Offset up to which the buffer holds no terminating line
+		self._scan = 0
+		self._chunk = bytearray(chunk_size)
+		self._view = memoryview(self._chunk)
+
+	def _fill(self, expires=None):
+		"""
+		Receive the next chunk from the socket into the buffer. A
+		non-blocking socket is waited for until expires
+		"""
+		while 1:
+			try:
+				received = self._sock.recv_into(self._view)
+				break
+			except socket.error as e:
+				if e.errno not in _WOULD_BLOCK:
+					raise
+				wait_ready(self._sock, expires)
+		if not received:
+			raise socket.error("Connection closed by actuator")
+		self._buffer += self._view[:received]
+		return received
+
+	def pending(self):
+		"""
+		Number of received bytes not yet returned as part of a response
+		"""
+		return len(self._buffer)
+
+	def _find_end(self):
+		"""
+		Return the offset just past the terminating line of the response at
+		the front of the buffer, or None if it has not been received yet
+		"""
+		if self._scan == 0:
+			match = _RESPONSE_END_AT.match(self._buffer)
+			if not match:
+				match = _RESPONSE_END.search(self._buffer)
+		else:
+			match = _RESPONSE_END.search(self._buffer, self._scan - 1)
+		if match:
+			self._scan = 0
+			return match.end()
+		#Only the unfinished last line can still become a terminator
+		self._scan = self._buffer.rfind(b"\n") + 1
+		return None
+
+	def read_response(self, expires=None):
+		"""
+		Read one complete response (including its terminating line). On a
+		non-blocking socket ActuatorTimeout is raised if it has not all
+		arrived by the absolute time expires; what did arrive stays buffered
+		"""
+		end = self._find_end()
+		while end is None:
+			self._fill(expires)
+			end = self._find_end()
+		data = _native(self._buffer[:end])
+		del self._buffer[:end]
+		return data
+
+	def iter_lines(self, expires=None):
+		"""
+		Generator yielding the lines of one response as they arrive, ending
+		with its terminating line. Lines are split off a whole received chunk
+		at a time. The response must be consumed completely before the next
+		one is read. expires bounds the wait as in read_response
+		"""
+		while 1:
+			end = self._find_end()
+			done = end is not None
+			if not done:
+				#Hand out every complete line received so far
+				end = self._scan
+				if not end:
+					self._fill(expires)
+					continue
+			lines = _native(self._buffer[:end]).split("\n")
+			del self._buffer[:end]
+			self._scan = 0
+			#The block ends with a newline, so the last item is always empty
+			for line in lines[:-1]:
+				yield line + "\n"
+			if done:
+				return
+
+#" <id>: <directive>; <expires>" line of an INFO response
+_INFO_LINE = re.compile(r"\s*(\d+):\s*(\S+)([^;]*)(?:;\s*(.*?))?\s*$")
+_EXPIRES_IN = re.compile(r"(\d+(?:\.\d+)?)\s*(?:s|secs?|seconds?)?\b", re.I)
+_EXPIRES_AT = re.compile(r"(\d{4}[-/]\d\d[-/]\d\d)[ T](\d\d:\d\d:\d\d)")
+_NEVER_EXPIRES = re.compile(r"never|indefinite|no (?:expiration|timeout)", re.I)
+
+class DirectiveRecord(object):
+	"""
+	One active directive from an INFO response.
+
+	id: Directive ID
+	directive: Directive type, e.g. "BLOCK"
+	params: Dictionary of parameter name (without "-") to value string, or
+		True for flags given without a value
+	expires: Expiry as epoch seconds, None if the directive never expires
+		or the actuator's expiry text was not understood
+	expires_text: Expiry text as sent by the actuator
+	rules: List of rule lines when INFO was run with rules=True, else None
+	"""
+	__slots__ = ("id", "directive", "params", "expires", "expires_text",
+				 "rules")
+
+	def __init__(self, id, directive, params, expires=None, expires_text="",
+				 rules=None):
+		self.id = id
+		self.directive = directive
+		self.params = params
+		self.expires = expires
+		self.expires_text = expires_text
+		self.rules = rules
+
+	@property
+	def expires_datetime(self):
+		""" Expiry as a local datetime, None if it never expires """
+		if self.expires is None:
+			return None
+		return datetime.datetime.fromtimestamp(self.expires)
+
+	def __repr__(self):
+		return "DirectiveRecord(%d, %r, %r, expires=%r)" % (self.id,
+			self.directive, self.params, self.expires)
+
+def parse_params(text):
+	"""
+	Parse "-name value -flag ..." directive parameters into a dictionary
+	"""
+	params = {}
+	tokens = text.split()
+	i = 0
+	while i < len(tokens):
+		token = tokens[i]
+		i += 1
+		if not token.startswith("-") or len(token) == 1:
+			continue
+		if i < len(tokens) and not tokens[i].startswith("-"):
+			params[token[1:]] = tokens[i]
+			i += 1
+		else:
+			params[token[1:]] = True
+	return params
+
+def parse_expires(text, now=None):
+	"""
+	Convert the expiry part of an INFO line to epoch seconds, None if the
+	directive never expires or the text is not understood
+	"""
+	if not text or _NEVER_EXPIRES.search(text):
+		return None
+	match = _EXPIRES_AT.search(text)
+	if match:
+		try:
+			stamp = time.strptime(match.group(1).replace("/", "-") + " " +
+								  match.group(2), "%Y-%m-%d %H:%M:%S")
+		except ValueError:
+			return None
+		return time.mktime(stamp)
+	match = _EXPIRES_IN.search(text)
+	if match:
+		return (time.time() if now is None else now) + float(match.group(1))
+	return None
+
+def parse_info_lines(lines, rules=False, now=None):
+	"""
+	Generator turning the lines of an INFO response into DirectiveRecords as
+	they are read. A record is yielded once the line after it shows that no
+	more rule lines follow, so only one record is held at a time. With
+	rules=True every record gets a (possibly empty) rules list. Raises
+	Exception if the response is an ERROR
+	"""
+	record = None
+	for line in lines:
+		if is_response_end(line):
+			if record is not None:
+				yield record
+			if line.startswith("ERROR"):
+				raise Exception(line)
+			return
+		match = _INFO_LINE.match(line)
+		if match:
+			if record is not None:
+				yield record
+			expires_text = match.group(4) or ""
+			record = DirectiveRecord(int(match.group(1)),
+									 match.group(2).upper(),
+									 parse_params(match.group(3)),
+									 parse_expires(expires_text, now),
+									 expires_text, [] if rules else None)
+		elif record is not None and line.strip():
+			#Anything between two directives is a rule of the first one
+			if record.rules is None:
+				record.rules = []
+			record.rules.append(line.strip())
+	if record is not None:
+		yield record
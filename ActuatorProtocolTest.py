@@ -0,0 +1,106 @@
+#!/usr/bin/python
+# ActuatorProtocolTest.py - Test for OF-Actuator response framing
+# Works with Python 2.7 and 3
+
+"""
+Tests ResponseReader framing over a local socket pair. No actuator needed.
+"""
+
+import socket
+import time
+import unittest
+
+from ActuatorProtocol import (ActuatorTimeout, ResponseReader, is_response_end,
+							  parse_info_lines, parse_params, send_all)
+
+class ActuatorProtocolTest(unittest.TestCase):
+
+	def setUp(self):
+		self.left, self.right = socket.socketpair()
+		self.reader = ResponseReader(self.right, chunk_size=7)
+
+	def tearDown(self):
+		self.left.close()
+		self.right.close()
+
+	def test_is_response_end(self):
+		""" Test that only whole keywords at the start of a line match. """
+		for line in ["OK 12\n", "OK\n", "DONE\n", "ERROR bad\n", "DONE"]:
+			self.assertTrue(is_response_end(line), line)
+		for line in [" 1: BLOCK -blockIP 10.0.0.1; OK\n", "OKAY\n",
+					 "DONEZO\n", "  host-OK 10.0.0.1\n"]:
+			self.assertFalse(is_response_end(line), line)
+
+	def test_read_response_fragmented(self):
+		""" Test a multi-line response received in small fragments. """
+		self.left.sendall(b" 1: BLOCK -blockIP 10.0.0.1; expires in 5 "
+						  b"seconds\n 2: DENY -IP1 10.0.0.2; never\nDONE\n")
+		data = self.reader.read_response()
+		self.assertEqual(data.count("\n"), 3)
+		self.assertTrue(data.endswith("DONE\n"))
+
+	def test_read_response_keeps_leftover(self):
+		""" Test that bytes past the end of a response are kept. """
+		self.left.sendall(b"OK 1\nOK 2\nERR")
+		self.assertEqual(self.reader.read_response(), "OK 1\n")
+		self.left.sendall(b"OR bad\n")
+		self.assertEqual(self.reader.read_response(), "OK 2\n")
+		self.assertEqual(self.reader.read_response(), "ERROR bad\n")
+		self.assertEqual(self.reader.pending(), 0)
+
+	def test_keyword_inside_line(self):
+		""" Test that OK/DONE inside a line does not end the response. """
+		self.left.sendall(b"  OKHOST 10.0.0.1 DONE\n  x OK\nDONE\n")
+		self.assertEqual(self.reader.read_response().count("\n"), 3)
+
+	def test_iter_lines(self):
+		""" Test streaming the lines of one response. """
+		self.left.sendall(b" 1: a\n 2: b\nDONE\nOK 7\n")
+		lines = list(self.reader.iter_lines())
+		self.assertEqual(lines, [" 1: a\n", " 2: b\n", "DONE\n"])
+		self.assertEqual(self.reader.read_response(), "OK 7\n")
+
+	def test_deadline(self):
+		""" Test reading and writing a non-blocking socket by a deadline. """
+		self.right.setblocking(0)
+		self.left.sendall(b"OK")
+		self.assertRaises(ActuatorTimeout, self.reader.read_response,
+						  time.time() + 0.02)
+		self.left.sendall(b" 1\n")
+		self.assertEqual(self.reader.read_response(time.time() + 1), "OK 1\n")
+		#Nobody reads the other end, so the socket buffers fill up
+		self.assertRaises(ActuatorTimeout, send_all, self.right,
+						  b"x" * (1 << 24), time.time() + 0.02)
+
+	def test_parse_params(self):
+		""" Test parameter parsing with values and bare flags. """
+		self.assertEqual(parse_params(" -blockIP 10.0.0.0/8 -linkdrop -timeout 5"),
+						 {"blockIP": "10.0.0.0/8", "linkdrop": True,
+						  "timeout": "5"})
+
+	def test_parse_info_lines(self):
+		""" Test INFO parsing into records, with rules and expiry. """
+		lines = [" 12: BLOCK -blockIP 10.0.0.1 -timeout 30; expires in 25 "
+				 "seconds\n", "    rule 1\n", "    rule 2\n",
+				 " 13: DENY -IP1 10.0.0.2; never\n",
+				 " 14: QUARANTINE -quarantinedIP 10.0.0.3 -notifier 10.0.0.4; "
+				 "expires 2030-01-02 03:04:05\n", "DONE\n"]
+		records = list(parse_info_lines(iter(lines), rules=True, now=1000.0))
+		self.assertEqual([r.id for r in records], [12, 13, 14])
+		self.assertEqual(records[0].directive, "BLOCK")
+		self.assertEqual(records[0].params, {"blockIP": "10.0.0.1",
+											 "timeout": "30"})
+		self.assertEqual(records[0].expires, 1025.0)
+		self.assertEqual(records[0].rules, ["rule 1", "rule 2"])
+		self.assertEqual(records[1].expires, None)
+		self.assertEqual(records[1].rules, [])
+		self.assertEqual(records[2].expires_datetime.year, 2030)
+
+	def test_parse_info_lines_error(self):
+		""" Test that an ERROR response raises. """
+		self.assertRaises(Exception, list,
+						  parse_info_lines(iter(["ERROR no such id\n"])))
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,361 @@
+#!/usr/bin/python
+# ActuatorProxy.py - Share a few OF-Actuator sessions among many processes
+# Works with Python 2.7 and 3
+
+"""
+Local proxy daemon that lets many processes (e.g. a multiprocess pool of
+responders) share a small number of actuator connections. Each process
+connecting to the actuator directly is a separate directive source; through
+the proxy the actuator only ever sees the proxy's connections:
+
+	python ActuatorProxy.py /run/ofactuator.sock [--actuator HOST:PORT]
+		[--connections 2] [--quantum 64] [--deadline SECONDS]
+
+Clients connect to the Unix domain socket and speak the actuator's own line
+protocol, so any ActuatorWrapper can use it by passing
+unix_socket="/run/ofactuator.sock" instead of an address. QUIT closes only
+the client's connection.
+
+Every upstream connection is served by one thread with its own
+ActuatorWrapper (so reconnects and deadlines work as usual). Clients with
+directives waiting are served round-robin: a thread takes up to quantum
+directives from the next client in turn and pipelines them upstream in one
+write, so a client streaming a large pipeline cannot starve the others. A
+client is served by one thread at a time, which keeps its replies in the
+order it sent its directives. At most max_queued directives of a client wait
+in the proxy; reading from a client that sends more pauses until there is
+room.
+
+If an upstream connection breaks, or sending a batch fails in any other
+way, directives of the batch that were not answered get an
+"ERROR Proxy: ..." reply and the thread goes on serving; like
+ConnectionLost, a BLOCK answered that way may still have been applied.
+"""
+
+import argparse
+import collections
+import os
+import socket
+import sys
+import threading
+import time
+
+try:
+	import SocketServer as socketserver
+except ImportError:
+	import socketserver
+
+from ActuatorWrapper import ActuatorWrapper
+
+class _Client(object):
+	""" Directives a connected process is waiting on """
+	__slots__ = ("sock", "lines", "busy", "ready", "dead")
+
+	def __init__(self, sock):
+		self.sock = sock
+		self.lines = collections.deque()
+		#Being served by a thread
+		self.busy = False
+		#In the proxy's round-robin queue
+		self.ready = False
+		#Its connection broke; drop its directives
+		self.dead = False
+
+def _directive_line(raw):
+	""" Native, stripped ASCII line from the bytes a client sent """
+	line = raw.decode("ascii", "replace").strip().encode("ascii", "replace")
+	return line if str is bytes else line.decode("ascii")
+
+class _Handler(socketserver.StreamRequestHandler):
+	""" One client process """
+
+	def setup(self):
+		socketserver.StreamRequestHandler.setup(self)
+		self.client = _Client(self.request)
+		self.server.proxy._connected(self.client)
+
+	def finish(self):
+		self.server.proxy._disconnected(self.client)
+		socketserver.StreamRequestHandler.finish(self)
+
+	def handle(self):
+		proxy = self.server.proxy
+		while 1:
+			try:
+				raw = self.rfile.readline()
+			except socket.error:
+				return
+			if not raw:
+				break
+			line = _directive_line(raw)
+			if not line:
+				continue
+			if line.split(" ", 1)[0].upper() == "QUIT":
+				break
+			if not proxy._enqueue(self.client, line):
+				return
+		#Answer what the client already sent before closing its connection
+		proxy._wait_idle(self.client)
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+	daemon_threads = True
+
+class ActuatorProxy(object):
+	""" Unix domain socket proxy multiplexing clients onto the actuator """
+
+	def __init__(self, path, server_ip="127.0.0.1", server_port=26795,
+				 connections=2, quantum=64, max_queued=1024, **options):
+		"""
+		ARGUMENTS:
+			o  path: File name of the Unix domain socket to listen on
+			o  server_ip, server_port: Actuator address
+			o  connections: Number of upstream actuator connections
+			o  quantum: Most directives of one client sent in a row before
+				the next client waiting gets its turn
+			o  max_queued: Most directives of one client waiting in the proxy
+			o  options: ActuatorWrapper keyword arguments for the upstream
+				connections, e.g. deadline or metrics
+		"""
+		if connections < 1 or quantum < 1 or max_queued < 1:
+			raise ValueError(("connections, quantum and max_queued must be "
+							  "at least 1"))
+		self.path = path
+		self._server_ip = server_ip
+		self._server_port = server_port
+		self._connections = connections
+		self.quantum = quantum
+		self.max_queued = max_queued
+		self._options = options
+		self._cond = threading.Condition()
+		#Clients with directives waiting and no thread serving them
+		self._ready = collections.deque()
+		self._clients = set()
+		self._stopping = False
+		self._stats = {"accepted": 0, "directives": 0, "batches": 0,
+					   "errors": 0}
+		self._wrappers = []
+		self._workers = []
+		self._server = None
+		self._thread = None
+
+	def start(self):
+		""" Connect upstream and start serving in background threads """
+		self._remove_stale_socket()
+		self._stopping = False
+		self._wrappers = [ActuatorWrapper(self._server_ip, self._server_port,
+										  **self._options)
+						  for i in range(self._connections)]
+		self._server = _Server(self.path, _Handler)
+		self._server.proxy = self
+		self._workers = []
+		for wrapper in self._wrappers:
+			worker = threading.Thread(target=self._work, args=(wrapper,))
+			worker.daemon = True
+			worker.start()
+			self._workers.append(worker)
+		#Short poll interval so stop() returns quickly
+		self._thread = threading.Thread(target=self._server.serve_forever,
+										args=(0.05,))
+		self._thread.daemon = True
+		self._thread.start()
+		return self
+
+	def _remove_stale_socket(self):
+		"""
+		Remove a socket file left behind by a proxy that is no longer
+		running. Raises socket.error if one is still listening on it
+		"""
+		if not os.path.exists(self.path):
+			return
+		probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		try:
+			probe.connect(self.path)
+		except socket.error:
+			os.unlink(self.path)
+			return
+		finally:
+			probe.close()
+		raise socket.error("A proxy is already listening on " + self.path)
+
+	def stop(self):
+		"""
+		Stop accepting clients, drop the connected ones and close the
+		upstream connections
+		"""
+		if self._server is None:
+			return
+		with self._cond:
+			self._stopping = True
+			clients = list(self._clients)
+			self._cond.notify_all()
+		self._server.shutdown()
+		self._server.server_close()
+		for client in clients:
+			try:
+				client.sock.shutdown(socket.SHUT_RDWR)
+			except socket.error:
+				pass
+		for worker in self._workers:
+			worker.join()
+		for wrapper in self._wrappers:
+			wrapper.quit()
+		try:
+			os.unlink(self.path)
+		except OSError:
+			pass
+		self._server = None
+
+	def __enter__(self):
+		return self.start()
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.stop()
+
+	def stats(self):
+		"""
+		RETURNS:
+			@rtype: Dictionary
+			@return: clients (connected now), accepted (in total),
+				directives and batches sent upstream, errors (directives
+				answered by the proxy because the upstream failed), queued
+				(directives waiting) and upstream (connections)
+		"""
+		with self._cond:
+			stats = dict(self._stats)
+			stats["clients"] = len(self._clients)
+			stats["queued"] = sum(len(client.lines)
+								  for client in self._clients)
+		stats["upstream"] = len(self._wrappers)
+		return stats
+
+	def _connected(self, client):
+		with self._cond:
+			self._clients.add(client)
+			self._stats["accepted"] += 1
+
+	def _disconnected(self, client):
+		with self._cond:
+			self._clients.discard(client)
+			client.dead = True
+			client.lines.clear()
+
+	def _enqueue(self, client, line):
+		"""
+		Queue a directive of client, waiting while it has max_queued
+		directives waiting already. False if the client or proxy is gone
+		"""
+		with self._cond:
+			while (len(client.lines) >= self.max_queued and
+				   not (client.dead or self._stopping)):
+				self._cond.wait()
+			if client.dead or self._stopping:
+				return False
+			client.lines.append(line)
+			if not client.busy and not client.ready:
+				client.ready = True
+				self._ready.append(client)
+				self._cond.notify_all()
+			return True
+
+	def _wait_idle(self, client):
+		""" Wait until every directive of client has been answered """
+		with self._cond:
+			while ((client.lines or client.busy) and
+				   not (client.dead or self._stopping)):
+				self._cond.wait()
+
+	def _next_batch(self):
+		"""
+		Take up to quantum directives of the next client waiting, marking it
+		busy. None once the proxy is stopping
+		"""
+		with self._cond:
+			while not self._ready and not self._stopping:
+				self._cond.wait()
+			if self._stopping:
+				return None
+			client = self._ready.popleft()
+			client.ready = False
+			client.busy = True
+			count = min(self.quantum, len(client.lines))
+			lines = [client.lines.popleft() for i in range(count)]
+			#Room for the client's reader
+			self._cond.notify_all()
+			return client, lines
+
+	def _work(self, wrapper):
+		""" Serve clients on one upstream connection """
+		while 1:
+			batch = self._next_batch()
+			if batch is None:
+				return
+			client, lines = batch
+			responses = []
+			errors = 0
+			try:
+				wrapper._send_batch(lines, responses=responses)
+			except Exception as e:
+				if not isinstance(e, (socket.error, ValueError)):
+					#Failed mid-batch: replies may still be on the way, so
+					#the next batch starts on a new connection
+					with wrapper._lock:
+						wrapper._close_conn()
+				error = ("ERROR Proxy: " +
+						 " ".join(str(e).split()) + "\n")
+				errors = len(lines) - len(responses)
+				responses.extend([error] * errors)
+			#Counted before replying, so a client sees its directives in stats
+			with self._cond:
+				self._stats["directives"] += len(lines)
+				self._stats["batches"] += 1
+				self._stats["errors"] += errors
+			try:
+				client.sock.sendall("".join(responses).encode("ascii"))
+			except socket.error:
+				client.dead = True
+			with self._cond:
+				client.busy = False
+				if client.dead:
+					client.lines.clear()
+				elif client.lines and not client.ready:
+					client.ready = True
+					self._ready.append(client)
+				self._cond.notify_all()
+
+def _address(text):
+	host, sep, port = text.rpartition(":")
+	if not sep:
+		raise argparse.ArgumentTypeError("Expected HOST:PORT")
+	return host, int(port)
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description=__doc__,
+		formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("path", help="Unix domain socket to listen on")
+	parser.add_argument("--actuator", type=_address,
+						default=("127.0.0.1", 26795))
+	parser.add_argument("--connections", type=int, default=2,
+						help="Upstream actuator connections")
+	parser.add_argument("--quantum", type=int, default=64,
+						help="Directives of one client sent per turn")
+	parser.add_argument("--max-queued", type=int, default=1024)
+	parser.add_argument("--deadline", type=float,
+						help="Seconds an upstream batch may take")
+	args = parser.parse_args(argv)
+
+	proxy = ActuatorProxy(args.path, args.actuator[0], args.actuator[1],
+						  args.connections, args.quantum, args.max_queued,
+						  deadline=args.deadline)
+	proxy.start()
+	sys.stderr.write("Proxying %s to %s:%d over %d connections\n" %
+					 ((args.path,) + args.actuator + (args.connections,)))
+	try:
+		while 1:
+			time.sleep(3600)
+	except KeyboardInterrupt:
+		pass
+	finally:
+		proxy.stop()
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,130 @@
+#!/usr/bin/python
+# ActuatorProxyTest.py - Test for the multiplexing actuator proxy
+# Works with Python 2.7 and 3
+
+"""
+Tests many wrappers sharing the proxy's connections to the simulated
+actuator. No actuator needed.
+"""
+
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import unittest
+
+from ActuatorMetrics import ActuatorMetrics
+from ActuatorProxy import ActuatorProxy
+from ActuatorWrapper import ActuatorWrapper
+from SimulatedActuator import SimulatedActuator
+
+class ActuatorProxyTest(unittest.TestCase):
+
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self.path = os.path.join(self.directory, "actuator.sock")
+		self.actuator = SimulatedActuator().start()
+
+	def tearDown(self):
+		self.actuator.stop()
+		shutil.rmtree(self.directory)
+
+	def proxy(self, **kwargs):
+		return ActuatorProxy(self.path, *self.actuator.address, **kwargs)
+
+	def test_many_clients(self):
+		""" Test that many clients share two actuator connections. """
+		d_ids = []
+		errors = []
+		def worker(n):
+			try:
+				wrapper = ActuatorWrapper(unix_socket=self.path)
+				with wrapper.pipeline() as pipe:
+					for i in range(20):
+						pipe.block(blockIP="10.%d.0.%d" % (n, i))
+				for i in range(5):
+					d_ids.append(wrapper.deny(IP1="10.%d.1.%d" % (n, i)))
+				d_ids.extend(pipe.results)
+				self.assertIn("DONE", wrapper.info())
+				wrapper.quit()
+			except Exception as e:
+				errors.append(e)
+		with self.proxy(connections=2, quantum=4) as proxy:
+			threads = [threading.Thread(target=worker, args=(n,))
+					   for n in range(8)]
+			for thread in threads:
+				thread.start()
+			for thread in threads:
+				thread.join()
+			self.assertEqual(errors, [])
+			self.assertEqual(len(set(d_ids)), 200)
+			self.assertEqual(len(self.actuator._server.connections), 2)
+			stats = proxy.stats()
+			self.assertEqual((stats["accepted"], stats["directives"],
+							  stats["upstream"]), (8, 208, 2))
+		self.assertFalse(os.path.exists(self.path))
+
+	def test_fairness(self):
+		""" Test that a long pipeline does not hold up another client. """
+		self.actuator.latency = 0.001
+		with self.proxy(connections=1, quantum=8):
+			bulk = ActuatorWrapper(unix_socket=self.path)
+			other = ActuatorWrapper(unix_socket=self.path)
+			def stream():
+				with bulk.pipeline() as pipe:
+					for i in range(300):
+						pipe.block(blockIP="10.2.%d.%d" % (i // 256, i % 256))
+			start = time.time()
+			thread = threading.Thread(target=stream)
+			thread.start()
+			time.sleep(0.05)
+			queried = time.time()
+			self.assertIn("DONE", other.switches())
+			answered = time.time()
+			thread.join()
+			finished = time.time()
+			self.assertTrue(answered - queried < 0.1)
+			self.assertTrue(finished - start > 0.2)
+			bulk.quit()
+			other.quit()
+
+	def test_errors(self):
+		""" Test ERROR replies, a broken upstream and QUIT. """
+		with self.proxy(connections=1):
+			first = ActuatorWrapper(unix_socket=self.path)
+			second = ActuatorWrapper(unix_socket=self.path,
+									 auto_reconnect=False)
+			self.assertRaises(Exception, first.adjust, id=999, timeout=5)
+			self.actuator.inject("BLOCK", None)
+			self.assertRaises(Exception, first.block, blockIP="10.3.0.1")
+			self.assertIs(type(first.block(blockIP="10.3.0.1")), int)
+			#QUIT only ends the client's own connection
+			first.quit()
+			self.assertIn("DONE", second.switches())
+			self.assertRaises(socket.error, self.proxy().start)
+			second.quit()
+
+
+	def test_failed_batch(self):
+		""" Test that an unexpected error only fails its own batch. """
+		def hook(directive, line, response, seconds):
+			if line == "BLOCK -blockIP 10.5.0.2":
+				raise RuntimeError("hook failed")
+		metrics = ActuatorMetrics()
+		metrics.add_hook(post_receive=hook)
+		with self.proxy(connections=1, metrics=metrics) as proxy:
+			wrapper = ActuatorWrapper(unix_socket=self.path, deadline=2)
+			self.assertIs(type(wrapper.block(blockIP="10.5.0.1")), int)
+			try:
+				wrapper.block(blockIP="10.5.0.2")
+				self.fail("Expected an ERROR reply")
+			except Exception as e:
+				self.assertIn("ERROR Proxy: hook failed", str(e))
+			self.assertIs(type(wrapper.block(blockIP="10.5.0.3")), int)
+			self.assertEqual(proxy.stats()["errors"], 1)
+			wrapper.quit()
+
+if __name__ == '__main__':
+	unittest.main()
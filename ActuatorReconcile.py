@@ -0,0 +1,179 @@
+#!/usr/bin/python
+# ActuatorReconcile.py - Bring the active directives to a desired set
+# Works with Python 2.7 and 3
+
+"""
+Computes the smallest set of directives that turns the directives active on
+the actuator into a desired set, instead of cancelling everything and
+issuing it all again. Used by ActuatorWrapper.reconcile():
+
+	desired = [("BLOCK", {"blockIP": ip, "timeout": 3600}) for ip in blocklist]
+	plan = wrapper.reconcile(desired)
+	print(len(plan), plan.errors)
+
+Desired and active directives are paired by what they do, using the same
+canonical form as dedupe (see canonical_key() in ActuatorCache.py): BLOCK
+pairs with the DENY it translates to, addresses and numbers are compared
+normalized, and parameters the actuator fills in from its defaults do not
+prevent a match. A pair whose timeout differs gets an ADJUST; unpaired
+desired directives are created and, with prune, unpaired active ones are
+cancelled. The creates go first, so nothing that stays desired is ever
+unprotected.
+"""
+
+from ActuatorCache import canonical_key, same_directive
+from ActuatorProtocol import DirectiveRecord
+from DirectiveSchema import DIRECTIVES, ID
+
+#Parameters deciding which traffic a directive matches (under their DENY
+#names); directives pair only if these are all equal
+_CRITERIA = frozenset(["IP1", "IP2", "IP1port", "IP2port", "proto",
+					   "quarantinedIP", "notifier", "remapIP", "remapPort",
+					   "IP", "linkAddr", "swPort", "all"])
+
+def _criteria_key(directive, params):
+	""" canonical_key() restricted to the matching criteria """
+	directive, items = canonical_key(directive, params)
+	return directive, tuple(item for item in items if item[0] in _CRITERIA)
+
+def _timeout(params):
+	""" Normalized timeout parameter, None if not given """
+	timeout = params.get("timeout")
+	if timeout is None:
+		return None
+	return str(int(float(timeout)))
+
+def _desired_entries(desired):
+	"""
+	Validate the desired directives, given as (directive, params) pairs or
+	records with directive and params, and return them as (DIRECTIVE,
+	params) pairs. Raises ValueError before anything is sent
+	"""
+	entries = []
+	for entry in desired:
+		if isinstance(entry, tuple):
+			directive, params = entry
+		else:
+			directive, params = entry.directive, entry.params
+		spec = DIRECTIVES.get(str(directive).lower())
+		if spec is None or spec.reply != ID:
+			raise ValueError(("Only BLOCK, DENY, REDIRECT, QUARANTINE and "
+							  "UNPLUG can be reconciled, not " +
+							  str(directive)))
+		params = dict((str(k), v) for k, v in params.items())
+		spec.build(params)
+		entries.append((spec.name, params))
+	return entries
+
+class ReconcilePlan(object):
+	"""
+	Directives needed to turn the active directives into the desired ones,
+	and after apply() their results.
+
+	create: (directive, params) of the desired directives that are missing
+	adjust: (id, timeout) of active directives whose timeout differs
+	cancel: IDs of active directives that are not desired
+	unchanged: Number of desired directives already active as wanted
+	results: After apply(), one entry per directive sent, in the order
+		create, adjust, cancel: the new ID (or True for ADJUST and CANCEL)
+		on success, otherwise the Exception describing the failure
+	"""
+
+	def __init__(self, desired, current, prune=True):
+		"""
+		ARGUMENTS:
+			o  desired: (directive, params) pairs or records with directive
+				and params, e.g. from a policy file
+			o  current: DirectiveRecords of the active directives
+			o  prune: Cancel active directives that are not desired
+		"""
+		desired = _desired_entries(desired)
+		candidates = {}
+		for record in current:
+			if record.directive.lower() not in DIRECTIVES:
+				continue
+			key = _criteria_key(record.directive, record.params)
+			candidates.setdefault(key, []).append(record)
+		self.create = []
+		self.adjust = []
+		self.unchanged = 0
+		paired = set()
+		seen = set()
+		for directive, params in desired:
+			#The same directive asked for twice
+			key = canonical_key(directive, params)
+			if key in seen:
+				continue
+			seen.add(key)
+			wanted = DirectiveRecord(None, directive, params)
+			for record in candidates.get(_criteria_key(directive, params), ()):
+				if record.id not in paired and same_directive(wanted, record):
+					break
+			else:
+				self.create.append((directive, params))
+				continue
+			paired.add(record.id)
+			timeout = _timeout(params)
+			if timeout is None or timeout == _timeout(record.params):
+				self.unchanged += 1
+			elif timeout == "0" and record.expires is None:
+				#Never expires, as asked, though INFO lists no timeout
+				self.unchanged += 1
+			else:
+				self.adjust.append((record.id, timeout))
+		self.cancel = []
+		if prune:
+			self.cancel = sorted(d_id for records in candidates.values()
+								 for d_id in (record.id for record in records)
+								 if d_id not in paired)
+		self.results = []
+
+	def __len__(self):
+		""" Number of directives the plan sends """
+		return len(self.create) + len(self.adjust) + len(self.cancel)
+
+	def lines(self):
+		"""
+		RETURNS:
+			@rtype: List
+			@return: Directive lines the plan sends, in order
+		"""
+		lines = [DIRECTIVES[directive.lower()].build(params)
+				 for directive, params in self.create]
+		lines.extend(DIRECTIVES["adjust"].build({"id": d_id,
+												 "timeout": timeout})
+					 for d_id, timeout in self.adjust)
+		lines.extend(DIRECTIVES["cancel"].build({"id": d_id})
+					 for d_id in self.cancel)
+		return lines
+
+	def apply(self, wrapper, deadline=None):
+		"""
+		Send the plan through wrapper as one pipeline. A directive refused
+		before sending (e.g. cancelling a stale ID) or rejected by the
+		actuator gets its Exception in results without failing the others
+		"""
+		calls = [(directive.lower(), params)
+				 for directive, params in self.create]
+		calls.extend(("adjust", {"id": d_id, "timeout": timeout})
+					 for d_id, timeout in self.adjust)
+		calls.extend(("cancel", {"id": d_id}) for d_id in self.cancel)
+		refused = []
+		with wrapper.pipeline(deadline) as pipe:
+			for name, params in calls:
+				try:
+					getattr(pipe, name)(**params)
+					refused.append(None)
+				except ValueError as e:
+					refused.append(e)
+		replies = iter(pipe.results)
+		self.results = [next(replies) if error is None else error
+						for error in refused]
+		return self.results
+
+	@property
+	def errors(self):
+		""" (directive line, Exception) for every directive that failed """
+		return [(line, result) for line, result in
+				zip(self.lines(), self.results)
+				if isinstance(result, Exception)]
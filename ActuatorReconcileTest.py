@@ -0,0 +1,101 @@
+#!/usr/bin/python
+# ActuatorReconcileTest.py - Test for desired-state reconciliation
+# Works with Python 2.7 and 3
+
+"""
+Tests planning the directive diff on its own, and reconciling a policy
+against the simulated actuator. No actuator needed.
+"""
+
+import unittest
+
+from ActuatorProtocol import DirectiveRecord
+from ActuatorReconcile import ReconcilePlan
+from ActuatorWrapper import ActuatorWrapper
+from SimulatedActuator import SimulatedActuator
+
+class ReconcilePlanTest(unittest.TestCase):
+
+	def setUp(self):
+		self.current = [
+			DirectiveRecord(1, "DENY", {"IP1": "10.0.0.1", "timeout": "60"},
+							expires=1060.0),
+			DirectiveRecord(2, "DENY", {"IP1": "10.0.0.2", "IP2port": "80",
+										"priority": "100"}),
+			DirectiveRecord(3, "QUARANTINE", {"quarantinedIP": "10.0.0.3",
+											  "notifier": "10.0.0.9"}),
+			DirectiveRecord(4, "DENY", {"IP1": "10.0.0.4/32"}),
+			DirectiveRecord(5, "DENY", {"IP1": "10.0.0.4"}),
+		]
+
+	def test_diff(self):
+		""" Test pairing desired and active directives. """
+		plan = ReconcilePlan([
+			("BLOCK", {"blockIP": "10.0.0.1", "timeout": 600}),
+			#Not the port 80 DENY
+			("block", {"blockIP": "10.0.0.2"}),
+			("DENY", {"IP1": "10.0.0.2", "IP2port": 80}),
+			("QUARANTINE", {"quarantinedIP": "10.0.0.3",
+							"notifier": "10.0.0.9", "timeout": 0}),
+			("BLOCK", {"blockIP": "10.0.0.4"}),
+			("DENY", {"IP1": "10.0.0.4/32"}),
+		], self.current)
+		self.assertEqual(plan.create, [("BLOCK", {"blockIP": "10.0.0.2"})])
+		self.assertEqual(plan.adjust, [(1, "600")])
+		self.assertEqual(plan.cancel, [5])
+		self.assertEqual(plan.unchanged, 3)
+		self.assertEqual(plan.lines(), ["BLOCK -blockIP 10.0.0.2",
+										"ADJUST -id 1 -timeout 600",
+										"CANCEL -id 5"])
+		self.assertEqual(len(plan), 3)
+		self.assertEqual(len(ReconcilePlan([], self.current, prune=False)), 0)
+
+	def test_invalid(self):
+		""" Test that bad desired directives raise ValueError. """
+		self.assertRaises(ValueError, ReconcilePlan, [("INFO", {})], [])
+		self.assertRaises(ValueError, ReconcilePlan,
+						  [("BLOCK", {"IP1": "10.0.0.1"})], [])
+		self.assertRaises(ValueError, ReconcilePlan, [("PASS", {})], [])
+
+class ReconcileTest(unittest.TestCase):
+
+	def setUp(self):
+		self.actuator = SimulatedActuator().start()
+
+	def tearDown(self):
+		self.actuator.stop()
+
+	def policy(self, first, last, timeout=3600):
+		return [("BLOCK", {"blockIP": "10.1.%d.%d" % (n // 256, n % 256),
+						   "timeout": timeout}) for n in range(first, last)]
+
+	def test_reconcile(self):
+		""" Test that a small policy change sends a small diff. """
+		wrapper = ActuatorWrapper(*self.actuator.address, track_state=True)
+		foreign = wrapper.quarantine(quarantinedIP="10.2.0.1",
+									 notifier="10.0.0.9")
+		plan = wrapper.reconcile(self.policy(0, 2000))
+		self.assertEqual((len(plan.create), plan.cancel), (2000, [foreign]))
+		self.assertEqual(plan.errors, [])
+		before = self.actuator.stats()
+		policy = self.policy(5, 2005)
+		policy[:3] = self.policy(5, 8, timeout=60)
+		plan = wrapper.reconcile(policy)
+		sent = self.actuator.stats()
+		self.assertEqual((len(plan.create), len(plan.adjust), len(plan.cancel),
+						  plan.unchanged), (5, 3, 5, 1992))
+		self.assertEqual([sent[d] - before.get(d, 0) for d in
+						  ("BLOCK", "ADJUST", "CANCEL")], [5, 3, 5])
+		self.assertEqual(len(self.actuator.active_ids()), 2000)
+		self.assertTrue(all(type(result) in (int, bool)
+							for result in plan.results))
+		#Applied already
+		self.assertEqual(len(wrapper.reconcile(policy)), 0)
+		plan = wrapper.reconcile([], dry_run=True)
+		self.assertEqual((len(plan.cancel), plan.results), (2000, []))
+		self.assertEqual(len(self.actuator.active_ids()), 2000)
+		wrapper.quit()
+
+
+if __name__ == '__main__':
+	unittest.main()
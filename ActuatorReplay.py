@@ -0,0 +1,344 @@
+#!/usr/bin/python
+# ActuatorReplay.py - Record directive sessions and replay them as load
+# Works with Python 2.7 and 3
+
+"""
+Records the directives wrappers send and replays a recording against an
+actuator, to size an actuator for the traffic of a real incident.
+
+Recording hooks into the wrapper's metrics (see ActuatorMetrics.py), so it
+costs nothing unless enabled:
+
+	recorder = SessionRecorder("incident.jsonl")
+	wrapper = ActuatorWrapper(<ACTUATOR_IP>, <ACTUATOR_PORT>,
+							  metrics=recorder.metrics)
+	...
+	recorder.close()
+
+Each exchange becomes one JSON line with t (monotonic send time in seconds
+since the recorder started), line (the directive line), latency (seconds to
+the response), result ("OK", "ERROR" or the exception type) and for
+directives creating a security directive its id.
+
+Replay sends the recorded lines again from concurrency connections:
+
+	python ActuatorReplay.py incident.jsonl [--actuator HOST:PORT |
+		--unix-socket PATH | --simulate] [--speed 10 | --speed max]
+		[--concurrency 8] [--deadline SECONDS] [--output report.json]
+
+Pacing is open-loop: every directive is due at its recorded time divided by
+speed whether or not earlier ones were answered, and its latency counts
+from when it was due, so a slow actuator shows as growing latency rather
+than as a slower replay. With --speed max the directives are sent as fast
+as the connections allow and latency counts from the send. IDs that
+CANCEL, ADJUST and INFO refer to are replaced by the IDs the recorded
+directives got in the replay; QUIT and SHUTDOWN are not replayed.
+"""
+
+import argparse
+import json
+import re
+import threading
+import time
+
+try:
+	import Queue as queue
+except ImportError:
+	import queue
+
+from ActuatorBenchmark import percentile, summarize
+from ActuatorMetrics import ActuatorMetrics
+from ActuatorWrapper import ActuatorWrapper
+from SimulatedActuator import SimulatedActuator
+
+try:
+	_string_types = basestring
+except NameError:
+	_string_types = str
+
+#Python 2 has no monotonic clock
+_clock = getattr(time, "monotonic", time.time)
+
+#Directives that end the session or the actuator rather than load it
+_NOT_REPLAYED = frozenset(["QUIT", "SHUTDOWN"])
+
+_ID_PARAM = re.compile(r"(-id )(\d+)")
+
+def _result(response):
+	""" Result field of a response text or exception """
+	if isinstance(response, Exception):
+		if type(response) is Exception and str(response).startswith("ERROR"):
+			return "ERROR"
+		return type(response).__name__
+	return "ERROR" if response.startswith("ERROR") else "OK"
+
+class SessionRecorder(object):
+	""" Writes every exchange of the wrappers using its metrics to a file """
+
+	def __init__(self, output, metrics=None):
+		"""
+		ARGUMENTS:
+			o  output: File name or open text file to write the JSON lines to
+			o  metrics: ActuatorMetrics the wrappers already use; a new one
+				is created otherwise. Pass recorder.metrics to the wrappers
+		"""
+		if isinstance(output, _string_types):
+			self._file = open(output, "w")
+			self._owned = True
+		else:
+			self._file = output
+			self._owned = False
+		self.metrics = metrics if metrics is not None else ActuatorMetrics()
+		self.count = 0
+		self._lock = threading.Lock()
+		self._start = _clock()
+		self.metrics.add_hook(post_receive=self._record)
+
+	def _record(self, directive, line, response, seconds):
+		record = {"t": round(_clock() - seconds - self._start, 6),
+				  "line": line, "latency": round(seconds, 6),
+				  "result": _result(response)}
+		if record["result"] == "OK":
+			d_id = re.match(r"OK (\d+)", response)
+			if d_id:
+				record["id"] = int(d_id.group(1))
+		text = json.dumps(record, sort_keys=True) + "\n"
+		with self._lock:
+			#Metrics hooks cannot be removed, so a closed recorder stays quiet
+			if self._file is None:
+				return
+			self._file.write(text)
+			self.count += 1
+
+	def close(self):
+		""" Stop recording and close the file if the recorder opened it """
+		with self._lock:
+			if self._file is None:
+				return
+			if self._owned:
+				self._file.close()
+			else:
+				self._file.flush()
+			self._file = None
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close()
+
+def load_session(source):
+	"""
+	ARGUMENTS:
+		o  source: File name or open file of a recording
+	RETURNS:
+		@rtype: List
+		@return: Recorded exchanges as dictionaries, in order of send time.
+			Raises ValueError on a malformed line
+	"""
+	if isinstance(source, _string_types):
+		with open(source) as recording:
+			return load_session(recording)
+	records = []
+	for number, text in enumerate(source, 1):
+		if not text.strip():
+			continue
+		try:
+			record = json.loads(text)
+			record["t"] = float(record["t"])
+			record["line"] = str(record["line"])
+		except (ValueError, KeyError, TypeError):
+			raise ValueError("Malformed recording line %d: %s" %
+							 (number, text.strip()))
+		records.append(record)
+	#Stable, so directives pipelined together keep their order
+	records.sort(key=lambda record: record["t"])
+	return records
+
+class _Replay(object):
+	""" State shared by the threads of one replay """
+
+	def __init__(self, records, deadline):
+		self.deadline = deadline
+		self.lines = []
+		#Recorded IDs of directives created by a replayed directive
+		self.creators = set()
+		for record in records:
+			if record["line"].split(" ", 1)[0].upper() in _NOT_REPLAYED:
+				continue
+			if "id" in record:
+				self.creators.add(record["id"])
+			self.lines.append(record)
+		self.jobs = queue.Queue()
+		self._cond = threading.Condition()
+		#Recorded ID -> ID in the replay, or None if not created
+		self._created = {}
+		self.latencies = []
+		self.service = []
+		self.errors = {}
+
+	def _remap(self, line):
+		"""
+		Replace a recorded ID by the one of the replay, waiting for the
+		directive creating it to be answered
+		"""
+		match = _ID_PARAM.search(line)
+		if match is None or int(match.group(2)) not in self.creators:
+			return line
+		recorded = int(match.group(2))
+		with self._cond:
+			while recorded not in self._created:
+				self._cond.wait()
+			d_id = self._created[recorded]
+		if d_id is None:
+			raise ValueError("Directive %d was not created in the replay" %
+							 recorded)
+		return line[:match.start(2)] + str(d_id) + line[match.end(2):]
+
+	def work(self, wrapper):
+		""" Send the directives taken from jobs until a None arrives """
+		while 1:
+			job = self.jobs.get()
+			if job is None:
+				return
+			due, record = job
+			sent = _clock()
+			try:
+				response = wrapper._send_command(self._remap(record["line"]),
+												 self.deadline)
+			except Exception as e:
+				response = e
+			answered = _clock()
+			result = _result(response)
+			with self._cond:
+				self.latencies.append(answered - (sent if due is None else due))
+				self.service.append(answered - sent)
+				if result != "OK":
+					self.errors[result] = self.errors.get(result, 0) + 1
+				if "id" in record:
+					d_id = re.match(r"OK (\d+)", str(response))
+					self._created[record["id"]] = (int(d_id.group(1)) if d_id
+												   else None)
+					self._cond.notify_all()
+
+def replay_session(records, server_ip="127.0.0.1", server_port=26795,
+				   speed=1.0, concurrency=8, deadline=None, **options):
+	"""
+	ARGUMENTS:
+		o  records: Recorded exchanges, see load_session()
+		o  server_ip, server_port: Actuator address
+		o  speed: Factor the recording is sped up by, e.g. 10 for 10x.
+			None sends as fast as possible
+		o  concurrency: Number of connections sending directives
+		o  deadline: Seconds each directive may take
+		o  options: ActuatorWrapper keyword arguments, e.g. unix_socket
+	RETURNS:
+		@rtype: Dictionary
+		@return: summarize() of the latencies (from when each directive was
+			due) with directives, skipped, elapsed, offered_per_s (rate the
+			recording asked for), service_p50_ms and service_p99_ms (from
+			the send) and errors (result -> count)
+	"""
+	if speed is not None and speed <= 0:
+		raise ValueError("speed must be positive")
+	if concurrency < 1:
+		raise ValueError("concurrency must be at least 1")
+	state = _Replay(records, deadline)
+	wrappers = [ActuatorWrapper(server_ip, server_port, **options)
+				for i in range(concurrency)]
+	workers = [threading.Thread(target=state.work, args=(wrapper,))
+			   for wrapper in wrappers]
+	for worker in workers:
+		worker.daemon = True
+		worker.start()
+	first = state.lines[0]["t"] if state.lines else 0.0
+	start = _clock()
+	for record in state.lines:
+		due = None
+		if speed is not None:
+			due = start + (record["t"] - first) / speed
+			wait = due - _clock()
+			if wait > 0:
+				time.sleep(wait)
+		state.jobs.put((due, record))
+	for worker in workers:
+		state.jobs.put(None)
+	for worker in workers:
+		worker.join()
+	elapsed = _clock() - start
+	for wrapper in wrappers:
+		wrapper.quit()
+
+	report = summarize(state.latencies, elapsed, len(state.lines))
+	span = state.lines[-1]["t"] - first if state.lines else 0.0
+	report["directives"] = len(state.lines)
+	report["skipped"] = len(records) - len(state.lines)
+	report["elapsed"] = elapsed
+	report["offered_per_s"] = None
+	if speed is not None and span > 0:
+		report["offered_per_s"] = len(state.lines) * speed / span
+	service = sorted(state.service)
+	report["service_p50_ms"] = percentile(service, 0.50) * 1000
+	report["service_p99_ms"] = percentile(service, 0.99) * 1000
+	report["errors"] = state.errors
+	return report
+
+def _address(text):
+	host, sep, port = text.rpartition(":")
+	if not sep:
+		raise argparse.ArgumentTypeError("Expected HOST:PORT")
+	return host, int(port)
+
+def _speed(text):
+	return None if text == "max" else float(text)
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description=__doc__,
+		formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("recording", help="JSON lines written by a recorder")
+	target = parser.add_mutually_exclusive_group()
+	target.add_argument("--actuator", type=_address,
+						default=("127.0.0.1", 26795))
+	target.add_argument("--unix-socket", help="ActuatorProxy socket")
+	target.add_argument("--simulate", action="store_true",
+						help="Replay against a local SimulatedActuator")
+	parser.add_argument("--rtt-ms", type=float, default=0.0,
+						help="Round-trip time of the simulated actuator")
+	parser.add_argument("--speed", type=_speed, default=1.0,
+						help="Speed-up factor, or max")
+	parser.add_argument("--concurrency", type=int, default=8)
+	parser.add_argument("--deadline", type=float,
+						help="Seconds each directive may take")
+	parser.add_argument("--output", help="Write the report to this JSON file")
+	args = parser.parse_args(argv)
+
+	records = load_session(args.recording)
+	actuator = None
+	address = args.actuator
+	options = {}
+	if args.simulate:
+		actuator = SimulatedActuator(rtt=args.rtt_ms / 1000.0).start()
+		address = actuator.address
+	elif args.unix_socket:
+		options["unix_socket"] = args.unix_socket
+	try:
+		report = replay_session(records, address[0], address[1], args.speed,
+								args.concurrency, args.deadline, **options)
+	finally:
+		if actuator is not None:
+			actuator.stop()
+	offered = report["offered_per_s"]
+	print("%d directives in %.2f s: %.0f/s achieved, %s offered" % (
+		  report["directives"], report["elapsed"], report["ops_per_s"],
+		  "max" if offered is None else "%.0f/s" % offered))
+	print("latency p50 %.2f ms  p90 %.2f ms  p99 %.2f ms  max %.2f ms" % (
+		  report["p50_ms"], report["p90_ms"], report["p99_ms"],
+		  report["max_ms"]))
+	print("errors %s" % (", ".join("%s %d" % item for item in
+						 sorted(report["errors"].items())) or "none"))
+	if args.output:
+		with open(args.output, "w") as output:
+			json.dump(report, output, indent=2, sort_keys=True)
+
+if __name__ == "__main__":
+	main()
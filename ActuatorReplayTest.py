@@ -0,0 +1,118 @@
+#!/usr/bin/python
+# ActuatorReplayTest.py - Test for session recording and replay
+# Works with Python 2.7 and 3
+
+"""
+Tests recording a session against the simulated actuator and replaying it
+against another one. No actuator needed.
+"""
+
+import io
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from ActuatorReplay import SessionRecorder, load_session, replay_session
+from ActuatorWrapper import ActuatorWrapper
+from SimulatedActuator import SimulatedActuator
+
+class ActuatorReplayTest(unittest.TestCase):
+
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self.path = os.path.join(self.directory, "session.jsonl")
+		self.actuator = SimulatedActuator().start()
+
+	def tearDown(self):
+		self.actuator.stop()
+		shutil.rmtree(self.directory)
+
+	def record(self):
+		""" Record a short session with pauses, a pipeline and an ERROR """
+		with SessionRecorder(self.path) as recorder:
+			wrapper = ActuatorWrapper(*self.actuator.address,
+									  metrics=recorder.metrics)
+			d_ids = [wrapper.block(blockIP="10.0.1.%d" % n) for n in range(5)]
+			time.sleep(0.1)
+			with wrapper.pipeline() as pipe:
+				for n in range(10):
+					pipe.deny(IP1="10.0.2.%d" % n)
+			wrapper.adjust(id=d_ids[0], timeout=60)
+			wrapper.cancel(id=d_ids[1])
+			time.sleep(0.1)
+			self.assertRaises(Exception, wrapper.cancel, id=999)
+			wrapper.quit()
+		return recorder
+
+	def test_record(self):
+		""" Test the recorded lines, times and results. """
+		recorder = self.record()
+		self.assertEqual(recorder.count, 19)
+		records = load_session(self.path)
+		self.assertEqual([r["line"] for r in records[:2]],
+						 ["BLOCK -blockIP 10.0.1.0", "BLOCK -blockIP 10.0.1.1"])
+		self.assertEqual(records[16]["line"], "CANCEL -id 2")
+		self.assertEqual([r["result"] for r in records[-2:]], ["ERROR", "OK"])
+		self.assertEqual([r.get("id") for r in records[:5]], [1, 2, 3, 4, 5])
+		self.assertTrue(records[5]["t"] - records[4]["t"] >= 0.09)
+		self.assertTrue(records[-1]["t"] - records[0]["t"] >= 0.19)
+		self.assertTrue(all(r["latency"] >= 0 for r in records))
+		#Closed recorders ignore later exchanges
+		wrapper = ActuatorWrapper(*self.actuator.address,
+								  metrics=recorder.metrics)
+		wrapper.block(blockIP="10.0.3.1")
+		self.assertEqual(len(load_session(self.path)), 19)
+		self.assertRaises(ValueError, load_session,
+						  io.StringIO(u"{\"line\": \"INFO\"}\n"))
+		#Unicode file names, e.g. from JSON configuration under Python 2
+		path = u"" + self.path
+		SessionRecorder(path).close()
+		self.assertEqual(load_session(path), [])
+
+	def test_replay(self):
+		""" Test replaying with remapped IDs, paced and at full speed. """
+		self.record()
+		records = load_session(self.path)
+		target = SimulatedActuator().start()
+		try:
+			#IDs in the replay differ from the recorded ones
+			ActuatorWrapper(*target.address).block(blockIP="10.9.0.1")
+			start = time.time()
+			report = replay_session(records, *target.address, speed=2,
+									concurrency=4)
+			self.assertTrue(time.time() - start >= 0.1)
+			self.assertEqual((report["directives"], report["skipped"]),
+							 (18, 1))
+			self.assertEqual(report["errors"], {"ERROR": 1})
+			self.assertEqual(target.stats()["CANCEL"], 2)
+			#The replayed directives plus the one before, less one cancelled
+			self.assertEqual(len(target.active_ids()), 15)
+			self.assertTrue(report["offered_per_s"] > 0)
+			for key in ("ops_per_s", "p50_ms", "p99_ms", "service_p50_ms"):
+				self.assertTrue(report[key] >= 0)
+			report = replay_session(records, *target.address, speed=None,
+									concurrency=2)
+			self.assertEqual(report["errors"], {"ERROR": 1})
+			self.assertIsNone(report["offered_per_s"])
+			self.assertEqual(len(target.active_ids()), 29)
+		finally:
+			target.stop()
+		self.assertRaises(ValueError, replay_session, records, speed=0)
+
+	def test_overload(self):
+		""" Test that latency counts from when a directive was due. """
+		self.actuator.latency = 0.01
+		records = [{"t": 0.0, "line": "BLOCK -blockIP 10.0.4.%d" % n}
+				   for n in range(20)]
+		report = replay_session(records, *self.actuator.address, speed=1,
+								concurrency=1)
+		#The last directive waited for the 19 before it
+		self.assertTrue(report["max_ms"] >= 190)
+		self.assertTrue(report["service_p99_ms"] < 100)
+		self.assertEqual(report["errors"], {})
+
+
+if __name__ == '__main__':
+	unittest.main()
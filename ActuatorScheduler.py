@@ -0,0 +1,510 @@
+#!/usr/bin/python
+# ActuatorScheduler.py - Admission control and rate limiting for directives
+# Works with Python 2.7 and 3
+
+"""
+Scheduler in front of a wrapper's directive methods, for bursts of
+directives larger than the actuator and the switch flow tables can absorb:
+
+	scheduler = DirectiveScheduler(wrapper, rate=500, burst=100).start()
+	ticket = scheduler.quarantine(quarantinedIP="10.0.0.5", notifier="10.0.0.9")
+	d_id = ticket.result(timeout=5)
+
+Directives are queued and sent by a dispatcher thread in pipelined batches,
+at most rate per second on average (token bucket holding up to burst
+tokens). The queue is ordered by urgency:
+
+	o  Directive type, through ranks (by default QUARANTINE and UNPLUG
+		first, then CANCEL, REDIRECT, DENY/BLOCK and ADJUST)
+	o  The directive's priority parameter, higher first
+	o  Submission order
+
+A directive submitted while an identical one is still queued (same
+canonical_key() apart from priority; for CANCEL and ADJUST the same ID) is
+coalesced into it: both tickets get the same result and the queued directive
+takes the more urgent place. An ADJUST coalesced into a queued one uses the
+newest timeout.
+
+Back-pressure: the queue holds at most max_queue directives. When it is full
+a more urgent directive sheds the least urgent queued one (its ticket fails
+with DirectiveShed); otherwise submit() raises SchedulerFull, or waits for
+room with block=True (the default of the directive methods is set when
+constructing the scheduler). Directives still queued after max_delay seconds are
+shed too, so queueing delay stays bounded. pressure() reports how full the
+queue is and the expected wait, for callers to slow down before that.
+"""
+
+import collections
+import heapq
+import itertools
+import threading
+import time
+
+from ActuatorCache import canonical_key
+from DirectiveSchema import ACK, DIRECTIVES, ID
+
+#Rank per directive type; lower ranks are sent first
+DEFAULT_RANKS = {"QUARANTINE": 0, "UNPLUG": 0, "CANCEL": 1, "REDIRECT": 2,
+				 "DENY": 3, "BLOCK": 3, "ADJUST": 4}
+
+class SchedulerFull(Exception):
+	""" The scheduler queue is full of directives at least as urgent """
+
+class DirectiveShed(Exception):
+	"""
+	A queued directive was dropped unsent, to make room for a more urgent
+	one or because it waited longer than max_delay
+	"""
+
+class TokenBucket(object):
+	""" Token bucket refilled at rate tokens per second, up to burst """
+
+	def __init__(self, rate, burst):
+		if rate <= 0 or burst < 1:
+			raise ValueError("rate must be positive and burst at least 1")
+		self.rate = float(rate)
+		self.burst = float(burst)
+		self._tokens = self.burst
+		self._updated = time.time()
+
+	def _refill(self, now):
+		elapsed = max(0.0, now - self._updated)
+		self._tokens = min(self.burst, self._tokens + elapsed * self.rate)
+		self._updated = now
+
+	def available(self, now=None):
+		""" Whole tokens available now """
+		self._refill(time.time() if now is None else now)
+		return int(self._tokens)
+
+	def take(self, count, now=None):
+		""" Take count tokens; the caller checked available() """
+		self._refill(time.time() if now is None else now)
+		self._tokens -= count
+
+	def wait_time(self, count=1, now=None):
+		""" Seconds until count tokens are available """
+		self._refill(time.time() if now is None else now)
+		return max(0.0, (count - self._tokens) / self.rate)
+
+class Ticket(object):
+	""" Result of a scheduled directive, set once it was sent or shed """
+
+	def __init__(self, directive):
+		self.directive = directive
+		self._event = threading.Event()
+		self._result = None
+		self._exception = None
+
+	def _set(self, result):
+		if isinstance(result, Exception):
+			self._exception = result
+		else:
+			self._result = result
+		self._event.set()
+
+	def done(self):
+		""" Whether the directive was sent (or shed) """
+		return self._event.is_set()
+
+	def result(self, timeout=None):
+		"""
+		Wait for the directive and return its result: the directive ID, or
+		True for CANCEL/ADJUST. Raises the Exception it failed with, or
+		DirectiveShed
+		"""
+		if not self._event.wait(timeout):
+			raise RuntimeError(("Directive not sent within %s seconds" %
+								timeout))
+		if self._exception is not None:
+			raise self._exception
+		return self._result
+
+	def exception(self, timeout=None):
+		""" Wait for the directive; the Exception it failed with, or None """
+		self._event.wait(timeout)
+		return self._exception
+
+class _Entry(object):
+	""" One queued directive and the tickets waiting for it """
+	__slots__ = ("key", "directive", "kwargs", "urgency", "queued",
+				 "tickets", "live")
+
+	def __init__(self, key, directive, kwargs, urgency, queued):
+		self.key = key
+		self.directive = directive
+		self.kwargs = kwargs
+		self.urgency = urgency
+		self.queued = queued
+		self.tickets = []
+		#False once sent, shed or replaced by a more urgent copy
+		self.live = True
+
+class DirectiveScheduler(object):
+	""" Priority queue with rate limiting in front of a wrapper """
+
+	def __init__(self, client, rate=None, burst=None, max_queue=10000,
+				 max_delay=None, batch=256, ranks=None, default_priority=100,
+				 block=False, block_timeout=None):
+		"""
+		ARGUMENTS:
+			o  client: ActuatorWrapper or ShardedActuator the directives are
+				sent with (through pipeline())
+			o  rate: Average directives per second, None for no limit
+			o  burst: Directives that may be sent at once after an idle
+				period. Defaults to a tenth of a second's worth of rate
+			o  max_queue: Most directives queued at a time
+			o  max_delay: Seconds a directive may stay queued before it is
+				shed, None to keep it until sent
+			o  batch: Most directives sent in one pipeline
+			o  ranks: Directive type -> rank, replacing DEFAULT_RANKS
+			o  default_priority: Priority of directives without a priority
+				parameter (the actuator's default)
+			o  block, block_timeout: Defaults for submit() when directives
+				are queued through the directive methods
+		"""
+		if max_queue < 1 or batch < 1:
+			raise ValueError("max_queue and batch must be at least 1")
+		self._client = client
+		self._bucket = None
+		if rate is not None:
+			if burst is None:
+				burst = max(1, int(rate / 10.0))
+			self._bucket = TokenBucket(rate, burst)
+		self._max_queue = max_queue
+		self._max_delay = max_delay
+		self._batch = batch
+		self._ranks = dict(DEFAULT_RANKS if ranks is None else ranks)
+		self._default_priority = default_priority
+		self._block = block
+		self._block_timeout = block_timeout
+		self._cond = threading.Condition(threading.Lock())
+		self._sequence = itertools.count()
+		#Most urgent first, and least urgent first, of the live entries
+		self._best = []
+		self._worst = []
+		self._size = 0
+		#Entries in submission order, for max_delay
+		self._fifo = collections.deque()
+		#Coalescing key -> live entry
+		self._queued = {}
+		self._stats = {"submitted": 0, "coalesced": 0, "rejected": 0,
+					   "shed": 0, "sent": 0, "failed": 0, "batches": 0}
+		self._running = False
+		self._thread = None
+
+	def _urgency(self, directive, kwargs):
+		""" Sort key of a directive; smaller is more urgent """
+		priority = kwargs.get("priority")
+		priority = self._default_priority if priority is None else priority
+		return (self._ranks.get(directive, len(self._ranks)),
+				-float(priority), next(self._sequence))
+
+	def _coalesce_key(self, directive, kwargs):
+		"""
+		Directives with the same key do the same thing and are sent once.
+		The priority only decides the queue order, so it is left out
+		"""
+		if directive in ("CANCEL", "ADJUST"):
+			return (directive, "all" if kwargs.get("all") else
+					int(kwargs["id"]))
+		return canonical_key(directive, dict((param, value) for param, value
+											 in kwargs.items()
+											 if param != "priority"))
+
+	def _push(self, entry):
+		""" Add a live entry to both heaps. Lock held """
+		rank, order, sequence = entry.urgency
+		heapq.heappush(self._best, (entry.urgency, entry))
+		heapq.heappush(self._worst, ((-rank, -order, -sequence), entry))
+
+	def _pop_best(self):
+		""" Remove and return the most urgent live entry. Lock held """
+		while self._best:
+			entry = heapq.heappop(self._best)[1]
+			if entry.live:
+				self._retire(entry)
+				return entry
+		return None
+
+	def _peek_worst(self):
+		""" The least urgent live entry, None if empty. Lock held """
+		while self._worst and not self._worst[0][1].live:
+			heapq.heappop(self._worst)
+		return self._worst[0][1] if self._worst else None
+
+	def _retire(self, entry):
+		""" Take an entry out of the queue. Lock held """
+		entry.live = False
+		self._size -= 1
+		if self._queued.get(entry.key) is entry:
+			del self._queued[entry.key]
+
+	def _shed(self, entry, reason):
+		""" Drop a queued entry, failing its tickets. Lock held """
+		self._retire(entry)
+		self._stats["shed"] += 1
+		error = DirectiveShed(reason)
+		for ticket in entry.tickets:
+			ticket._set(error)
+		self._cond.notify_all()
+
+	def _expire(self, now):
+		""" Shed entries queued longer than max_delay. Lock held """
+		if self._max_delay is None:
+			return
+		fifo = self._fifo
+		while fifo and now - fifo[0].queued > self._max_delay:
+			first = fifo.popleft()
+			entry = first
+			if not entry.live:
+				#Sent, shed, or moved up by coalescing into a copy that
+				#keeps its submission time
+				entry = self._queued.get(first.key)
+				if (entry is None or not entry.live or
+						entry.queued != first.queued):
+					continue
+			self._shed(entry, ("Waited more than %s seconds to be sent" %
+							   self._max_delay))
+
+	def submit(self, directive, kwargs, block=False, timeout=None):
+		"""
+		ARGUMENTS:
+			o  directive: Directive type, e.g. "BLOCK"
+			o  kwargs: Dictionary of the directive's parameters
+			o  block: Wait for room in a full queue instead of raising
+				SchedulerFull
+			o  timeout: Seconds to wait for room with block=True
+		DESCRIPTION:
+			Queue a directive. Parameters are validated right away
+			(ValueError).
+		RETURNS:
+			@rtype: Ticket
+			@return: Ticket for the directive's result
+		"""
+		directive = directive.upper()
+		spec = DIRECTIVES.get(directive.lower())
+		if spec is None or spec.reply not in (ID, ACK):
+			raise ValueError(("Directive " + directive + " cannot be "
+							  "scheduled"))
+		spec.build(kwargs)
+		key = self._coalesce_key(directive, kwargs)
+		ticket = Ticket(directive)
+		deadline = None if timeout is None else time.time() + timeout
+		with self._cond:
+			self._stats["submitted"] += 1
+			urgency = self._urgency(directive, kwargs)
+			while 1:
+				queued = self._queued.get(key)
+				if queued is not None:
+					self._stats["coalesced"] += 1
+					if directive == "ADJUST":
+						queued.kwargs = kwargs
+					queued.tickets.append(ticket)
+					if urgency < queued.urgency:
+						#Move it up: replace it by a copy at the new place,
+						#sent as the more urgent submission
+						queued.live = False
+						entry = _Entry(key, directive, kwargs, urgency,
+									   queued.queued)
+						entry.tickets = queued.tickets
+						self._queued[key] = entry
+						self._push(entry)
+					return ticket
+				if self._size < self._max_queue:
+					break
+				worst = self._peek_worst()
+				if urgency < worst.urgency:
+					self._shed(worst, "Shed for a more urgent directive")
+					break
+				remaining = None if deadline is None else deadline - time.time()
+				if not block or (remaining is not None and remaining <= 0):
+					self._stats["rejected"] += 1
+					raise SchedulerFull(("Scheduler queue is full (%d "
+										 "directives)" % self._size))
+				self._cond.wait(remaining)
+			entry = _Entry(key, directive, kwargs, urgency, time.time())
+			entry.tickets.append(ticket)
+			self._queued[key] = entry
+			self._size += 1
+			self._push(entry)
+			if self._max_delay is not None:
+				self._fifo.append(entry)
+			self._cond.notify_all()
+		return ticket
+
+	def _take_batch(self, now):
+		"""
+		Remove the entries that may be sent now: as many as the token bucket
+		allows, up to batch. Lock held
+		"""
+		self._expire(now)
+		count = min(self._batch, self._size)
+		if self._bucket is not None:
+			count = min(count, self._bucket.available(now))
+		entries = []
+		while len(entries) < count:
+			entry = self._pop_best()
+			if entry is None:
+				break
+			entries.append(entry)
+		if self._bucket is not None and entries:
+			self._bucket.take(len(entries), now)
+		if entries:
+			self._cond.notify_all()
+		return entries
+
+	def _send(self, entries):
+		"""
+		Send entries in one pipeline and hand out the results. An entry
+		refused before sending (e.g. a stale ID) gets its Exception without
+		failing the others
+		"""
+		refused = []
+		try:
+			with self._client.pipeline() as pipe:
+				for entry in entries:
+					try:
+						getattr(pipe, entry.directive.lower())(**entry.kwargs)
+						refused.append(None)
+					except ValueError as e:
+						refused.append(e)
+			replies = iter(pipe.results)
+			results = [next(replies) if error is None else error
+					   for error in refused]
+		except Exception as e:
+			#The batch failed; refused entries keep their own error
+			refused.extend([None] * (len(entries) - len(refused)))
+			results = [e if error is None else error for error in refused]
+		failed = 0
+		for entry, result in zip(entries, results):
+			if isinstance(result, Exception):
+				failed += 1
+			for ticket in entry.tickets:
+				ticket._set(result)
+		with self._cond:
+			self._stats["batches"] += 1
+			self._stats["sent"] += len(entries) - failed
+			self._stats["failed"] += failed
+
+	def dispatch(self, now=None):
+		"""
+		Send what the rate limit allows right now, in one pipeline. Called by
+		the dispatcher thread; call it directly to drive the scheduler
+		without one.
+
+		RETURNS:
+			@rtype: Integer
+			@return: Number of directives sent
+		"""
+		now = time.time() if now is None else now
+		with self._cond:
+			entries = self._take_batch(now)
+		if entries:
+			self._send(entries)
+		return len(entries)
+
+	def _run(self):
+		while 1:
+			with self._cond:
+				while self._running and not self._size:
+					self._cond.wait(1.0)
+				if not self._running:
+					return
+				now = time.time()
+				entries = self._take_batch(now)
+				if not entries and self._size:
+					#Rate limited: sleep until the next token
+					self._cond.wait(self._bucket.wait_time(1, now))
+					continue
+			if entries:
+				self._send(entries)
+
+	def start(self):
+		""" Start the dispatcher thread. Returns self """
+		with self._cond:
+			if self._thread is not None:
+				return self
+			self._running = True
+			self._thread = threading.Thread(target=self._run)
+			self._thread.daemon = True
+		self._thread.start()
+		return self
+
+	def stop(self, drain=True):
+		"""
+		Stop the dispatcher thread. With drain, directives still queued are
+		sent first (ignoring the rate limit), otherwise they are shed
+		"""
+		with self._cond:
+			self._running = False
+			self._cond.notify_all()
+			thread, self._thread = self._thread, None
+		if thread is not None:
+			thread.join()
+		if drain:
+			while 1:
+				with self._cond:
+					entries = []
+					while len(entries) < self._batch:
+						entry = self._pop_best()
+						if entry is None:
+							break
+						entries.append(entry)
+				if not entries:
+					break
+				self._send(entries)
+		else:
+			with self._cond:
+				while self._peek_worst() is not None:
+					self._shed(self._peek_worst(), "Scheduler stopped")
+
+	def __enter__(self):
+		return self.start()
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.stop()
+
+	def __len__(self):
+		with self._cond:
+			return self._size
+
+	def pressure(self):
+		"""
+		RETURNS:
+			@rtype: Dictionary
+			@return: queued, capacity, fill (queued / capacity) and wait
+				(seconds until a directive submitted now at the back of the
+				queue would be sent, at the rate limit)
+		"""
+		with self._cond:
+			size = self._size
+			wait = 0.0
+			if self._bucket is not None:
+				wait = self._bucket.wait_time(size + 1)
+		return {"queued": size, "capacity": self._max_queue,
+				"fill": float(size) / self._max_queue, "wait": wait}
+
+	def stats(self):
+		"""
+		RETURNS:
+			@rtype: Dictionary
+			@return: Counters: submitted, coalesced, rejected (SchedulerFull),
+				shed, sent, failed and batches
+		"""
+		with self._cond:
+			return dict(self._stats)
+
+def _scheduled_directive(spec):
+	""" Build the DirectiveScheduler method queueing a directive """
+	name = spec.name
+	def directive(self, **kwargs):
+		return self.submit(name, kwargs, self._block, self._block_timeout)
+	directive.__name__ = name.lower()
+	directive.__doc__ = (" Queue %s directive and return its Ticket. See "
+						 "ActuatorWrapper.%s " % (name, name.lower()))
+	return directive
+
+for _name, _spec in DIRECTIVES.items():
+	if _spec.reply in (ID, ACK):
+		setattr(DirectiveScheduler, _name, _scheduled_directive(_spec))
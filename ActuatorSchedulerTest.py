@@ -0,0 +1,140 @@
+#!/usr/bin/python
+# ActuatorSchedulerTest.py - Test for directive admission control
+# Works with Python 2.7 and 3
+
+"""
+Tests the token bucket and DirectiveScheduler against the simulated actuator.
+No actuator needed.
+"""
+
+import time
+import unittest
+
+from ActuatorMetrics import ActuatorMetrics
+from ActuatorScheduler import (DirectiveScheduler, DirectiveShed,
+							   SchedulerFull, TokenBucket)
+from ActuatorWrapper import ActuatorWrapper, StaleDirectiveError
+from SimulatedActuator import SimulatedActuator
+
+class TokenBucketTest(unittest.TestCase):
+
+	def test_refill(self):
+		""" Test that tokens refill at the rate, up to the burst. """
+		bucket = TokenBucket(rate=10, burst=5)
+		now = time.time()
+		self.assertEqual(bucket.available(now), 5)
+		bucket.take(5, now)
+		self.assertEqual(bucket.available(now + 0.25), 2)
+		self.assertAlmostEqual(bucket.wait_time(3, now + 0.25), 0.05)
+		self.assertEqual(bucket.available(now + 60), 5)
+		self.assertRaises(ValueError, TokenBucket, 0, 1)
+
+class DirectiveSchedulerTest(unittest.TestCase):
+
+	def setUp(self):
+		self.actuator = SimulatedActuator().start()
+		self.metrics = ActuatorMetrics()
+		self.sent = []
+		self.metrics.add_hook(pre_send=lambda directive, line:
+							  self.sent.append(line))
+		self.wrapper = ActuatorWrapper(*self.actuator.address,
+									   metrics=self.metrics)
+
+	def tearDown(self):
+		self.wrapper.quit()
+		self.actuator.stop()
+
+	def test_priority_order(self):
+		""" Test that directive type, then priority, decide the order. """
+		scheduler = DirectiveScheduler(self.wrapper)
+		low = scheduler.block(blockIP="10.0.5.1")
+		high = scheduler.block(blockIP="10.0.5.2", priority=200)
+		adjust = scheduler.adjust(id=999, timeout=60)
+		quarantine = scheduler.quarantine(quarantinedIP="10.0.5.3",
+										  notifier="10.0.0.9")
+		self.assertEqual(scheduler.dispatch(), 4)
+		self.assertEqual([line.split()[0] for line in self.sent],
+						 ["QUARANTINE", "BLOCK", "BLOCK", "ADJUST"])
+		self.assertIn("10.0.5.2", self.sent[1])
+		self.assertIs(type(low.result(1)), int)
+		self.assertIs(type(high.result(1)), int)
+		self.assertIs(type(quarantine.result(1)), int)
+		self.assertIsInstance(adjust.exception(1), Exception)
+
+	def test_refused_entry(self):
+		""" Test that an entry refused before sending fails alone. """
+		scheduler = DirectiveScheduler(self.wrapper)
+		d_id = self.wrapper.block(blockIP="10.0.5.20")
+		#As if found stale after a reconnect
+		self.wrapper._stale_ids.add(d_id)
+		block = scheduler.block(blockIP="10.0.5.21")
+		cancel = scheduler.cancel(id=d_id)
+		quarantine = scheduler.quarantine(quarantinedIP="10.0.5.22",
+										  notifier="10.0.0.9")
+		self.assertEqual(scheduler.dispatch(), 3)
+		self.assertIsInstance(cancel.exception(1), StaleDirectiveError)
+		self.assertIs(type(block.result(1)), int)
+		self.assertIs(type(quarantine.result(1)), int)
+		self.assertEqual(len(self.actuator.active_ids()), 3)
+		stats = scheduler.stats()
+		self.assertEqual((stats["sent"], stats["failed"]), (2, 1))
+
+	def test_coalescing(self):
+		""" Test that queued duplicates are sent once. """
+		scheduler = DirectiveScheduler(self.wrapper)
+		first = scheduler.block(blockIP="10.0.5.4", dstPort=22)
+		second = scheduler.deny(IP1="10.0.5.4", IP2port=22, priority=300)
+		d_id = self.wrapper.block(blockIP="10.0.5.5")
+		self.sent[:] = []
+		scheduler.adjust(id=d_id, timeout=60)
+		scheduler.adjust(id=d_id, timeout=600)
+		self.assertEqual(len(scheduler), 2)
+		self.assertEqual(scheduler.dispatch(), 2)
+		self.assertEqual(first.result(1), second.result(1))
+		self.assertEqual(self.sent[1], "ADJUST -id %d -timeout 600" % d_id)
+		self.assertEqual(scheduler.stats()["coalesced"], 2)
+
+	def test_backpressure(self):
+		""" Test rejecting and shedding when the queue is full. """
+		scheduler = DirectiveScheduler(self.wrapper, max_queue=2)
+		scheduler.block(blockIP="10.0.5.6", priority=50)
+		low = scheduler.block(blockIP="10.0.5.7", priority=10)
+		self.assertRaises(SchedulerFull, scheduler.block, blockIP="10.0.5.8",
+						  priority=5)
+		self.assertRaises(SchedulerFull, scheduler.submit, "BLOCK",
+						  {"blockIP": "10.0.5.8", "priority": 5}, block=True,
+						  timeout=0.05)
+		self.assertEqual(scheduler.pressure()["fill"], 1.0)
+		urgent = scheduler.quarantine(quarantinedIP="10.0.5.9",
+									  notifier="10.0.0.9")
+		self.assertIsInstance(low.exception(0), DirectiveShed)
+		scheduler.dispatch()
+		self.assertIs(type(urgent.result(1)), int)
+		self.assertEqual(scheduler.stats()["rejected"], 2)
+		self.assertEqual(scheduler.stats()["shed"], 1)
+		self.assertRaises(ValueError, scheduler.block, test=1)
+
+	def test_max_delay(self):
+		""" Test that directives queued too long are shed. """
+		scheduler = DirectiveScheduler(self.wrapper, max_delay=0.01)
+		ticket = scheduler.block(blockIP="10.0.5.10")
+		time.sleep(0.02)
+		self.assertEqual(scheduler.dispatch(), 0)
+		self.assertRaises(DirectiveShed, ticket.result, 0)
+
+	def test_rate_limit(self):
+		""" Test that the dispatcher thread keeps to the rate. """
+		start = time.time()
+		with DirectiveScheduler(self.wrapper, rate=200, burst=10) as scheduler:
+			tickets = [scheduler.block(blockIP="10.0.6.%d" % n)
+					   for n in range(50)]
+			for ticket in tickets:
+				ticket.result(5)
+		#10 at once, the other 40 at 200 per second
+		self.assertTrue(time.time() - start >= 0.18)
+		self.assertEqual(len(set(ticket.result() for ticket in tickets)), 50)
+		self.assertTrue(scheduler.stats()["batches"] > 1)
+
+
+if __name__ == '__main__':
+	unittest.main()
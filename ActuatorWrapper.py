@@ -1,6 +1,6 @@
 #!/usr/bin/python
 # ActuatorWrapper.py - Wrapper for openflowsec.org's OF-Actuator
-# Works with Python 2.7. For 3 compatibility, unicode conversion required
+# Works with Python 2.7 and 3
 # Written by Eric Ellett <eric.a.ellett@gmail.com>
 
 """
@@ -33,398 +33,1045 @@ and its active network security directives:
  """
 __version__ = '0.1'
 
+import random
 import re
+import select
 import socket
+import threading
+import time
 from time import sleep
 
-class ActuatorWrapper:
+from ActuatorCache import DirectiveCache, canonical_key, same_directive
+from DirectiveSchema import ACK, DIRECTIVES, ID, TEXT_REPLY
+from CidrAggregator import BlockReport, aggregate, format_cidr, ip_to_int
+from ActuatorProtocol import (ActuatorTimeout, ResponseReader,
+							  is_response_end, parse_info_lines, send_all)
+from ActuatorReconcile import ReconcilePlan
+
+#Directives that give the same result when sent twice, so a directive whose
+#connection broke before its reply arrived can simply be sent again
+_REPLAYABLE = frozenset(["ADJUST", "CANCEL", "DEFAULTS", "HELP", "HOSTINFO",
+						 "INFO", "SWITCHES"])
+
+class ConnectionLost(socket.error):
+	"""
+	The connection to the actuator broke while a directive that must not be
+	sent twice (e.g. BLOCK) was waiting for its reply, so whether the
+	actuator applied it is unknown. With auto_reconnect the wrapper is
+	connected again when this is raised
+	"""
+
+class ActuatorUnavailable(socket.error):
+	"""
+	The actuator could not be reached again within reconnect_timeout, or too
+	many directives were already waiting for the reconnect
+	"""
+
+class StaleDirectiveError(ValueError):
+	"""
+	A directive ID from before a reconnect no longer names the same active
+	directive: it expired or was cancelled meanwhile, or the actuator was
+	restarted and may have given the ID to another directive
+	"""
+
+class DirectiveBuilder(object):
+	"""
+	Validates directive parameters and builds the directive strings sent to
+	the OF-Actuator. Shared by ActuatorWrapper, DirectivePipeline and
+	AsyncActuatorWrapper. The _build_<name> methods are generated from
+	DirectiveSchema.py at the end of this module
+	"""
+
+	def _extract_directive_id(self, data):
+		""" 
+		Retrieve directive id from Actuator response
+		"""
+		dir_id = re.match(r"OK (\d+)", str(data))
+		if not dir_id:
+			raise ValueError(("Data received did not contain directive "
+							  "identifier, instead received: \"" + data + "\"" ))
+		return int(dir_id.group(1))
+
+	def _is_response_end(self, line):
+		"""
+		Check whether a response line is the last line of a response
+		"""
+		return is_response_end(line)
+
+class DirectivePipeline(DirectiveBuilder):
+	"""
+	Queues directives and streams them to the actuator in one write instead of
+	one round-trip per directive. Replies are read back in order and matched
+	to the queued directives. Use through ActuatorWrapper.pipeline():
+
+		with wrapper.pipeline() as pipe:
+			for ip in blocklist:
+				pipe.block(blockIP=ip)
+		d_ids = pipe.results
+
+	Parameters are validated as each directive is queued, so bad parameters
+	raise ValueError immediately. A directive the actuator rejects does not
+	abort the batch; its slot in the results holds the Exception instead.
+	With a deadline, each flush must be answered within that many seconds.
+	"""
+
+	def __init__(self, wrapper, deadline=None):
+		self._wrapper = wrapper
+		self._deadline = deadline
+		self._queue = []
+		#canonical_key -> queue index of directives queued with dedupe on
+		self._queued_keys = {}
+		self.results = []
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		#Only send the batch if it was queued without errors
+		if exc_type is None:
+			self.flush()
+
+	def __len__(self):
+		return len(self._queue)
+
+	def _queue_directive(self, cmd_string, parse, directive, kwargs):
+		self._queue.append((cmd_string, parse, directive, kwargs))
+
+	def _return_true(self, data):
+		return True
+
+	def _queue_create(self, directive, cmd_string, kwargs):
+		"""
+		Queue a directive creating a security directive. With dedupe enabled
+		on the wrapper, an identical directive already active or queued in
+		this batch is not sent again; its slot gets the existing ID
+		"""
+		wrapper = self._wrapper
+		if not wrapper._dedupe:
+			self._queue_directive(cmd_string, self._extract_directive_id,
+								  directive, kwargs)
+			return
+		key = canonical_key(directive, kwargs)
+		index = self._queued_keys.get(key)
+		if index is not None:
+			wrapper._count_dedupe("hits")
+			self._queue_directive(None, lambda done: done[index], None, None)
+			return
+		record = wrapper._find_duplicate(key)
+		if record is None:
+			self._queued_keys[key] = len(self._queue)
+			self._queue_directive(cmd_string, self._extract_directive_id,
+								  directive, kwargs)
+			return
+		d_id = record.id
+		timeout = wrapper._extension(record, kwargs)
+		if timeout is None:
+			self._queue_directive(None, lambda done: d_id, None, None)
+			return
+		wrapper._count_dedupe("extended")
+		adjust_kwargs = {"id": d_id, "timeout": timeout}
+		self._queue_directive(self._build_adjust(**adjust_kwargs),
+							  lambda data: d_id, "ADJUST", adjust_kwargs)
+
+	def flush(self):
+		"""
+		Send all queued directives and collect their replies.
+
+		RETURNS:
+			@rtype: List
+			@return: One entry per queued directive, in queue order. Directive
+				ID (or True for CANCEL/ADJUST) on success, otherwise the
+				Exception describing the failure.
+		"""
+		queue, self._queue = self._queue, []
+		self._queued_keys = {}
+		replies = iter(self._wrapper._send_batch([item[0] for item in queue
+												  if item[0] is not None],
+												 deadline=self._deadline))
+		results = []
+		for cmd, parse, directive, kwargs in queue:
+			if cmd is None:
+				#Deduplicated: resolved from an earlier result of the batch
+				#or an already active directive
+				results.append(parse(results))
+				continue
+			data = next(replies)
+			if re.match("ERROR", data):
+				results.append(Exception(data))
+				continue
+			try:
+				result = parse(data)
+			except ValueError as e:
+				results.append(e)
+				continue
+			self._wrapper._directive_done(directive, kwargs, result)
+			results.append(result)
+		self.results.extend(results)
+		return results
+
+class ActuatorWrapper(DirectiveBuilder):
 	""" A simple wrapper class for the openflowsec.org's OF-Actuator"""
 
-	def __init__(self, server_ip="127.0.0.1", server_port=26795):
+	#First and longest pause in seconds between reconnect attempts
+	backoff_initial = 0.01
+	backoff_max = 0.25
+
+	def __init__(self, server_ip="127.0.0.1", server_port=26795,
+				 track_state=False, staleness=30.0, hostinfo_cache=None,
+				 dedupe=False, dedupe_extend=False, metrics=None,
+				 auto_reconnect=True, reconnect_timeout=1.0, max_pending=64,
+				 on_reconnect=None, journal=None, query_coalescer=None,
+				 deadline=None, unix_socket=None):
+		"""
+		ARGUMENTS:
+			o  server_ip, server_port: Actuator address
+			o  track_state: Keep a local mirror of active directives, see
+				active_directives()
+			o  staleness: Seconds the mirror may go without reconciling
+				against INFO. None never reconciles automatically
+			o  hostinfo_cache: HostInfoCache answering repeated hostinfo(IP=)
+				lookups locally
+			o  dedupe: Return the ID of an identical active directive instead
+				of creating a duplicate. Implies track_state
+			o  dedupe_extend: With dedupe, ADJUST the existing directive when
+				the repeated request's timeout would outlast it
+			o  metrics: ActuatorMetrics recording latency, bytes, errors and
+				reconnects of every exchange
+			o  auto_reconnect: Reconnect when the connection breaks or was
+				closed with quit(), see "Reconnecting" in README.md
+			o  reconnect_timeout: Seconds to keep retrying a reconnect, with
+				jittered exponential backoff, before ActuatorUnavailable
+			o  max_pending: Most directives of other threads that may wait
+				for a reconnect in progress; more fail immediately
+			o  on_reconnect: Called as on_reconnect(wrapper, stale_ids) after
+				every automatic reconnect
+			o  journal: DirectiveJournal recording the directives created,
+				cancelled and adjusted through this wrapper. Its directives
+				are loaded into the mirror and reconciled against INFO on
+				startup. Implies track_state
+			o  query_coalescer: QueryCoalescer sharing one outstanding INFO,
+				SWITCHES, HOSTINFO or HELP among concurrent identical calls.
+				Share one between the wrappers of a pool
+			o  deadline: Default seconds a directive may take, from sending
+				it until its whole response is read, and a connection attempt
+				may take. Every directive method also takes a deadline
+				keyword. None waits indefinitely
+			o  unix_socket: Path of an ActuatorProxy's Unix domain socket
+				to connect through instead of to server_ip:server_port, so
+				many processes share the proxy's actuator connections
+		"""
+		if deadline is not None and deadline <= 0:
+			raise ValueError("deadline must be positive")
 		self._server_ip = server_ip
 		self._server_port = server_port
+		track_state = track_state or dedupe or journal is not None
+		self._state = DirectiveCache(staleness) if track_state else None
+		self._dedupe = dedupe
+		self._dedupe_extend = dedupe_extend
+		self._dedupe_stats = {"hits": 0, "misses": 0, "extended": 0}
+		self._hostinfo_cache = hostinfo_cache
+		self._metrics = metrics
+		self._auto_reconnect = auto_reconnect
+		self._reconnect_timeout = reconnect_timeout
+		self._max_pending = max_pending
+		self._on_reconnect = on_reconnect
+		self._journal = journal
+		self._queries = query_coalescer
+		self._deadline = deadline
+		self._unix_socket = unix_socket
+		#Set while a thread is reconnecting; others queue up behind it
+		self._reconnecting = False
+		self._pending = 0
+		self._pending_lock = threading.Lock()
+		#Counts failed reconnects so queued directives fail with them
+		self._failed_reconnects = 0
+		#IDs of directives found gone (or replaced) after a reconnect
+		self._stale_ids = set()
+		#Serializes request/response exchanges of threads sharing the wrapper
+		self._lock = threading.RLock()
+		#Set while info_records() is streaming a response off the connection
+		self._streaming = False
 		self._conn = self._init_server_conn()
+		self._reader = ResponseReader(self._conn)
+		if journal is not None:
+			self._recover_journal()
 
-	def _init_server_conn(self):
+	def _init_server_conn(self, timeout=None):
 		"""
-		Init server and return create_connection
+		Init server and return create_connection, switched to non-blocking
+		so that reads and writes can keep to a deadline. The connection
+		attempt takes at most timeout seconds, by default the wrapper's
+		deadline
 		"""
+		if timeout is None:
+			timeout = self._deadline
 		#Let default socket exception be thrown back to user
-		conn = socket.create_connection((self._server_ip, self._server_port))
-	
+		if self._unix_socket is None:
+			conn = socket.create_connection((self._server_ip,
+											 self._server_port), timeout)
+		else:
+			conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+			conn.settimeout(timeout)
+			try:
+				conn.connect(self._unix_socket)
+			except socket.error:
+				conn.close()
+				raise
+		conn.setblocking(0)
 		return conn
 
-	def _send_command(self, directive):
+	def _expires(self, deadline):
 		"""
-		Send directive string to server and return response
+		Absolute time a directive sent now with deadline seconds (by default
+		the wrapper's deadline) must be answered by, None for no limit
+		"""
+		if deadline is None:
+			deadline = self._deadline
+			if deadline is None:
+				return None
+		elif deadline <= 0:
+			raise ValueError("deadline must be positive")
+		return time.time() + deadline
+
+	def _send_command(self, directive, deadline=None):
+		"""
+		Send directive string to server and return response. ActuatorTimeout
+		is raised if the response is not read within deadline seconds
 		"""
 		#Check for ASCII encoding
 		if type(directive) != str:
 			raise ValueError("Directive must be in ASCII")
-		if not self._conn:
-			self.restart_server_conn()
-		self._conn.send(directive + "\n")
-		data = ""
-		#QUIT closes socket and expects no response
-		if "QUIT" not in directive:
-			while 1:
-				data = self._conn.recv(1024)
-				if any(word in data for word in ["OK", "DONE", "ERROR", "echo"]):
-					break
+		expires = self._expires(deadline)
+		if self._metrics is None:
+			data = self._exchange(directive, expires)
+		else:
+			data = self._metrics.measure(directive, self._exchange, expires)
 
 		if re.match("ERROR", data):
 			raise Exception(data)
 
 		return data
 
-	def restart_server_conn(self, server_ip = None, server_port = None):
+	def _exchange(self, directive, expires=None):
 		"""
-		Restarts the server connection to previous or new address
+		Write one directive line and read its response by the absolute time
+		expires. If the connection breaks, reconnect and send the directive
+		again when that is safe
 		"""
+		if self._reconnecting:
+			self._wait_for_reconnect()
+		with self._lock:
+			self._check_not_streaming()
+			if not self._conn:
+				#Nothing was sent yet, so any directive may go out on the
+				#new connection
+				self._reconnect(expires)
+			try:
+				return self._write_read(directive, expires)
+			except ActuatorTimeout:
+				#The late response would be read as the next directive's;
+				#the next directive reconnects instead
+				self._close_conn()
+				raise
+			except socket.error:
+				if not self._auto_reconnect or directive == "QUIT":
+					raise
+				self._connection_lost(expires)
+				if (not self._conn or
+						directive.split(" ", 1)[0] not in _REPLAYABLE):
+					raise ConnectionLost(("Connection to the actuator lost "
+										  "before \"" + directive + "\" was "
+										  "answered; it may have been applied"))
+				try:
+					return self._write_read(directive, expires)
+				except ActuatorTimeout:
+					self._close_conn()
+					raise
 
-		self._server_ip = server_ip if server_ip else self._server_ip
-		self._server_port = server_port if server_port else self._server_port
-		self._conn = init_server_conn()
+	def _write_read(self, directive, expires=None):
+		"""
+		Send one directive line on the current connection and read its
+		response
+		"""
+		send_all(self._conn, (directive + "\n").encode("ascii"), expires)
+		#QUIT closes socket and expects no response
+		if "QUIT" in directive:
+			return ""
+		return self._read_response(expires)
 
+	def _close_conn(self):
+		"""
+		Close and forget the connection
+		"""
+		conn, self._conn = self._conn, None
+		if conn:
+			try:
+				conn.close()
+			except socket.error:
+				pass
 
-	def _generate_args(self, poss_params, **kwargs):
+	def _connection_lost(self, expires=None):
 		"""
-		Create directive addon string out of kwargs
-		"""		
-		args_gen = " "
-		for param, value in kwargs.iteritems():
-			param = str(param)
-			if param not in poss_params:
-				raise ValueError(("Parameter \"" + param + "\" not in possible "
-							"parameter set for this Directive. Possible "
-							"parameters are - " + " ".join(poss_params)))
-			#If argument is a bool, simply add the '-param' to the string
-			if type(value) == bool and value == True:
-				args_gen += "-" + str(param) + " "
-			else:
-				args_gen += "-" + str(param) + " " + str(value) + " "
-		
-		return args_gen.rstrip()
+		Drop a broken connection and, with auto_reconnect, reconnect right
+		away. The lock must be held
+		"""
+		self._close_conn()
+		#A failure while already reconnecting is retried by _reconnect
+		if self._auto_reconnect and not self._reconnecting:
+			self._reconnect(expires)
 
-	def _extract_directive_id(self, data):
-		""" 
-		Retrieve directive id from Actuator response
+	def _wait_for_reconnect(self):
 		"""
-		dir_id = re.match(r"OK (\d+)", str(data))
-		if not dir_id:
-			raise ValueError(("Data received did not contain directive "
-							  "identifier, instead received: \"" + data + "\"" ))
-		return int(dir_id.group(1))
+		Wait for another thread's reconnect to finish. At most max_pending
+		directives wait; the rest, and all of them if the reconnect fails,
+		raise ActuatorUnavailable
+		"""
+		with self._pending_lock:
+			if self._pending >= self._max_pending:
+				raise ActuatorUnavailable(("Reconnecting to the actuator; " +
+										   str(self._pending) + " directives "
+										   "are already waiting"))
+			self._pending += 1
+			failed = self._failed_reconnects
+		try:
+			with self._lock:
+				if self._failed_reconnects != failed:
+					raise ActuatorUnavailable(("Could not reconnect to the "
+											   "actuator"))
+		finally:
+			with self._pending_lock:
+				self._pending -= 1
 
-	def block(self, **kwargs):
+	def _reconnect(self, expires=None):
 		"""
-		ARGUMENTS:
-			o   -blockIP <CIDR>
-			o  [-dstPort <port>         ]
-			o  [-proto <protocol>       ]
-			o  [-linkdrop <True/False>  ]
-			o  [-style <style>          ]
-			o  [-resetAfter <seconds>   ]
-			o  [-priority <N>           ]
-			o  [-switch <switch-id>     ]
-			o  [-timeout <seconds>      ]
-		
-		DESCRIPTION: Blocks all traffic matching specified criteria.
-			This directive is translated into the equivalent DENY directive:
-			DENY -IP1 <CIDR> [ -IP2port <port> ] ...options...
-			Note: "-linkdrop" becomes "-linkdrop1"
+		Connect again, retrying with jittered exponential backoff for up to
+		reconnect_timeout seconds (or until the absolute time expires, if
+		sooner), then reconcile the directive mirror. The lock must be held
+		"""
+		if not self._auto_reconnect:
+			self._restart(expires)
+			return
+		self._reconnecting = True
+		try:
+			deadline = time.time() + self._reconnect_timeout
+			if expires is not None and expires < deadline:
+				deadline = expires
+			delay = self.backoff_initial
+			while 1:
+				try:
+					self._restart(deadline)
+					#A reconcile that fails counts as a failed attempt, so
+					#nothing is replayed on the connection it closed. It may
+					#take until the caller's deadline, not just the
+					#reconnect_timeout
+					stale_ids = self._find_stale(expires)
+					break
+				except socket.error as e:
+					remaining = deadline - time.time()
+					if remaining <= 0:
+						self._failed_reconnects += 1
+						if deadline == expires:
+							raise ActuatorTimeout(("Could not reconnect to "
+												   "the actuator before the "
+												   "deadline: " + str(e)))
+						raise ActuatorUnavailable(("Could not reconnect to "
+												   "the actuator: " + str(e)))
+					#Jitter keeps many clients of a restarted actuator from
+					#all retrying in lockstep
+					sleep(min(random.uniform(delay / 2, delay), remaining))
+					delay = min(delay * 2, self.backoff_max)
+		finally:
+			self._reconnecting = False
+		if self._on_reconnect is not None:
+			self._on_reconnect(self, stale_ids)
 
-		RETURNS:
-			@rtype: Integer
-			@return: Directive ID
-		"""
-		poss_params = ["blockIP", "dstPort", "proto", "linkdrop", "style",
-						"resetAfter", "priority", "switch", "timeout"]
-
-		if kwargs.get("blockIP") == None:
-			raise ValueError("blockIP must be specified")
-
-		cmd_string = ("BLOCK" + self._generate_args(poss_params, **kwargs))
-		data = self._send_command(cmd_string)
-		return self._extract_directive_id(data)
-
-	def deny(self, **kwargs):
-		"""
-		ARGUMENTS: (at least one of the first four criteria required)
-			o  [-IP1 <CIDR>             ]
-			o  [-IP2 <CIDR>             ]
-			o  [-IP1port <port>         ]
-			o  [-IP2port <port>         ]
-			o  [-proto <protocol>       ]
-			o  [-linkdrop1 <True/False> ]
-			o  [-linkdrop2 <True/False> ]
-			o  [-style <style>          ]
-			o  [-resetAfter <seconds>   ]
-			o  [-priority <N>           ]
-			o  [-switch <switch-id>     ]
-			o  [-timeout <seconds>      ]
-		
-		DESCRIPTION: Blocks all traffic matching specified criteria.
-			Blocks (drops) all IP traffic to/from IP1-CIDR/IP1-port (from/to
-			IP2-CIDR/IP2-port)...
-			NOTE: See OFActuator_directives.txt for more info
+	def _find_stale(self, expires=None):
+		"""
+		Reconcile the directive mirror against INFO, read by the absolute
+		time expires, after a reconnect. IDs that are no longer active, or
+		now name a different directive, are dropped from the mirror and
+		remembered as stale. Raises socket.error if INFO fails, with the
+		connection closed
+		"""
+		if self._state is None:
+			return set()
+		records = dict((record.id, record) for record in
+					   self._info_records(self._build_info(), False, expires))
+		stale_ids = set()
+		for known in self._state.active():
+			record = records.get(known.id)
+			if record is not None and same_directive(known, record):
+				continue
+			stale_ids.add(known.id)
+			self._state.cancel(known.id)
+		self._state.begin_sync()
+		self._state.replace(records.values())
+		self._stale_ids.update(stale_ids)
+		if self._journal is not None:
+			self._journal.discard(stale_ids)
+		return stale_ids
 
-		RETURNS:
-			@rtype: Integer
-			@return: Directive ID
-		"""
-		poss_params = ["IP1", "IP2", "IP1port", "IP2port", "proto", "linkdrop1",
-					   "linkdrop2", "style", "resetAfter", "priority", "switch",
-					   "timeout"]
-
-		#Who needs short circuits???
-		if all([kwargs.get("IP1") == None, kwargs.get("IP2") == None, 
-				kwargs.get("IP1port") == None, 
-				kwargs.get("IP2port") == None]):
-			raise ValueError(("You must specify at least one of the parameters:"
-							  " IP1, IP2, IP1port, IP2port"))
-
-		cmd_string = "DENY" + self._generate_args(poss_params, **kwargs)
-		data = self._send_command(cmd_string)
-		return self._extract_directive_id(data)
-
-
-	def redirect(self, **kwargs):
-		"""
-		ARGUMENTS: (at least one of the first four criteria required)
-			o  [-IP1 <CIDR>             ]
-			o  [-IP2 <CIDR>             ]
-			o  [-IP1port <port>         ]
-			o  [-IP2port <port>         ]
-			o  [-proto <protocol>       ]
-			o   -remapIP <IP>
-			o  [-remapPort <port>       ]
-			o  [-block <style>          ]
-			o  [-resetAfter <seconds>   ]
-			o  [-redirectIdle <seconds> ]
-			o  [-priority <N>           ]
-			o  [-switch <switch-id>     ]
-			o  [-timeout <seconds>      ]
-		
-		DESCRIPTION: Redirect matching network traffic to remapIP address (and 
-			port). This directive will rewrite any traffic from IP1/port to 
-			IP2/port as traffic from IP1/port to remapIP/port and DENY matching 
-			traffic from IP2/port to IP1/port.  Further, any IP1/port to 
-			IP2/port traffic from pre-existing TCP connections will be blocked 
-			as per <style>.
-			NOTE: See OFActuator_directives.txt for more info
+	def _recover_journal(self):
+		"""
+		Load the journaled directives into the mirror and reconcile them
+		against INFO, keeping only those still active in the journal
+		"""
+		self._state.replace(self._journal.records())
+		try:
+			self._find_stale()
+		except socket.error:
+			#Reconcile later, on the next use of the mirror
+			self._state.last_sync = None
+		self._journal.retain(record.id for record in self._state.active()
+							 if record.id in self._journal)
 
-		RETURNS:
-			@rtype: Integer
-			@return: Directive ID
-
-		"""
-		poss_params = ["IP1", "IP2", "IP1port", "IP2port", "proto", "remapIP", 
-					   "remapPort", "block", "resetAfter", "redirectIdle",
-					   "priority", "switch", "timeout"]
-
-		#Probably a better way to format this
-		if (kwargs.get("remapIP") == None or 
-			all([	kwargs.get("IP1") == None, kwargs.get("IP2") == None, 
-					kwargs.get("IP1port") == None, 
-					kwargs.get("IP2port") == None])):
-			raise ValueError(("You must specify remapIP and at least one of "
-							  "the parameters: ip1, ip2, ip1_port, ip2_port as "
-							  "well as remapIP"))
-
-		cmd_string = "REDIRECT" + self._generate_args(poss_params, **kwargs)
-		data = self._send_command(cmd_string)
-		return self._extract_directive_id(data)
-
-	def quarantine(self, **kwargs):
-		"""
-		ARGUMENTS: 
-			o   -quarantinedIP <IP>
-			o   -notifier <IP>
-			o  [-notifierPort <port>    ]
-			o  [-dnsIP <IP>             ]
-			o  [-dnsPass <True/False>  	]
-			o  [-linkdrop <True/False>	]
-			o  [-style <style>          ]
-			o  [-resetAfter <seconds>   ]
-			o  [-redirectIdle <seconds> ]
-			o  [-priority <N>           ]
-			o  [-switch <switch-id>     ]
-			o  [-timeout <seconds>      ]
-		
-		DESCRIPTION: 
-			Drop quarantined IP off the network; redirect web/DNS.
-			Blocks all general traffic through the switch to/from the 
-			quarantined IP address, with the exception that all DNS requests 
-			will be redirected to the dnsIP (default: notifier's IP addr) and 
-			all web (port 80) requests will be redirected to the notifier's 
-			IP/port (allows the notifier to return web pages informing the user
-			of the quarantine, providing remediationi nstructions, requesting 
-			the user to contact administrative support, etc.).
-			NOTE: See OFActuator_directives.txt for more info
+	def _check_stale(self, kwargs):
+		"""
+		Refuse to CANCEL or ADJUST a directive ID found stale after a
+		reconnect; after an actuator restart it may name someone else's
+		directive
+		"""
+		d_id = kwargs.get("id")
+		if d_id is not None and int(d_id) in self._stale_ids:
+			raise StaleDirectiveError(("Directive " + str(d_id) + " is no "
+									   "longer active since the actuator "
+									   "connection was re-established"))
 
+	def stale_ids(self):
+		"""
 		RETURNS:
-			@rtype: Integer
-			@return: Directive ID
+			@rtype: Set
+			@return: Directive IDs found no longer active, or replaced by
+				another directive, when the wrapper reconnected. Needs
+				track_state
+		"""
+		with self._lock:
+			return set(self._stale_ids)
 
+	def _check_not_streaming(self):
+		"""
+		Refuse to send a directive from inside an info_records() loop, where
+		its reply would be mixed up with the rest of the INFO response
 		"""
-		poss_params = ["quarantinedIP", "notifier", "notifierPort", "dnsIP", 
-						"dnsPass", "linkdrop", "style", "resetAfter", 
-						"redirectIdle", "priority", "switch", "timeout"]
+		if self._streaming:
+			raise RuntimeError(("Cannot send a directive while iterating "
+								"over info_records()"))
 
-		if any([kwargs.get("quarantinedIP") == None, 
-				kwargs.get("notifier") == None]):
-			raise ValueError(("You must specify quarantinedIP and notifier"))
+	def _read_response(self, expires=None):
+		"""
+		Read one response from the server. Anything received past the end of
+		the response is kept by the reader for the next call
+		"""
+		return self._reader.read_response(expires)
 
-		cmd_string = "QUARANTINE" + self._generate_args(poss_params, **kwargs)
-		data = self._send_command(cmd_string)
-		return self._extract_directive_id(data)
+	def _send_batch(self, directives, window=1024, deadline=None,
+					responses=None):
+		"""
+		Stream several directive strings to the server and return their
+		responses in order. At most window directives are left unanswered at
+		a time so neither side can stall on a full socket buffer. The whole
+		batch must be answered within deadline seconds. If given, responses
+		is the list they are appended to, so the caller still has those
+		received before an error
+		"""
+		for directive in directives:
+			if type(directive) != str:
+				raise ValueError("Directive must be in ASCII")
+		expires = self._expires(deadline)
+		if responses is None:
+			responses = []
+		if self._reconnecting:
+			self._wait_for_reconnect()
+		with self._lock:
+			self._check_not_streaming()
+			if not self._conn:
+				self._reconnect(expires)
+			try:
+				self._stream_batch(directives, window, responses, expires)
+			except ActuatorTimeout:
+				self._close_conn()
+				raise ActuatorTimeout(("Deadline passed after " +
+									   str(len(responses)) + " of " +
+									   str(len(directives)) + " directives "
+									   "were answered"))
+			except socket.error:
+				if not self._auto_reconnect:
+					raise
+				self._connection_lost()
+				raise ConnectionLost(("Connection to the actuator lost after " +
+									  str(len(responses)) + " of " +
+									  str(len(directives)) + " directives "
+									  "were answered"))
+		return responses
 
-	def unplug(self, **kwargs):
+	def _stream_batch(self, directives, window, responses, expires=None):
 		"""
-		ARGUMENTS: 
-			o  [-all <True/False        ]
-			o  [-IP <IP>                ]
-			o  [-linkAddr <MAC>         ]
-			o  [-swPort <n>             ]
-			o  [-priority <N>           ]
-			o  [-switch <switch-id>     ]
-			o  [-timeout <seconds>      ]		
-		DESCRIPTION: 
-			Drop packets on one or more switch ports.
-			NOTE: See OFActuator_directives.txt for more info
+		Send directives on the current connection, appending their responses
+		to responses. The lock must be held
+		"""
+		sent = 0
+		metrics = self._metrics
+		#Send time of each directive, for per-directive latency
+		sent_at = []
+		while len(responses) < len(directives):
+			outstanding = sent - len(responses)
+			if sent < len(directives) and outstanding <= window // 2:
+				batch = directives[sent:sent + window - outstanding]
+				lines = "".join(directive + "\n" for directive in batch)
+				if metrics is not None:
+					for directive in batch:
+						metrics.pre_send(directive.split(" ", 1)[0],
+										 directive)
+					sent_at.extend([time.time()] * len(batch))
+				send_all(self._conn, lines.encode("ascii"), expires)
+				sent += len(batch)
+			else:
+				response = self._read_response(expires)
+				if metrics is not None:
+					i = len(responses)
+					metrics.post_receive(directives[i].split(" ", 1)[0],
+										 directives[i], response,
+										 time.time() - sent_at[i])
+				responses.append(response)
+		return responses
 
-		RETURNS:
-			@rtype: Integer
-			@return: Directive ID
+	def is_connected(self):
+		"""
+		Check, without sending anything, that the connection is still usable:
+		open, not closed by the actuator and with no unexpected data waiting
+		"""
+		if not self._conn or self._reader.pending():
+			return False
+		try:
+			readable = select.select([self._conn], [], [], 0)[0]
+		except (select.error, socket.error, ValueError):
+			return False
+		#Between directives the actuator has nothing to say; readable means
+		#either EOF or stray data that would desync the next response
+		return not readable
+
+	def _query(self, cmd_string, deadline=None):
+		"""
+		Send a read-only directive, sharing the response with identical
+		queries in flight when the wrapper has a query_coalescer. Callers
+		joining a query in flight wait for it under its sender's deadline
+		"""
+		if self._queries is None:
+			return self._send_command(cmd_string, deadline)
+		return self._queries.query((self._server_ip, self._server_port,
+									cmd_string), self._send_command,
+								   cmd_string, deadline)
 
+	def _directive_done(self, directive, kwargs, result):
 		"""
-		poss_params = ["all", "IP", "linkAddr", "swPort", "priority", "switch",
-					   "timeout"]
+		Update client-side state after the actuator accepted a directive
+		"""
+		if self._queries is not None:
+			#INFO responses in flight or kept may predate the directive
+			self._queries.invalidate("INFO")
+		if self._state is None:
+			return
+		journal = self._journal
+		if directive in ("BLOCK", "DENY", "REDIRECT", "QUARANTINE", "UNPLUG"):
+			#A restarted actuator hands out old IDs again
+			self._stale_ids.discard(result)
+			record = self._state.add(result, directive, kwargs)
+			if journal is not None:
+				journal.created(result, directive, kwargs, record.expires)
+		elif directive == "CANCEL":
+			if kwargs.get("all"):
+				self._state.cancel_all()
+				if journal is not None:
+					journal.cancelled_all()
+			else:
+				self._state.cancel(int(kwargs["id"]))
+				if journal is not None:
+					journal.cancelled(int(kwargs["id"]))
+		elif directive == "ADJUST":
+			self._state.adjust(int(kwargs["id"]), kwargs["timeout"])
+			if journal is not None:
+				journal.adjusted(int(kwargs["id"]), kwargs["timeout"])
+		elif directive == "DEFAULTS" and kwargs.get("timeout") is not None:
+			self._state.default_timeout = kwargs["timeout"]
+		elif directive == "SHUTDOWN":
+			self._state.cancel_all()
+			if journal is not None:
+				journal.cancelled_all()
 
-		if sum([kwargs.get("all") == None, kwargs.get("IP") == None, 
-				kwargs.get("linkAddr") == None, 
-				kwargs.get("swPort") == None]) != 3:
-			raise ValueError(("Exactly one of all, ip, linkAddr, or swPort must" 
-							  " be specified."))
+	def _count_dedupe(self, counter):
+		with self._lock:
+			self._dedupe_stats[counter] += 1
 
-		cmd_string = "UNPLUG" + self._generate_args(poss_params, **kwargs)
-		data = self._send_command(cmd_string)
-		return self._extract_directive_id(data)
+	def _find_duplicate(self, key):
+		"""
+		Return the active DirectiveRecord with canonical key, None if there is
+		none. Counts a hit or a miss
+		"""
+		with self._lock:
+			if self._state.is_stale():
+				self.refresh_state()
+			record = self._state.find(key)
+			self._dedupe_stats["misses" if record is None else "hits"] += 1
+			return record
 
-	def info(self, **kwargs):
+	def _extension(self, record, kwargs):
 		"""
-		ARGUMENTS: 
-			o  [-id <N> 			]
-			o  [-rules <True/False> ]	
-		DESCRIPTION:
-			List active security directives.
-			The INFO command allows you to ask the actuator for the disposition 
-			of all active (i.e., not-expired) security directives.  If the -id 
-			parameter is specified, then only its associated security directive 
-			is displayed.
-			NOTE: See OFActuator_directives.txt for more info
+		Timeout to ADJUST an existing directive to for a repeated request, None
+		if it already lasts at least as long as the request asks for
+		"""
+		timeout = kwargs.get("timeout")
+		if not self._dedupe_extend or timeout is None:
+			return None
+		if record.expires is None:
+			return None
+		if float(timeout) > 0 and time.time() + float(timeout) <= record.expires:
+			return None
+		return timeout
+
+	def _create_directive(self, directive, cmd_string, kwargs, deadline=None):
+		"""
+		Send a directive creating a security directive and return its ID. With
+		dedupe enabled an identical active directive's ID is returned instead
+		"""
+		if not self._dedupe:
+			data = self._send_command(cmd_string, deadline)
+			d_id = self._extract_directive_id(data)
+			self._directive_done(directive, kwargs, d_id)
+			return d_id
+		with self._lock:
+			record = self._find_duplicate(canonical_key(directive, kwargs))
+			if record is not None:
+				timeout = self._extension(record, kwargs)
+				if timeout is not None:
+					self.adjust(id=record.id, timeout=timeout,
+								deadline=deadline)
+					self._dedupe_stats["extended"] += 1
+				return record.id
+			try:
+				data = self._send_command(cmd_string, deadline)
+			except ConnectionLost:
+				#Reconnecting reconciled the mirror, so it shows whether the
+				#directive was applied before the connection broke
+				record = self._state.find(canonical_key(directive, kwargs))
+				if record is not None:
+					return record.id
+				data = self._send_command(cmd_string, deadline)
+			d_id = self._extract_directive_id(data)
+			self._directive_done(directive, kwargs, d_id)
+			return d_id
 
+	def dedupe_stats(self):
+		"""
 		RETURNS:
-			@rtype: return
-			@String: One directive per line format: 
-				" <id>: <directive>; <expires>" 
+			@rtype: Dictionary
+			@return: hits (repeated directives answered with an existing ID,
+				without creating a directive), misses (directives sent) and
+				extended (hits that ADJUSTed the existing directive)
+		"""
+		with self._lock:
+			return dict(self._dedupe_stats)
 
+	def refresh_state(self):
 		"""
-		poss_params = ["id", "rules"]
+		Reconcile the local directive mirror against INFO now
+		"""
+		if self._state is None:
+			raise ValueError("State tracking is not enabled for this wrapper")
+		self._state.begin_sync()
+		self._state.replace(self.info_records())
 
-		cmd_string = "INFO" + self._generate_args(poss_params, **kwargs)
-		data = self._send_command(cmd_string)
-		return data
+	def active_directives(self, directive=None):
+		"""
+		ARGUMENTS:
+			o  [directive <type>  ] e.g. "BLOCK"
+		DESCRIPTION:
+			List the active directives from the local mirror (requires
+			track_state=True), without asking the actuator. The mirror is
+			first reconciled against INFO if it is older than the staleness
+			bound.
+		RETURNS:
+			@rtype: List
+			@return: DirectiveRecords ordered by directive ID
+		"""
+		return self._synced_state().active(directive)
 
-	def cancel(self, **kwargs):
+	def _synced_state(self):
+		"""
+		Return the directive mirror, reconciled against INFO first if it is
+		older than the staleness bound
+		"""
+		if self._state is None:
+			raise ValueError("State tracking is not enabled for this wrapper")
+		if self._state.is_stale():
+			self.refresh_state()
+		return self._state
+
+	def covering_directives(self, address):
 		"""
 		ARGUMENTS:
-			o  [-all <True/False>   ]
-			o  [-id <N> ]
-		DESCRIPTION:   Request removal of currently-active security directives.
-			Remove all flow mods associated with the security directive(s) or 
-			otherwise removes the effects of the directive on the switch (e.g., 
-			for "UNPLUG" re-activates the switch port).  If "-all" is specified,
-			all directives are removed.  If "-id <N>" is specified, the 
-			specified directive is removed. It is an error to specify both.
-			NOTE: See OFActuator_directives.txt for more info
+			o   address <IP>
+		DESCRIPTION:
+			Find the active BLOCK, DENY, QUARANTINE and UNPLUG directives
+			whose addresses or prefixes cover address, from the local mirror
+			(requires track_state=True) in O(log n). Use it to skip blocking
+			an address that is blocked already. A DENY limited to some ports
+			or peers covers the address too; check the records' params.
 		RETURNS:
-			@rtype: Boolean
-			@return: True if directive succeeds
+			@rtype: List
+			@return: DirectiveRecords ordered by directive ID, empty if none
 		"""
-		poss_params = ["all", "id"]
+		return self._synced_state().covering(address)
 
-		if sum([kwargs.get("all") == None, kwargs.get("id") == None]) != 1:
-			raise ValueError("You must specify either all or id")
+	def overlapping_directives(self, cidr):
+		"""
+		ARGUMENTS:
+			o   cidr <CIDR>
+		DESCRIPTION:
+			Like covering_directives(), but also finds directives for
+			narrower prefixes inside cidr.
+		RETURNS:
+			@rtype: List
+			@return: DirectiveRecords ordered by directive ID
+		"""
+		return self._synced_state().overlapping(cidr)
 
-		cmd_string = "CANCEL" + self._generate_args(poss_params, **kwargs)
-		self._send_command(cmd_string)
-		return True
+	def covered_many(self, addresses):
+		"""
+		ARGUMENTS:
+			o   addresses <list of IPv4 addresses or a NumPy uint32 array>
+		DESCRIPTION:
+			Check a whole triage list against the active directives at once.
+			NumPy arrays are checked vectorized when NumPy is installed.
+		RETURNS:
+			@rtype: List or numpy.ndarray
+			@return: Per address, whether an active directive covers it
+		"""
+		return self._synced_state().contains_many(addresses)
+
+	def pipeline(self, deadline=None):
+		"""
+		Return a DirectivePipeline that queues directives and sends them all
+		in one write when flushed (or when its "with" block exits). deadline
+		bounds each flush instead of each directive
+		"""
+		return DirectivePipeline(self, deadline)
 
-	def adjust(self, **kwargs):
+	def restart_server_conn(self, server_ip = None, server_port = None):
+		"""
+		Restarts the server connection to previous or new address
+		"""
+
+		with self._lock:
+			self._server_ip = server_ip if server_ip else self._server_ip
+			self._server_port = (server_port if server_port else
+								 self._server_port)
+			self._restart()
+
+	def _restart(self, expires=None):
+		"""
+		Replace the connection with a new one, connecting by the absolute
+		time expires if given. The lock must be held
+		"""
+		self._close_conn()
+		timeout = None
+		if expires is not None:
+			timeout = expires - time.time()
+			if timeout <= 0:
+				raise ActuatorTimeout("Deadline passed before connecting")
+		self._conn = self._init_server_conn(timeout)
+		self._reader = ResponseReader(self._conn)
+		if self._metrics is not None:
+			self._metrics.record_reconnect()
+
+	def block_many(self, addresses, tolerance=0.0, min_prefixlen=16,
+				   deadline=None, **kwargs):
 		"""
 		ARGUMENTS:
-			o   -id <N>
-			o   -timeout <seconds>
-		DESCRIPTION:   Adjust time-out of security directive.
-			Will adjust the timeout of a currently-active security directive to 
-			at least <seconds> from the time the directive is processed by the 
-			actuator.  This can either lengthen or shorten the expiration of the
-			affected directive.  As	with directive creation, a value of zero 
-			means the directive remains active indefinitely.
-			NOTE: See OFActuator_directives.txt for more info
+			o   addresses <list of IPv4 addresses>
+			o  [tolerance <fraction>    ]
+			o  [min_prefixlen <N>       ]
+			o  [deadline <seconds>      ]
+			o  [any BLOCK parameter except blockIP]
+		DESCRIPTION: Blocks a large list of addresses with as few BLOCK
+			directives as possible. The addresses are collapsed into a
+			minimal set of covering CIDR prefixes (see CidrAggregator.py),
+			which are then sent as one pipeline. With tolerance > 0 a prefix
+			may also cover up to that fraction of addresses not in the list.
+			No prefix shorter than min_prefixlen is used. The remaining
+			keyword arguments are passed to every BLOCK.
+
 		RETURNS:
-			@rtype: Boolean
-			@return: True if directive succeeds
+			@rtype: BlockReport
+			@return: Blocked prefixes, their directive IDs (or Exceptions for
+				rejected ones) and the prefix covering each input address
 		"""
-		poss_params = ["id", "timeout"]
-		
-		if kwargs.get("id") == None or kwargs.get("timeout") == None:
-			raise ValueError("You must specify id and timeout")
+		if "blockIP" in kwargs:
+			raise ValueError("blockIP is set by block_many from addresses")
+		values = sorted(set(ip_to_int(address) for address in addresses))
+		prefixes = aggregate(values, tolerance, min_prefixlen)
+		with self.pipeline(deadline) as pipe:
+			for network, prefixlen, lo, hi in prefixes:
+				pipe.block(blockIP=format_cidr(network, prefixlen), **kwargs)
+		return BlockReport(values, prefixes, pipe.results)
 
-		cmd_string = "ADJUST" + self._generate_args(poss_params, **kwargs)
-		self._send_command(cmd_string)
-		return True
+	def reconcile(self, desired, prune=True, dry_run=False, deadline=None):
+		"""
+		ARGUMENTS:
+			o   desired <list of (directive, params) pairs>
+			o  [prune <True/False>      ]
+			o  [dry_run <True/False>    ]
+			o  [deadline <seconds>      ]
+		DESCRIPTION: Makes the active directives match a desired set (e.g. a
+			policy) with as few directives as possible, instead of
+			"CANCEL -all" and issuing everything again. The active
+			directives are read from INFO (or from the mirror, reconciled
+			against INFO, with track_state). Missing directives are created,
+			directives whose timeout differs are ADJUSTed and, with prune,
+			directives not desired are cancelled, all in one pipeline.
+			Nothing is sent with dry_run. See ActuatorReconcile.py.
 
-	def switches(self, **kwargs):
+		RETURNS:
+			@rtype: ReconcilePlan
+			@return: The create, adjust and cancel lists and, unless dry_run,
+				the result of every directive sent
+		"""
+		if self._state is not None:
+			self._state.begin_sync()
+			self._state.replace(self.info_records(deadline))
+			current = self._state.active()
+		else:
+			current = list(self.info_records(deadline))
+		plan = ReconcilePlan(desired, current, prune)
+		if not dry_run and len(plan):
+			plan.apply(self, deadline)
+		return plan
+
+	def _pipelined_many(self, name, ids, deadline=None, **kwargs):
+		"""
+		Send one directive per ID in a single pipeline. An ID refused before
+		sending (e.g. a stale one) gets its Exception without failing the
+		others
+		"""
+		refused = []
+		with self.pipeline(deadline) as pipe:
+			for d_id in ids:
+				try:
+					getattr(pipe, name)(id=d_id, **kwargs)
+					refused.append(None)
+				except ValueError as e:
+					refused.append(e)
+		replies = iter(pipe.results)
+		return [next(replies) if error is None else error
+				for error in refused]
+
+	def cancel_many(self, ids, deadline=None):
 		"""
 		ARGUMENTS:
-			o [ -v <True/False>]
-		DESCRIPTION:   Lists the switches managed by the controller.
-			NOTE: See OFActuator_directives.txt for more info
+			o   ids <list of directive IDs>
+			o  [deadline <seconds>         ]
+		DESCRIPTION: Cancels many directives with one pipelined batch instead
+			of a round-trip per CANCEL.
+
 		RETURNS:
-			@rtype: String
-			@return: List of switches managed by the controller
+			@rtype: List
+			@return: Per ID, in order: True if cancelled, otherwise the
+				Exception describing the failure
 		"""
-		poss_params = ["v"]
+		return self._pipelined_many("cancel", ids, deadline)
 
-		cmd_string = "SWITCHES" + self._generate_args(poss_params, **kwargs)
-		data = self._send_command(cmd_string)
-		return data
+	def adjust_many(self, ids, timeout, deadline=None):
+		"""
+		ARGUMENTS:
+			o   ids <list of directive IDs>
+			o   timeout <N>
+			o  [deadline <seconds>         ]
+		DESCRIPTION: Sets the time-out of many directives with one pipelined
+			batch of ADJUSTs, e.g. to renew leases (see ActuatorLease.py).
+
+		RETURNS:
+			@rtype: List
+			@return: Per ID, in order: True if adjusted, otherwise the
+				Exception describing the failure
+		"""
+		return self._pipelined_many("adjust", ids, deadline, timeout=timeout)
 
-	def defaults(self, **kwargs):
+	def info_records(self, deadline=None, **kwargs):
 		"""
 		ARGUMENTS:
-			o  [-priority <N>           ]
-			o  [-redirectIdle <seconds> ]
-			o  [-resetAfter <seconds>   ]
-			o  [-switch <switch-id>     ]
-			o  [-timeout <seconds>      ]
-		DESCRIPTION:   Sets and displays default values for the actuator.
-			NOTE: See OFActuator_directives.txt for more info
+			o  [-id <N> 			]
+			o  [-rules <True/False> ]
+		DESCRIPTION:
+			Same as info(), but parses the response into DirectiveRecord
+			objects (see ActuatorProtocol.py) line by line as it arrives
+			instead of buffering the whole response. Directives cannot be
+			sent on this wrapper until the generator is exhausted or closed;
+			other threads using the wrapper wait for it. A deadline covers
+			the whole response, including time spent between records.
+
 		RETURNS:
-			@rtype: Boolean
-			@return: True if directive succeeds
+			@rtype: Generator
+			@return: DirectiveRecord per active directive, with id, directive,
+				params, expires (epoch seconds or None) and rules (when
+				rules=True)
 		"""
-		poss_params = ["priority", "redirectIdle", "resetAfter", "switch", 
-					   "timeout"]
+		return self._info_records(self._build_info(**kwargs),
+								  kwargs.get("rules"), self._expires(deadline))
 
-		cmd_string = "DEFAULTS" + self._generate_args(poss_params, **kwargs)
-		self._send_command(cmd_string)
-		return True
+	def _info_records(self, cmd_string, rules, expires=None):
+		"""
+		Generator behind info_records(), reading the response of cmd_string
+		by the absolute time expires
+		"""
+		metrics = self._metrics
+		if self._reconnecting:
+			self._wait_for_reconnect()
+		with self._lock:
+			self._check_not_streaming()
+			if not self._conn:
+				self._reconnect(expires)
+			if metrics is not None:
+				metrics.pre_send("INFO", cmd_string)
+				start = time.time()
+			send_all(self._conn, (cmd_string + "\n").encode("ascii"), expires)
+			lines = self._reader.iter_lines(expires)
+			if metrics is not None:
+				#[bytes received, last line]
+				totals = [0, ""]
+				lines = self._count_lines(lines, totals)
+			self._streaming = True
+			failure = None
+			try:
+				for record in parse_info_lines(lines, rules):
+					yield record
+			except socket.error as e:
+				failure = e
+				raise
+			finally:
+				if failure is None:
+					#Consume whatever the caller did not read so the next
+					#response starts at the right place
+					for line in lines:
+						pass
+				self._streaming = False
+				if failure is not None:
+					self._close_conn()
+				if metrics is not None:
+					#The response is never held whole; report its
+					#terminating line and its size
+					metrics.post_receive("INFO", cmd_string,
+										 failure or totals[1],
+										 time.time() - start, totals[0])
 
-	def shutdown(self):
+	def _count_lines(self, lines, totals):
+		"""
+		Pass lines through, keeping their total length and the last line
+		"""
+		for line in lines:
+			totals[0] += len(line)
+			totals[1] = line
+			yield line
+
+	def shutdown(self, deadline=None):
 		"""
 		ARGUMENTS: none
 		DESCRIPTION:   Terminate the actuator. Perform a "CANCEL -all" and 
@@ -435,32 +1082,18 @@ class ActuatorWrapper:
 			@return: True if directive succeeds
 		"""
 		cmd_string = "SHUTDOWN"
-		self._send_command(cmd_string)
+		self._send_command(cmd_string, deadline)
+		self._directive_done("SHUTDOWN", {}, True)
 		return True
 
-	def help(self, **kwargs):
-		"""
-		ARGUMENTS:
-			o  [<directive-name>     ]
-		DESCRIPTION:   Provides directive help-text.
-			NOTE: See OFActuator_directives.txt for more info
-		RETURNS:
-			@rtype: String
-			@return: If <directive-name> is provided and is a known directive, 
-				displays extended help-text for the directive.  Otherwise a 
-				usage summary for each directive is displayed.
-		"""
-		poss_params = ["directive-name"]
-
-		cmd_string = "HELP" + self._generate_args(poss_params, **kwargs)
-		data = self._send_command(cmd_string)
-		return data
-
-	def hostinfo(self, **kwargs):
+	def hostinfo(self, deadline=None, **kwargs):
 		"""
 		ARGUMENTS:
 			o  [-IP <IP>                ]
 		DESCRIPTION:   Provides information on hosts.
+			If the wrapper has a hostinfo_cache, lookups of a single IP are
+			answered from it while fresh, including hosts the actuator
+			reported as unknown (the cached ERROR is raised again).
 			NOTE: See OFActuator_directives.txt for more info
 		RETURNS:
 			@rtype: String
@@ -469,13 +1102,46 @@ class ActuatorWrapper:
 				path ID and port number). Otherwise (if <IP> is not provided), 
 				returns known information about all hosts in the local cache.
 		"""
-		poss_params = ["IP"]
-
-		cmd_string = "HOSTINFO" + self._generate_args(poss_params, **kwargs)
-		data = self._send_command(cmd_string)
+		cmd_string = self._build_hostinfo(**kwargs)
+		cache = self._hostinfo_cache
+		if cache is None:
+			return self._query(cmd_string, deadline)
+		ip = kwargs.get("IP")
+		if ip is None:
+			#Listing every host refreshes the whole cache for free
+			data = self._query(cmd_string, deadline)
+			cache.load_all(data)
+			return data
+		ip = str(ip)
+		found, data = cache.lookup(ip)
+		if found:
+			if isinstance(data, Exception):
+				raise data
+			return data
+		try:
+			data = self._query(cmd_string, deadline)
+		except Exception as e:
+			#Only an ERROR reply says the host is unknown
+			if str(e).startswith("ERROR"):
+				cache.store_unknown(ip, e)
+			raise
+		cache.store(ip, data)
 		return data
 
-	def quit(self):
+	def warm_hostinfo(self, deadline=None):
+		"""
+		Fill the HOSTINFO cache from one no-argument HOSTINFO listing all
+		hosts known to the actuator.
+		RETURNS:
+			@rtype: Integer
+			@return: Number of hosts cached
+		"""
+		if self._hostinfo_cache is None:
+			raise ValueError("HOSTINFO caching is not enabled for this wrapper")
+		data = self._query(self._build_hostinfo(), deadline)
+		return self._hostinfo_cache.load_all(data)
+
+	def quit(self, deadline=None):
 		"""
 		ARGUMENTS: none
 		DESCRIPTION:   Disconnects the directive source issuing the directive.
@@ -485,10 +1151,72 @@ class ActuatorWrapper:
 			@return: True if directive succeeds
 		"""
 		cmd_string = "QUIT"
-		self._send_command(cmd_string)
-		self._conn = None
+		with self._lock:
+			if self._conn:
+				try:
+					self._send_command(cmd_string, deadline)
+				except socket.error:
+					#Already disconnected
+					pass
+				self._close_conn()
 		return True
 
 	def close(self):
 		""" Utility function for "with" blocks """
 		self.quit()
+
+def _builder(spec):
+	""" Build the _build_<name> method of a directive """
+	build = spec.build
+	def builder(self, **kwargs):
+		return build(kwargs)
+	builder.__name__ = "_build_" + spec.name.lower()
+	builder.__doc__ = (" Validate %s parameters and return the directive "
+					   "string " % spec.name)
+	return builder
+
+def _pipelined_directive(spec):
+	""" Build the DirectivePipeline method queueing a directive """
+	name, build = spec.name, spec.build
+	if spec.reply == ID:
+		def directive(self, **kwargs):
+			self._queue_create(name, build(kwargs), kwargs)
+	else:
+		def directive(self, **kwargs):
+			if self._wrapper._stale_ids:
+				self._wrapper._check_stale(kwargs)
+			self._queue_directive(build(kwargs), self._return_true, name,
+								  kwargs)
+	directive.__name__ = name.lower()
+	directive.__doc__ = (" Queue %s directive. See ActuatorWrapper.%s " %
+						 (name, name.lower()))
+	return directive
+
+def _wrapper_directive(spec):
+	""" Build the ActuatorWrapper method sending a directive """
+	name, build = spec.name, spec.build
+	if spec.reply == ID:
+		def directive(self, deadline=None, **kwargs):
+			return self._create_directive(name, build(kwargs), kwargs,
+										  deadline)
+	elif spec.reply == ACK:
+		def directive(self, deadline=None, **kwargs):
+			if self._stale_ids:
+				self._check_stale(kwargs)
+			self._send_command(build(kwargs), deadline)
+			self._directive_done(name, kwargs, True)
+			return True
+	else:
+		def directive(self, deadline=None, **kwargs):
+			return self._query(build(kwargs), deadline)
+	directive.__name__ = name.lower()
+	directive.__doc__ = spec.doc
+	return directive
+
+for _name, _spec in DIRECTIVES.items():
+	setattr(DirectiveBuilder, "_build_" + _name, _builder(_spec))
+	if _spec.reply != TEXT_REPLY:
+		setattr(DirectivePipeline, _name, _pipelined_directive(_spec))
+	#Hand-written methods (e.g. hostinfo with its cache) take precedence
+	if _name not in ActuatorWrapper.__dict__:
+		setattr(ActuatorWrapper, _name, _wrapper_directive(_spec))
@@ -4,24 +4,38 @@
 # Written by Eric Ellett <eric.a.ellett@gmail.com>
 
 """
-To run this test you must have se-floodlight.jar and the OFActuator.jar running,
-you must also be running mininet (testing with 2.0) with a single switch
-topology with 3 hosts. Mac field must also be set. Example mininet deployment
-command (sudo mn --topo single,3 --mac).
+By default the tests run against SimulatedActuator, started in-process on a
+free local port, so nothing else needs to be running.
 
-If actuator is remote and/or using a different port, set the global variables 
-SERVER_IP and SERVER_PORT accordingly.
+To run them against a real actuator instead, set the environment variable
+ACTUATOR_ADDRESS to its "host:port". You must have se-floodlight.jar and the
+OFActuator.jar running, and you must also be running mininet (testing with
+2.0) with a single switch topology with 3 hosts. Mac field must also be set.
+Example mininet deployment command (sudo mn --topo single,3 --mac).
 
 Since command implementation is out of scope of the ActuatorWrapper, we only
 test basic functionality
 
 """
 
+import os
+import threading
+import time
 import unittest
-from ActuatorWrapper import ActuatorWrapper
-
-SERVER_IP = "127.0.0.1"
-SERVER_PORT = "26795"
+from ActuatorCache import HostInfoCache, QueryCoalescer
+from ActuatorMetrics import ActuatorMetrics
+from ActuatorWrapper import (ActuatorTimeout, ActuatorUnavailable,
+							 ActuatorWrapper, ConnectionLost,
+							 StaleDirectiveError)
+from SimulatedActuator import SimulatedActuator
+
+if os.environ.get("ACTUATOR_ADDRESS"):
+	SERVER_IP, SERVER_PORT = os.environ["ACTUATOR_ADDRESS"].rsplit(":", 1)
+	SIMULATOR = None
+else:
+	#Shared by the other test modules through SERVER_IP and SERVER_PORT
+	SIMULATOR = SimulatedActuator().start()
+	SERVER_IP, SERVER_PORT = SIMULATOR.address
 
 class ActuatorWrapperTest(unittest.TestCase):
 
@@ -49,6 +63,62 @@ class ActuatorWrapperTest(unittest.TestCase):
 		self.assertRaises(ValueError, self.wrapper.block, blockIP="10.0.0.1",
 						  test=1)
 
+	def test_pipeline(self):
+		""" Test normal pipelined BLOCK/CANCEL behavior. """
+		with self.wrapper.pipeline() as pipe:
+			pipe.block(blockIP="10.0.0.1", resetAfter="1")
+			pipe.block(blockIP="10.0.0.2", resetAfter="1")
+		d_ids = pipe.results
+		self.assertEqual(len(d_ids), 2)
+		for d_id in d_ids:
+			self.assertIs(type(d_id), int)
+		with self.wrapper.pipeline() as pipe:
+			for d_id in d_ids:
+				pipe.cancel(id=d_id)
+		self.assertEqual(pipe.results, [True, True])
+
+	def test_pipeline_partial_failure(self):
+		""" Test that a rejected directive does not abort the batch. """
+		with self.wrapper.pipeline() as pipe:
+			pipe.block(blockIP="10.0.0.1", resetAfter="1")
+			pipe.cancel(id=999999)
+		self.assertIs(type(pipe.results[0]), int)
+		self.assertIsInstance(pipe.results[1], Exception)
+		self.wrapper.cancel(id=pipe.results[0])
+
+	def test_pipeline_bad_params_1(self):
+		""" Test pipelined BLOCK with bad parameters. """
+		pipe = self.wrapper.pipeline()
+		self.assertRaises(ValueError, pipe.block, resetAfter=1)
+		self.assertEqual(len(pipe), 0)
+
+	def test_block_many(self):
+		""" Test bulk BLOCK of adjacent addresses. """
+		addresses = ["10.0.1.%d" % i for i in range(8)] + ["10.0.2.1"]
+		report = self.wrapper.block_many(addresses, resetAfter="1")
+		self.assertEqual(report.prefixes, ["10.0.1.0/29", "10.0.2.1"])
+		self.assertEqual(report.errors, [])
+		prefix, d_id = report.lookup("10.0.1.3")
+		self.assertIs(type(d_id), int)
+		for d_id in report.results:
+			self.wrapper.cancel(id=d_id)
+
+	def test_block_many_bad_params_1(self):
+		""" Test bulk BLOCK with an invalid address. """
+		self.assertRaises(ValueError, self.wrapper.block_many, ["10.0.0"])
+
+	def test_cancel_adjust_many(self):
+		""" Test bulk ADJUST and CANCEL of directives. """
+		d_ids = [self.wrapper.block(blockIP="10.0.4.%d" % i, timeout=60)
+				 for i in range(3)]
+		self.assertEqual(self.wrapper.adjust_many(d_ids, timeout=120),
+						 [True] * 3)
+		self.wrapper.cancel(id=d_ids[1])
+		results = self.wrapper.cancel_many(d_ids)
+		self.assertEqual(results[0], True)
+		self.assertIsInstance(results[1], Exception)
+		self.assertEqual(results[2], True)
+
 	def test_deny(self):
 		""" Test normal DENY behavior. """
 		d_id = self.wrapper.deny(IP1="10.0.0.2", resetAfter="1")
@@ -125,6 +195,25 @@ class ActuatorWrapperTest(unittest.TestCase):
 		d_str = self.wrapper.info(rules=True)
 		self.assertIn("DONE", d_str)
 		
+	def test_info_records(self):
+		""" Test INFO parsed into records. """
+		d_id = self.wrapper.block(blockIP="10.0.0.1", resetAfter="1")
+		records = dict((r.id, r) for r in self.wrapper.info_records())
+		self.wrapper.cancel(id=d_id)
+		self.assertIn(d_id, records)
+		self.assertIs(type(records[d_id].params), dict)
+
+	def test_info_records_stop_early(self):
+		""" Test that abandoning info_records() keeps the connection in sync. """
+		d_ids = [self.wrapper.block(blockIP="10.0.0.%d" % i, resetAfter="1")
+				 for i in range(1, 4)]
+		for record in self.wrapper.info_records():
+			self.assertRaises(RuntimeError, self.wrapper.switches)
+			break
+		self.assertIn("DONE", self.wrapper.switches())
+		for d_id in d_ids:
+			self.wrapper.cancel(id=d_id)
+
 	def test_info_bad_params_1(self):
 		"""	Test INFO with bad parameters. """
 		self.assertRaises(ValueError, self.wrapper.info, test=1)
@@ -207,6 +296,23 @@ class ActuatorWrapperTest(unittest.TestCase):
 		d_str = self.wrapper.hostinfo()
 		self.assertIn("DONE", d_str)
 
+	def test_hostinfo_cached(self):
+		""" Test that repeated HOSTINFO lookups are answered from the cache. """
+		cache = HostInfoCache(ttl=60)
+		wrapper = ActuatorWrapper(SERVER_IP, SERVER_PORT, hostinfo_cache=cache)
+		first = wrapper.hostinfo(IP="10.0.0.1")
+		self.assertEqual(wrapper.hostinfo(IP="10.0.0.1"), first)
+		self.assertEqual(cache.stats()["hits"], 1)
+		self.assertEqual(cache.stats()["misses"], 1)
+		wrapper.quit()
+
+	def test_warm_hostinfo(self):
+		""" Test warming the HOSTINFO cache from the full host listing. """
+		cache = HostInfoCache(ttl=60)
+		wrapper = ActuatorWrapper(SERVER_IP, SERVER_PORT, hostinfo_cache=cache)
+		self.assertEqual(wrapper.warm_hostinfo(), len(cache))
+		wrapper.quit()
+
 	def test_hostinfo_bad_params_1(self):
 		""" Test HOSTINFO with bad parameters. """
 		self.assertRaises(ValueError, self.wrapper.hostinfo, test=0)
@@ -217,6 +323,328 @@ class ActuatorWrapperTest(unittest.TestCase):
 		d_bool = temp_wrapper.quit()
 		self.assertEqual(True, d_bool)
 	
+class DirectiveStateTest(unittest.TestCase):
+	""" Tests for the local mirror of active directives (track_state). """
+
+	@classmethod
+	def setUpClass(cls):
+		cls.wrapper = ActuatorWrapper(SERVER_IP, SERVER_PORT,
+									  track_state=True, staleness=None)
+
+	@classmethod
+	def tearDownClass(cls):
+		cls.wrapper.cancel(all=True)
+		cls.wrapper.quit()
+
+	def test_issued_directives_tracked(self):
+		""" Test that issued, adjusted and cancelled directives are mirrored. """
+		d_id = self.wrapper.block(blockIP="10.0.0.1", timeout=60)
+		active = dict((r.id, r) for r in self.wrapper.active_directives())
+		self.assertEqual(active[d_id].directive, "BLOCK")
+		self.assertEqual(active[d_id].params["blockIP"], "10.0.0.1")
+		self.wrapper.adjust(id=d_id, timeout=0)
+		self.assertEqual(active[d_id].expires, None)
+		self.wrapper.cancel(id=d_id)
+		self.assertNotIn(d_id, [r.id for r in self.wrapper.active_directives()])
+
+	def test_refresh_state(self):
+		""" Test reconciling the mirror against INFO. """
+		other = ActuatorWrapper(SERVER_IP, SERVER_PORT)
+		d_id = other.block(blockIP="10.0.0.2", timeout=60)
+		self.assertNotIn(d_id, [r.id for r in self.wrapper.active_directives()])
+		self.wrapper.refresh_state()
+		self.assertIn(d_id, [r.id for r in self.wrapper.active_directives()])
+		other.cancel(id=d_id)
+		other.quit()
+
+	def test_covering_directives(self):
+		""" Test asking whether an address is blocked already. """
+		d_id = self.wrapper.block(blockIP="10.9.0.0/16", timeout=60)
+		self.assertIn(d_id, [r.id for r in
+							 self.wrapper.covering_directives("10.9.1.1")])
+		self.assertEqual(self.wrapper.covering_directives("10.10.0.1"), [])
+		self.assertIn(d_id, [r.id for r in
+							 self.wrapper.overlapping_directives("10.0.0.0/8")])
+		self.assertEqual(list(self.wrapper.covered_many(["10.9.255.255",
+														 "10.8.255.255"])),
+						 [True, False])
+		self.wrapper.cancel(id=d_id)
+		self.assertEqual(self.wrapper.covering_directives("10.9.1.1"), [])
+
+	def test_state_not_enabled(self):
+		""" Test that active_directives() needs track_state. """
+		wrapper = ActuatorWrapper(SERVER_IP, SERVER_PORT)
+		self.assertRaises(ValueError, wrapper.active_directives)
+		self.assertRaises(ValueError, wrapper.covering_directives, "10.0.0.1")
+		wrapper.quit()
+
+class DedupeTest(unittest.TestCase):
+	""" Tests for idempotent directive submission (dedupe). """
+
+	def setUp(self):
+		self.wrapper = ActuatorWrapper(SERVER_IP, SERVER_PORT, dedupe=True,
+									   staleness=None)
+
+	def tearDown(self):
+		self.wrapper.cancel(all=True)
+		self.wrapper.quit()
+
+	def test_repeat_returns_existing_id(self):
+		""" Test that a repeated directive is not created again. """
+		d_id = self.wrapper.block(blockIP="10.0.1.1", dstPort=80, timeout=60)
+		self.assertEqual(d_id, self.wrapper.deny(IP2port="80", IP1="10.0.1.1"))
+		other = self.wrapper.block(blockIP="10.0.1.2", timeout=60)
+		self.assertNotEqual(d_id, other)
+		#Unset parameters do not change the directive sent
+		self.assertEqual(other, self.wrapper.block(blockIP="10.0.1.2",
+												   style=None, linkdrop=False))
+		self.assertEqual(self.wrapper.dedupe_stats(),
+						 {"hits": 2, "misses": 2, "extended": 0})
+		#Cancelled directives are created again
+		self.wrapper.cancel(id=d_id)
+		self.assertNotEqual(d_id, self.wrapper.block(blockIP="10.0.1.1",
+													 dstPort=80))
+
+	def test_extend(self):
+		""" Test that dedupe_extend ADJUSTs the existing directive. """
+		wrapper = ActuatorWrapper(SERVER_IP, SERVER_PORT, dedupe=True,
+								  dedupe_extend=True, staleness=None)
+		d_id = wrapper.block(blockIP="10.0.1.3", timeout=60)
+		self.assertEqual(d_id, wrapper.block(blockIP="10.0.1.3", timeout=30))
+		self.assertEqual(wrapper.dedupe_stats()["extended"], 0)
+		self.assertEqual(d_id, wrapper.block(blockIP="10.0.1.3", timeout=600))
+		self.assertEqual(wrapper.dedupe_stats()["extended"], 1)
+		record = [r for r in wrapper.active_directives() if r.id == d_id][0]
+		self.assertEqual(record.params["timeout"], "600")
+		wrapper.quit()
+
+	def test_pipeline(self):
+		""" Test dedupe against active and queued directives in a pipeline. """
+		d_id = self.wrapper.block(blockIP="10.0.1.4")
+		with self.wrapper.pipeline() as pipe:
+			pipe.block(blockIP="10.0.1.4")
+			pipe.block(blockIP="10.0.1.5")
+			pipe.block(blockIP="10.0.1.5")
+		self.assertEqual(pipe.results[0], d_id)
+		self.assertEqual(pipe.results[1], pipe.results[2])
+		self.assertEqual(self.wrapper.dedupe_stats()["hits"], 2)
+
+@unittest.skipIf(SIMULATOR is None, "restarts its own simulated actuator")
+class ReconnectTest(unittest.TestCase):
+	""" Tests for automatic reconnects, replay and stale IDs. """
+
+	def setUp(self):
+		self.actuator = SimulatedActuator().start()
+		self.port = self.actuator.port
+		self.metrics = ActuatorMetrics()
+		self.wrapper = ActuatorWrapper("127.0.0.1", self.port,
+									   metrics=self.metrics)
+
+	def tearDown(self):
+		self.wrapper.quit()
+		self.actuator.stop()
+
+	def restart_actuator(self):
+		""" Replace the actuator with a fresh one on the same port. """
+		self.actuator.stop()
+		self.actuator = SimulatedActuator(port=self.port).start()
+
+	def test_restart_server_conn(self):
+		""" Test explicit reconnects and directives sent after quit(). """
+		self.wrapper.restart_server_conn()
+		self.assertIn("DONE", self.wrapper.switches())
+		self.wrapper.quit()
+		self.assertIn("DONE", self.wrapper.switches())
+		self.assertEqual(self.metrics.snapshot()["reconnects"], 2)
+
+	def test_replay(self):
+		""" Test that idempotent directives are sent again after a drop. """
+		self.actuator.inject(reply=None)
+		self.assertIn("DONE", self.wrapper.switches())
+		self.assertEqual(self.actuator.stats()["SWITCHES"], 2)
+		self.restart_actuator()
+		start = time.time()
+		self.assertIn("DONE", self.wrapper.switches())
+		self.assertLess(time.time() - start, 1.0)
+		self.assertEqual(self.metrics.snapshot()["reconnects"], 2)
+
+	def test_failed_reconcile(self):
+		""" Test that a failed reconcile INFO is retried, within deadline. """
+		wrapper = ActuatorWrapper("127.0.0.1", self.port, track_state=True,
+								  staleness=None)
+		self.actuator.inject("SWITCHES", reply=None)
+		self.actuator.inject("INFO", reply=None)
+		self.assertIn("DONE", wrapper.switches())
+		self.assertEqual(self.actuator.stats()["INFO"], 2)
+		self.actuator.latency = {"INFO": 0.5}
+		self.actuator.inject("SWITCHES", reply=None)
+		start = time.time()
+		self.assertRaises(ActuatorTimeout, wrapper.switches, deadline=0.1)
+		self.assertLess(time.time() - start, 0.3)
+		self.actuator.latency = 0.0
+		self.assertIn("DONE", wrapper.switches())
+		wrapper.quit()
+
+	def test_lost_create(self):
+		""" Test that a lost BLOCK reply is only resent when deduplicated. """
+		self.actuator.inject("BLOCK", reply=None, execute=True)
+		self.assertRaises(ConnectionLost, self.wrapper.block,
+						  blockIP="10.0.2.1")
+		self.assertTrue(self.wrapper.is_connected())
+		wrapper = ActuatorWrapper("127.0.0.1", self.port, dedupe=True,
+								  staleness=None)
+		self.actuator.inject("BLOCK", reply=None, execute=True)
+		d_id = wrapper.block(blockIP="10.0.2.2")
+		self.assertEqual(len(self.actuator.active_ids()), 2)
+		self.assertIn(d_id, self.actuator.active_ids())
+		wrapper.quit()
+
+	def test_stale_ids(self):
+		""" Test detecting IDs lost or reused across an actuator restart. """
+		reconnects = []
+		wrapper = ActuatorWrapper("127.0.0.1", self.port, track_state=True,
+								  staleness=None,
+								  on_reconnect=lambda w, ids:
+								  reconnects.append(ids))
+		d_id = wrapper.block(blockIP="10.0.2.3")
+		self.restart_actuator()
+		#Another source gets the old ID for a different directive
+		other = ActuatorWrapper("127.0.0.1", self.port)
+		self.assertEqual(other.deny(IP1="10.0.2.4"), d_id)
+		self.assertIn("DONE", wrapper.switches())
+		self.assertEqual(reconnects, [set([d_id])])
+		self.assertEqual(wrapper.stale_ids(), set([d_id]))
+		self.assertRaises(StaleDirectiveError, wrapper.cancel, id=d_id)
+		self.assertEqual(self.actuator.active_ids(), [d_id])
+		self.assertEqual([r.id for r in wrapper.active_directives()], [d_id])
+		wrapper.quit()
+		other.quit()
+
+	def test_unavailable(self):
+		""" Test giving up on an actuator that does not come back. """
+		wrapper = ActuatorWrapper("127.0.0.1", self.port,
+								  reconnect_timeout=0.1)
+		self.actuator.stop()
+		start = time.time()
+		self.assertRaises(ActuatorUnavailable, wrapper.switches)
+		self.assertLess(time.time() - start, 0.5)
+		self.actuator = SimulatedActuator(port=self.port).start()
+		self.assertIn("DONE", wrapper.switches())
+		wrapper.quit()
+
+	def test_max_pending(self):
+		""" Test that only max_pending directives wait for a reconnect. """
+		wrapper = ActuatorWrapper("127.0.0.1", self.port,
+								  reconnect_timeout=0.5, max_pending=1)
+		self.actuator.stop()
+		results = []
+		def send():
+			try:
+				results.append(wrapper.switches())
+			except ActuatorUnavailable as e:
+				results.append(e)
+		threads = [threading.Thread(target=send) for i in range(3)]
+		threads[0].start()
+		while not wrapper._reconnecting:
+			time.sleep(0.001)
+		for thread in threads[1:]:
+			thread.start()
+		time.sleep(0.1)
+		self.actuator = SimulatedActuator(port=self.port).start()
+		for thread in threads:
+			thread.join()
+		failed = [r for r in results if isinstance(r, ActuatorUnavailable)]
+		self.assertEqual(len(failed), 1)
+		wrapper.quit()
+
+
+class QueryCoalescingTest(unittest.TestCase):
+	""" Tests for sharing read-only queries between threads. """
+
+	def setUp(self):
+		self.actuator = SimulatedActuator(rtt=0.05).start()
+		self.coalescer = QueryCoalescer(window=60)
+		self.wrappers = [ActuatorWrapper(*self.actuator.address,
+										 query_coalescer=self.coalescer)
+						 for i in range(4)]
+
+	def tearDown(self):
+		for wrapper in self.wrappers:
+			wrapper.quit()
+		self.actuator.stop()
+
+	def test_concurrent_info(self):
+		""" Test that concurrent INFO calls reach the actuator once. """
+		results = []
+		threads = [threading.Thread(target=lambda w=wrapper:
+									results.append(w.info()))
+				   for wrapper in self.wrappers * 2]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+		self.assertEqual(len(results), 8)
+		self.assertEqual(len(set(results)), 1)
+		self.assertEqual(self.actuator.stats()["INFO"], 1)
+		self.assertEqual(self.wrappers[0].switches(),
+						 self.wrappers[1].switches())
+		self.assertEqual(self.actuator.stats()["SWITCHES"], 1)
+
+	def test_directive_invalidates(self):
+		""" Test that INFO after a new directive lists it. """
+		self.wrappers[0].info()
+		d_id = self.wrappers[1].block(blockIP="10.0.0.1")
+		self.assertIn(" %d:" % d_id, self.wrappers[0].info())
+		self.assertEqual(self.actuator.stats()["INFO"], 2)
+
+	def test_warm_hostinfo(self):
+		""" Test that warming the HOSTINFO cache joins a listing query. """
+		wrapper = ActuatorWrapper(*self.actuator.address,
+								  query_coalescer=self.coalescer,
+								  hostinfo_cache=HostInfoCache())
+		listing = threading.Thread(target=self.wrappers[0].hostinfo)
+		listing.start()
+		self.assertEqual(wrapper.warm_hostinfo(), 3)
+		listing.join()
+		self.assertEqual(self.actuator.stats()["HOSTINFO"], 1)
+		wrapper.quit()
+
+
+class DeadlineTest(unittest.TestCase):
+	""" Tests for per-call and default deadlines against a slow actuator. """
+
+	def setUp(self):
+		self.actuator = SimulatedActuator(rtt=0.2).start()
+
+	def tearDown(self):
+		self.actuator.stop()
+
+	def test_deadline(self):
+		""" Test that a late reply raises ActuatorTimeout and is discarded. """
+		wrapper = ActuatorWrapper(*self.actuator.address)
+		start = time.time()
+		self.assertRaises(ActuatorTimeout, wrapper.info, deadline=0.05)
+		self.assertTrue(time.time() - start < 0.15)
+		self.assertFalse(wrapper.is_connected())
+		#The next directive gets its own reply on a new connection
+		self.assertIs(type(wrapper.block(blockIP="10.0.0.1")), int)
+		self.assertRaises(ValueError, wrapper.info, deadline=0)
+		wrapper.quit()
+
+	def test_default_deadline(self):
+		""" Test the wrapper-wide deadline and overriding it per call. """
+		wrapper = ActuatorWrapper(*self.actuator.address, deadline=0.05)
+		self.assertRaises(ActuatorTimeout, wrapper.block, blockIP="10.0.0.2")
+		self.assertTrue(wrapper.switches(deadline=2).endswith("DONE\n"))
+		with wrapper.pipeline() as pipe:
+			pipe.block(blockIP="10.0.0.3")
+			pipe.deny(IP1="10.0.0.4")
+			self.assertRaises(ActuatorTimeout, pipe.flush)
+		self.assertEqual(len(wrapper.cancel_many([1, 2], deadline=2)), 2)
+		wrapper.quit()
+		self.assertRaises(ValueError, ActuatorWrapper, *self.actuator.address,
+						  deadline=-1)
+
 
 if __name__ == '__main__':
 	unittest.main()
\ No newline at end of file
@@ -0,0 +1,231 @@
+#!/usr/bin/python
+# AddressIndex.py - Interval index over the CIDR prefixes of directives
+# Works with Python 2.7 and 3
+
+"""
+Answers "does an active directive already cover this address?" without
+asking the actuator. Used by DirectiveCache (see ActuatorCache.py) to index
+the addresses of the directives it mirrors; see
+ActuatorWrapper.covering_directives().
+
+Two CIDR prefixes are always either disjoint or nested, so the prefixes cut
+the IPv4 address space into segments, each covered by a chain of nested
+prefixes. The index keeps the sorted segment boundaries, the innermost prefix
+of every segment and each prefix's enclosing prefix. A point lookup is then a
+binary search (O(log n)) plus a walk up the chain for the prefixes covering
+it, and an overlap query a binary search over the sorted prefix starts.
+
+contains_many() checks a whole array of addresses at once. With NumPy
+installed the binary searches run vectorized (numpy.searchsorted) over a
+uint32 array; without it they fall back to the bisect module.
+"""
+
+import bisect
+import numbers
+import re
+
+from CidrAggregator import format_cidr, ip_to_int
+
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
+_CIDR = re.compile(r"^\s*(\d{1,3}(?:\.\d{1,3}){3})(?:/(\d{1,2}))?\s*$")
+
+def parse_cidr(text):
+	"""
+	Parse "a.b.c.d" or "a.b.c.d/len" into (first, last) address integers of
+	the prefix. Host bits set in the address are ignored. Raises ValueError
+	for anything else
+	"""
+	match = _CIDR.match(str(text))
+	if not match:
+		raise ValueError("Invalid IPv4 prefix: \"" + str(text) + "\"")
+	prefixlen = int(match.group(2) or 32)
+	if prefixlen > 32:
+		raise ValueError("Invalid IPv4 prefix: \"" + str(text) + "\"")
+	hostmask = (1 << (32 - prefixlen)) - 1
+	first = ip_to_int(match.group(1)) & ~hostmask
+	return first, first | hostmask
+
+def address_int(address):
+	""" Address integer of a dotted IPv4 address or an integer """
+	if isinstance(address, numbers.Integral):
+		address = int(address)
+		if not 0 <= address <= 0xffffffff:
+			raise ValueError("Address integer out of range: " + str(address))
+		return address
+	return ip_to_int(address)
+
+class AddressIndex(object):
+	"""
+	Immutable index of CIDR prefixes, each carrying a value (e.g. the
+	DirectiveRecord that blocks it). Build a new index when the prefixes
+	change; building sorts the prefixes once, O(n log n).
+	"""
+
+	def __init__(self, prefixes=()):
+		"""
+		ARGUMENTS:
+			o  prefixes: (CIDR or (first, last) address integers, value)
+				pairs. The same prefix may appear with several values
+		"""
+		entries = []
+		for prefix, value in prefixes:
+			if not isinstance(prefix, tuple):
+				prefix = parse_cidr(prefix)
+			entries.append((prefix[0], -prefix[1], len(entries), value))
+		#Enclosing prefixes sort before the prefixes nested in them
+		entries.sort(key=lambda entry: entry[:3])
+		self._starts = [entry[0] for entry in entries]
+		self._lasts = [-entry[1] for entry in entries]
+		self._values = [entry[3] for entry in entries]
+		#Index of the prefix directly enclosing each prefix, -1 for none
+		self._parent = []
+		#Segment k is [bounds[k], bounds[k + 1]); owner[k] is the innermost
+		#prefix covering it, -1 for none
+		self._bounds = []
+		self._owner = []
+		ends = sorted(set(last + 1 for last in self._lasts))
+		stack = []
+		i = 0
+		j = 0
+		while i < len(entries) or j < len(ends):
+			if j == len(ends) or (i < len(entries) and
+								  self._starts[i] < ends[j]):
+				bound = self._starts[i]
+			else:
+				bound = ends[j]
+				j += 1
+			while stack and self._lasts[stack[-1]] < bound:
+				stack.pop()
+			while i < len(entries) and self._starts[i] == bound:
+				self._parent.append(stack[-1] if stack else -1)
+				stack.append(i)
+				i += 1
+			if self._bounds and self._bounds[-1] == bound:
+				self._owner[-1] = stack[-1] if stack else -1
+			else:
+				self._bounds.append(bound)
+				self._owner.append(stack[-1] if stack else -1)
+		self._arrays = None
+
+	def __len__(self):
+		return len(self._values)
+
+	def _segment_owner(self, value):
+		""" Innermost prefix covering an address integer, -1 for none """
+		k = bisect.bisect_right(self._bounds, value) - 1
+		return self._owner[k] if k >= 0 else -1
+
+	def _chain(self, i):
+		""" Values of prefix i and its enclosing prefixes, innermost first """
+		values = []
+		while i >= 0:
+			values.append(self._values[i])
+			i = self._parent[i]
+		return values
+
+	def contains(self, address):
+		"""
+		RETURNS:
+			@rtype: Boolean
+			@return: Whether any prefix covers address (dotted or integer)
+		"""
+		return self._segment_owner(address_int(address)) >= 0
+
+	def covering(self, address):
+		"""
+		RETURNS:
+			@rtype: List
+			@return: Values of the prefixes covering address, innermost
+				(longest) prefix first
+		"""
+		return self._chain(self._segment_owner(address_int(address)))
+
+	def overlapping(self, cidr):
+		"""
+		RETURNS:
+			@rtype: List
+			@return: Values of the prefixes that overlap cidr: those covering
+				it and those inside it, in address order of their prefixes
+		"""
+		first, last = parse_cidr(cidr)
+		inside = bisect.bisect_left(self._starts, first)
+		#Prefixes starting before cidr overlap it only if they enclose it
+		outer = self._segment_owner(first)
+		while outer >= inside:
+			outer = self._parent[outer]
+		enclosing = self._chain(outer)
+		enclosing.reverse()
+		end = bisect.bisect_right(self._starts, last, inside)
+		return enclosing + self._values[inside:end]
+
+	def overlaps(self, cidr):
+		"""
+		RETURNS:
+			@rtype: Boolean
+			@return: Whether any prefix overlaps cidr, in O(log n)
+		"""
+		first, last = parse_cidr(cidr)
+		if self._segment_owner(first) >= 0:
+			return True
+		i = bisect.bisect_left(self._starts, first)
+		return i < len(self._starts) and self._starts[i] <= last
+
+	def contains_many(self, addresses):
+		"""
+		ARGUMENTS:
+			o  addresses: Iterable of dotted addresses or address integers,
+				or a NumPy integer array. Raises ValueError for integers
+				outside 0 to 2**32 - 1
+		DESCRIPTION:
+			Check many addresses at once, e.g. a triage list against the
+			active blocks. NumPy arrays are checked vectorized.
+		RETURNS:
+			@rtype: List or numpy.ndarray
+			@return: Per address, whether any prefix covers it: a bool
+				array when NumPy is installed, otherwise a list of bools
+		"""
+		if numpy is None:
+			owner, bounds = self._owner, self._bounds
+			search = bisect.bisect_right
+			covered = []
+			for address in addresses:
+				k = search(bounds, address_int(address)) - 1
+				covered.append(k >= 0 and owner[k] >= 0)
+			return covered
+		if not isinstance(addresses, numpy.ndarray):
+			#Validated one by one, so the cast cannot wrap
+			addresses = numpy.fromiter((address_int(address)
+										for address in addresses),
+									   numpy.uint32)
+		if self._arrays is None:
+			#The segment past the last address (bound 2**32) covers nothing
+			#and does not fit a uint32
+			count = bisect.bisect_left(self._bounds, 1 << 32)
+			#One extra False segment answers addresses before the first one
+			self._arrays = (numpy.array(self._bounds[:count], numpy.uint32),
+							numpy.append(numpy.array(self._owner[:count],
+													 numpy.int64) >= 0,
+										 False))
+		bounds, covered = self._arrays
+		if addresses.dtype != numpy.uint32:
+			#astype() would silently wrap out of range values
+			if addresses.size and (addresses.min() < 0 or
+								   addresses.max() > 0xffffffff):
+				raise ValueError("Address integers must be 0 to 2**32 - 1")
+			addresses = addresses.astype(numpy.uint32)
+		segments = numpy.searchsorted(bounds, addresses, "right") - 1
+		return covered[segments]
+
+	def prefixes(self):
+		"""
+		RETURNS:
+			@rtype: List
+			@return: (CIDR, value) per indexed prefix, in address order
+		"""
+		return [(format_cidr(first, 32 - (last - first).bit_length()), value)
+				for first, last, value in zip(self._starts, self._lasts,
+											  self._values)]
@@ -0,0 +1,108 @@
+#!/usr/bin/python
+# AddressIndexTest.py - Test for the CIDR interval index
+# Works with Python 2.7 and 3
+
+"""
+Tests AddressIndex lookups on nested prefixes and against a brute-force scan
+of random prefixes. No actuator needed.
+"""
+
+import random
+import unittest
+
+from AddressIndex import AddressIndex, numpy, parse_cidr
+from CidrAggregator import int_to_ip, ip_to_int
+
+class AddressIndexTest(unittest.TestCase):
+
+	def setUp(self):
+		self.index = AddressIndex([("10.0.0.0/8", "a"), ("10.1.0.0/16", "b"),
+								   ("10.1.2.3", "c"), ("10.1.0.0/16", "d"),
+								   ("192.168.0.0/24", "e"), ("0.0.0.0/0", "f"),
+								   ("255.255.255.255", "g")])
+
+	def test_covering(self):
+		""" Test point lookups through nested prefixes. """
+		self.assertEqual(self.index.covering("10.1.2.3"),
+						 ["c", "d", "b", "a", "f"])
+		self.assertEqual(self.index.covering("10.1.2.4"), ["d", "b", "a", "f"])
+		self.assertEqual(self.index.covering(ip_to_int("10.2.0.0")),
+						 ["a", "f"])
+		self.assertEqual(self.index.covering("255.255.255.255"), ["g", "f"])
+		self.assertTrue(self.index.contains("11.0.0.0"))
+		empty = AddressIndex()
+		self.assertFalse(empty.contains("10.0.0.1"))
+		self.assertEqual(empty.covering("10.0.0.1"), [])
+
+	def test_overlapping(self):
+		""" Test finding enclosing and enclosed prefixes of a range. """
+		index = AddressIndex([("10.0.0.0/8", "a"), ("10.1.0.0/16", "b"),
+							  ("10.1.2.3", "c"), ("10.2.0.0/16", "d"),
+							  ("192.168.0.0/24", "e")])
+		self.assertEqual(index.overlapping("10.1.0.0/15"), ["a", "b", "c"])
+		self.assertEqual(index.overlapping("10.1.2.0/24"), ["a", "b", "c"])
+		self.assertEqual(index.overlapping("0.0.0.0/0"),
+						 ["a", "b", "c", "d", "e"])
+		self.assertEqual(index.overlapping("172.16.0.0/12"), [])
+		self.assertTrue(index.overlaps("192.168.0.128/25"))
+		self.assertTrue(index.overlaps("192.0.0.0/8"))
+		self.assertFalse(index.overlaps("192.168.1.0/24"))
+		self.assertEqual(index.prefixes()[:3], [("10.0.0.0/8", "a"),
+												("10.1.0.0/16", "b"),
+												("10.1.2.3", "c")])
+
+	def test_contains_many(self):
+		""" Test checking a list of addresses at once. """
+		addresses = ["10.1.2.3", "9.255.255.255", ip_to_int("10.255.0.1"),
+					 "11.0.0.0", "192.168.0.255"]
+		index = AddressIndex([("10.0.0.0/8", 1), ("192.168.0.0/24", 2)])
+		expected = [True, False, True, False, True]
+		self.assertEqual(list(index.contains_many(addresses)), expected)
+		self.assertEqual(list(AddressIndex().contains_many(addresses)),
+						 [False] * 5)
+		self.assertEqual(list(index.contains_many(a for a in addresses)),
+						 expected)
+		outside = ip_to_int("10.0.0.5") + (1 << 32)
+		self.assertRaises(ValueError, index.contains_many, [outside])
+		self.assertRaises(ValueError, index.contains_many, [-1])
+		if numpy is not None:
+			values = numpy.array([ip_to_int(a) if isinstance(a, str) else a
+								  for a in addresses], numpy.uint32)
+			self.assertEqual(index.contains_many(values).tolist(), expected)
+			self.assertRaises(ValueError, index.contains_many,
+							  numpy.array([outside], numpy.int64))
+
+	def test_random(self):
+		""" Test lookups against a brute-force scan of random prefixes. """
+		rand = random.Random(7)
+		prefixes = []
+		for i in range(300):
+			prefixlen = rand.choice([8, 12, 16, 20, 24, 28, 32])
+			address = int_to_ip(rand.randrange(1 << 32) & 0x0fffffff)
+			prefixes.append(("%s/%d" % (address, prefixlen), i))
+		index = AddressIndex(prefixes)
+		ranges = [(parse_cidr(cidr), i) for cidr, i in prefixes]
+		probes = [rand.randrange(1 << 28) for i in range(500)]
+		probes += [first for (first, last), i in ranges]
+		probes += [last for (first, last), i in ranges]
+		covered = index.contains_many(probes)
+		for value, is_covered in zip(probes, covered):
+			expected = set(i for (first, last), i in ranges
+						   if first <= value <= last)
+			self.assertEqual(set(index.covering(value)), expected)
+			self.assertEqual(bool(is_covered), bool(expected))
+		for cidr, i in prefixes[:50]:
+			lo, hi = parse_cidr(cidr)
+			expected = set(j for (first, last), j in ranges
+						   if first <= hi and lo <= last)
+			self.assertEqual(set(index.overlapping(cidr)), expected)
+
+	def test_invalid(self):
+		""" Test that bad prefixes raise ValueError. """
+		self.assertRaises(ValueError, AddressIndex, [("10.0.0.0/33", 1)])
+		self.assertRaises(ValueError, AddressIndex, [("host.example", 1)])
+		self.assertRaises(ValueError, self.index.contains, "10.0.0")
+
+
+if __name__ == '__main__':
+	unittest.main()
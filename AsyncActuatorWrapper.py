@@ -0,0 +1,286 @@
+#!/usr/bin/python3
+# AsyncActuatorWrapper.py - asyncio wrapper for openflowsec.org's OF-Actuator
+# Requires Python 3.7+ (asyncio streams). ActuatorWrapper.py must be importable
+
+"""
+asyncio version of ActuatorWrapper. Every directive method is a coroutine and
+all callers share a single connection to the actuator:
+
+	wrapper = await AsyncActuatorWrapper.connect(<ACTUATOR_IP>, <ACTUATOR_PORT>)
+	d_ids = await asyncio.gather(*[wrapper.block(blockIP=ip) for ip in ips])
+	await wrapper.close()
+
+The actuator answers directives in the order it receives them, so each
+directive written to the connection queues a future and a single reader task
+resolves those futures in the same order as responses arrive. Any number of
+directives can be in flight without a thread per directive.
+
+The directive coroutines are generated from the DirectiveSchema table, so
+parameters are validated exactly as in ActuatorWrapper and the lines are
+encoded straight to the bytes written; see ActuatorWrapper.py for the
+directive documentation.
+
+With coalesce_queries, concurrent identical INFO, SWITCHES, HOSTINFO and HELP
+calls share one request in flight; with query_window its response also
+answers identical calls for that many seconds. A directive sent on the
+wrapper that changes what INFO lists is never answered by an INFO sent
+before it.
+"""
+
+import asyncio
+import collections
+import functools
+import re
+
+from ActuatorWrapper import DirectiveBuilder
+from DirectiveSchema import ACK, DIRECTIVES, ID
+
+#Read-only directives whose identical requests may share a response
+_QUERIES = ("INFO", "SWITCHES", "HOSTINFO", "HELP")
+#Most responses kept for query_window
+_MAX_KEPT = 256
+
+class AsyncActuatorWrapper(DirectiveBuilder):
+	""" asyncio wrapper class for the openflowsec.org's OF-Actuator """
+
+	def __init__(self, server_ip="127.0.0.1", server_port=26795,
+				 coalesce_queries=False, query_window=0.0):
+		"""
+		ARGUMENTS:
+			o  server_ip, server_port: Actuator address
+			o  coalesce_queries: Share one request among concurrent identical
+				read-only queries
+			o  query_window: Seconds a query's response keeps answering
+				identical queries. Implies coalesce_queries
+		"""
+		self._server_ip = server_ip
+		self._server_port = server_port
+		self._reader = None
+		self._writer = None
+		self._reader_task = None
+		self._waiters = collections.deque()
+		self._write_lock = None
+		#Serializes opening the connection on first use
+		self._connect_lock = None
+		self._coalesce = coalesce_queries or query_window > 0
+		self._query_window = query_window
+		#Directive line -> task of the query in flight for it
+		self._flights = {}
+		#Directive line -> (expires, response) kept for query_window
+		self._kept = {}
+
+	@classmethod
+	async def connect(cls, server_ip="127.0.0.1", server_port=26795,
+					  **kwargs):
+		"""
+		Create a wrapper and open its connection to the actuator. Keyword
+		arguments are passed to the constructor
+		"""
+		wrapper = cls(server_ip, server_port, **kwargs)
+		await wrapper._ensure_connected()
+		return wrapper
+
+	async def __aenter__(self):
+		await self._ensure_connected()
+		return self
+
+	async def __aexit__(self, exc_type, exc_value, traceback):
+		await self.close()
+
+	async def _init_server_conn(self):
+		"""
+		Open the connection and start the task reading responses from it
+		"""
+		#Let default socket exception be thrown back to user
+		self._reader, self._writer = await asyncio.open_connection(
+			self._server_ip, self._server_port)
+		self._reader_task = asyncio.ensure_future(self._read_responses())
+		if self._write_lock is None:
+			self._write_lock = asyncio.Lock()
+
+	async def _ensure_connected(self):
+		"""
+		Open the connection unless it is open. Concurrent first callers wait
+		for one connection instead of each opening their own
+		"""
+		if self._connect_lock is None:
+			self._connect_lock = asyncio.Lock()
+		async with self._connect_lock:
+			if self._writer is None:
+				await self._init_server_conn()
+
+	async def _read_responses(self):
+		"""
+		Read responses off the connection and hand each one to the oldest
+		directive still waiting for a reply
+		"""
+		lines = []
+		try:
+			while 1:
+				line = await self._reader.readline()
+				if not line:
+					raise ConnectionError("Connection closed by actuator")
+				line = line.decode("ascii", "replace")
+				lines.append(line)
+				if not self._is_response_end(line):
+					continue
+				data = "".join(lines)
+				lines = []
+				if not self._waiters:
+					#Nobody asked for this response; drop it
+					continue
+				waiter = self._waiters.popleft()
+				if not waiter.done():
+					waiter.set_result(data)
+		except asyncio.CancelledError:
+			self._fail_waiters(ConnectionError("Connection closed"))
+			raise
+		except Exception as e:
+			self._fail_waiters(e)
+
+	def _fail_waiters(self, error):
+		""" Fail every directive still waiting for a response """
+		while self._waiters:
+			waiter = self._waiters.popleft()
+			if not waiter.done():
+				waiter.set_exception(error)
+
+	async def _send_command(self, directive):
+		"""
+		Send directive string to server and return response
+		"""
+		#Check for ASCII encoding
+		if type(directive) != str:
+			raise ValueError("Directive must be in ASCII")
+		return await self._send_payload((directive + "\n").encode("ascii"),
+										directive.startswith(_QUERIES))
+
+	async def _send_payload(self, payload, query=False):
+		"""
+		Send an encoded directive line (bytes ending in a newline) and return
+		the response. query tells read-only directives apart
+		"""
+		await self._ensure_connected()
+		if self._coalesce and not query:
+			#INFO calls from here on must see this directive
+			self._forget("INFO")
+		waiter = asyncio.get_running_loop().create_future()
+		#Queue the waiter and write under one lock so that waiter order
+		#always matches the order directives hit the wire
+		async with self._write_lock:
+			#Checked under the lock: the reader may have died while this
+			#caller waited for it, and would never resolve the waiter
+			if self._reader_task is None or self._reader_task.done():
+				raise ConnectionError("Connection to actuator is closed")
+			self._waiters.append(waiter)
+			self._writer.write(payload)
+			await self._writer.drain()
+		data = await waiter
+
+		if re.match("ERROR", data):
+			raise Exception(data)
+
+		return data
+
+	async def _query(self, directive):
+		"""
+		Send a read-only directive, or share the response of an identical
+		one in flight or kept for query_window
+		"""
+		if not self._coalesce:
+			return await self._send_command(directive)
+		kept = self._kept.get(directive)
+		if kept is not None:
+			if kept[0] > asyncio.get_running_loop().time():
+				return kept[1]
+			del self._kept[directive]
+		flight = self._flights.get(directive)
+		if flight is None:
+			flight = asyncio.ensure_future(self._send_command(directive))
+			self._flights[directive] = flight
+			flight.add_done_callback(functools.partial(self._landed,
+													   directive))
+		#A cancelled caller must not cancel the request others wait for
+		return await asyncio.shield(flight)
+
+	def _landed(self, directive, flight):
+		""" Retire a finished query, keeping its response for the window """
+		if self._flights.get(directive) is not flight:
+			#Forgotten meanwhile
+			return
+		del self._flights[directive]
+		if (self._query_window and not flight.cancelled() and
+				flight.exception() is None):
+			if len(self._kept) >= _MAX_KEPT:
+				self._kept.clear()
+			self._kept[directive] = (flight.get_loop().time() +
+									 self._query_window, flight.result())
+
+	def _forget(self, directive_type):
+		""" Stop sharing queries of one directive type """
+		for table in (self._flights, self._kept):
+			for directive in list(table):
+				if directive.split(" ", 1)[0] == directive_type:
+					del table[directive]
+
+	async def shutdown(self):
+		""" SHUTDOWN directive. See ActuatorWrapper.shutdown """
+		await self._send_command("SHUTDOWN")
+		return True
+
+	async def quit(self):
+		"""
+		QUIT directive. See ActuatorWrapper.quit. Waits for the responses of
+		directives already in flight before disconnecting
+		"""
+		if self._writer is None:
+			return True
+		#QUIT closes socket and expects no response
+		async with self._write_lock:
+			try:
+				#No directive is written while the lock is held. Cancelled
+				#callers' waiters are done already, and a dying reader fails
+				#the others
+				pending = [waiter for waiter in self._waiters
+						   if not waiter.done()]
+				if pending:
+					await asyncio.wait(pending)
+				if not self._reader_task.done():
+					self._writer.write(b"QUIT\n")
+					await self._writer.drain()
+			except OSError:
+				#Already disconnected
+				pass
+			finally:
+				self._reader_task.cancel()
+				self._writer.close()
+				self._reader = self._writer = self._reader_task = None
+		return True
+
+	async def close(self):
+		""" Utility function for "async with" blocks """
+		await self.quit()
+
+def _async_directive(spec):
+	""" Build the AsyncActuatorWrapper coroutine sending a directive """
+	name, build, encode = spec.name, spec.build, spec.encode
+	if spec.reply == ID:
+		async def directive(self, **kwargs):
+			data = await self._send_payload(encode(kwargs))
+			return self._extract_directive_id(data)
+	elif spec.reply == ACK:
+		async def directive(self, **kwargs):
+			await self._send_payload(encode(kwargs))
+			return True
+	else:
+		#The line is the key identical queries share a response under
+		async def directive(self, **kwargs):
+			return await self._query(build(kwargs))
+	directive.__name__ = name.lower()
+	directive.__doc__ = (" %s directive. See ActuatorWrapper.%s " %
+						 (name, name.lower()))
+	return directive
+
+for _name, _spec in DIRECTIVES.items():
+	if _name not in AsyncActuatorWrapper.__dict__:
+		setattr(AsyncActuatorWrapper, _name, _async_directive(_spec))
@@ -0,0 +1,165 @@
+#!/usr/bin/python3
+# AsyncActuatorWrapperTest.py - Test for asyncio wrapper for OF-Actuator
+# Requires Python 3.7+
+
+"""
+Same requirements as ActuatorWrapperTest.py: a running se-floodlight.jar,
+OFActuator.jar and mininet single switch topology. SERVER_IP and SERVER_PORT
+are shared with ActuatorWrapperTest.
+
+Only the asyncio specifics (shared connection, response ordering) are tested
+here, directive validation is covered by ActuatorWrapperTest
+"""
+
+import sys
+import unittest
+
+import ActuatorWrapperTest
+
+if sys.version_info >= (3, 7):
+	import asyncio
+	from AsyncActuatorWrapper import AsyncActuatorWrapper
+
+@unittest.skipIf(sys.version_info < (3, 7), "asyncio wrapper requires 3.7+")
+class AsyncActuatorWrapperTest(unittest.TestCase):
+
+	def run_async(self, coro):
+		return asyncio.run(coro)
+
+	def connect(self):
+		return AsyncActuatorWrapper.connect(ActuatorWrapperTest.SERVER_IP,
+											ActuatorWrapperTest.SERVER_PORT)
+
+	def test_block(self):
+		""" Test normal BLOCK behavior. """
+		async def run():
+			async with await self.connect() as wrapper:
+				d_id = await wrapper.block(blockIP="10.0.0.1", resetAfter="1")
+				await wrapper.cancel(id=d_id)
+				return d_id
+		self.assertIs(type(self.run_async(run())), int)
+
+	def test_concurrent_directives(self):
+		""" Test many concurrent directives sharing one connection. """
+		async def run():
+			async with await self.connect() as wrapper:
+				d_ids = await asyncio.gather(*[
+					wrapper.block(blockIP="10.0.%d.1" % i, resetAfter="1")
+					for i in range(100)])
+				info = await wrapper.info()
+				await asyncio.gather(*[wrapper.cancel(id=d_id)
+									   for d_id in d_ids])
+				return d_ids, info
+		d_ids, info = self.run_async(run())
+		self.assertEqual(len(set(d_ids)), 100)
+		self.assertIn("DONE", info)
+
+	def test_error_does_not_desync(self):
+		""" Test that an ERROR reply only fails its own directive. """
+		async def run():
+			async with await self.connect() as wrapper:
+				results = await asyncio.gather(
+					wrapper.cancel(id=999999), wrapper.switches(),
+					return_exceptions=True)
+				return results
+		results = self.run_async(run())
+		self.assertIsInstance(results[0], Exception)
+		self.assertIn("DONE", results[1])
+
+	def test_coalesce_queries(self):
+		""" Test that concurrent identical queries share one request. """
+		from SimulatedActuator import SimulatedActuator
+		async def run(address):
+			wrapper = await AsyncActuatorWrapper.connect(
+				*address, coalesce_queries=True)
+			async with wrapper:
+				infos = await asyncio.gather(*[wrapper.info()
+											   for i in range(10)])
+				d_id = await wrapper.block(blockIP="10.0.0.1")
+				info = await wrapper.info()
+				return infos, d_id, info
+		with SimulatedActuator() as actuator:
+			infos, d_id, info = self.run_async(run(actuator.address))
+			self.assertEqual(actuator.stats()["INFO"], 2)
+		self.assertEqual(len(set(infos)), 1)
+		self.assertIn(" %d:" % d_id, info)
+
+	def test_first_use(self):
+		""" Test concurrent first directives and a reader that dies. """
+		from SimulatedActuator import SimulatedActuator
+		async def run(address):
+			wrapper = AsyncActuatorWrapper(*address)
+			d_ids = await asyncio.gather(*[
+				wrapper.block(blockIP="10.0.1.%d" % i) for i in range(10)])
+			connections = len(actuator._server.connections)
+			async with wrapper._write_lock:
+				pending = asyncio.ensure_future(wrapper.switches())
+				await asyncio.sleep(0)
+				wrapper._reader_task.cancel()
+				await asyncio.sleep(0)
+			try:
+				await asyncio.wait_for(pending, 1)
+			except ConnectionError:
+				pending = None
+			await wrapper.close()
+			return d_ids, connections, pending
+		with SimulatedActuator() as actuator:
+			d_ids, connections, pending = self.run_async(
+				run(actuator.address))
+		self.assertEqual(len(set(d_ids)), 10)
+		self.assertEqual(connections, 1)
+		self.assertIsNone(pending)
+
+	def test_quit(self):
+		""" Test quitting with a cancelled directive and a dead reader. """
+		from SimulatedActuator import SimulatedActuator
+		async def run(actuator):
+			wrapper = await AsyncActuatorWrapper.connect(*actuator.address)
+			pending = asyncio.ensure_future(wrapper.block(blockIP="10.0.3.1"))
+			await asyncio.sleep(0.05)
+			pending.cancel()
+			loop = asyncio.get_running_loop()
+			start = loop.time()
+			await wrapper.quit()
+			waited = loop.time() - start
+			await wrapper.switches()
+			actuator.stop()
+			await asyncio.wait_for(wrapper._reader_task, 1)
+			closed = await wrapper.quit()
+			return waited, closed, wrapper._writer
+		actuator = SimulatedActuator(latency={"BLOCK": 1.0}).start()
+		try:
+			waited, closed, writer = self.run_async(run(actuator))
+		finally:
+			actuator.stop()
+		self.assertTrue(waited < 0.5)
+		self.assertIs(closed, True)
+		self.assertIsNone(writer)
+
+	def test_schema_directives(self):
+		""" Test the coroutines generated from the directive schema. """
+		from DirectiveSchema import DIRECTIVES
+		from SimulatedActuator import SimulatedActuator
+		for name in DIRECTIVES:
+			self.assertTrue(asyncio.iscoroutinefunction(
+				getattr(AsyncActuatorWrapper, name)), name)
+		async def run(address):
+			async with await AsyncActuatorWrapper.connect(*address) as wrapper:
+				d_id = await wrapper.deny(IP1="10.0.2.1")
+				return (d_id, await wrapper.adjust(id=d_id, timeout=60),
+						await wrapper.hostinfo())
+		with SimulatedActuator() as actuator:
+			d_id, adjusted, hostinfo = self.run_async(run(actuator.address))
+		self.assertIs(type(d_id), int)
+		self.assertIs(adjusted, True)
+		self.assertIn("DONE", hostinfo)
+
+	def test_block_bad_params_1(self):
+		""" Test BLOCK with bad parameters. Do not specify reqired blockIP. """
+		wrapper = AsyncActuatorWrapper()
+		self.assertRaises(ValueError, self.run_async,
+						  wrapper.block(resetAfter=1))
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,162 @@
+#!/usr/bin/python
+# CidrAggregator.py - Collapse IPv4 address lists into covering CIDR prefixes
+# Works with Python 2.7 and 3
+
+"""
+Collapses a list of IPv4 addresses into few CIDR prefixes so a bulk block
+list needs fewer BLOCK directives (and fewer flow mods on the switch). Used by
+ActuatorWrapper.block_many().
+
+The addresses are sorted once and then walked as a path-compressed binary
+prefix tree (radix tree): every node is the longest common prefix of a run of
+sorted addresses, so nodes that would only have one child are never visited
+and the walk touches at most 2n nodes. A node is emitted as one prefix when
+enough of the addresses it covers are in the input; otherwise the walk splits
+it at its next bit with a binary search.
+
+With tolerance=0 the result is the exact minimal set of prefixes covering
+the input. A tolerance t > 0 accepts a prefix as long as at most a fraction t
+of the addresses it covers were not in the input (over-blocking), trading
+precision for fewer directives. min_prefixlen keeps the result from ever
+containing prefixes wider than, say, a /16.
+"""
+
+import bisect
+import socket
+import struct
+
+def ip_to_int(address):
+	"""
+	Convert a dotted IPv4 address to an integer. Raises ValueError if the
+	address is not valid
+	"""
+	try:
+		return struct.unpack("!I", socket.inet_pton(socket.AF_INET,
+													 address.strip()))[0]
+	except (socket.error, AttributeError, TypeError):
+		raise ValueError("Invalid IPv4 address: \"" + str(address) + "\"")
+
+def int_to_ip(value):
+	""" Convert an integer to a dotted IPv4 address """
+	return socket.inet_ntoa(struct.pack("!I", value))
+
+def format_cidr(network, prefixlen):
+	""" Format a prefix, leaving out the "/32" of single addresses """
+	if prefixlen == 32:
+		return int_to_ip(network)
+	return "%s/%d" % (int_to_ip(network), prefixlen)
+
+def aggregate(values, tolerance=0.0, min_prefixlen=16):
+	"""
+	ARGUMENTS:
+		o  values: Sorted list of unique IPv4 addresses as integers
+		o  tolerance: Fraction of a prefix that may lie outside the input
+		o  min_prefixlen: Shortest prefix length that may be emitted
+	DESCRIPTION:
+		Walk the radix tree over values and collect the covering prefixes.
+	RETURNS:
+		@rtype: List
+		@return: (network, prefixlen, lo, hi) per prefix in address order,
+			where values[lo:hi] are the input addresses it covers
+	"""
+	if not 0 <= tolerance < 1:
+		raise ValueError("tolerance must be in [0, 1)")
+	if not 0 <= min_prefixlen <= 32:
+		raise ValueError("min_prefixlen must be in [0, 32]")
+	density = 1.0 - tolerance
+	prefixes = []
+	stack = [(0, len(values))] if values else []
+	while stack:
+		lo, hi = stack.pop()
+		first = values[lo]
+		#Longest common prefix of the run is the smallest node covering it
+		hostbits = (first ^ values[hi - 1]).bit_length()
+		prefixlen = 32 - hostbits
+		network = first >> hostbits << hostbits
+		if (prefixlen >= min_prefixlen and
+				hi - lo >= density * (1 << hostbits)):
+			prefixes.append((network, prefixlen, lo, hi))
+			continue
+		#Split at the node's next bit; both halves are non-empty because the
+		#run's first and last address differ in that bit
+		split = bisect.bisect_left(values, network | (1 << (hostbits - 1)),
+								   lo, hi)
+		stack.append((split, hi))
+		stack.append((lo, split))
+	return prefixes
+
+class BlockReport(object):
+	"""
+	Result of ActuatorWrapper.block_many(): the prefixes that were blocked,
+	the directive (ID or Exception) issued for each, and which prefix covers
+	each input address.
+	"""
+
+	def __init__(self, values, prefixes, results):
+		self._values = values
+		self._prefixes = prefixes
+		self._starts = [network for network, prefixlen, lo, hi in prefixes]
+		self.results = results
+
+	def __len__(self):
+		return len(self._prefixes)
+
+	@property
+	def prefixes(self):
+		""" Blocked prefixes in CIDR notation, in address order """
+		return [format_cidr(network, prefixlen)
+				for network, prefixlen, lo, hi in self._prefixes]
+
+	@property
+	def address_count(self):
+		""" Number of unique input addresses """
+		return len(self._values)
+
+	@property
+	def overblocked(self):
+		""" Number of blocked addresses that were not in the input """
+		return sum((1 << (32 - prefixlen)) - (hi - lo)
+				   for network, prefixlen, lo, hi in self._prefixes)
+
+	@property
+	def errors(self):
+		""" (prefix, Exception) for every directive the actuator rejected """
+		return [(cidr, result) for cidr, result in
+				zip(self.prefixes, self.results)
+				if isinstance(result, Exception)]
+
+	def lookup(self, address):
+		"""
+		RETURNS:
+			@rtype: Tuple
+			@return: (prefix, directive ID or Exception) covering address,
+				None if no blocked prefix covers it
+		"""
+		value = ip_to_int(address)
+		i = bisect.bisect_right(self._starts, value) - 1
+		if i < 0:
+			return None
+		network, prefixlen, lo, hi = self._prefixes[i]
+		if value >> (32 - prefixlen) != network >> (32 - prefixlen):
+			return None
+		return format_cidr(network, prefixlen), self.results[i]
+
+	def items(self):
+		"""
+		Generator yielding (address, prefix, directive ID or Exception) for
+		every input address, in address order
+		"""
+		for i, (network, prefixlen, lo, hi) in enumerate(self._prefixes):
+			cidr = format_cidr(network, prefixlen)
+			result = self.results[i]
+			for value in self._values[lo:hi]:
+				yield int_to_ip(value), cidr, result
+
+	def as_dict(self):
+		"""
+		RETURNS:
+			@rtype: Dictionary
+			@return: Input address -> (prefix, directive ID or Exception)
+		"""
+		return dict((address, (cidr, result))
+					for address, cidr, result in self.items())
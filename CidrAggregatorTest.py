@@ -0,0 +1,67 @@
+#!/usr/bin/python
+# CidrAggregatorTest.py - Test for CIDR aggregation of block lists
+# Works with Python 2.7 and 3
+
+"""
+Tests the prefix aggregation on its own. No actuator needed.
+"""
+
+import unittest
+
+from CidrAggregator import (BlockReport, aggregate, format_cidr, int_to_ip,
+							ip_to_int)
+
+def collapse(addresses, tolerance=0.0, min_prefixlen=16):
+	values = sorted(set(ip_to_int(address) for address in addresses))
+	return [format_cidr(network, prefixlen) for network, prefixlen, lo, hi in
+			aggregate(values, tolerance, min_prefixlen)]
+
+class CidrAggregatorTest(unittest.TestCase):
+
+	def test_ip_conversion(self):
+		""" Test address conversion and validation. """
+		self.assertEqual(ip_to_int("10.0.0.1"), 0x0a000001)
+		self.assertEqual(int_to_ip(0x0a000001), "10.0.0.1")
+		self.assertRaises(ValueError, ip_to_int, "10.0.1")
+		self.assertRaises(ValueError, ip_to_int, "10.0.0.256")
+
+	def test_exact_aggregation(self):
+		""" Test collapsing adjacent addresses into exact prefixes. """
+		addresses = ["10.0.0.%d" % i for i in range(256)] + ["10.0.1.5",
+					 "10.0.1.4", "10.0.1.6", "10.0.1.7", "10.0.1.9"]
+		self.assertEqual(collapse(addresses),
+						 ["10.0.0.0/24", "10.0.1.4/30", "10.0.1.9"])
+
+	def test_duplicates(self):
+		""" Test that duplicate addresses do not matter. """
+		self.assertEqual(collapse(["10.0.0.1", "10.0.0.1"]), ["10.0.0.1"])
+		self.assertEqual(collapse([]), [])
+
+	def test_tolerance(self):
+		""" Test over-blocking tolerance. """
+		addresses = ["10.0.0.%d" % i for i in range(256) if i != 7]
+		self.assertEqual(len(collapse(addresses)), 8)
+		self.assertEqual(collapse(addresses, tolerance=0.01), ["10.0.0.0/24"])
+
+	def test_min_prefixlen(self):
+		""" Test that no prefix is wider than min_prefixlen. """
+		addresses = ["10.%d.%d.%d" % (a, b, c) for a in range(2)
+					 for b in range(256) for c in range(0, 256, 16)]
+		for cidr in collapse(addresses, tolerance=0.99, min_prefixlen=16):
+			self.assertEqual(cidr.split("/")[1], "16")
+
+	def test_report(self):
+		""" Test mapping input addresses to covering prefixes. """
+		values = sorted(ip_to_int("10.0.0.%d" % i) for i in range(4))
+		values.append(ip_to_int("10.0.9.9"))
+		report = BlockReport(values, aggregate(values), [11, 12])
+		self.assertEqual(report.prefixes, ["10.0.0.0/30", "10.0.9.9"])
+		self.assertEqual(report.lookup("10.0.0.2"), ("10.0.0.0/30", 11))
+		self.assertEqual(report.lookup("10.0.9.9"), ("10.0.9.9", 12))
+		self.assertEqual(report.lookup("10.0.0.8"), None)
+		self.assertEqual(report.as_dict()["10.0.0.3"], ("10.0.0.0/30", 11))
+		self.assertEqual(report.overblocked, 0)
+
+
+if __name__ == '__main__':
+	unittest.main()
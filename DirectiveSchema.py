@@ -0,0 +1,453 @@
+#!/usr/bin/python
+# DirectiveSchema.py - Directive definitions for openflowsec.org's OF-Actuator
+# Works with Python 2.7 and 3
+
+"""
+Single table describing every directive the wrapper can send: its
+parameters and their value types, which parameters are required, and what
+the actuator replies. ActuatorWrapper.py generates the _build_<name> methods,
+the DirectivePipeline methods and most public ActuatorWrapper methods from
+it.
+
+Each entry is compiled once at import into a CompiledDirective whose build()
+validates keyword arguments and encodes the directive line in a single pass:
+parameter lookups are dictionary hits, the " -name" prefixes are prebuilt
+and the line is joined once instead of grown by concatenation.
+
+Table entries:
+	name: Directive keyword
+	reply: ID ("OK <id>"), ACK (plain OK) or TEXT_REPLY (listing)
+	params: (parameter, type) pairs. FLAG parameters take True (sent as
+		"-name") or False (left out); NUMBER and TEXT parameters take one
+		whitespace-free value
+	required: Parameters that must all be given
+	any_of: Parameters of which at least one must be given
+	one_of: Parameters of which exactly one must be given
+	message: ValueError text when one of the above is violated
+	doc: Docstring of the generated public method
+"""
+
+import re
+
+#Parameter types
+FLAG = "flag"
+NUMBER = "number"
+TEXT = "text"
+
+#Reply kinds
+ID = "id"
+ACK = "ack"
+TEXT_REPLY = "text"
+
+SCHEMA = [
+	{
+		"name": "BLOCK",
+		"reply": ID,
+		"params": [("blockIP", TEXT), ("dstPort", NUMBER), ("proto", TEXT),
+				   ("linkdrop", FLAG), ("style", TEXT), ("resetAfter", NUMBER),
+				   ("priority", NUMBER), ("switch", TEXT), ("timeout", NUMBER)],
+		"required": ["blockIP"],
+		"message": "blockIP must be specified",
+		"doc": """
+		ARGUMENTS:
+			o   -blockIP <CIDR>
+			o  [-dstPort <port>         ]
+			o  [-proto <protocol>       ]
+			o  [-linkdrop <True/False>  ]
+			o  [-style <style>          ]
+			o  [-resetAfter <seconds>   ]
+			o  [-priority <N>           ]
+			o  [-switch <switch-id>     ]
+			o  [-timeout <seconds>      ]
+		
+		DESCRIPTION: Blocks all traffic matching specified criteria.
+			This directive is translated into the equivalent DENY directive:
+			DENY -IP1 <CIDR> [ -IP2port <port> ] ...options...
+			Note: "-linkdrop" becomes "-linkdrop1"
+
+		RETURNS:
+			@rtype: Integer
+			@return: Directive ID
+		""",
+	},
+	{
+		"name": "DENY",
+		"reply": ID,
+		"params": [("IP1", TEXT), ("IP2", TEXT), ("IP1port", NUMBER),
+				   ("IP2port", NUMBER), ("proto", TEXT), ("linkdrop1", FLAG),
+				   ("linkdrop2", FLAG), ("style", TEXT), ("resetAfter", NUMBER),
+				   ("priority", NUMBER), ("switch", TEXT), ("timeout", NUMBER)],
+		"any_of": ["IP1", "IP2", "IP1port", "IP2port"],
+		"message": ("You must specify at least one of the parameters: IP1, "
+					"IP2, IP1port, IP2port"),
+		"doc": """
+		ARGUMENTS: (at least one of the first four criteria required)
+			o  [-IP1 <CIDR>             ]
+			o  [-IP2 <CIDR>             ]
+			o  [-IP1port <port>         ]
+			o  [-IP2port <port>         ]
+			o  [-proto <protocol>       ]
+			o  [-linkdrop1 <True/False> ]
+			o  [-linkdrop2 <True/False> ]
+			o  [-style <style>          ]
+			o  [-resetAfter <seconds>   ]
+			o  [-priority <N>           ]
+			o  [-switch <switch-id>     ]
+			o  [-timeout <seconds>      ]
+		
+		DESCRIPTION: Blocks all traffic matching specified criteria.
+			Blocks (drops) all IP traffic to/from IP1-CIDR/IP1-port (from/to
+			IP2-CIDR/IP2-port)...
+			NOTE: See OFActuator_directives.txt for more info
+
+		RETURNS:
+			@rtype: Integer
+			@return: Directive ID
+		""",
+	},
+	{
+		"name": "REDIRECT",
+		"reply": ID,
+		"params": [("IP1", TEXT), ("IP2", TEXT), ("IP1port", NUMBER),
+				   ("IP2port", NUMBER), ("proto", TEXT), ("remapIP", TEXT),
+				   ("remapPort", NUMBER), ("block", TEXT), ("resetAfter", NUMBER),
+				   ("redirectIdle", NUMBER), ("priority", NUMBER),
+				   ("switch", TEXT), ("timeout", NUMBER)],
+		"required": ["remapIP"],
+		"any_of": ["IP1", "IP2", "IP1port", "IP2port"],
+		"message": ("You must specify remapIP and at least one of the "
+					"parameters: IP1, IP2, IP1port, IP2port"),
+		"doc": """
+		ARGUMENTS: (at least one of the first four criteria required)
+			o  [-IP1 <CIDR>             ]
+			o  [-IP2 <CIDR>             ]
+			o  [-IP1port <port>         ]
+			o  [-IP2port <port>         ]
+			o  [-proto <protocol>       ]
+			o   -remapIP <IP>
+			o  [-remapPort <port>       ]
+			o  [-block <style>          ]
+			o  [-resetAfter <seconds>   ]
+			o  [-redirectIdle <seconds> ]
+			o  [-priority <N>           ]
+			o  [-switch <switch-id>     ]
+			o  [-timeout <seconds>      ]
+		
+		DESCRIPTION: Redirect matching network traffic to remapIP address (and 
+			port). This directive will rewrite any traffic from IP1/port to 
+			IP2/port as traffic from IP1/port to remapIP/port and DENY matching 
+			traffic from IP2/port to IP1/port.  Further, any IP1/port to 
+			IP2/port traffic from pre-existing TCP connections will be blocked 
+			as per <style>.
+			NOTE: See OFActuator_directives.txt for more info
+
+		RETURNS:
+			@rtype: Integer
+			@return: Directive ID
+
+		""",
+	},
+	{
+		"name": "QUARANTINE",
+		"reply": ID,
+		"params": [("quarantinedIP", TEXT), ("notifier", TEXT),
+				   ("notifierPort", NUMBER), ("dnsIP", TEXT), ("dnsPass", FLAG),
+				   ("linkdrop", FLAG), ("style", TEXT), ("resetAfter", NUMBER),
+				   ("redirectIdle", NUMBER), ("priority", NUMBER),
+				   ("switch", TEXT), ("timeout", NUMBER)],
+		"required": ["quarantinedIP", "notifier"],
+		"message": "You must specify quarantinedIP and notifier",
+		"doc": """
+		ARGUMENTS: 
+			o   -quarantinedIP <IP>
+			o   -notifier <IP>
+			o  [-notifierPort <port>    ]
+			o  [-dnsIP <IP>             ]
+			o  [-dnsPass <True/False>  	]
+			o  [-linkdrop <True/False>	]
+			o  [-style <style>          ]
+			o  [-resetAfter <seconds>   ]
+			o  [-redirectIdle <seconds> ]
+			o  [-priority <N>           ]
+			o  [-switch <switch-id>     ]
+			o  [-timeout <seconds>      ]
+		
+		DESCRIPTION: 
+			Drop quarantined IP off the network; redirect web/DNS.
+			Blocks all general traffic through the switch to/from the 
+			quarantined IP address, with the exception that all DNS requests 
+			will be redirected to the dnsIP (default: notifier's IP addr) and 
+			all web (port 80) requests will be redirected to the notifier's 
+			IP/port (allows the notifier to return web pages informing the user
+			of the quarantine, providing remediationi nstructions, requesting 
+			the user to contact administrative support, etc.).
+			NOTE: See OFActuator_directives.txt for more info
+
+		RETURNS:
+			@rtype: Integer
+			@return: Directive ID
+
+		""",
+	},
+	{
+		"name": "UNPLUG",
+		"reply": ID,
+		"params": [("all", FLAG), ("IP", TEXT), ("linkAddr", TEXT),
+				   ("swPort", NUMBER), ("priority", NUMBER), ("switch", TEXT),
+				   ("timeout", NUMBER)],
+		"one_of": ["all", "IP", "linkAddr", "swPort"],
+		"message": ("Exactly one of all, IP, linkAddr, or swPort must be "
+					"specified."),
+		"doc": """
+		ARGUMENTS: 
+			o  [-all <True/False        ]
+			o  [-IP <IP>                ]
+			o  [-linkAddr <MAC>         ]
+			o  [-swPort <n>             ]
+			o  [-priority <N>           ]
+			o  [-switch <switch-id>     ]
+			o  [-timeout <seconds>      ]		
+		DESCRIPTION: 
+			Drop packets on one or more switch ports.
+			NOTE: See OFActuator_directives.txt for more info
+
+		RETURNS:
+			@rtype: Integer
+			@return: Directive ID
+
+		""",
+	},
+	{
+		"name": "INFO",
+		"reply": TEXT_REPLY,
+		"params": [("id", NUMBER), ("rules", FLAG)],
+		"doc": """
+		ARGUMENTS: 
+			o  [-id <N> 			]
+			o  [-rules <True/False> ]	
+		DESCRIPTION:
+			List active security directives.
+			The INFO command allows you to ask the actuator for the disposition 
+			of all active (i.e., not-expired) security directives.  If the -id 
+			parameter is specified, then only its associated security directive 
+			is displayed.
+			NOTE: See OFActuator_directives.txt for more info
+
+		RETURNS:
+			@rtype: return
+			@String: One directive per line format: 
+				" <id>: <directive>; <expires>" 
+
+		""",
+	},
+	{
+		"name": "CANCEL",
+		"reply": ACK,
+		"params": [("all", FLAG), ("id", NUMBER)],
+		"one_of": ["all", "id"],
+		"message": "You must specify either all or id",
+		"doc": """
+		ARGUMENTS:
+			o  [-all <True/False>   ]
+			o  [-id <N> ]
+		DESCRIPTION:   Request removal of currently-active security directives.
+			Remove all flow mods associated with the security directive(s) or 
+			otherwise removes the effects of the directive on the switch (e.g., 
+			for "UNPLUG" re-activates the switch port).  If "-all" is specified,
+			all directives are removed.  If "-id <N>" is specified, the 
+			specified directive is removed. It is an error to specify both.
+			NOTE: See OFActuator_directives.txt for more info
+		RETURNS:
+			@rtype: Boolean
+			@return: True if directive succeeds
+		""",
+	},
+	{
+		"name": "ADJUST",
+		"reply": ACK,
+		"params": [("id", NUMBER), ("timeout", NUMBER)],
+		"required": ["id", "timeout"],
+		"message": "You must specify id and timeout",
+		"doc": """
+		ARGUMENTS:
+			o   -id <N>
+			o   -timeout <seconds>
+		DESCRIPTION:   Adjust time-out of security directive.
+			Will adjust the timeout of a currently-active security directive to 
+			at least <seconds> from the time the directive is processed by the 
+			actuator.  This can either lengthen or shorten the expiration of the
+			affected directive.  As	with directive creation, a value of zero 
+			means the directive remains active indefinitely.
+			NOTE: See OFActuator_directives.txt for more info
+		RETURNS:
+			@rtype: Boolean
+			@return: True if directive succeeds
+		""",
+	},
+	{
+		"name": "SWITCHES",
+		"reply": TEXT_REPLY,
+		"params": [("v", FLAG)],
+		"doc": """
+		ARGUMENTS:
+			o [ -v <True/False>]
+		DESCRIPTION:   Lists the switches managed by the controller.
+			NOTE: See OFActuator_directives.txt for more info
+		RETURNS:
+			@rtype: String
+			@return: List of switches managed by the controller
+		""",
+	},
+	{
+		"name": "DEFAULTS",
+		"reply": ACK,
+		"params": [("priority", NUMBER), ("redirectIdle", NUMBER),
+				   ("resetAfter", NUMBER), ("switch", TEXT), ("timeout", NUMBER)],
+		"doc": """
+		ARGUMENTS:
+			o  [-priority <N>           ]
+			o  [-redirectIdle <seconds> ]
+			o  [-resetAfter <seconds>   ]
+			o  [-switch <switch-id>     ]
+			o  [-timeout <seconds>      ]
+		DESCRIPTION:   Sets and displays default values for the actuator.
+			NOTE: See OFActuator_directives.txt for more info
+		RETURNS:
+			@rtype: Boolean
+			@return: True if directive succeeds
+		""",
+	},
+	{
+		"name": "HELP",
+		"reply": TEXT_REPLY,
+		"params": [("directive-name", TEXT)],
+		"doc": """
+		ARGUMENTS:
+			o  [<directive-name>     ]
+		DESCRIPTION:   Provides directive help-text.
+			NOTE: See OFActuator_directives.txt for more info
+		RETURNS:
+			@rtype: String
+			@return: If <directive-name> is provided and is a known directive, 
+				displays extended help-text for the directive.  Otherwise a 
+				usage summary for each directive is displayed.
+		""",
+	},
+	{
+		"name": "HOSTINFO",
+		"reply": TEXT_REPLY,
+		"params": [("IP", TEXT)],
+	},
+]
+
+_VALUE_PATTERNS = {
+	NUMBER: re.compile(r"-?\d+(?:\.\d+)?\Z"),
+	#One token: whitespace would split it, a newline would start another
+	#directive
+	TEXT: re.compile(r"\S+\Z"),
+}
+
+try:
+	_INTEGER_TYPES = (int, long)
+except NameError:
+	_INTEGER_TYPES = (int,)
+
+def _compile_check(required, any_of, one_of, message):
+	"""
+	Return a function raising ValueError(message) if kwargs break the
+	required/any_of/one_of rules, None if the directive has no rules. A
+	parameter that is None or False counts as not specified
+	"""
+	if not (required or any_of or one_of):
+		return None
+	def check(kwargs):
+		get = kwargs.get
+		for param in required:
+			value = get(param)
+			if value is None or value is False:
+				raise ValueError(message)
+		if any_of:
+			for param in any_of:
+				value = get(param)
+				if value is not None and value is not False:
+					break
+			else:
+				raise ValueError(message)
+		if one_of:
+			given = 0
+			for param in one_of:
+				value = get(param)
+				if value is not None and value is not False:
+					given += 1
+			if given != 1:
+				raise ValueError(message)
+	return check
+
+class CompiledDirective(object):
+	"""
+	One SCHEMA entry compiled into a validator and encoder
+	"""
+	__slots__ = ("name", "reply", "params", "doc", "_check", "_encoders",
+				 "_unknown")
+
+	def __init__(self, entry):
+		self.name = entry["name"]
+		self.reply = entry["reply"]
+		self.params = tuple(param for param, kind in entry["params"])
+		self.doc = entry.get("doc")
+		self._check = _compile_check(tuple(entry.get("required", ())),
+									 tuple(entry.get("any_of", ())),
+									 tuple(entry.get("one_of", ())),
+									 entry.get("message"))
+		#param -> (prebuilt prefix, value matcher or None for flags)
+		self._encoders = {}
+		for param, kind in entry["params"]:
+			if kind == FLAG:
+				self._encoders[param] = (" -" + param, None)
+			else:
+				self._encoders[param] = (" -" + param + " ",
+										 _VALUE_PATTERNS[kind].match)
+		self._unknown = ("\" not in possible parameter set for this Directive. "
+						 "Possible parameters are - " + " ".join(self.params))
+
+	def build(self, kwargs):
+		"""
+		Validate keyword arguments and return the directive line (without
+		newline). Raises ValueError for unknown parameters, missing required
+		ones and values of the wrong type. None values are left out
+		"""
+		if self._check is not None:
+			self._check(kwargs)
+		encoders = self._encoders
+		parts = [self.name]
+		for param, value in kwargs.items():
+			encoder = encoders.get(param)
+			if encoder is None:
+				raise ValueError("Parameter \"" + str(param) + self._unknown)
+			if value is None:
+				continue
+			prefix, match = encoder
+			if match is None:
+				if value is True:
+					parts.append(prefix)
+				elif value is not False:
+					raise ValueError(("Parameter \"" + param + "\" is a flag "
+									  "and must be True or False"))
+			elif type(value) in _INTEGER_TYPES:
+				#Integers are always valid, skip the pattern for them
+				parts.append(prefix + str(value))
+			else:
+				text = str(value)
+				if match(text) is None:
+					raise ValueError(("Invalid value \"" + text + "\" for "
+									  "parameter \"" + param + "\""))
+				parts.append(prefix + text)
+		return "".join(parts)
+
+	def encode(self, kwargs):
+		""" Same as build(), as the ASCII bytes sent on the wire """
+		return (self.build(kwargs) + "\n").encode("ascii")
+
+#name (lower case) -> CompiledDirective, compiled once at import
+DIRECTIVES = dict((entry["name"].lower(), CompiledDirective(entry))
+				  for entry in SCHEMA)
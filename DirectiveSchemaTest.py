@@ -0,0 +1,67 @@
+#!/usr/bin/python
+# DirectiveSchemaTest.py - Test for the OF-Actuator directive schema table
+# Works with Python 2.7 and 3
+
+"""
+Tests validating and encoding directives from the schema. No actuator needed.
+"""
+
+import unittest
+
+from DirectiveSchema import DIRECTIVES, SCHEMA
+
+def build(name, **kwargs):
+	return DIRECTIVES[name].build(kwargs)
+
+class DirectiveSchemaTest(unittest.TestCase):
+
+	def test_encode(self):
+		""" Test encoding values and flags. """
+		self.assertEqual(build("block", blockIP="10.0.0.0/24"),
+						 "BLOCK -blockIP 10.0.0.0/24")
+		line = build("deny", IP1="10.0.0.1", IP2port=22, linkdrop1=True,
+					 linkdrop2=False, timeout=None)
+		self.assertEqual(sorted(line.split(" -")),
+						 ["DENY", "IP1 10.0.0.1", "IP2port 22", "linkdrop1"])
+		self.assertEqual(build("info"), "INFO")
+		self.assertEqual(DIRECTIVES["cancel"].encode({"id": 7}),
+						 b"CANCEL -id 7\n")
+
+	def test_constraints(self):
+		""" Test required, any_of and one_of parameters. """
+		self.assertRaises(ValueError, build, "block", resetAfter=1)
+		self.assertRaises(ValueError, build, "deny", proto="tcp")
+		self.assertRaises(ValueError, build, "redirect", IP1="10.0.0.1")
+		self.assertRaises(ValueError, build, "unplug", IP="10.0.0.1",
+						  swPort=2)
+		self.assertRaises(ValueError, build, "cancel", all=False)
+		self.assertEqual(build("cancel", all=True), "CANCEL -all")
+		#Zero is a value, not a missing parameter
+		self.assertEqual(build("adjust", id=3, timeout=0),
+						 "ADJUST -id 3 -timeout 0")
+
+	def test_bad_values(self):
+		""" Test rejecting unknown parameters and badly typed values. """
+		self.assertRaises(ValueError, build, "block", blockIP="10.0.0.1",
+						  test=1)
+		self.assertRaises(ValueError, build, "block", blockIP="10.0.0.1",
+						  timeout="soon")
+		self.assertRaises(ValueError, build, "block", blockIP="10.0.0.1",
+						  linkdrop="yes")
+		#A value must not be able to smuggle in another directive
+		self.assertRaises(ValueError, build, "block",
+						  blockIP="10.0.0.1\nSHUTDOWN")
+		self.assertRaises(ValueError, build, "block", blockIP="")
+
+	def test_schema_complete(self):
+		""" Test that every entry compiled and documents its parameters. """
+		self.assertEqual(len(DIRECTIVES), len(SCHEMA))
+		for name, spec in DIRECTIVES.items():
+			if spec.doc is None:
+				continue
+			for param in spec.params:
+				self.assertIn(param, spec.doc, "%s: %s" % (name, param))
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,566 @@
+#!/usr/bin/python
+# ShardedActuator.py - One client for several OF-Actuator instances
+# Works with Python 2.7 and 3
+
+"""
+Front end for several OF-Actuator instances, each managing its own set of
+switches:
+
+	sharded = ShardedActuator([(<IP_1>, <PORT_1>), (<IP_2>, <PORT_2>)])
+	d_id = sharded.block(blockIP="10.0.0.1")
+	sharded.cancel(id=d_id)
+
+Each shard is reached through an ActuatorPool by default, so threads sharing
+the front end talk to all actuators at once, and pipeline() flushes the
+batches of all shards in parallel.
+
+Routing:
+	o  A directive with a switch parameter goes to the shard managing that
+		switch, as listed by SWITCHES.
+	o  Otherwise its host address (blockIP, IP1, IP2, quarantinedIP or IP)
+		picks the shard whose HOSTINFO knows the host. Hosts missing from the
+		listings read by refresh_topology() are looked up with HOSTINFO -IP
+		on every shard.
+	o  Directives that cannot be routed (no switch, subnets, unknown hosts,
+		CANCEL -all, DEFAULTS) fan out to every shard in parallel.
+
+Directive IDs are shard-qualified: the ID of a directive created by shard s
+(of n) is local_id * n + s, so CANCEL, ADJUST and INFO -id go back to the
+right actuator. A fanned-out creation returns the list of its IDs, one per
+shard. INFO, SWITCHES and HOSTINFO without a target merge the responses of
+all shards.
+"""
+
+import contextlib
+import re
+import threading
+
+from ActuatorPool import ActuatorPool
+from ActuatorProtocol import DirectiveRecord
+from DirectiveSchema import DIRECTIVES
+
+#Parameters naming the host a directive is about, in routing order
+_HOST_PARAMS = ("blockIP", "IP1", "IP2", "quarantinedIP", "IP")
+_HOST_IP = re.compile(r"(?<![\d.])(\d{1,3}(?:\.\d{1,3}){3})(?![\d.])")
+_DPID = re.compile(r"^\s*((?:[0-9a-fA-F]{2}:){7}[0-9a-fA-F]{2})\b")
+#" <id>:" at the start of an INFO line
+_INFO_ID = re.compile(r"^(\s*)(\d+):", re.M)
+
+class ShardError(Exception):
+	"""
+	A directive fanned out to several shards failed on some of them. results
+	holds what each shard returned (shard-qualified IDs for creations), or
+	the Exception it raised, in shard order
+	"""
+
+	def __init__(self, message, results):
+		Exception.__init__(self, message)
+		self.results = results
+
+def switch_key(switch):
+	"""
+	Normalize a switch ID, so "a", 10 and "00:00:00:00:00:00:00:0a" are the
+	same switch. Strings are hex DPIDs, with or without colons
+	"""
+	if isinstance(switch, int):
+		return switch
+	text = str(switch).strip().lower()
+	try:
+		return int(text.replace(":", ""), 16)
+	except ValueError:
+		return text
+
+def run_parallel(calls):
+	"""
+	Run zero-argument callables in parallel, the first one in the calling
+	thread. Returns their results in order, with the exception a call raised
+	in place of its result
+	"""
+	results = [None] * len(calls)
+	def run(i):
+		try:
+			results[i] = calls[i]()
+		except Exception as e:
+			results[i] = e
+	threads = [threading.Thread(target=run, args=(i,))
+			   for i in range(1, len(calls))]
+	for thread in threads:
+		thread.daemon = True
+		thread.start()
+	if calls:
+		run(0)
+	for thread in threads:
+		thread.join()
+	return results
+
+@contextlib.contextmanager
+def _connection(client):
+	""" Wrapper to use for a shard: a pooled connection or the client """
+	if hasattr(client, "connection"):
+		with client.connection() as wrapper:
+			yield wrapper
+	else:
+		yield client
+
+def _merge(responses):
+	"""
+	Join the bodies of several responses under the terminating line of the
+	last one
+	"""
+	lines = []
+	for data in responses:
+		lines.extend(data.splitlines()[:-1])
+	lines.append(responses[-1].splitlines()[-1])
+	return "\n".join(lines) + "\n"
+
+class ShardedActuator(object):
+	""" Routes directives across several actuators """
+
+	def __init__(self, shards, client_factory=ActuatorPool, switch_map=None):
+		"""
+		ARGUMENTS:
+			o  shards: List of (server_ip, server_port) addresses, or of
+				ready ActuatorWrappers/ActuatorPools, one per actuator
+			o  client_factory: Callable(server_ip, server_port) returning
+				the client for an address
+			o  switch_map: Optional switch ID -> shard index, for switches
+				SWITCHES does not list
+		"""
+		if not shards:
+			raise ValueError("At least one shard is required")
+		self._clients = [client_factory(*shard)
+						 if isinstance(shard, (tuple, list)) else shard
+						 for shard in shards]
+		self._switch_map = dict((switch_key(switch), index) for switch, index
+								in (switch_map or {}).items())
+		self._lock = threading.Lock()
+		#switch_key -> shard index, None until the topology is loaded
+		self._switches = None
+		#Host IP -> shard index, None for hosts no shard knows
+		self._hosts = {}
+
+	def __len__(self):
+		return len(self._clients)
+
+	def _call(self, index, name, kwargs):
+		""" Send one directive to one shard """
+		with _connection(self._clients[index]) as wrapper:
+			return getattr(wrapper, name)(**kwargs)
+
+	def _fan_out(self, name, kwargs, indexes=None):
+		"""
+		Send a directive to several shards (all by default) in parallel.
+		Raises ShardError if any of them failed
+		"""
+		if indexes is None:
+			indexes = range(len(self._clients))
+		results = run_parallel([lambda index=index: self._call(index, name,
+																kwargs)
+								for index in indexes])
+		failed = [result for result in results
+				  if isinstance(result, Exception)]
+		if failed:
+			raise ShardError(("%s failed on %d of %d shards: %s" %
+							  (name.upper(), len(failed), len(results),
+							   failed[0])), results)
+		return results
+
+	def global_id(self, index, d_id):
+		""" Shard-qualified ID of directive d_id of shard index """
+		return int(d_id) * len(self._clients) + index
+
+	def split_id(self, d_id):
+		"""
+		RETURNS:
+			@rtype: Tuple
+			@return: (shard index, directive ID on that shard)
+		"""
+		d_id = int(d_id)
+		if d_id < 0:
+			raise ValueError("Invalid directive ID: " + str(d_id))
+		return d_id % len(self._clients), d_id // len(self._clients)
+
+	def refresh_topology(self):
+		"""
+		Learn which shard manages which switches (SWITCHES) and hosts
+		(HOSTINFO), from all shards in parallel. Forgets hosts that were not
+		found before
+		"""
+		listings = run_parallel([lambda index=index: (
+			self._call(index, "switches", {}),
+			self._call(index, "hostinfo", {}))
+			for index in range(len(self._clients))])
+		switches = {}
+		hosts = {}
+		for index, listing in enumerate(listings):
+			if isinstance(listing, Exception):
+				continue
+			for line in listing[0].splitlines():
+				match = _DPID.match(line)
+				if match:
+					switches[switch_key(match.group(1))] = index
+			for line in listing[1].splitlines():
+				match = _HOST_IP.search(line)
+				if match:
+					hosts.setdefault(match.group(1), index)
+		switches.update(self._switch_map)
+		with self._lock:
+			self._switches = switches
+			self._hosts = hosts
+
+	def _switch_index(self, switch):
+		""" Shard managing a switch, None for "all" """
+		if str(switch).lower() == "all":
+			return None
+		if self._switches is None:
+			self.refresh_topology()
+		index = self._switches.get(switch_key(switch))
+		if index is None:
+			raise ValueError(("Switch " + str(switch) + " is not managed by "
+							  "any shard"))
+		return index
+
+	def _host_index(self, ip):
+		""" Shard knowing a host, None if none does """
+		if "/" in ip:
+			return None
+		if self._switches is None:
+			self.refresh_topology()
+		with self._lock:
+			if ip in self._hosts:
+				return self._hosts[ip]
+		found = run_parallel([lambda index=index: self._call(
+			index, "hostinfo", {"IP": ip})
+			for index in range(len(self._clients))])
+		index = None
+		for i, result in enumerate(found):
+			if not isinstance(result, Exception):
+				index = i
+				break
+		with self._lock:
+			self._hosts[ip] = index
+		return index
+
+	def shard_for(self, **kwargs):
+		"""
+		RETURNS:
+			@rtype: Integer
+			@return: Index of the shard a directive with these parameters is
+				sent to, None if it fans out to every shard
+		"""
+		switch = kwargs.get("switch")
+		if switch is not None:
+			return self._switch_index(switch)
+		for param in _HOST_PARAMS:
+			ip = kwargs.get(param)
+			if ip is not None:
+				index = self._host_index(str(ip))
+				if index is not None:
+					return index
+		return None
+
+	def _create(self, name, kwargs):
+		""" Send a directive creating a security directive """
+		index = self.shard_for(**kwargs)
+		if index is not None:
+			return self.global_id(index, self._call(index, name, kwargs))
+		try:
+			d_ids = self._fan_out(name, kwargs)
+		except ShardError as e:
+			#Shard-qualified, so the directives created can be cancelled
+			e.results = [result if isinstance(result, Exception) else
+						 self.global_id(index, result)
+						 for index, result in enumerate(e.results)]
+			raise
+		return [self.global_id(index, d_id) for index, d_id in
+				enumerate(d_ids)]
+
+	def _local(self, kwargs):
+		""" Shard index and kwargs with the shard-local directive ID """
+		index, d_id = self.split_id(kwargs["id"])
+		kwargs = dict(kwargs)
+		kwargs["id"] = d_id
+		return index, kwargs
+
+	def cancel(self, **kwargs):
+		"""
+		CANCEL directive. -id goes to the shard that created the directive,
+		-all to every shard. See ActuatorWrapper.cancel
+		"""
+		if kwargs.get("id") is None:
+			self._fan_out("cancel", kwargs)
+			return True
+		index, kwargs = self._local(kwargs)
+		return self._call(index, "cancel", kwargs)
+
+	def adjust(self, **kwargs):
+		"""
+		ADJUST directive on the shard that created the directive. See
+		ActuatorWrapper.adjust
+		"""
+		if kwargs.get("id") is None:
+			raise ValueError("ADJUST requires id")
+		index, kwargs = self._local(kwargs)
+		return self._call(index, "adjust", kwargs)
+
+	def _pipelined_many(self, name, ids, **kwargs):
+		""" One directive per ID, pipelined per shard """
+		refused = []
+		with self.pipeline() as pipe:
+			for d_id in ids:
+				try:
+					getattr(pipe, name)(id=d_id, **kwargs)
+					refused.append(None)
+				except ValueError as e:
+					refused.append(e)
+		replies = iter(pipe.results)
+		return [next(replies) if error is None else error
+				for error in refused]
+
+	def cancel_many(self, ids):
+		"""
+		CANCEL many directives, each shard's share as one pipelined batch.
+		See ActuatorWrapper.cancel_many
+		"""
+		return self._pipelined_many("cancel", ids)
+
+	def adjust_many(self, ids, timeout):
+		"""
+		ADJUST many directives, each shard's share as one pipelined batch.
+		See ActuatorWrapper.adjust_many
+		"""
+		return self._pipelined_many("adjust", ids, timeout=timeout)
+
+	def _rewrite_ids(self, index, data):
+		""" Replace the directive IDs of an INFO response by global IDs """
+		return _INFO_ID.sub(lambda match: "%s%d:" % (
+			match.group(1), self.global_id(index, match.group(2))), data)
+
+	def info(self, **kwargs):
+		"""
+		INFO directive. With -id only the shard that created the directive is
+		asked; otherwise the listings of all shards are merged. Directive IDs
+		are shard-qualified. See ActuatorWrapper.info
+		"""
+		if kwargs.get("id") is not None:
+			index, kwargs = self._local(kwargs)
+			return self._rewrite_ids(index, self._call(index, "info",
+													   kwargs))
+		return _merge([self._rewrite_ids(index, data) for index, data in
+					   enumerate(self._fan_out("info", kwargs))])
+
+	def info_records(self, **kwargs):
+		"""
+		RETURNS:
+			@rtype: List
+			@return: DirectiveRecords of the active directives of all shards,
+				with shard-qualified IDs. See ActuatorWrapper.info_records
+		"""
+		def records(index, kwargs):
+			with _connection(self._clients[index]) as wrapper:
+				return [DirectiveRecord(self.global_id(index, r.id),
+										r.directive, r.params, r.expires,
+										r.expires_text, r.rules)
+						for r in wrapper.info_records(**kwargs)]
+		if kwargs.get("id") is not None:
+			index, kwargs = self._local(kwargs)
+			return records(index, kwargs)
+		results = run_parallel([lambda index=index: records(index, kwargs)
+								for index in range(len(self._clients))])
+		merged = []
+		for result in results:
+			if isinstance(result, Exception):
+				raise ShardError(("INFO failed on a shard: " + str(result)),
+								 results)
+			merged.extend(result)
+		merged.sort(key=lambda record: record.id)
+		return merged
+
+	def switches(self, **kwargs):
+		"""
+		SWITCHES directive, merged across all shards. See
+		ActuatorWrapper.switches
+		"""
+		return _merge(self._fan_out("switches", kwargs))
+
+	def hostinfo(self, **kwargs):
+		"""
+		HOSTINFO directive. A host lookup goes to the shard knowing the host
+		(raising the ERROR of the first shard if none does); the host
+		listing is merged across all shards. See ActuatorWrapper.hostinfo
+		"""
+		ip = kwargs.get("IP")
+		if ip is None:
+			return _merge(self._fan_out("hostinfo", kwargs))
+		index = self._host_index(str(ip))
+		return self._call(0 if index is None else index, "hostinfo", kwargs)
+
+	def defaults(self, **kwargs):
+		"""
+		DEFAULTS directive on every shard; returns the first shard's
+		response. See ActuatorWrapper.defaults
+		"""
+		return self._fan_out("defaults", kwargs)[0]
+
+	def help(self, **kwargs):
+		""" HELP directive, answered by the first shard """
+		return self._call(0, "help", kwargs)
+
+	def pipeline(self):
+		"""
+		Return a ShardedPipeline that queues directives and flushes each
+		shard's share as one pipelined batch, all shards in parallel
+		"""
+		return ShardedPipeline(self)
+
+	def close(self):
+		""" Close the clients of all shards """
+		for client in self._clients:
+			client.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close()
+
+class ShardedPipeline(object):
+	"""
+	DirectivePipeline across shards. Directives are routed as they are
+	queued; flush() sends every shard's batch in parallel and returns the
+	results in queue order: shard-qualified IDs (a list of them for fanned
+	out creations), True for CANCEL/ADJUST, or the Exception of a failed
+	directive
+	"""
+
+	def __init__(self, sharded):
+		self._sharded = sharded
+		#(name, [(shard index, kwargs)], creates) per queued directive
+		self._queue = []
+		self.results = []
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		if exc_type is None:
+			self.flush()
+
+	def __len__(self):
+		return len(self._queue)
+
+	def _queue_create(self, name, kwargs):
+		#Refuse bad parameters now rather than failing the shard's batch
+		DIRECTIVES[name].build(kwargs)
+		sharded = self._sharded
+		index = sharded.shard_for(**kwargs)
+		targets = range(len(sharded)) if index is None else [index]
+		self._queue.append((name, [(i, kwargs) for i in targets],
+							index is None))
+
+	def cancel(self, **kwargs):
+		""" Queue CANCEL directive. See ShardedActuator.cancel """
+		if kwargs.get("id") is None:
+			DIRECTIVES["cancel"].build(kwargs)
+			self._queue.append(("cancel", [(i, kwargs) for i in
+										   range(len(self._sharded))], True))
+			return
+		index, kwargs = self._sharded._local(kwargs)
+		DIRECTIVES["cancel"].build(kwargs)
+		self._queue.append(("cancel", [(index, kwargs)], False))
+
+	def adjust(self, **kwargs):
+		""" Queue ADJUST directive. See ShardedActuator.adjust """
+		if kwargs.get("id") is None:
+			raise ValueError("ADJUST requires id")
+		index, kwargs = self._sharded._local(kwargs)
+		DIRECTIVES["adjust"].build(kwargs)
+		self._queue.append(("adjust", [(index, kwargs)], False))
+
+	def _send(self, index, items):
+		"""
+		Flush one shard's batch and return its results. A directive the
+		shard's wrapper refuses before sending (e.g. a stale ID) gets its
+		Exception without failing the others
+		"""
+		refused = []
+		with _connection(self._sharded._clients[index]) as wrapper:
+			with wrapper.pipeline() as pipe:
+				for name, kwargs in items:
+					try:
+						getattr(pipe, name)(**kwargs)
+						refused.append(None)
+					except ValueError as e:
+						refused.append(e)
+		replies = iter(pipe.results)
+		return [next(replies) if error is None else error
+				for error in refused]
+
+	def flush(self):
+		"""
+		Send all queued directives and collect their results.
+
+		RETURNS:
+			@rtype: List
+			@return: One entry per queued directive, in queue order
+		"""
+		queue, self._queue = self._queue, []
+		sharded = self._sharded
+		batches = [[] for i in range(len(sharded))]
+		for name, targets, fanned in queue:
+			for index, kwargs in targets:
+				batches[index].append((name, kwargs))
+		replies = run_parallel([lambda index=index: self._send(
+			index, batches[index]) for index in range(len(sharded))])
+		#Per shard, iterator over its results (or its batch's Exception)
+		positions = [iter(reply) if isinstance(reply, list) else None
+					 for reply in replies]
+		results = []
+		for name, targets, fanned in queue:
+			shard_results = []
+			for index, kwargs in targets:
+				if positions[index] is None:
+					result = replies[index]
+				else:
+					result = next(positions[index])
+				if (name not in ("cancel", "adjust") and
+						not isinstance(result, Exception)):
+					result = sharded.global_id(index, result)
+				shard_results.append(result)
+			if not fanned:
+				results.append(shard_results[0])
+				continue
+			failed = [r for r in shard_results if isinstance(r, Exception)]
+			if failed:
+				results.append(ShardError(("%s failed on %d of %d shards: %s"
+										   % (name.upper(), len(failed),
+											  len(shard_results), failed[0])),
+										  shard_results))
+			else:
+				#CANCEL -all acknowledges once, creations list their IDs
+				results.append(True if name == "cancel" else shard_results)
+		self.results.extend(results)
+		return results
+
+def _sharded_create(name):
+	""" Build the ShardedActuator method creating a security directive """
+	def directive(self, **kwargs):
+		return self._create(name, kwargs)
+	directive.__name__ = name
+	directive.__doc__ = (" %s directive on the shard it routes to, or on "
+						 "every shard. See ActuatorWrapper.%s " %
+						 (name.upper(), name))
+	return directive
+
+def _pipelined_create(name):
+	""" Build the ShardedPipeline method queueing a security directive """
+	def directive(self, **kwargs):
+		self._queue_create(name, kwargs)
+	directive.__name__ = name
+	directive.__doc__ = (" Queue %s directive. See ShardedActuator.%s " %
+						 (name.upper(), name))
+	return directive
+
+for _name in ["block", "deny", "redirect", "quarantine", "unplug"]:
+	setattr(ShardedActuator, _name, _sharded_create(_name))
+	setattr(ShardedPipeline, _name, _pipelined_create(_name))
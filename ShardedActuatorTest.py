@@ -0,0 +1,134 @@
+#!/usr/bin/python
+# ShardedActuatorTest.py - Test for the multi-actuator front end
+# Works with Python 2.7 and 3
+
+"""
+Tests ShardedActuator against two simulated actuators, one managing switch 1
+with hosts 10.0.0.1-3 and one managing switch 2 with hosts 10.0.0.4-6.
+"""
+
+import unittest
+
+from ShardedActuator import ShardError, ShardedActuator, switch_key
+from SimulatedActuator import SimulatedActuator
+
+class ShardedActuatorTest(unittest.TestCase):
+
+	def setUp(self):
+		self.actuators = [SimulatedActuator(switch_id=1).start(),
+						  SimulatedActuator(switch_id=2, first_host=4).start()]
+		self.sharded = ShardedActuator([actuator.address
+										for actuator in self.actuators])
+
+	def tearDown(self):
+		self.sharded.close()
+		for actuator in self.actuators:
+			actuator.stop()
+
+	def test_switch_key(self):
+		""" Test that switch IDs are compared by value. """
+		self.assertEqual(switch_key("00:00:00:00:00:00:00:0A"), switch_key(10))
+		self.assertEqual(switch_key("a"), switch_key(10))
+		self.assertEqual(switch_key("all"), "all")
+
+	def test_route_by_host(self):
+		""" Test that a directive goes to the shard knowing its host. """
+		d_id = self.sharded.block(blockIP="10.0.0.5")
+		shard, local = self.sharded.split_id(d_id)
+		self.assertEqual(shard, 1)
+		self.assertEqual(self.actuators[1].active_ids(), [local])
+		self.assertEqual(self.actuators[0].active_ids(), [])
+		self.assertEqual(self.sharded.shard_for(IP1="10.0.0.2"), 0)
+		self.assertTrue(self.sharded.cancel(id=d_id))
+		self.assertEqual(self.actuators[1].active_ids(), [])
+
+	def test_route_by_switch(self):
+		""" Test that the switch parameter picks the shard. """
+		d_id = self.sharded.deny(IP1="192.0.2.1", switch="2")
+		self.assertEqual(self.sharded.split_id(d_id)[0], 1)
+		self.assertTrue(self.sharded.adjust(id=d_id, timeout=60))
+		self.assertRaises(ValueError, self.sharded.deny, IP1="192.0.2.1",
+						  switch="00:00:00:00:00:00:00:03")
+
+	def test_fan_out(self):
+		""" Test that unroutable directives go to every shard. """
+		d_ids = self.sharded.block(blockIP="10.1.0.0/16")
+		self.assertEqual(sorted(self.sharded.split_id(d_id)[0]
+								for d_id in d_ids), [0, 1])
+		records = self.sharded.info_records()
+		self.assertEqual(sorted(r.id for r in records), sorted(d_ids))
+		info = self.sharded.info()
+		for d_id in d_ids:
+			self.assertIn(" %d:" % d_id, info)
+		self.assertTrue(info.endswith("DONE\n"))
+		self.assertTrue(self.sharded.cancel(all=True))
+		self.assertEqual(self.sharded.info_records(), [])
+
+	def test_cancel_many(self):
+		""" Test bulk CANCEL across shards. """
+		d_ids = [self.sharded.block(blockIP="10.0.0.%d" % n)
+				 for n in (1, 4, 5)]
+		self.assertEqual(self.sharded.adjust_many(d_ids, 60), [True] * 3)
+		self.assertEqual(self.sharded.cancel_many(d_ids), [True] * 3)
+		self.assertEqual(self.sharded.info_records(), [])
+
+	def test_merged_listings(self):
+		""" Test SWITCHES and HOSTINFO merged across shards. """
+		switches = self.sharded.switches()
+		self.assertIn("00:00:00:00:00:00:00:01", switches)
+		self.assertIn("00:00:00:00:00:00:00:02", switches)
+		self.assertEqual(switches.count("DONE"), 1)
+		hosts = self.sharded.hostinfo()
+		self.assertIn("10.0.0.1 ", hosts)
+		self.assertIn("10.0.0.6 ", hosts)
+		self.assertIn("00:00:00:00:00:00:00:02",
+					  self.sharded.hostinfo(IP="10.0.0.4"))
+
+	def test_fan_out_errors(self):
+		""" Test that a directive failing on one shard raises ShardError. """
+		self.actuators[1].inject("BLOCK")
+		try:
+			self.sharded.block(blockIP="10.2.0.0/16")
+		except ShardError as e:
+			self.assertIs(type(e.results[0]), int)
+			self.assertIsInstance(e.results[1], Exception)
+			#The partial creation can be rolled back
+			self.assertEqual(self.sharded.split_id(e.results[0])[0], 0)
+			self.sharded.cancel(id=e.results[0])
+			self.assertEqual(self.actuators[0].active_ids(), [])
+		else:
+			self.fail("ShardError not raised")
+
+	def test_pipeline(self):
+		""" Test pipelining across shards. """
+		with self.sharded.pipeline() as pipe:
+			pipe.block(blockIP="10.0.0.1")
+			pipe.block(blockIP="10.0.0.6")
+			pipe.block(blockIP="10.3.0.0/16")
+		first, second, fanned = pipe.results
+		self.assertEqual(self.sharded.split_id(first)[0], 0)
+		self.assertEqual(self.sharded.split_id(second)[0], 1)
+		self.assertEqual(len(fanned), 2)
+		with self.sharded.pipeline() as pipe:
+			pipe.cancel(id=first)
+			pipe.adjust(id=second, timeout=30)
+			pipe.cancel(all=True)
+		self.assertEqual(pipe.results, [True, True, True])
+		self.assertEqual(self.actuators[0].active_ids(), [])
+		self.assertEqual(self.actuators[1].active_ids(), [])
+
+	def test_pipeline_validation(self):
+		""" Test that bad parameters are refused when queued. """
+		with self.sharded.pipeline() as pipe:
+			pipe.block(blockIP="10.0.0.1")
+			self.assertRaises(ValueError, pipe.block, IP1="10.0.0.2")
+			self.assertRaises(ValueError, pipe.deny, IP1="10.0.0.2", test=1)
+			self.assertRaises(ValueError, pipe.adjust, id=4)
+			pipe.block(blockIP="10.0.0.6")
+		self.assertEqual(len(pipe.results), 2)
+		self.assertEqual(len(self.actuators[0].active_ids()), 1)
+		self.assertEqual(len(self.actuators[1].active_ids()), 1)
+
+
+if __name__ == '__main__':
+	unittest.main()
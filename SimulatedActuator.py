@@ -0,0 +1,495 @@
+#!/usr/bin/python
+# SimulatedActuator.py - In-process stand-in for openflowsec.org's OF-Actuator
+# Works with Python 2.7 and 3
+
+"""
+Pure-Python server speaking the OF-Actuator line protocol on a local TCP
+port, so the wrapper can be tested and benchmarked without se-floodlight,
+OFActuator.jar and mininet:
+
+	actuator = SimulatedActuator(latency=0.001, jitter=0.001).start()
+	wrapper = ActuatorWrapper(*actuator.address)
+	...
+	actuator.stop()
+
+It validates directives against DirectiveSchema, assigns directive IDs and
+keeps the state behind INFO, CANCEL, ADJUST and DEFAULTS (including
+expiry). SWITCHES and HOSTINFO describe a single-switch topology like
+"mn --topo single,3 --mac". BLOCK is stored as the DENY it translates to.
+
+Network conditions are configurable:
+	latency, jitter: Seconds spent processing each directive, plus a
+		uniformly random extra of up to jitter. Either may be a dictionary
+		of directive -> seconds, with "*" as the fallback
+	rtt: Network round-trip time added to every reply. Directives sent
+		back to back (pipelined) overlap their round trips
+	chunk_size, chunk_delay: Send replies in chunk_size byte pieces with
+		chunk_delay seconds between them, to exercise response reassembly
+	error_rate: Fraction of directives (or dictionary of directive ->
+		fraction) answered with an ERROR instead of being executed
+	inject(): Queue a scripted reply or disconnect for the next directives
+
+Run it stand-alone with "python SimulatedActuator.py [port]".
+"""
+
+import random
+import socket
+import sys
+import threading
+import time
+
+try:
+	import Queue as queue
+	import SocketServer as socketserver
+except ImportError:
+	import queue
+	import socketserver
+
+from ActuatorProtocol import parse_params
+from DirectiveSchema import DIRECTIVES
+
+#BLOCK parameters under their DENY names
+_BLOCK_AS_DENY = {"blockIP": "IP1", "dstPort": "IP2port",
+				  "linkdrop": "linkdrop1"}
+
+class _Directive(object):
+	""" Security directive active on the simulated actuator """
+	__slots__ = ("id", "directive", "params", "expires")
+
+	def __init__(self, d_id, directive, params, expires):
+		self.id = d_id
+		self.directive = directive
+		self.params = params
+		self.expires = expires
+
+	def format_params(self):
+		parts = []
+		for param, value in self.params:
+			if value is True:
+				parts.append("-" + param)
+			else:
+				parts.append("-%s %s" % (param, value))
+		return " ".join(parts)
+
+class _Handler(socketserver.StreamRequestHandler):
+	""" One directive source connection """
+
+	def setup(self):
+		socketserver.StreamRequestHandler.setup(self)
+		self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+		with self.server.actuator._lock:
+			self.server.connections.add(self.request)
+
+	def finish(self):
+		with self.server.actuator._lock:
+			self.server.connections.discard(self.request)
+		socketserver.StreamRequestHandler.finish(self)
+
+	def handle(self):
+		actuator = self.server.actuator
+		delayed = None
+		if actuator.rtt:
+			#Replies travel back after the round-trip time without holding
+			#up the directives behind them, as on a real network link
+			delayed = queue.Queue()
+			sender = threading.Thread(target=self._send_delayed,
+									  args=(delayed,))
+			sender.daemon = True
+			sender.start()
+		try:
+			while 1:
+				try:
+					line = self.rfile.readline()
+				except socket.error:
+					#Reset by the directive source
+					return
+				if not line:
+					return
+				arrived = time.time()
+				line = line.decode("ascii", "replace").strip()
+				if not line:
+					continue
+				reply = actuator.handle_line(line)
+				if reply is None:
+					return
+				if delayed is None:
+					actuator.send_reply(self.request, reply)
+				else:
+					delayed.put((arrived + actuator.rtt, reply))
+		finally:
+			if delayed is not None:
+				#Deliver what is still in flight before the connection closes
+				delayed.put(None)
+				sender.join()
+
+	def _send_delayed(self, delayed):
+		""" Send queued replies once their round-trip time has passed """
+		actuator = self.server.actuator
+		while 1:
+			item = delayed.get()
+			if item is None:
+				return
+			due, reply = item
+			wait = due - time.time()
+			if wait > 0:
+				time.sleep(wait)
+			try:
+				actuator.send_reply(self.request, reply)
+			except socket.error:
+				return
+
+class _Server(socketserver.ThreadingMixIn, socketserver.TCPServer):
+	allow_reuse_address = True
+	daemon_threads = True
+
+class SimulatedActuator(object):
+	""" Simulated OF-Actuator serving on a local TCP port """
+
+	def __init__(self, host="127.0.0.1", port=0, latency=0.0, jitter=0.0,
+				 chunk_size=None, chunk_delay=0.0, error_rate=0.0, hosts=3,
+				 seed=None, rtt=0.0, switch_id=1, first_host=1):
+		"""
+		ARGUMENTS:
+			o  host, port: Address to listen on. Port 0 picks a free port
+			o  latency, jitter: Reply delay in seconds, see module docstring
+			o  chunk_size, chunk_delay: Reply fragmentation
+			o  error_rate: Fraction of directives failed with an ERROR
+			o  hosts: Number of hosts on the simulated switch
+			o  seed: Seed for jitter and error injection
+			o  rtt: Network round-trip time in seconds. Unlike latency it
+				does not delay the directives queued behind a reply
+			o  switch_id, first_host: DPID of the switch and number of its
+				first host (10.0.0.<first_host>), so several simulated
+				actuators can manage different networks
+		"""
+		self._host = host
+		self._port = port
+		self.latency = latency
+		self.jitter = jitter
+		self.chunk_size = chunk_size
+		self.chunk_delay = chunk_delay
+		self.error_rate = error_rate
+		self.hosts = hosts
+		self.rtt = rtt
+		self.switch_id = switch_id
+		self.first_host = first_host
+		self._random = random.Random(seed)
+		self._lock = threading.Lock()
+		self._directives = {}
+		self._next_id = 0
+		self._defaults = {"priority": "100", "redirectIdle": "60",
+						  "resetAfter": "0", "switch": "all", "timeout": "0"}
+		#Scripted (directive or None, reply or None for disconnect) entries
+		self._injected = []
+		self._counts = {}
+		self._server = None
+		self._thread = None
+
+	@property
+	def address(self):
+		""" (host, port) the actuator listens on, once started """
+		return self._server.server_address[:2]
+
+	@property
+	def port(self):
+		return self.address[1]
+
+	def start(self):
+		""" Start serving in a background thread. Returns self """
+		self._server = _Server((self._host, self._port), _Handler)
+		self._server.actuator = self
+		self._server.connections = set()
+		#Short poll interval so stop() returns quickly
+		self._thread = threading.Thread(target=self._server.serve_forever,
+										args=(0.05,))
+		self._thread.daemon = True
+		self._thread.start()
+		return self
+
+	def stop(self):
+		"""
+		Stop accepting connections and drop the open ones, like an actuator
+		process exiting
+		"""
+		if self._server is not None:
+			self._server.shutdown()
+			self._server.server_close()
+			with self._lock:
+				connections = list(self._server.connections)
+			for conn in connections:
+				try:
+					conn.shutdown(socket.SHUT_RDWR)
+				except socket.error:
+					pass
+			self._server = None
+
+	def __enter__(self):
+		return self.start()
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.stop()
+
+	def inject(self, directive=None, reply="ERROR Injected failure", count=1,
+			   execute=False):
+		"""
+		Answer the next count directives (only those of type directive, if
+		given) with reply instead of executing them. reply=None closes the
+		connection instead of answering. With execute=True the directives are
+		executed first and only their replies are replaced, like a reply lost
+		on the way back
+		"""
+		with self._lock:
+			self._injected.extend([(directive, reply, execute)] * count)
+
+	def stats(self):
+		"""
+		RETURNS:
+			@rtype: Dictionary
+			@return: Number of directives received per directive type
+		"""
+		with self._lock:
+			return dict(self._counts)
+
+	def active_ids(self):
+		""" IDs of the active directives, in order """
+		with self._lock:
+			self._expire(time.time())
+			return sorted(self._directives)
+
+	def _per_directive(self, setting, directive):
+		if isinstance(setting, dict):
+			return setting.get(directive, setting.get("*", 0))
+		return setting
+
+	def _injected_reply(self, directive):
+		"""
+		Pop the scripted (reply, execute) for directive, False if there is
+		none
+		"""
+		for i, (target, reply, execute) in enumerate(self._injected):
+			if target is None or target == directive:
+				del self._injected[i]
+				return reply, execute
+		return False
+
+	def handle_line(self, line):
+		"""
+		Execute one directive line and return the reply text, None to close
+		the connection
+		"""
+		words = line.split(None, 1)
+		directive = words[0].upper()
+		args = words[1] if len(words) > 1 else ""
+		with self._lock:
+			self._counts[directive] = self._counts.get(directive, 0) + 1
+			injected = self._injected_reply(directive)
+			error_rate = self._per_directive(self.error_rate, directive)
+			failed = error_rate and self._random.random() < error_rate
+			delay = self._per_directive(self.latency, directive)
+			jitter = self._per_directive(self.jitter, directive)
+			if jitter:
+				delay += self._random.uniform(0, jitter)
+		if delay:
+			time.sleep(delay)
+		if injected is not False:
+			reply, execute = injected
+			if execute:
+				self._execute(directive, words[0], args)
+			return reply
+		if directive == "QUIT":
+			return None
+		if failed:
+			return "ERROR Injected failure"
+		return self._execute(directive, words[0], args)
+
+	def _execute(self, directive, word, args):
+		""" Run a directive's handler and return its reply text """
+		handler = getattr(self, "_do_" + directive.lower(), None)
+		if handler is None:
+			return "ERROR Unknown directive \"%s\"" % word
+		try:
+			return handler(directive, args)
+		except ValueError as e:
+			return "ERROR %s" % e
+
+	def send_reply(self, sock, reply):
+		""" Send a reply, fragmented if chunk_size is set """
+		data = (reply.rstrip("\n") + "\n").encode("ascii")
+		if not self.chunk_size:
+			sock.sendall(data)
+			return
+		for start in range(0, len(data), self.chunk_size):
+			if start and self.chunk_delay:
+				time.sleep(self.chunk_delay)
+			sock.sendall(data[start:start + self.chunk_size])
+
+	def _params(self, directive, args):
+		""" Parse and validate directive parameters as the wrapper sends them """
+		params = parse_params(args)
+		spec = DIRECTIVES.get(directive.lower())
+		if spec is not None:
+			spec.build(params)
+		return params
+
+	def _expire(self, now):
+		""" Drop expired directives. Lock must be held """
+		for d_id in [d_id for d_id, d in self._directives.items()
+					 if d.expires is not None and d.expires <= now]:
+			del self._directives[d_id]
+
+	def _expires(self, timeout, now):
+		timeout = float(timeout if timeout is not None else
+						self._defaults["timeout"])
+		return None if timeout <= 0 else now + timeout
+
+	def _create(self, directive, args):
+		params = self._params(directive, args)
+		#Keep the order the parameters were given in
+		ordered = [(token[1:], params[token[1:]]) for token in args.split()
+				   if token[1:] in params]
+		if directive == "BLOCK":
+			directive = "DENY"
+			ordered = [(_BLOCK_AS_DENY.get(k, k), v) for k, v in ordered]
+		now = time.time()
+		with self._lock:
+			self._next_id += 1
+			d_id = self._next_id
+			self._directives[d_id] = _Directive(d_id, directive, ordered,
+				self._expires(params.get("timeout"), now))
+		return "OK %d" % d_id
+
+	_do_block = _do_deny = _do_redirect = _create
+	_do_quarantine = _do_unplug = _create
+
+	def _do_info(self, directive, args):
+		params = self._params(directive, args)
+		now = time.time()
+		with self._lock:
+			self._expire(now)
+			if params.get("id") is not None:
+				d_id = int(params["id"])
+				if d_id not in self._directives:
+					raise ValueError("No active directive with id %d" % d_id)
+				active = [self._directives[d_id]]
+			else:
+				active = [self._directives[d_id]
+						  for d_id in sorted(self._directives)]
+			lines = []
+			for d in active:
+				if d.expires is None:
+					expires = "never expires"
+				else:
+					expires = "expires in %d seconds" % max(0, round(
+						d.expires - now))
+				lines.append(" %d: %s %s; %s" % (d.id, d.directive,
+												 d.format_params(), expires))
+				if params.get("rules"):
+					lines.append("    flow-mod priority=%s cookie=%d "
+								 "actions=drop" % (self._defaults["priority"],
+												   d.id))
+		lines.append("DONE")
+		return "\n".join(lines)
+
+	def _do_cancel(self, directive, args):
+		params = self._params(directive, args)
+		with self._lock:
+			if params.get("all"):
+				self._directives.clear()
+				return "OK"
+			self._expire(time.time())
+			d_id = int(params["id"])
+			if self._directives.pop(d_id, None) is None:
+				raise ValueError("No active directive with id %d" % d_id)
+		return "OK"
+
+	def _do_adjust(self, directive, args):
+		params = self._params(directive, args)
+		now = time.time()
+		with self._lock:
+			self._expire(now)
+			d_id = int(params["id"])
+			if d_id not in self._directives:
+				raise ValueError("No active directive with id %d" % d_id)
+			self._directives[d_id].expires = self._expires(params["timeout"],
+														   now)
+		return "OK"
+
+	def _do_defaults(self, directive, args):
+		params = self._params(directive, args)
+		with self._lock:
+			self._defaults.update((k, str(v)) for k, v in params.items())
+			lines = ["  %s: %s" % (k, self._defaults[k])
+					 for k in sorted(self._defaults)]
+		lines.append("OK")
+		return "\n".join(lines)
+
+	def _dpid(self):
+		dpid = "%016x" % self.switch_id
+		return ":".join(dpid[i:i + 2] for i in range(0, 16, 2))
+
+	def _do_switches(self, directive, args):
+		params = self._params(directive, args)
+		lines = [" " + self._dpid()]
+		if params.get("v"):
+			lines.extend("    port %d: s1-eth%d" % (n, n)
+						 for n in range(1, self.hosts + 1))
+		lines.append("DONE")
+		return "\n".join(lines)
+
+	def _host_line(self, n):
+		"""
+		HOSTINFO line of host number n (10.0.0.n for the first 254), on port
+		n - first_host + 1
+		"""
+		return ("  10.%d.%d.%d mac 00:00:00:%02x:%02x:%02x switch %s port %d" %
+				((n >> 16) & 255, (n >> 8) & 255, n & 255, (n >> 16) & 255,
+				 (n >> 8) & 255, n & 255, self._dpid(),
+				 n - self.first_host + 1))
+
+	def _do_hostinfo(self, directive, args):
+		params = self._params(directive, args)
+		ip = params.get("IP")
+		first = self.first_host
+		if ip is None:
+			lines = [self._host_line(n)
+					 for n in range(first, first + self.hosts)]
+		else:
+			octets = ip.split(".")
+			n = 0
+			if (len(octets) == 4 and octets[0] == "10" and
+					all(octet.isdigit() for octet in octets[1:])):
+				n = ((int(octets[1]) << 16) | (int(octets[2]) << 8) |
+					 int(octets[3]))
+			if not first <= n < first + self.hosts:
+				raise ValueError("Unknown host %s" % ip)
+			lines = [self._host_line(n)]
+		lines.append("DONE")
+		return "\n".join(lines)
+
+	def _do_help(self, directive, args):
+		lines = [" %s %s" % (spec.name, " ".join("[-%s]" % p
+												 for p in spec.params))
+				 for name, spec in sorted(DIRECTIVES.items())]
+		lines.append("DONE")
+		return "\n".join(lines)
+
+	def _do_echo(self, directive, args):
+		return "echo " + args
+
+	def _do_shutdown(self, directive, args):
+		with self._lock:
+			self._directives.clear()
+		#Answer first, then stop from another thread (shutdown() waits for
+		#the serving loop, which may be this one's caller)
+		threading.Thread(target=self.stop).start()
+		return "OK"
+
+if __name__ == "__main__":
+	actuator = SimulatedActuator(port=int(sys.argv[1]) if len(sys.argv) > 1
+								 else 26795).start()
+	print("Simulated actuator listening on %s:%d" % actuator.address)
+	try:
+		while 1:
+			time.sleep(3600)
+	except KeyboardInterrupt:
+		actuator.stop()
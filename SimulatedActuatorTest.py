@@ -0,0 +1,96 @@
+#!/usr/bin/python
+# SimulatedActuatorTest.py - Test for the in-process OF-Actuator stand-in
+# Works with Python 2.7 and 3
+
+"""
+Tests the simulated actuator through ActuatorWrapper. Nothing else needs to
+be running.
+"""
+
+import socket
+import time
+import unittest
+
+from ActuatorWrapper import ActuatorWrapper
+from SimulatedActuator import SimulatedActuator
+
+class SimulatedActuatorTest(unittest.TestCase):
+
+	def setUp(self):
+		self.actuator = SimulatedActuator(seed=1).start()
+		self.wrapper = ActuatorWrapper(*self.actuator.address)
+
+	def tearDown(self):
+		self.wrapper.quit()
+		self.actuator.stop()
+
+	def test_directive_state(self):
+		""" Test IDs and the state behind INFO, CANCEL and ADJUST. """
+		first = self.wrapper.block(blockIP="10.0.0.1", dstPort=22)
+		second = self.wrapper.deny(IP1="10.0.0.2", timeout=60)
+		self.assertEqual(second, first + 1)
+		records = list(self.wrapper.info_records())
+		self.assertEqual([r.directive for r in records], ["DENY", "DENY"])
+		self.assertEqual(records[0].params, {"IP1": "10.0.0.1",
+											 "IP2port": "22"})
+		self.assertEqual(records[0].expires, None)
+		self.assertTrue(records[1].expires > time.time() + 50)
+		self.wrapper.adjust(id=second, timeout=0.05)
+		self.wrapper.cancel(id=first)
+		time.sleep(0.1)
+		self.assertEqual(self.actuator.active_ids(), [])
+		self.assertRaises(Exception, self.wrapper.cancel, id=first)
+		self.assertRaises(Exception, self.wrapper.block, blockIP="10.0.0.1",
+						  timeout="soon")
+
+	def test_topology(self):
+		""" Test SWITCHES and HOSTINFO output. """
+		self.assertIn("00:00:00:00:00:00:00:01", self.wrapper.switches())
+		self.assertIn("mac 00:00:00:00:00:02",
+					  self.wrapper.hostinfo(IP="10.0.0.2"))
+		self.assertEqual(self.wrapper.hostinfo().count("10.0.0."), 3)
+		self.assertRaises(Exception, self.wrapper.hostinfo, IP="10.0.0.9")
+
+	def test_latency(self):
+		""" Test per-directive latency and jitter. """
+		self.actuator.latency = {"SWITCHES": 0.05}
+		self.actuator.jitter = 0.01
+		start = time.time()
+		self.wrapper.switches()
+		self.assertTrue(0.05 <= time.time() - start < 0.5)
+
+	def test_chunked_replies(self):
+		""" Test that fragmented replies are reassembled. """
+		self.actuator.chunk_size = 3
+		self.actuator.chunk_delay = 0.001
+		with self.wrapper.pipeline() as pipe:
+			for i in range(20):
+				pipe.block(blockIP="10.0.1.%d" % i)
+		self.assertEqual(len(set(pipe.results)), 20)
+		self.assertEqual(len(list(self.wrapper.info_records())), 20)
+
+	def test_error_injection(self):
+		""" Test scripted and random ERROR replies and disconnects. """
+		self.actuator.inject("BLOCK", count=2)
+		self.assertRaises(Exception, self.wrapper.block, blockIP="10.0.0.1")
+		self.assertRaises(Exception, self.wrapper.block, blockIP="10.0.0.1")
+		self.assertIs(type(self.wrapper.block(blockIP="10.0.0.1")), int)
+		self.actuator.error_rate = {"DENY": 1.0}
+		self.assertRaises(Exception, self.wrapper.deny, IP1="10.0.0.1")
+		self.assertEqual(self.actuator.stats()["BLOCK"], 3)
+		self.wrapper = ActuatorWrapper(*self.actuator.address,
+									   auto_reconnect=False)
+		self.actuator.inject(reply=None)
+		self.assertRaises(socket.error, self.wrapper.switches)
+		self.wrapper = ActuatorWrapper(*self.actuator.address,
+									   auto_reconnect=False)
+		#The directive runs, only its reply is lost
+		self.actuator.inject("BLOCK", reply=None, execute=True)
+		self.assertRaises(socket.error, self.wrapper.block,
+						  blockIP="10.0.0.2")
+		self.assertEqual(len(self.actuator.active_ids()), 2)
+		self.wrapper = ActuatorWrapper(*self.actuator.address)
+
+
+if __name__ == '__main__':
+	unittest.main()